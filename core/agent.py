@@ -1,22 +1,114 @@
 """Ядро ИИ-агента: обработка запросов, вызов LLM, использование памяти и инструментов."""
 
-from core.llm_client import LLMClient
+import asyncio
+import functools
+import logging
+import os
+from collections.abc import AsyncIterator, Awaitable
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, TypeVar
+
+from core.context import ContextBuilder
+from core import metrics
+from core.llm_client import LLMClient, LLMStreamError
+from core.media import MediaFile, MediaStore
 from core.memory import Memory
+from core.model_router import ModelRouter
 from core.models import MessageIn, MessageOut, UserProfile
+from core.timing import StageTimer
 from core.tools import ToolRouter
 
+if TYPE_CHECKING:
+    from core.archive import RetentionManager
+    from core.compaction import HistoryCompactor
+    from core.model_router import ModelWarmer
+    from core.semantic import SemanticMemory
+    from core.sharding import ShardedMemory, ShardedRetention, ShardedSemantic, ShardedService
+
+logger = logging.getLogger("core.agent")
+
+T = TypeVar("T")
+
+# Запас внешнего дедлайна этапа инструментов сверх их общего бюджета, с
+TOOL_DEADLINE_GRACE = 0.5
+
+
+@dataclass
+class PreparedRequest:
+    """Всё, что нужно для запроса к LLM по одному входящему сообщению."""
+
+    prompt: str
+    system: str
+    history: list[dict[str, str]] | None
+    use_cache: bool
+    timer: StageTimer
+    # Модель, выбранная ModelRouter
+    model: str
+
 
 class Agent:
-    """Основной агент, обрабатывающий запросы пользователей."""
+    """
+    Основной агент, обрабатывающий запросы пользователей.
+
+    Независимые этапы подготовки запроса (профиль, инструменты, история
+    и, если подключена `SemanticMemory`, похожие прошлые разговоры)
+    выполняются параллельно, у каждого свой дедлайн: медленный этап
+    деградирует до значения по умолчанию, а не задерживает ответ.
+    Сохранение в память идёт в фоне и не входит во время ответа.
+    Итоговый контекст упаковывается `ContextBuilder` в бюджет токенов;
+    старую историю `HistoryCompactor` в фоне сворачивает в сводку.
+    """
 
     def __init__(
         self,
         llm_client: LLMClient | None = None,
-        memory: Memory | None = None,
+        memory: "Memory | ShardedMemory | None" = None,
+        tool_timeout: float | None = None,
+        memory_timeout: float | None = None,
+        semantic: "SemanticMemory | ShardedSemantic | None" = None,
+        context_builder: ContextBuilder | None = None,
+        compactor: "HistoryCompactor | ShardedService[HistoryCompactor] | None" = None,
+        history_limit: int | None = None,
+        media_store: MediaStore | None = None,
+        retention: "RetentionManager | ShardedRetention | None" = None,
+        model_router: ModelRouter | None = None,
+        warmer: "ModelWarmer | None" = None,
     ) -> None:
         self.llm = llm_client or LLMClient()
+        # Быстрая или сильная модель под каждый запрос (по умолчанию — из окружения)
+        self.model_router = model_router or ModelRouter.from_env(self.llm.model)
+        self.warmer = warmer
         self.memory = memory or Memory()
+        self.media_store = media_store or MediaStore()
+        self.semantic = semantic
+        self.context_builder = context_builder or ContextBuilder()
+        self.compactor = compactor
+        self.retention = retention
+        # Сколько последних обменов загружать; в промпт попадёт столько, сколько влезет в бюджет
+        self.history_limit = history_limit or int(os.getenv("AGENT_HISTORY_LIMIT", "20"))
+        # Запросы дольше порога логируются с разбивкой по этапам и trace-id
+        self.slow_request_ms = float(os.getenv("AGENT_SLOW_REQUEST_MS", "10000"))
         self.tool_router = ToolRouter()
+        self.tool_timeout = tool_timeout or float(os.getenv("AGENT_TOOL_TIMEOUT", "3.0"))
+        self.memory_timeout = memory_timeout or float(os.getenv("AGENT_MEMORY_TIMEOUT", "2.0"))
+        self._background: set[asyncio.Task[None]] = set()
+
+    async def aclose(self) -> None:
+        """Дождаться фоновых записей и закрыть HTTP-клиенты, инструменты и память агента."""
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+        if self.warmer is not None:
+            # До закрытия клиента: иначе прогрев успел бы открыть новый пул соединений
+            await self.warmer.stop()
+        await self.llm.aclose()
+        await self.tool_router.aclose()
+        await self.memory.aclose()
+        if self.semantic is not None:
+            await self.semantic.stop()
+        if self.compactor is not None:
+            await self.compactor.stop()
+        if self.retention is not None:
+            await self.retention.stop()
 
     async def process(self, msg_in: MessageIn) -> MessageOut:
         """
@@ -26,69 +118,224 @@ class Agent:
             msg_in: Входящее сообщение
 
         Returns:
-            Ответ агента
+            Ответ агента (в `timings` — длительности этапов в мс)
+        """
+        request = await self._prepare(msg_in)
+
+        # Генерируем ответ через LLM
+        with request.timer.stage("llm"):
+            response_text = await self.llm.generate(
+                prompt=request.prompt,
+                system=request.system,
+                history=request.history,
+                use_cache=request.use_cache,
+                model=request.model,
+            )
+
+        msg_out = MessageOut(text=response_text)
+
+        # Сохраняем взаимодействие в память, не задерживая ответ
+        self._save_in_background(msg_in, msg_out)
+
+        msg_out.timings = request.timer.as_dict()
+        self._observe(msg_in, msg_out.timings)
+        return msg_out
+
+    async def process_stream(self, msg_in: MessageIn) -> AsyncIterator[str]:
         """
+        Обработать входящее сообщение, отдавая ответ по частям.
+
+        Полный текст сохраняется в память, когда поток дочитан до конца.
+        Если поток оборвался на середине, в память идёт только уже
+        полученная часть ответа — без заглушки об ошибке, — а
+        `LLMStreamError` пробрасывается дальше.
+
+        Args:
+            msg_in: Входящее сообщение
+
+        Yields:
+            Очередные фрагменты ответа
+
+        Raises:
+            LLMStreamError: Генерация оборвалась после первого фрагмента
+        """
+        request = await self._prepare(msg_in)
+
+        chunks: list[str] = []
+        try:
+            with request.timer.stage("llm"):
+                async for chunk in self.llm.stream(
+                    prompt=request.prompt,
+                    system=request.system,
+                    history=request.history,
+                    use_cache=request.use_cache,
+                    model=request.model,
+                ):
+                    chunks.append(chunk)
+                    yield chunk
+        except LLMStreamError as exc:
+            logger.warning(
+                "trace=%s поток ответа пользователю %s оборвался: %r",
+                metrics.trace_id.get(), msg_in.user_id, exc.cause,
+            )
+            self._save_in_background(msg_in, MessageOut(text="".join(chunks)))
+            raise
+
+        self._save_in_background(msg_in, MessageOut(text="".join(chunks)))
+        self._observe(msg_in, request.timer.as_dict())
+
+    def _observe(self, msg_in: MessageIn, timings: dict[str, float]) -> None:
+        for stage, ms in timings.items():
+            metrics.STAGE_SECONDS.observe(ms / 1000, stage)
+        if timings.get("total", 0.0) >= self.slow_request_ms:
+            logger.warning(
+                "Медленный запрос trace=%s user=%s, этапы (мс): %s",
+                metrics.trace_id.get(), msg_in.user_id, timings,
+            )
+        else:
+            logger.debug("trace=%s этапы обработки (мс): %s", metrics.trace_id.get(), timings)
+
+    def _save_in_background(self, msg_in: MessageIn, msg_out: MessageOut) -> None:
+        task = asyncio.create_task(self._save(msg_in, msg_out))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _save(self, msg_in: MessageIn, msg_out: MessageOut) -> None:
+        try:
+            await self.memory.save_interaction(msg_in, msg_out)
+        except Exception:  # noqa: BLE001
+            logger.exception("Не удалось сохранить взаимодействие пользователя %s", msg_in.user_id)
+            return
+        if self.semantic is not None:
+            self.semantic.notify()
+
+    async def _with_deadline(
+        self, timer: StageTimer, stage: str, coro: Awaitable[T], timeout: float, default: T
+    ) -> T:
+        """Выполнить этап с дедлайном; при таймауте или ошибке вернуть `default`."""
+        with timer.stage(stage):
+            try:
+                async with asyncio.timeout(timeout):
+                    return await coro
+            except TimeoutError:
+                logger.warning("Этап %s не уложился в %.1f с — продолжаем без него", stage, timeout)
+            except Exception:  # noqa: BLE001
+                logger.exception("Этап %s завершился ошибкой — продолжаем без него", stage)
+        return default
+
+    async def _load_profile(self, msg_in: MessageIn) -> UserProfile:
         # Получаем или создаём профиль пользователя
-        profile = self.memory.get_or_create_profile(msg_in.user_id)
+        profile = await self.memory.get_or_create_profile(msg_in.user_id)
 
         # Обновляем профиль, если пришли новые данные
         if msg_in.channel == "telegram":
-            self.memory.update_profile(msg_in.user_id, telegram_id=msg_in.user_id)
+            await self.memory.update_profile(msg_in.user_id, telegram_id=msg_in.user_id)
         elif msg_in.channel == "mac_client":
             # TODO: извлечь mac_username из msg_in, когда появится
             pass
+        return profile
 
-        # Проверяем, нужен ли инструмент (поиск, анализ медиа и т.д.)
-        tool_result = await self.tool_router.route({
-            "text": msg_in.text,
-            "media_type": msg_in.media_type,
-            "media_data": msg_in.media_data,
-        })
-
-        # Получаем контекст из истории
-        history = self.memory.get_recent_history(msg_in.user_id, limit=5)
-        history_messages = []
-        for hist_in, hist_out in history:
-            if hist_in.text:
-                history_messages.append({"role": "user", "content": hist_in.text})
-            if hist_out.text:
-                history_messages.append({"role": "assistant", "content": hist_out.text})
+    async def _load_history(
+        self, user_id: str
+    ) -> tuple[str | None, list[tuple[MessageIn, MessageOut]]]:
+        summary, history = await asyncio.gather(
+            self.memory.get_summary(user_id),
+            self.memory.get_recent_history(user_id, limit=self.history_limit),
+        )
+        return (summary[0] if summary else None), history
 
-        # Формируем системный промпт с учётом профиля
-        system_prompt = self._build_system_prompt(profile)
+    async def _recall(self, msg_in: MessageIn) -> list[str]:
+        if self.semantic is None or not msg_in.text:
+            return []
+        return await self.semantic.search(msg_in.user_id, msg_in.text)
 
-        # Формируем промпт для LLM (включая результат инструмента, если есть)
-        user_text = msg_in.text or "[медиа-сообщение без текста]"
-        if tool_result:
-            user_text = f"{user_text}\n\n[Контекст от инструмента: {tool_result}]"
+    def _media_file(self, msg_in: MessageIn) -> MediaFile | None:
+        """Загруженный через /v1/media файл сообщения (ссылка `sha256` в `media_data`)."""
+        digest = (msg_in.media_data or {}).get("sha256")
+        return self.media_store.get(digest) if digest else None
 
-        # Генерируем ответ через LLM
-        response_text = await self.llm.generate(
-            prompt=user_text,
-            system=system_prompt,
-            history=history_messages if history_messages else None,
+    async def _prepare(self, msg_in: MessageIn) -> PreparedRequest:
+        """Собрать промпт, системный промпт и историю для запроса к LLM."""
+        timer = StageTimer()
+
+        # Профиль, инструменты (поиск, анализ медиа и т.д.) и история независимы
+        profile, tool_result, (summary, history), recalled = await asyncio.gather(
+            self._with_deadline(
+                timer, "profile", self._load_profile(msg_in),
+                self.memory_timeout, UserProfile(user_id=msg_in.user_id),
+            ),
+            self._with_deadline(
+                timer, "tools",
+                self.tool_router.route({
+                    "text": msg_in.text,
+                    "media_type": msg_in.media_type,
+                    "media_data": msg_in.media_data,
+                    "media_file": self._media_file(msg_in),
+                }, timeout=self.tool_timeout),
+                # Инструменты сами укладываются в tool_timeout и отдают частичные
+                # результаты; внешний дедлайн — страховка от зависшего кода
+                self.tool_timeout + TOOL_DEADLINE_GRACE, "",
+            ),
+            self._with_deadline(
+                timer, "history", self._load_history(msg_in.user_id),
+                self.memory_timeout, (None, []),
+            ),
+            self._with_deadline(
+                timer, "semantic", self._recall(msg_in), self.memory_timeout, [],
+            ),
         )
 
-        msg_out = MessageOut(text=response_text)
+        # Формируем системный промпт с учётом профиля
+        system_prompt = self._build_system_prompt(profile)
+        route = self.model_router.route(msg_in.text, profile.model_profile, tool_result)
+        logger.debug("trace=%s модель %s (%s)", metrics.trace_id.get(), route.model, route.reason)
 
-        # Сохраняем взаимодействие в память
-        self.memory.save_interaction(msg_in, msg_out)
+        # Похожие прошлые разговоры, которых нет в недавней истории
+        recent = {self.semantic.document(i.text, o.text) for i, o in history} if recalled else set()
+        recalled = [snippet for snippet in recalled if snippet not in recent]
 
-        return msg_out
+        # Упаковываем промпт, сводку, историю, воспоминания и инструменты в бюджет
+        with timer.stage("context"):
+            context = self.context_builder.build(
+                system=system_prompt,
+                text=msg_in.text or "[медиа-сообщение без текста]",
+                history=[(hist_in.text, hist_out.text) for hist_in, hist_out in history],
+                summary=summary,
+                memories=recalled,
+                tool_result=tool_result,
+                user_id=msg_in.user_id,
+            )
+
+        return PreparedRequest(
+            prompt=context.prompt,
+            system=system_prompt,
+            history=context.history or None,
+            # Ответ с контекстом инструмента зависит от внешних данных — не кэшируем
+            use_cache=profile.cache_responses and not tool_result,
+            timer=timer,
+            model=route.model,
+        )
 
     def _build_system_prompt(self, profile: UserProfile) -> str:
         """Построить системный промпт с учётом профиля пользователя."""
+        return self._system_prompt_for(profile.tone, profile.language)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def _system_prompt_for(tone: str, language: str) -> str:
+        # Промпт зависит только от этих полей профиля: один и тот же объект строки
+        # на всех запросах пользователя, пока профиль не изменится
         tone_map = {
             "friendly": "дружелюбный, неформальный",
             "formal": "формальный, вежливый",
             "casual": "непринуждённый, разговорный",
         }
-        tone_desc = tone_map.get(profile.tone, "дружелюбный")
+        tone_desc = tone_map.get(tone, "дружелюбный")
 
         return f"""Ты — персональный ИИ-ассистент. Твоя задача — помогать пользователю в любых вопросах.
 
 Тон общения: {tone_desc}
-Язык: {profile.language}
+Язык: {language}
 
 Будь полезным, точным и дружелюбным. Если не знаешь ответа — честно скажи об этом.
 Используй информацию от инструментов (веб-поиск, анализ файлов), если она предоставлена в контексте."""
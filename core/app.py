@@ -1,33 +1,585 @@
+"""HTTP-приложение ядра (Starlette).
+
+Запуск для разработки: `make core-dev`; в продакшене — через фабрику
+`create_app` с несколькими воркерами uvicorn (см. core/README.md).
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+import os
+from collections.abc import AsyncIterator, Awaitable, Callable
+from typing import TYPE_CHECKING, Any
+
 from starlette.applications import Starlette
 from starlette.requests import Request
-from starlette.responses import JSONResponse
+from starlette.middleware import Middleware
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from starlette.routing import Route
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from core import metrics
+from core.agent import Agent
+from core.archive import HistoryArchive, RetentionManager
+from core.compaction import HistoryCompactor
+from core.llm_client import LLMClient, LLMStreamError
+from core.media import MediaStore, MediaTooLarge
+from core.memory import Memory
+from core.model_router import ModelRouter, ModelWarmer
+from core.models import MessageIn
+from core.response_cache import ResponseCache
+from core.scheduler import Scheduler, SchedulerBusy, Ticket
+
+if TYPE_CHECKING:
+    from core.semantic import SemanticMemory
+    from core.sharding import ShardedMemory, ShardedRetention, ShardedSemantic, ShardedService
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson необязателен
+    orjson = None
+
+logger = logging.getLogger("core.app")
+
+AgentFactory = Callable[[], Awaitable[Agent]]
+
+
+def dumps(data: Any) -> bytes:
+    """Сериализовать JSON (через orjson, если установлен)."""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(raw: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse с быстрой сериализацией через orjson."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+async def health(_: Request) -> Response:
+    return FastJSONResponse({"status": "ok"})
+
+
+async def metrics_endpoint(_: Request) -> Response:
+    """Метрики процесса в текстовом формате Prometheus."""
+    return PlainTextResponse(
+        metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+_profiler = metrics.SamplingProfiler()
+
+
+async def profile(request: Request) -> Response:
+    """
+    Снять профиль процесса за `seconds` секунд (collapsed stacks для flamegraph).
+
+    Доступно только при `CORE_PROFILING=1`: эндпоинт отладочный.
+    """
+    if os.getenv("CORE_PROFILING", "0") != "1":
+        return FastJSONResponse({"error": "profiling disabled"}, status_code=404)
+    try:
+        seconds = float(request.query_params.get("seconds", "10"))
+    except ValueError:
+        seconds = 0.0
+    # NaN тоже не проходит сравнение; слишком долгий профиль урезаем до двух минут
+    if not seconds > 0:
+        return FastJSONResponse({"error": "seconds — положительное число, не больше 120"}, status_code=400)
+    seconds = min(seconds, 120.0)
+    try:
+        stacks = await asyncio.to_thread(_profiler.run, seconds)
+    except RuntimeError as exc:
+        return FastJSONResponse({"error": str(exc)}, status_code=409)
+    return PlainTextResponse(stacks)
+
+
+class TraceMiddleware:
+    """
+    Trace-id и время обработки каждого HTTP-запроса.
+
+    Trace-id берётся из заголовка `X-Trace-Id` (его передаёт `tg_bot`) или
+    создаётся заново, доступен коду ядра через `metrics.trace_id` и
+    возвращается клиенту в том же заголовке.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = dict(scope["headers"]).get(b"x-trace-id", b"").decode("latin-1")[:64]
+        current = incoming or metrics.new_trace_id()
+        token = metrics.trace_id.set(current)
+        # Метка маршрута — только из известных путей, чтобы не плодить серии
+        route = scope["path"] if scope["path"] in _ROUTE_PATHS else "other"
+        status = "500"
+        started = asyncio.get_running_loop().time()
+
+        async def send_with_trace(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+                message["headers"] = [*message.get("headers", []), (b"x-trace-id", current.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace)
+        finally:
+            metrics.REQUEST_SECONDS.observe(asyncio.get_running_loop().time() - started, route, status)
+            metrics.trace_id.reset(token)
+
+
+def _message_from_payload(payload: Any) -> MessageIn:
+    """Сообщение из тела запроса; `TypeError`, если поля не тех типов."""
+    if not isinstance(payload, dict):
+        raise TypeError("тело запроса должно быть JSON-объектом")
+    for name, kind in (("text", str), ("media_type", str), ("media_data", dict)):
+        if payload.get(name) is not None and not isinstance(payload[name], kind):
+            raise TypeError(f"поле {name} должно быть {kind.__name__} или null")
+    return MessageIn(
+        user_id=str(payload.get("user_id") or "unknown"),
+        channel=str(payload.get("channel") or "unknown"),
+        text=payload.get("text"),
+        media_type=payload.get("media_type"),
+        media_data=payload.get("media_data"),
+    )
+
+
+def _wants_stream(request: Request, payload: dict) -> bool:
+    return bool(payload.get("stream")) or "text/event-stream" in request.headers.get("accept", "")
+
+
+def _sse(data: dict, event: str | None = None) -> bytes:
+    prefix = f"event: {event}\n".encode() if event else b""
+    return prefix + b"data: " + dumps(data) + b"\n\n"
+
+
+class ScheduledStreamingResponse(StreamingResponse):
+    """Потоковый ответ, который при любом исходе освобождает место в планировщике."""
+
+    def __init__(self, *args: Any, scheduler: Scheduler, ticket: Ticket, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.scheduler = scheduler
+        self.ticket = ticket
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.scheduler.release(self.ticket)
+
+
+def _busy_response(exc: SchedulerBusy) -> Response:
+    retry_after = max(1, round(exc.retry_after))
+    return FastJSONResponse(
+        {"error": "busy", "reason": exc.reason, "retry_after": retry_after},
+        status_code=503,
+        headers={"Retry-After": str(retry_after)},
+    )
+
+
+async def post_message(request: Request) -> Response:
+    """
+    Endpoint ядра для приёма сообщений от клиентов.
+
+    По умолчанию возвращает полный ответ JSON-объектом `{"text": ...}`.
+    Если в теле передано `"stream": true` или клиент принимает
+    `text/event-stream`, ответ отдаётся как SSE: события `data: {"delta": ...}`
+    с фрагментами текста и финальное `event: done` с полным текстом. Если
+    генерация оборвалась на середине, вместо `done` приходит `event: error`
+    с заглушкой `{"error": ..., "text": <полученная часть>}`.
 
+    Сообщения проходят через `Scheduler`; при перегрузке ядро сразу отвечает
+    503 с заголовком `Retry-After`. Тело не JSON-объект или поля не тех
+    типов — 400 с описанием ошибки.
+    """
+    try:
+        payload = loads(await request.body())
+        msg_in = _message_from_payload(payload)
+    except ValueError:
+        # orjson.JSONDecodeError и json.JSONDecodeError — подклассы ValueError
+        return FastJSONResponse({"error": "тело запроса — не JSON"}, status_code=400)
+    except TypeError as exc:
+        return FastJSONResponse({"error": str(exc)}, status_code=400)
+    agent: Agent = request.app.state.agent
+    scheduler: Scheduler = request.app.state.scheduler
+
+    if not _wants_stream(request, payload):
+        try:
+            msg_out = await scheduler.submit(msg_in)
+        except SchedulerBusy as exc:
+            return _busy_response(exc)
+        return FastJSONResponse({"text": msg_out.text})
+
+    try:
+        ticket = scheduler.admit(msg_in)
+    except SchedulerBusy as exc:
+        return _busy_response(exc)
+
+    async def events() -> AsyncIterator[bytes]:
+        await scheduler.wait(ticket)
+        chunks: list[str] = []
+        try:
+            async for chunk in agent.process_stream(msg_in):
+                chunks.append(chunk)
+                yield _sse({"delta": chunk})
+        except LLMStreamError as exc:
+            yield _sse({"error": exc.text, "text": "".join(chunks)}, event="error")
+            return
+        yield _sse({"text": "".join(chunks)}, event="done")
 
-async def health(_: Request) -> JSONResponse:
-    return JSONResponse({"status": "ok"})
+    return ScheduledStreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        scheduler=scheduler,
+        ticket=ticket,
+    )
 
 
-async def post_message(request: Request) -> JSONResponse:
+def _int_param(request: Request, name: str) -> int | None:
+    value = request.query_params.get(name)
+    if value is None or value == "":
+        return None
+    number = int(value)
+    if number < 0:
+        raise ValueError(name)
+    return number
+
+
+async def get_history(request: Request) -> Response:
     """
-    Минимальный endpoint ядра для приёма сообщений от клиентов.
+    История пользователя в формате JSON Lines (`application/x-ndjson`).
+
+    Параметры запроса: `user_id` (обязателен), `after` / `before` — курсоры
+    по `id` сообщения, `limit` — сколько отдать (по умолчанию вся история),
+    `order` — `asc` (по умолчанию) или `desc`. Каждая строка ответа —
+    одно сообщение `{"id", "channel", "type", "input", "output",
+    "input_media", "output_media", "created_at"}`.
+
+    Ответ отдаётся потоком по мере чтения страниц из БД, поэтому даже
+    история в сотни тысяч сообщений не собирается в памяти ни у ядра, ни у
+    клиента. Для докачки клиент повторяет запрос с `after` = id последней
+    полученной строки. Запрос идёт мимо планировщика: LLM не нужна.
+    """
+    user_id = request.query_params.get("user_id")
+    order = request.query_params.get("order", "asc")
+    try:
+        after = _int_param(request, "after")
+        before = _int_param(request, "before")
+        limit = _int_param(request, "limit")
+    except ValueError:
+        return FastJSONResponse({"error": "after, before и limit — неотрицательные целые"}, status_code=400)
+    if not user_id or order not in ("asc", "desc"):
+        return FastJSONResponse({"error": "нужен user_id; order — asc или desc"}, status_code=400)
+
+    memory: "Memory | ShardedMemory" = request.app.state.agent.memory
+
+    async def lines() -> AsyncIterator[bytes]:
+        async for item in memory.iter_history(
+            user_id, after=after, before=before, limit=limit, descending=order == "desc"
+        ):
+            yield dumps(item) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
 
-    Agent Core/LLM в дальнейшем заменит эту заглушку на вызов настоящего агента.
+async def upload_media(request: Request) -> Response:
     """
-    payload = await request.json()
-    user_id = str(payload.get("user_id") or "unknown")
-    channel = str(payload.get("channel") or "unknown")
-    text = payload.get("text") or "Пустое сообщение."
+    Загрузка файла в хранилище медиа ядра.
 
-    reply_text = f"Эхо от ядра (канал={channel}, user_id={user_id}): {text}"
-    return JSONResponse({"text": reply_text})
+    Тело запроса — сами байты файла (клиент может слать их chunked, не зная
+    размера заранее); ядро пишет их на диск по мере поступления и отвечает
+    `{"sha256", "size", "deduplicated"}`. Полученный `sha256` клиент передаёт
+    в `media_data` сообщения `/v1/messages`, и инструменты анализа читают
+    файл прямо из хранилища. Запрос идёт мимо планировщика: LLM не нужна.
+    """
+    store: MediaStore = request.app.state.agent.media_store
+    declared = request.headers.get("content-length")
+    if declared is not None and declared.isdigit() and int(declared) > store.max_bytes:
+        return FastJSONResponse({"error": "too_large", "limit": store.max_bytes}, status_code=413)
+    try:
+        stored = await store.save(request.stream())
+    except MediaTooLarge as exc:
+        return FastJSONResponse({"error": "too_large", "limit": exc.limit}, status_code=413)
+    return FastJSONResponse(
+        {"sha256": stored.sha256, "size": stored.size, "deduplicated": stored.deduplicated},
+        status_code=200 if stored.deduplicated else 201,
+    )
 
 
 routes = [
     Route("/health", health, methods=["GET"]),
+    Route("/metrics", metrics_endpoint, methods=["GET"]),
+    Route("/debug/profile", profile, methods=["GET"]),
     Route("/v1/messages", post_message, methods=["POST"]),
+    Route("/v1/history", get_history, methods=["GET"]),
+    Route("/v1/media", upload_media, methods=["POST"]),
 ]
+_ROUTE_PATHS = {route.path for route in routes}
+
+
+def build_memory() -> "Memory | ShardedMemory":
+    """
+    Хранилище истории: один файл `CORE_DB_PATH` или шарды по пользователям,
+    если задан `CORE_SHARDS` (число или имена через запятую, см. core/sharding.py).
+    """
+    # История пишется пакетами в фоне; при остановке очередь сбрасывается в БД
+    # Старые сообщения переносятся в сжатый архив и дочитываются оттуда прозрачно
+    archive_dir = os.getenv("ARCHIVE_DIR", "data/archive")
+    spec = os.getenv("CORE_SHARDS", "").strip()
+    if spec:
+        from core.sharding import ShardedMemory, parse_shards
+
+        return ShardedMemory(
+            os.getenv("CORE_SHARD_DIR", "data/shards"),
+            parse_shards(spec),
+            write_behind=True,
+            archive_dir=archive_dir,
+        )
+    return Memory(
+        os.getenv("CORE_DB_PATH", "data/core.db"), write_behind=True, archive=HistoryArchive(archive_dir)
+    )
+
+
+async def build_agent() -> Agent:
+    """Собрать агента и его зависимости (один экземпляр на воркер)."""
+    # Конструктор Memory создаёт схему синхронно — не блокируем event loop.
+    memory = await asyncio.to_thread(build_memory)
+    # Кэш ответов: в памяти всегда, на диске — если задан RESPONSE_CACHE_DB
+    cache = await asyncio.to_thread(
+        ResponseCache,
+        ttl=float(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+        disk_path=os.getenv("RESPONSE_CACHE_DB") or None,
+        include_history=os.getenv("RESPONSE_CACHE_HISTORY", "1") != "0",
+        max_disk_rows=int(os.getenv("RESPONSE_CACHE_MAX_ROWS", "50000")),
+    )
+    # Один пул соединений к Ollama и общий лимит параллельных генераций на процесс;
+    # несколько бэкендов — OLLAMA_BASE_URL через запятую
+    llm = LLMClient(cache=cache)
+    # Быстрая модель для коротких запросов (OLLAMA_FAST_MODEL), сильная — для остальных
+    model_router = ModelRouter.from_env(llm.model)
+    history_limit = int(os.getenv("AGENT_HISTORY_LIMIT", "20"))
+    return Agent(
+        llm_client=llm,
+        memory=memory,
+        semantic=build_semantic(memory),
+        compactor=build_compactor(memory, llm, history_limit),
+        retention=build_retention(memory, history_limit),
+        model_router=model_router,
+        warmer=build_warmer(llm, model_router),
+        history_limit=history_limit,
+        media_store=MediaStore(os.getenv("CORE_MEDIA_DIR", "data/media")),
+    )
+
+
+def _per_shard(memory: "ShardedMemory", build: Callable[[Memory], Any]) -> dict[str, Any]:
+    """Запустить по экземпляру фонового компонента на каждый шард."""
+    parts = {name: build(shard) for name, shard in memory.shards.items()}
+    for part in parts.values():
+        part.start()
+    return parts
+
+
+def build_semantic(memory: "Memory | ShardedMemory") -> "SemanticMemory | ShardedSemantic | None":
+    """Семантическая память: `SEMANTIC_MEMORY` = ollama (по умолчанию), hash или 0."""
+    kind = os.getenv("SEMANTIC_MEMORY", "ollama")
+    if kind == "0":
+        return None
+    from core.semantic import HashEmbedder, OllamaEmbedder, SemanticMemory
+
+    embedder = HashEmbedder() if kind == "hash" else OllamaEmbedder()
+    index_dir = os.getenv("SEMANTIC_INDEX_DIR", "data/semantic")
+    if not isinstance(memory, Memory):
+        from core.sharding import ShardedSemantic
+
+        # Индекс на шард: индексатор каждого шарда читает только свою БД
+        return ShardedSemantic(memory, _per_shard(
+            memory, lambda shard: SemanticMemory(shard, embedder, index_dir=os.path.join(index_dir, shard.engine.name))
+        ))
+    semantic = SemanticMemory(memory, embedder, index_dir=index_dir)
+    semantic.start()
+    return semantic
+
+
+def build_compactor(
+    memory: "Memory | ShardedMemory", llm: LLMClient, keep_recent: int
+) -> "HistoryCompactor | ShardedService[HistoryCompactor] | None":
+    """Фоновое сжатие старой истории (`COMPACTION=0` — выключить)."""
+    if os.getenv("COMPACTION", "1") == "0":
+        return None
+
+    def build(shard: Memory) -> HistoryCompactor:
+        return HistoryCompactor(
+            shard, llm, keep_recent=keep_recent, interval=float(os.getenv("COMPACTION_INTERVAL", "300"))
+        )
+
+    if not isinstance(memory, Memory):
+        from core.sharding import ShardedService
+
+        return ShardedService(memory, _per_shard(memory, build))
+    compactor = build(memory)
+    compactor.start()
+    return compactor
+
+
+def build_retention(
+    memory: "Memory | ShardedMemory", keep_recent: int
+) -> "RetentionManager | ShardedRetention | None":
+    """Перенос старой истории в архив (`RETENTION=0` — выключить)."""
+    if os.getenv("RETENTION", "1") == "0":
+        return None
+
+    def build(shard: Memory) -> RetentionManager:
+        assert shard.archive is not None
+        return RetentionManager(
+            shard,
+            shard.archive,
+            max_age_days=float(os.getenv("RETENTION_DAYS", "90")),
+            keep_recent=keep_recent,
+            interval=float(os.getenv("RETENTION_INTERVAL", "3600")),
+        )
+
+    if not isinstance(memory, Memory):
+        from core.sharding import ShardedRetention
+
+        return ShardedRetention(memory, _per_shard(memory, build))
+    if memory.archive is None:
+        return None
+    retention = build(memory)
+    retention.start()
+    return retention
+
+
+def build_warmer(llm: LLMClient, model_router: ModelRouter) -> ModelWarmer | None:
+    """Продление keep_alive моделей по трафику (`LLM_WARMER=0` — выключить)."""
+    if os.getenv("LLM_WARMER", "1") == "0":
+        return None
+    warmer = ModelWarmer(
+        llm,
+        model_router.models,
+        interval=float(os.getenv("LLM_WARMER_INTERVAL", "60")),
+        active_window=float(os.getenv("LLM_WARMER_ACTIVE_WINDOW", "7200")),
+    )
+    warmer.start()
+    return warmer
+
+
+def build_scheduler(agent: Agent) -> Scheduler:
+    """Планировщик сообщений воркера (лимиты из окружения)."""
+    return Scheduler(
+        agent.process,
+        max_concurrency=int(os.getenv("SCHED_MAX_CONCURRENCY", "4")),
+        max_user_queue=int(os.getenv("SCHED_MAX_USER_QUEUE", "5")),
+        max_queue=int(os.getenv("SCHED_MAX_QUEUE", "100")),
+        latency_slo=float(os.getenv("SCHED_LATENCY_SLO", "60")),
+        coalesce=os.getenv("SCHED_COALESCE", "1") != "0",
+    )
+
+
+async def warmup(agent: Agent) -> None:
+    """Прогреть модели маршрутизатора в Ollama, чтобы первый пользователь не ждал их загрузки."""
+    timeout = float(os.getenv("CORE_WARMUP_TIMEOUT", "60"))
+    # Быстрая модель первой: она отвечает на большинство первых сообщений
+    for model in agent.model_router.models:
+        try:
+            loaded = await asyncio.wait_for(agent.llm.warmup(model), timeout)
+        except asyncio.TimeoutError:
+            loaded = False
+        if loaded:
+            logger.info("Модель %s загружена", model)
+        else:
+            logger.warning("Не удалось прогреть модель %s — продолжаем без прогрева", model)
+
+
+def register_gauges(agent: Agent, scheduler: Scheduler) -> None:
+    """Текущие значения очередей для /metrics (читаются из stats() при каждом запросе)."""
+    gauge = metrics.REGISTRY.gauge
+    gauge("core_scheduler_running", "Сообщений в обработке", lambda: scheduler.stats()["running"])
+    gauge("core_scheduler_queued", "Сообщений в очереди планировщика", lambda: scheduler.stats()["queued"])
+    gauge("core_scheduler_rejected_total", "Отказов планировщика 503", lambda: scheduler.rejected)
+    gauge("core_llm_in_flight", "Запросов к LLM в работе", lambda: agent.llm.in_flight)
+    gauge("core_llm_waiting", "Запросов к LLM в ожидании места", lambda: agent.llm.waiting)
+    pool = agent.llm.pool
+    gauge("core_llm_backends_available", "Бэкендов Ollama, принимающих запросы", lambda: len(pool.available()))
+    gauge("core_llm_failovers_total", "Повторов запроса на другом бэкенде Ollama", lambda: pool.failovers)
+    offload = agent.tool_router.offload
+    gauge("core_offload_busy", "Занятых процессов пула инструментов", lambda: offload.stats()["busy"])
+    gauge("core_offload_waiting", "Задач в очереди пула инструментов", lambda: offload.stats()["waiting"])
+    gauge("core_offload_killed_total", "Процессов пула, убитых по таймауту или отмене", lambda: offload.killed)
+    media = agent.media_store
+    gauge("core_media_saved_total", "Новых файлов в хранилище медиа", lambda: media.saved)
+    gauge("core_media_deduplicated_total", "Загрузок, совпавших с уже сохранённым файлом", lambda: media.deduplicated)
+    shards = list(getattr(agent.memory, "shards", {"": agent.memory}).values())
+    loggers = [shard.interaction_logger for shard in shards if shard.interaction_logger is not None]
+    if loggers:
+        gauge(
+            "core_write_behind_queue", "Взаимодействий в очереди записи",
+            lambda: sum(interaction_logger.queue_size for interaction_logger in loggers),
+        )
+    if agent.warmer is not None:
+        warmer = agent.warmer
+        gauge("core_llm_warmer_refreshes_total", "Продлений keep_alive моделей прогревщиком", lambda: warmer.refreshes)
+    retention = agent.retention
+    if retention is not None:
+        gauge("core_archived_messages_total", "Сообщений, перенесённых в архив истории", lambda: retention.archived_messages)
+    if agent.llm.cache is not None:
+        cache = agent.llm.cache
+        gauge("core_response_cache_hit_rate", "Доля попаданий в кэш ответов", lambda: cache.stats()["hit_rate"])
+
+
+def create_app(
+    debug: bool | None = None,
+    agent_factory: AgentFactory | None = None,
+    warmup_llm: bool | None = None,
+) -> Starlette:
+    """
+    Фабрика приложения ядра.
+
+    Агент создаётся один раз на воркер в lifespan и переиспользуется всеми
+    запросами; при остановке фоновые записи и очередь истории сбрасываются в БД.
+
+    Args:
+        debug: Режим отладки Starlette (по умолчанию из `CORE_DEBUG`)
+        agent_factory: Корутина-фабрика агента (для бенчмарков и стендов)
+        warmup_llm: Прогревать ли модель при старте (по умолчанию из `CORE_WARMUP`)
+    """
+    if debug is None:
+        debug = os.getenv("CORE_DEBUG", "0") == "1"
+    if warmup_llm is None:
+        warmup_llm = os.getenv("CORE_WARMUP", "1") != "0"
+    factory = agent_factory or build_agent
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app: Starlette) -> AsyncIterator[None]:
+        """Жизненный цикл ядра: общие ресурсы создаются при старте и закрываются при остановке."""
+        app.state.agent = await factory()
+        app.state.scheduler = build_scheduler(app.state.agent)
+        register_gauges(app.state.agent, app.state.scheduler)
+        # Пул соединений к Ollama — до первого запроса, а не во время него
+        await app.state.agent.llm.connect()
+        if warmup_llm:
+            await warmup(app.state.agent)
+        try:
+            yield
+        finally:
+            await app.state.agent.aclose()
 
-app = Starlette(debug=True, routes=routes)
+    return Starlette(
+        debug=debug, routes=routes, lifespan=lifespan, middleware=[Middleware(TraceMiddleware)]
+    )
 
 
+app = create_app()
@@ -0,0 +1,561 @@
+"""Холодный архив истории: сжатые сегменты по пользователям и перенос в них старых сообщений."""
+
+import asyncio
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import struct
+import time
+import zlib
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Callable, Iterable, Iterator
+from pathlib import Path
+from typing import Any
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - zstandard необязателен
+    zstandard = None
+
+from core.memory import Memory
+
+logger = logging.getLogger("core.archive")
+
+# Запись индекса блока: первый и последний id, номер сегмента, смещение, длина, кодек
+_INDEX = struct.Struct("<qqIQIB")
+_CODEC_ZLIB = 0
+_CODEC_ZSTD = 1
+
+
+def _compress(codec: int, data: bytes) -> bytes:
+    if codec == _CODEC_ZSTD:
+        return zstandard.ZstdCompressor(level=9).compress(data)
+    return zlib.compress(data, 6)
+
+
+def _decompress(codec: int, data: bytes) -> bytes:
+    if codec == _CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("Блок архива сжат zstd, а пакет zstandard не установлен")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+class HistoryArchive:
+    """
+    Архив старых сообщений: по каталогу на пользователя, только дописывание.
+
+    Сообщения (в формате строк `/v1/history`) пишутся блоками по `block_rows`
+    строк JSONL, каждый блок сжат отдельно (zstd, если установлен
+    `zstandard`, иначе zlib) и дописывается в текущий сегмент `NNNNNN.seg`;
+    сегмент закрывается, когда вырастает больше `segment_bytes`. Индекс
+    `index` — записи фиксированного размера «первый/последний id блока,
+    сегмент, смещение, длина, кодек», по нему чтение диапазона id
+    распаковывает только нужные блоки.
+
+    Блок сначала записывается и синхронизируется на диск, потом попадает в
+    индекс, поэтому читатель (в том числе другой воркер) видит только
+    целые блоки. Индекс кэшируется в памяти и дочитывается, если файл вырос.
+    """
+
+    def __init__(
+        self,
+        root: str | Path = "data/archive",
+        block_rows: int = 256,
+        segment_bytes: int = 64 << 20,
+        max_cached: int = 1024,
+    ) -> None:
+        self.root = Path(root)
+        self.block_rows = block_rows
+        self.segment_bytes = segment_bytes
+        self.max_cached = max_cached
+        self.codec = _CODEC_ZSTD if zstandard is not None else _CODEC_ZLIB
+        # user_id -> (размер файла индекса, записи индекса)
+        self._indexes: OrderedDict[str, tuple[int, list[tuple[int, ...]]]] = OrderedDict()
+
+    def _dir(self, user_id: str) -> Path:
+        return self.root / hashlib.sha1(user_id.encode("utf-8")).hexdigest()[:20]
+
+    def _index(self, user_id: str) -> list[tuple[int, ...]]:
+        path = self._dir(user_id) / "index"
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            return []
+        size -= size % _INDEX.size
+        cached_size, entries = self._indexes.get(user_id, (0, []))
+        if size != cached_size:
+            with open(path, "rb") as file:
+                file.seek(cached_size)
+                tail = file.read(size - cached_size)
+            entries = entries + [entry for entry in _INDEX.iter_unpack(tail)]
+            self._indexes[user_id] = (size, entries)
+        if user_id in self._indexes:
+            self._indexes.move_to_end(user_id)
+        while len(self._indexes) > self.max_cached:
+            self._indexes.popitem(last=False)
+        return entries
+
+    def last_id(self, user_id: str) -> int:
+        """Наибольший id в архиве пользователя (0, если архива нет)."""
+        index = self._index(user_id)
+        return index[-1][1] if index else 0
+
+    def users(self) -> list[str]:
+        """Пользователи, у которых есть архив."""
+        if not self.root.exists():
+            return []
+        users = []
+        for path in sorted(self.root.iterdir()):
+            name_file = path / "user"
+            if name_file.exists():
+                users.append(name_file.read_text(encoding="utf-8"))
+        return users
+
+    def move_user(self, user_id: str, other: "HistoryArchive") -> bool:
+        """
+        Перенести архив пользователя в архив `other` (перенос между шардами).
+
+        Каталог переименовывается целиком, без перепаковки сегментов; архивы
+        должны лежать на одной файловой системе. Нет архива — ничего не делает.
+        """
+        source, target = self._dir(user_id), other._dir(user_id)
+        if not source.exists():
+            return False
+        if target.exists():
+            raise RuntimeError(f"Архив пользователя {user_id} уже есть в {other.root}")
+        target.parent.mkdir(parents=True, exist_ok=True)
+        source.rename(target)
+        self._indexes.pop(user_id, None)
+        other._indexes.pop(user_id, None)
+        return True
+
+    def append(self, user_id: str, records: list[dict[str, Any]]) -> int:
+        """
+        Дописать сообщения в архив (синхронно; вызывать из потока).
+
+        Записи должны идти по возрастанию id; уже заархивированные (id не
+        больше `last_id`) пропускаются — повтор после сбоя безопасен.
+        """
+        index = self._index(user_id)
+        last = index[-1][1] if index else 0
+        records = [record for record in records if record["id"] > last]
+        if not records:
+            return 0
+
+        user_dir = self._dir(user_id)
+        user_dir.mkdir(parents=True, exist_ok=True)
+        name_file = user_dir / "user"
+        if not name_file.exists():
+            name_file.write_text(user_id, encoding="utf-8")
+
+        segment = index[-1][2] if index else 1
+        segment_path = user_dir / f"{segment:06d}.seg"
+        if segment_path.exists() and segment_path.stat().st_size >= self.segment_bytes:
+            segment += 1
+            segment_path = user_dir / f"{segment:06d}.seg"
+
+        entries = []
+        with open(segment_path, "ab") as file:
+            offset = file.tell()
+            for start in range(0, len(records), self.block_rows):
+                block = records[start:start + self.block_rows]
+                raw = b"".join(
+                    json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n" for record in block
+                )
+                data = _compress(self.codec, raw)
+                file.write(data)
+                entries.append((block[0]["id"], block[-1]["id"], segment, offset, len(data), self.codec))
+                offset += len(data)
+            file.flush()
+            os.fsync(file.fileno())
+        with open(user_dir / "index", "ab") as file:
+            file.write(b"".join(_INDEX.pack(*entry) for entry in entries))
+            file.flush()
+            os.fsync(file.fileno())
+        return len(records)
+
+    def _read_block(self, user_id: str, entry: tuple[int, ...]) -> list[dict[str, Any]]:
+        _, _, segment, offset, length, codec = entry
+        with open(self._dir(user_id) / f"{segment:06d}.seg", "rb") as file:
+            file.seek(offset)
+            raw = _decompress(codec, file.read(length))
+        return [json.loads(line) for line in raw.splitlines()]
+
+    def _blocks(
+        self, user_id: str, after: int | None, before: int | None, descending: bool
+    ) -> list[tuple[int, ...]]:
+        blocks = [
+            entry for entry in self._index(user_id)
+            if (after is None or entry[1] > after) and (before is None or entry[0] < before)
+        ]
+        return blocks[::-1] if descending else blocks
+
+    @staticmethod
+    def _select(
+        records: list[dict[str, Any]], after: int | None, before: int | None, descending: bool
+    ) -> list[dict[str, Any]]:
+        records = [
+            record for record in records
+            if (after is None or record["id"] > after) and (before is None or record["id"] < before)
+        ]
+        return records[::-1] if descending else records
+
+    def read(
+        self,
+        user_id: str,
+        after: int | None = None,
+        before: int | None = None,
+        descending: bool = False,
+    ) -> Iterator[dict[str, Any]]:
+        """Сообщения из архива с `after < id < before` (синхронно, блок за блоком)."""
+        for entry in self._blocks(user_id, after, before, descending):
+            yield from self._select(self._read_block(user_id, entry), after, before, descending)
+
+    async def aread(
+        self,
+        user_id: str,
+        after: int | None = None,
+        before: int | None = None,
+        descending: bool = False,
+    ) -> AsyncIterator[dict[str, Any]]:
+        """Асинхронный `read`: чтение и распаковка блоков идут в потоке."""
+        blocks = await asyncio.to_thread(self._blocks, user_id, after, before, descending)
+        for entry in blocks:
+            records = await asyncio.to_thread(self._read_block, user_id, entry)
+            for record in self._select(records, after, before, descending):
+                yield record
+
+    def lookup(self, user_id: str, ids: Iterable[int]) -> dict[int, dict[str, Any]]:
+        """Сообщения архива по id (синхронно; читаются только блоки с этими id)."""
+        wanted = set(ids)
+        found: dict[int, dict[str, Any]] = {}
+        for entry in self._index(user_id):
+            if any(entry[0] <= message_id <= entry[1] for message_id in wanted):
+                for record in self._read_block(user_id, entry):
+                    if record["id"] in wanted:
+                        found[record["id"]] = record
+        return found
+
+    def tail(self, user_id: str, limit: int, before: int | None = None) -> list[dict[str, Any]]:
+        """Последние `limit` сообщений архива (с id меньше `before`) по возрастанию id."""
+        records: list[dict[str, Any]] = []
+        if limit <= 0:
+            return records
+        for record in self.read(user_id, before=before, descending=True):
+            records.append(record)
+            if len(records) >= limit:
+                break
+        return records[::-1]
+
+    def stats(self) -> dict[str, int]:
+        users = blocks = compressed = 0
+        if self.root.exists():
+            for path in self.root.glob("*/index"):
+                users += 1
+                blocks += path.stat().st_size // _INDEX.size
+                compressed += sum(seg.stat().st_size for seg in path.parent.glob("*.seg"))
+        return {"users": users, "blocks": blocks, "compressed_bytes": compressed}
+
+
+class RetentionManager:
+    """
+    Переносит старые сообщения из таблицы `messages` в `HistoryArchive`.
+
+    Раз в `interval` секунд для каждого пользователя с сообщениями старше
+    `max_age_days` архивирует непрерывный префикс его истории: всё до
+    первого сообщения моложе порога, но никогда не последние `keep_recent`
+    (их агент читает в каждом запросе). Порядок: блок записан в архив →
+    строки удалены из БД. Если процесс упал между этими шагами, следующий
+    проход сначала удалит из БД то, что уже есть в архиве.
+
+    При нескольких воркерах архивирует только один: остальные не получают
+    файловую блокировку `<архив>/.lock` и пропускают проход.
+    """
+
+    def __init__(
+        self,
+        memory: Memory,
+        archive: HistoryArchive,
+        max_age_days: float = 90.0,
+        keep_recent: int = 20,
+        interval: float = 3600.0,
+        batch_rows: int = 5000,
+    ) -> None:
+        self.memory = memory
+        self.archive = archive
+        self.max_age_days = max_age_days
+        self.keep_recent = keep_recent
+        self.interval = interval
+        self.batch_rows = batch_rows
+        self._task: asyncio.Task[None] | None = None
+
+        self.archived_messages = 0
+        self.runs = 0
+
+    def start(self) -> None:
+        """Запустить периодический перенос (нужен работающий event loop)."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception:  # noqa: BLE001
+                logger.exception("Ошибка архивирования истории — повторим позже")
+            await asyncio.sleep(self.interval)
+
+    @contextlib.contextmanager
+    def _exclusive(self) -> Iterator[bool]:
+        self.archive.root.mkdir(parents=True, exist_ok=True)
+        with open(self.archive.root / ".lock", "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _cutoff(self) -> str:
+        # Формат CURRENT_TIMESTAMP SQLite (UTC)
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time() - self.max_age_days * 86400))
+
+    async def run_once(self) -> int:
+        """Один проход по всем пользователям; возвращает число перенесённых сообщений."""
+        cutoff = self._cutoff()
+        with self._exclusive() as acquired:
+            if not acquired:
+                return 0
+            users = await self.memory.engine.read(
+                lambda conn: [
+                    row[0] for row in conn.execute(
+                        "SELECT DISTINCT user_id FROM messages WHERE created_at < ?", (cutoff,)
+                    )
+                ]
+            )
+            moved = 0
+            for user_id in users:
+                moved += await self.archive_user(user_id, cutoff)
+        self.runs += 1
+        if moved:
+            logger.info("В архив перенесено %d сообщений %d пользователей", moved, len(users))
+        return moved
+
+    def _boundary(self, conn: sqlite3.Connection, user_id: str, cutoff: str) -> int | None:
+        """id, начиная с которого сообщения пользователя остаются в БД."""
+        keep_from = conn.execute(
+            "SELECT id FROM messages WHERE user_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?",
+            (user_id, max(0, self.keep_recent - 1)),
+        ).fetchone()
+        if keep_from is None:
+            return None
+        young = conn.execute(
+            "SELECT MIN(id) FROM messages WHERE user_id = ? AND created_at >= ?", (user_id, cutoff)
+        ).fetchone()[0]
+        return min(keep_from[0], young) if young is not None else keep_from[0]
+
+    async def archive_user(self, user_id: str, cutoff: str | None = None) -> int:
+        """Перенести в архив старый префикс истории пользователя."""
+        cutoff = cutoff or self._cutoff()
+        engine = self.memory.engine
+        last = await asyncio.to_thread(self.archive.last_id, user_id)
+        if last:
+            # Хвост прошлого прохода: в архиве уже есть, из БД удалить не успели.
+            # Удаляются только строки, которые действительно лежат в архиве
+            stale = await engine.read(self._select_ids_upto, user_id, last)
+            if stale:
+                archived = await asyncio.to_thread(self.archive.lookup, user_id, stale)
+                await engine.write(self._delete_ids, user_id, list(archived))
+                if len(archived) < len(stale):
+                    logger.warning(
+                        "У %s %d сообщений с id не больше архивного (%d), которых нет в архиве — оставлены в БД",
+                        user_id, len(stale) - len(archived), last,
+                    )
+
+        boundary = await engine.read(self._boundary, user_id, cutoff)
+        if boundary is None:
+            return 0
+        moved = 0
+        while True:
+            rows = await engine.read(
+                lambda conn: conn.execute(
+                    f"""
+                    SELECT {Memory.HISTORY_COLUMNS} FROM messages
+                    WHERE user_id = ? AND id > ? AND id < ?
+                    ORDER BY id LIMIT ?
+                    """,
+                    (user_id, last, boundary, self.batch_rows),
+                ).fetchall()
+            )
+            if not rows:
+                break
+            records = [Memory.history_record(row) for row in rows]
+            await asyncio.to_thread(self.archive.append, user_id, records)
+            await engine.write(self._delete_ids, user_id, [record["id"] for record in records])
+            last = records[-1]["id"]
+            moved += len(records)
+        self.archived_messages += moved
+        return moved
+
+    @staticmethod
+    def _select_ids_upto(conn: sqlite3.Connection, user_id: str, upto_id: int) -> list[int]:
+        return [
+            row[0] for row in conn.execute(
+                "SELECT id FROM messages WHERE user_id = ? AND id <= ? ORDER BY id", (user_id, upto_id)
+            )
+        ]
+
+    @staticmethod
+    def _delete_ids(conn: sqlite3.Connection, user_id: str, ids: list[int]) -> None:
+        conn.executemany("DELETE FROM messages WHERE user_id = ? AND id = ?", [(user_id, i) for i in ids])
+
+    def stats(self) -> dict[str, float]:
+        return {"runs": self.runs, "archived_messages": self.archived_messages}
+
+
+async def export_jsonl(
+    memory: Memory, write: Callable[[bytes], Any], users: Iterable[str] | None = None
+) -> int:
+    """
+    Выгрузить историю (архив и таблицу `messages`) строками JSONL с полем `user_id`.
+
+    Пользователи выгружаются по очереди, история каждого — потоком через
+    `Memory.iter_history`, так что в памяти не больше страницы сообщений.
+    """
+    if users is None:
+        hot = await memory.engine.read(
+            lambda conn: [row[0] for row in conn.execute("SELECT DISTINCT user_id FROM messages")]
+        )
+        archived = await asyncio.to_thread(memory.archive.users) if memory.archive else []
+        users = sorted(set(hot) | set(archived))
+    count = 0
+    for user_id in users:
+        async for record in memory.iter_history(user_id):
+            write(json.dumps({"user_id": user_id, **record}, ensure_ascii=False).encode("utf-8") + b"\n")
+            count += 1
+    return count
+
+
+class ImportConflict(ValueError):
+    """Строка выгрузки занимает id, который в БД или архиве принадлежит другому сообщению."""
+
+
+def _same_message(existing: tuple[Any, ...] | None, row: tuple[Any, ...]) -> bool:
+    # row — параметры вставки: id, channel, type, input, output, ..., created_at, user_id
+    return existing is not None and existing == (row[8], row[7], row[3], row[4])
+
+
+def _import_batch(
+    conn: sqlite3.Connection, rows: list[tuple[Any, ...]], floors: dict[str, int],
+    archived: set[tuple[str, int]], remap: bool,
+) -> dict[str, int]:
+    counts = {"imported": 0, "skipped": 0, "remapped": 0}
+    for row in rows:
+        message_id, user_id = row[0], row[8]
+        if (user_id, message_id) in archived:
+            counts["skipped"] += 1
+            continue
+        existing = conn.execute(
+            "SELECT user_id, created_at, input_text, output_text FROM messages WHERE id = ?", (message_id,)
+        ).fetchone()
+        if _same_message(existing, row):
+            counts["skipped"] += 1
+            continue
+        if existing is None and message_id > floors.get(user_id, 0):
+            conn.execute(_IMPORT_SQL, row)
+            counts["imported"] += 1
+            continue
+        # id занят другим сообщением или ниже границы архива пользователя
+        if not remap:
+            raise ImportConflict(
+                f"id {message_id} пользователя {user_id} уже занят"
+                + (" другим сообщением" if existing is not None else " архивом (id не больше архивного)")
+                + "; импортируйте с перенумерацией"
+            )
+        # Перенумерованная строка получает id больше всех в БД: повторный импорт её узнаёт
+        duplicate = conn.execute(
+            """
+            SELECT 1 FROM messages WHERE user_id = ? AND id > ? AND created_at = ?
+            AND input_text IS ? AND output_text IS ? LIMIT 1
+            """,
+            (user_id, message_id, row[7], row[3], row[4]),
+        ).fetchone()
+        if duplicate is not None:
+            counts["skipped"] += 1
+            continue
+        conn.execute(_IMPORT_SQL, (None, *row[1:]))
+        counts["imported"] += 1
+        counts["remapped"] += 1
+    return counts
+
+
+_IMPORT_SQL = f"INSERT INTO messages ({Memory.HISTORY_COLUMNS}, user_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+
+async def import_jsonl(
+    memory: Memory, lines: Iterable[bytes], batch_size: int = 1000, remap: bool = False
+) -> dict[str, int]:
+    """
+    Загрузить строки `export_jsonl` в таблицу `messages`, сохраняя id.
+
+    Строка, уже лежащая в БД или архиве под тем же id, пропускается — повторный
+    импорт того же файла ничего не дублирует. Если id занят другим сообщением
+    (например, при слиянии выгрузок двух узлов) или не больше архивного id
+    пользователя, импорт останавливается с `ImportConflict` (уже загруженные
+    пакеты остаются); с `remap=True` такие строки получают новые id после всех
+    существующих. Старые сообщения затем перенесёт в архив `RetentionManager`.
+    Возвращает число вставленных, пропущенных и перенумерованных строк.
+    """
+    floors: dict[str, int] = {}
+    totals = {"imported": 0, "skipped": 0, "remapped": 0}
+
+    async def flush(rows: list[tuple[Any, ...]]) -> None:
+        for user_id in {row[8] for row in rows} - floors.keys():
+            floors[user_id] = await asyncio.to_thread(memory.archive.last_id, user_id) if memory.archive else 0
+        # Строки ниже границы архива могут уже лежать в нём (выгрузка включает архив)
+        below: dict[str, list[int]] = {}
+        for row in rows:
+            if row[0] <= floors[row[8]]:
+                below.setdefault(row[8], []).append(row[0])
+        archived: set[tuple[str, int]] = set()
+        for user_id, ids in below.items():
+            found = await asyncio.to_thread(memory.archive.lookup, user_id, ids)  # type: ignore[union-attr]
+            archived.update((user_id, message_id) for message_id in found)
+        counts = await memory.engine.write(_import_batch, rows, floors, archived, remap)
+        for key, value in counts.items():
+            totals[key] += value
+
+    batch: list[tuple[Any, ...]] = []
+    for line in lines:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        batch.append((
+            record["id"], record["channel"], record["type"], record["input"], record["output"],
+            json.dumps(record["input_media"]) if record.get("input_media") else None,
+            json.dumps(record["output_media"]) if record.get("output_media") else None,
+            record["created_at"], record["user_id"],
+        ))
+        if len(batch) >= batch_size:
+            await flush(batch)
+            batch = []
+    if batch:
+        await flush(batch)
+    return totals
@@ -0,0 +1,155 @@
+"""Фоновое сжатие старой истории в сводки по пользователям."""
+
+import asyncio
+import logging
+import sqlite3
+from typing import Any
+
+from core.context import truncate_to_tokens
+from core.llm_client import LLMClient
+from core.memory import Memory
+
+logger = logging.getLogger("core.compaction")
+
+SUMMARY_SYSTEM_PROMPT = (
+    "Ты ведёшь заметки о собеседнике. Обнови краткое содержание переписки: "
+    "сохрани факты о пользователе, его предпочтения, договорённости и открытые вопросы. "
+    "Пиши сжато, списком, без приветствий и пересказа очевидного."
+)
+
+
+class HistoryCompactor:
+    """
+    Сворачивает старые сообщения пользователя в сводку.
+
+    Раз в `interval` секунд ищет пользователей, у которых после последней
+    сводки накопилось больше `keep_recent + min_batch` сообщений, и просит
+    LLM обновить сводку с учётом всего, кроме последних `keep_recent`.
+    Последние `keep_recent` сообщений остаются как есть — их агент берёт в
+    историю напрямую, поэтому `keep_recent` не должен быть меньше лимита
+    истории агента, иначе реплики попадут в контекст дважды.
+    Сами строки `messages` не удаляются.
+    """
+
+    def __init__(
+        self,
+        memory: Memory,
+        llm: LLMClient,
+        keep_recent: int = 20,
+        min_batch: int = 20,
+        max_batch: int = 100,
+        interval: float = 300.0,
+        summary_tokens: int = 400,
+    ) -> None:
+        self.memory = memory
+        self.llm = llm
+        self.keep_recent = keep_recent
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.interval = interval
+        self.summary_tokens = summary_tokens
+        self._task: asyncio.Task[None] | None = None
+
+        self.compacted_users = 0
+        self.compacted_messages = 0
+
+    def start(self) -> None:
+        """Запустить периодическое сжатие (нужен работающий event loop)."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.compact_all()
+            except Exception:  # noqa: BLE001
+                logger.exception("Ошибка сжатия истории — повторим позже")
+
+    def _select_candidates(self, conn: sqlite3.Connection) -> list[str]:
+        rows = conn.execute(
+            """
+            SELECT m.user_id FROM messages m
+            LEFT JOIN summaries s ON s.user_id = m.user_id
+            WHERE m.id > COALESCE(s.upto_id, 0)
+            GROUP BY m.user_id
+            HAVING COUNT(*) >= ?
+            """,
+            (self.keep_recent + self.min_batch,),
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def _select_batch(
+        self, conn: sqlite3.Connection, user_id: str, after_id: int
+    ) -> list[tuple[Any, ...]]:
+        # Первые max_batch сообщений после прошлой сводки, кроме последних keep_recent:
+        # граница — id (keep_recent + 1)-го с конца сообщения, оба запроса идут по индексу
+        return conn.execute(
+            """
+            SELECT id, input_text, output_text FROM messages
+            WHERE user_id = ? AND id > ? AND id <= (
+                SELECT id FROM messages WHERE user_id = ?
+                ORDER BY id DESC LIMIT 1 OFFSET ?
+            )
+            ORDER BY id
+            LIMIT ?
+            """,
+            (user_id, after_id, user_id, self.keep_recent, self.max_batch),
+        ).fetchall()
+
+    async def compact_all(self) -> int:
+        """Обновить сводки всех пользователей, которым это нужно. Возвращает их число."""
+        users = await self.memory.engine.read(self._select_candidates)
+        done = 0
+        for user_id in users:
+            if await self.compact_user(user_id):
+                done += 1
+        return done
+
+    async def compact_user(self, user_id: str) -> bool:
+        """Свернуть накопившиеся старые сообщения пользователя в сводку."""
+        current = await self.memory.get_summary(user_id)
+        summary, upto_id = current if current else ("", 0)
+
+        rows = await self.memory.engine.read(self._select_batch, user_id, upto_id)
+        if len(rows) < self.min_batch:
+            return False
+
+        lines = []
+        for _, input_text, output_text in rows:
+            if input_text:
+                lines.append(f"Пользователь: {input_text}")
+            if output_text:
+                lines.append(f"Ассистент: {truncate_to_tokens(output_text, 200)}")
+        prompt = (
+            f"Текущее краткое содержание:\n{summary or '(пока пусто)'}\n\n"
+            "Новые сообщения:\n" + "\n".join(lines) + "\n\nОбновлённое краткое содержание:"
+        )
+
+        try:
+            new_summary = await self.llm.generate(
+                prompt, system=SUMMARY_SYSTEM_PROMPT, use_cache=False, raise_errors=True
+            )
+        except Exception:  # noqa: BLE001
+            logger.warning("LLM недоступна — сводку пользователя %s обновим позже", user_id)
+            return False
+
+        new_summary = truncate_to_tokens(new_summary.strip(), self.summary_tokens)
+        if not new_summary:
+            return False
+        await self.memory.save_summary(user_id, new_summary, rows[-1][0])
+        self.compacted_users += 1
+        self.compacted_messages += len(rows)
+        return True
+
+    def stats(self) -> dict[str, float]:
+        return {"users": self.compacted_users, "messages": self.compacted_messages}
@@ -0,0 +1,234 @@
+"""Сборка контекста запроса к LLM в пределах бюджета токенов."""
+
+import functools
+import hashlib
+import math
+import os
+import re
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+@functools.lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    """
+    Приблизительное число токенов в тексте.
+
+    Точный токенизатор модели здесь не нужен и стоит дорого, поэтому слово
+    считается как ceil(длина / 4) токенов для латиницы и ceil(длина / 2.5)
+    для остальных алфавитов (кириллица в BPE-словарях дробится сильнее),
+    каждый знак препинания — отдельный токен. Результат кэшируется:
+    одни и те же реплики истории пересчитываются на каждом запросе.
+    """
+    tokens = 0
+    for piece in _TOKEN_RE.findall(text):
+        if len(piece) == 1:
+            tokens += 1
+        elif piece.isascii():
+            tokens += math.ceil(len(piece) / 4)
+        else:
+            tokens += math.ceil(len(piece) / 2.5)
+    return tokens
+
+
+def truncate_to_tokens(text: str, limit: int) -> str:
+    """Обрезать текст так, чтобы он укладывался в `limit` токенов (по оценке `count_tokens`)."""
+    if limit <= 0:
+        return ""
+    total = count_tokens(text)
+    if total <= limit:
+        return text
+    # Длина пропорциональна числу токенов; подрезаем, пока оценка не сойдётся
+    end = max(1, len(text) * limit // total)
+    while end > 1 and count_tokens(text[:end]) + 1 > limit:
+        end = end * 9 // 10
+    return text[:end].rstrip() + "…"
+
+
+@dataclass
+class BuiltContext:
+    """Результат сборки: что отправить в LLM и сколько это стоит."""
+
+    prompt: str
+    history: list[dict[str, str]]
+    tokens: int
+    # Сколько элементов каждого вида вошло в контекст
+    included: dict[str, int] = field(default_factory=dict)
+
+
+class ContextBuilder:
+    """
+    Упаковывает контекст запроса в бюджет токенов.
+
+    Системный промпт и сам запрос пользователя входят всегда (запрос при
+    необходимости обрезается). Остальное добавляется по приоритету, пока
+    есть место:
+
+    1. результат инструментов — не больше `tool_share` оставшегося бюджета;
+    2. сводка прежних разговоров;
+    3. история — от новых реплик к старым, обмен «вопрос-ответ» целиком;
+    4. найденные семантической памятью фрагменты.
+
+    Бюджет по умолчанию — `CONTEXT_BUDGET_TOKENS` (1536): стандартное окно
+    Ollama в 2048 токенов минус запас на ответ.
+
+    В режиме `stable_prefix` (`CONTEXT_STABLE_PREFIX=1`) окно истории не
+    сдвигается на каждом ходу. Для пользователя запоминается первый обмен
+    окна (якорь), и новые реплики только дописываются в конец, так что
+    начало промпта (системный промпт, сводка, история) побайтно совпадает с
+    предыдущим запросом и Ollama переиспользует KV-кэш. Когда история с якоря
+    перестаёт помещаться, окно переустанавливается так, чтобы занять не больше
+    `refill_share` бюджета истории — дальше снова есть куда дописывать.
+    """
+
+    def __init__(
+        self,
+        budget_tokens: int | None = None,
+        tool_share: float = 0.5,
+        stable_prefix: bool | None = None,
+        refill_share: float = 0.5,
+        max_anchors: int = 10000,
+    ) -> None:
+        self.budget_tokens = budget_tokens or int(os.getenv("CONTEXT_BUDGET_TOKENS", "1536"))
+        self.tool_share = tool_share
+        if stable_prefix is None:
+            stable_prefix = os.getenv("CONTEXT_STABLE_PREFIX", "0") == "1"
+        self.stable_prefix = stable_prefix
+        self.refill_share = refill_share
+        self.max_anchors = max_anchors
+        # user_id -> отпечаток первого обмена текущего окна истории
+        self._anchors: OrderedDict[str, str] = OrderedDict()
+
+        self.rewindows = 0
+
+    @staticmethod
+    def _fingerprint(input_text: str | None, output_text: str | None) -> str:
+        raw = f"{input_text or ''}\x00{output_text or ''}".encode("utf-8")
+        return hashlib.blake2b(raw, digest_size=8).hexdigest()
+
+    @staticmethod
+    def _exchange(input_text: str | None, output_text: str | None) -> list[dict[str, str]]:
+        exchange = []
+        if input_text:
+            exchange.append({"role": "user", "content": input_text})
+        if output_text:
+            exchange.append({"role": "assistant", "content": output_text})
+        return exchange
+
+    def _newest_fitting(
+        self, history: list[tuple[str | None, str | None]], budget: int
+    ) -> int:
+        """Индекс начала самого длинного хвоста истории, укладывающегося в `budget`."""
+        used = 0
+        start = len(history)
+        for index in range(len(history) - 1, -1, -1):
+            cost = sum(count_tokens(m["content"]) for m in self._exchange(*history[index]))
+            if used + cost > budget:
+                break
+            used += cost
+            start = index
+        return start
+
+    def _window_start(
+        self, user_id: str, history: list[tuple[str | None, str | None]], budget: int
+    ) -> int:
+        if not history:
+            return 0
+        anchor = self._anchors.get(user_id)
+        if anchor is not None:
+            for index, exchange in enumerate(history):
+                if self._fingerprint(*exchange) == anchor:
+                    if self._newest_fitting(history[index:], budget) == 0:
+                        self._anchors.move_to_end(user_id)
+                        return index
+                    break
+
+        # Якорь выпал из загруженной истории или окно переполнилось — переустанавливаем
+        if anchor is not None:
+            self.rewindows += 1
+        start = self._newest_fitting(history, int(budget * self.refill_share))
+        if start < len(history):
+            self._anchors[user_id] = self._fingerprint(*history[start])
+            self._anchors.move_to_end(user_id)
+            while len(self._anchors) > self.max_anchors:
+                self._anchors.popitem(last=False)
+        return start
+
+    def build(
+        self,
+        system: str,
+        text: str,
+        history: list[tuple[str | None, str | None]] | None = None,
+        summary: str | None = None,
+        memories: list[str] | None = None,
+        tool_result: str | None = None,
+        user_id: str | None = None,
+    ) -> BuiltContext:
+        """
+        Собрать промпт и историю.
+
+        Args:
+            system: Системный промпт
+            text: Текст запроса пользователя
+            history: Пары (вопрос, ответ) от старых к новым
+            summary: Сводка более ранних разговоров
+            memories: Фрагменты прошлых разговоров от семантической памяти
+            tool_result: Объединённый результат инструментов
+            user_id: Пользователь (нужен для окна истории в режиме `stable_prefix`)
+        """
+        included = {"history": 0, "memories": 0, "summary": 0, "tool": 0}
+        used = count_tokens(system)
+
+        # Сам запрос важнее всего остального, но не больше половины бюджета
+        text = truncate_to_tokens(text, max(1, (self.budget_tokens - used) // 2))
+        used += count_tokens(text)
+
+        tool_block = ""
+        if tool_result:
+            limit = int((self.budget_tokens - used) * self.tool_share)
+            tool_result = truncate_to_tokens(tool_result, limit - 8)
+            if tool_result:
+                tool_block = f"\n\n[Контекст от инструмента: {tool_result}]"
+                used += count_tokens(tool_block)
+                included["tool"] = 1
+
+        summary_messages: list[dict[str, str]] = []
+        if summary:
+            content = f"Краткое содержание прежних разговоров с пользователем:\n{summary}"
+            cost = count_tokens(content)
+            if used + cost <= self.budget_tokens:
+                summary_messages.append({"role": "system", "content": content})
+                used += cost
+                included["summary"] = 1
+
+        history = history or []
+        if self.stable_prefix and user_id is not None:
+            # Окно сдвигается, только если история с якоря перестала помещаться
+            start = self._window_start(user_id, history, self.budget_tokens - used)
+        else:
+            start = self._newest_fitting(history, self.budget_tokens - used)
+        exchanges = [self._exchange(*exchange) for exchange in history[start:]]
+        used += sum(count_tokens(m["content"]) for exchange in exchanges for m in exchange)
+        included["history"] = len(exchanges)
+
+        memory_block = ""
+        kept: list[str] = []
+        for snippet in memories or []:
+            candidate = "\n---\n".join([*kept, snippet])
+            block = f"\n\n[Из прошлых разговоров с пользователем:\n{candidate}]"
+            if used - count_tokens(memory_block) + count_tokens(block) > self.budget_tokens:
+                break
+            used += count_tokens(block) - count_tokens(memory_block)
+            kept.append(snippet)
+            memory_block = block
+        included["memories"] = len(kept)
+
+        messages = summary_messages + [m for exchange in exchanges for m in exchange]
+        return BuiltContext(
+            prompt=text + memory_block + tool_block,
+            history=messages,
+            tokens=used,
+            included=included,
+        )
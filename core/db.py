@@ -0,0 +1,121 @@
+"""Асинхронный движок SQLite: долгоживущие соединения вне event loop."""
+
+import asyncio
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, TypeVar
+
+from core.metrics import SHARD_WRITE_SECONDS, SQLITE_SECONDS
+
+T = TypeVar("T")
+
+# Прагмы применяются к каждому соединению один раз при его открытии.
+# WAL позволяет читателям не блокироваться писателем, synchronous=NORMAL
+# в режиме WAL безопасен для целостности БД и не делает fsync на каждый commit.
+DEFAULT_PRAGMAS: dict[str, str | int] = {
+    # Первым: переключение в WAL берёт блокировку и должно ждать другие процессы
+    "busy_timeout": 5000,
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "temp_store": "MEMORY",
+    "cache_size": -16000,  # ~16 MB страничного кэша на соединение
+    "mmap_size": 128 * 1024 * 1024,
+}
+
+
+class SQLiteEngine:
+    """
+    Пул долгоживущих SQLite-соединений с выделенными потоками.
+
+    Все запросы выполняются в отдельных потоках, а не в event loop:
+    записи идут через единственный поток-писатель (SQLite всё равно
+    допускает только одного писателя), чтения — через небольшой пул читателей.
+    У каждого потока своё соединение, открытое один раз и живущее до `close()`.
+    Движок шарда (`name`) дополнительно пишет свои транзакции в метрику
+    `core_shard_write_seconds{shard}`.
+    """
+
+    def __init__(
+        self,
+        db_path: str | Path,
+        readers: int = 4,
+        pragmas: dict[str, str | int] | None = None,
+        name: str | None = None,
+    ) -> None:
+        self.db_path = Path(db_path)
+        self.name = name
+        self.writes = 0
+        self.pragmas = pragmas if pragmas is not None else DEFAULT_PRAGMAS
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer")
+        self._readers = ThreadPoolExecutor(
+            max_workers=max(1, readers), thread_name_prefix="sqlite-reader"
+        )
+        self._closed = False
+
+    def _connection(self) -> sqlite3.Connection:
+        """Соединение текущего потока (создаётся при первом обращении)."""
+        conn: sqlite3.Connection | None = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            for name, value in self.pragmas.items():
+                conn.execute(f"PRAGMA {name} = {value}")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _run_read(self, fn: Callable[..., T], args: tuple[Any, ...]) -> T:
+        return fn(self._connection(), *args)
+
+    def _run_write(self, fn: Callable[..., T], args: tuple[Any, ...]) -> T:
+        conn = self._connection()
+        try:
+            result = fn(conn, *args)
+            conn.commit()
+            return result
+        except BaseException:
+            conn.rollback()
+            raise
+
+    async def read(self, fn: Callable[..., T], *args: Any) -> T:
+        """Выполнить `fn(conn, *args)` в потоке-читателе."""
+        loop = asyncio.get_running_loop()
+        with SQLITE_SECONDS.time("read"):
+            return await loop.run_in_executor(self._readers, self._run_read, fn, args)
+
+    async def write(self, fn: Callable[..., T], *args: Any) -> T:
+        """Выполнить `fn(conn, *args)` в потоке-писателе и зафиксировать транзакцию."""
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        with SQLITE_SECONDS.time("write"):
+            result = await loop.run_in_executor(self._writer, self._run_write, fn, args)
+        self.writes += 1
+        if self.name is not None:
+            SHARD_WRITE_SECONDS.observe(time.perf_counter() - started, self.name)
+        return result
+
+    def write_sync(self, fn: Callable[..., T], *args: Any) -> T:
+        """Синхронный вариант `write` (для инициализации вне event loop)."""
+        return self._writer.submit(self._run_write, fn, args).result()
+
+    def close(self) -> None:
+        """Дождаться текущих запросов и закрыть все соединения."""
+        if self._closed:
+            return
+        self._closed = True
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+    async def aclose(self) -> None:
+        """Асинхронный `close()`: ожидание потоков не блокирует event loop."""
+        await asyncio.to_thread(self.close)
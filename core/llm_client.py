@@ -1,20 +1,191 @@
 """Абстракция для работы с LLM (локальные модели через Ollama)."""
 
+import asyncio
+import contextlib
 import httpx
+import json
+import logging
 import os
+import time
+from collections.abc import AsyncIterator
 from typing import Any
 
+from core import metrics
+from core.llm_pool import Backend, BackendPool
+from core.response_cache import ResponseCache
+
+logger = logging.getLogger("core.llm_client")
+
+
+class LLMStreamError(RuntimeError):
+    """
+    Поток ответа оборвался после того, как часть текста уже отдана.
+
+    `text` — заглушка для пользователя (как у `generate` при ошибке); в сам
+    поток она не попадает, чтобы не склеиться с частичным ответом.
+    """
+
+    def __init__(self, text: str, cause: BaseException) -> None:
+        super().__init__(text)
+        self.text = text
+        self.cause = cause
+
 
 class LLMClient:
-    """Клиент для локального LLM через Ollama."""
+    """
+    Клиент для локального LLM через Ollama.
+
+    Держит один пул HTTP-соединений с keep-alive на всё время жизни клиента
+    и ограничивает число одновременных генераций семафором: лишние запросы
+    ждут в очереди, а не перегружают GPU/CPU-бэкенды.
+    После использования клиент нужно закрыть через `aclose()`.
+
+    Бэкендов может быть несколько (`OLLAMA_BASE_URL` через запятую): запросы
+    распределяет `BackendPool` — балансировка, повтор на другом бэкенде,
+    circuit breaker и хеджирование. `max_in_flight` — лимит на один бэкенд.
 
-    def __init__(self, base_url: str | None = None, model: str = "llama3.2") -> None:
+    Во все запросы передаются одинаковые `keep_alive` (`OLLAMA_KEEP_ALIVE`,
+    30m) и `options` (например, `num_ctx` из `OLLAMA_NUM_CTX`): другое
+    значение `num_ctx` заставило бы Ollama перезагрузить модель и сбросить
+    KV-кэш, а короткий `keep_alive` — выгрузить её между сообщениями.
+    """
+
+    def __init__(
+        self,
+        base_url: str | None = None,
+        model: str | None = None,
+        max_in_flight: int | None = None,
+        http_client: httpx.AsyncClient | None = None,
+        cache: ResponseCache | None = None,
+        keep_alive: str | None = None,
+        options: dict[str, Any] | None = None,
+        pool: BackendPool | None = None,
+    ) -> None:
         self.base_url = base_url or os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
         self.model = model or os.getenv("OLLAMA_MODEL", "llama3.2")
         self.timeout = 60.0
+        backend_limit = max_in_flight or int(os.getenv("OLLAMA_MAX_IN_FLIGHT", "2"))
+        self.pool = pool or BackendPool.from_env(self.base_url, capacity=backend_limit)
+        self.max_in_flight = backend_limit * len(self.pool.backends)
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        self._client = http_client
+        self._owns_client = http_client is None
+        self.cache = cache
+        self.keep_alive = keep_alive or os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+        if options is None:
+            options = {}
+            if os.getenv("OLLAMA_NUM_CTX"):
+                options["num_ctx"] = int(os.environ["OLLAMA_NUM_CTX"])
+        self.options = options
+
+        # Метрики очереди к бэкенду
+        self.in_flight = 0
+        self.waiting = 0
+        self.requests = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        # Трафик по моделям (для прогрева, см. core.model_router.ModelWarmer)
+        self.model_requests: dict[str, int] = {}
+        self.last_used: dict[str, float] = {}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_in_flight * 2,
+                    max_keepalive_connections=self.max_in_flight,
+                    keepalive_expiry=120.0,
+                ),
+            )
+        return self._client
+
+    async def connect(self) -> None:
+        """
+        Создать пул соединений заранее, в потоке, и запустить проверки бэкендов.
+
+        Первое создание клиента импортирует транспорт httpcore и загружает
+        корневые сертификаты — это сотни миллисекунд, которые иначе
+        достались бы первому запросу пользователя.
+        """
+        if self._client is None:
+            await asyncio.to_thread(self._get_client)
+        self.pool.start(self._get_client())
+
+    async def aclose(self) -> None:
+        """Закрыть пул соединений (если клиент создан этим объектом)."""
+        await self.pool.stop()
+        if self._client is not None and self._owns_client:
+            await self._client.aclose()
+        self._client = None
+        if self.cache is not None:
+            await self.cache.aclose()
+
+    @contextlib.asynccontextmanager
+    async def _slot(self) -> AsyncIterator[None]:
+        """Занять место среди одновременных запросов к LLM с учётом времени ожидания."""
+        started = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        waited = time.perf_counter() - started
+        metrics.LLM_QUEUE_SECONDS.observe(waited)
+        self.requests += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "requests": self.requests,
+            "avg_wait": self.total_wait / self.requests if self.requests else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+    async def warmup(self, model: str | None = None) -> bool:
+        """
+        Загрузить модель (по умолчанию `self.model`) в память Ollama заранее.
+
+        Запрос к `/api/chat` с пустым списком сообщений только загружает
+        модель, не генерируя текст, и продлевает её `keep_alive`. Модель
+        загружается на всех доступных бэкендах пула. Возвращает False, если
+        ни один бэкенд её не загрузил.
+        """
+        payload = self._payload([], stream=False, model=model)
+
+        async def load(backend: Backend) -> bool:
+            try:
+                resp = await self._get_client().post(f"{backend.url}/api/chat", json=payload)
+                resp.raise_for_status()
+                return True
+            except httpx.HTTPError:
+                return False
+
+        return any(await asyncio.gather(*(load(backend) for backend in self.pool.available())))
+
+    def _touch(self, model: str) -> None:
+        self.model_requests[model] = self.model_requests.get(model, 0) + 1
+        self.last_used[model] = time.monotonic()
 
     async def generate(
-        self, prompt: str, system: str | None = None, history: list[dict[str, str]] | None = None
+        self,
+        prompt: str,
+        system: str | None = None,
+        history: list[dict[str, str]] | None = None,
+        use_cache: bool = True,
+        raise_errors: bool = False,
+        model: str | None = None,
     ) -> str:
         """
         Сгенерировать ответ от LLM.
@@ -23,34 +194,239 @@ class LLMClient:
             prompt: Пользовательский запрос
             system: Системный промпт (опционально)
             history: История диалога в формате [{"role": "user", "content": "..."}, ...]
+            use_cache: Разрешить ответ из кэша (если кэш подключён)
+            raise_errors: Пробрасывать ошибки вместо текста-заглушки
+                (для фоновых задач, которым заглушка не нужна)
+            model: Модель для этого запроса (по умолчанию `self.model`)
 
         Returns:
             Сгенерированный текст ответа
         """
+        model = model or self.model
+        cache_key = self._cache_key(prompt, system, history, model) if use_cache else None
+        if cache_key is not None:
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        payload = self._payload(self._build_messages(prompt, system, history), stream=False, model=model)
+        self._touch(model)
+
+        started = time.perf_counter()
+        try:
+            async with self._slot():
+                backend, data = await self.pool.call(lambda b: self._post_chat(b, payload), "generate")
+                self.pool.release(backend)
+                text = str(data.get("message", {}).get("content", ""))
+        except Exception as e:
+            metrics.LLM_SECONDS.observe(time.perf_counter() - started, "generate", "error")
+            if raise_errors:
+                raise
+            # Если Ollama недоступна, возвращаем умную заглушку
+            return self._error_text(e, model)
+        metrics.LLM_SECONDS.observe(time.perf_counter() - started, "generate", "ok")
+        self._record_usage(data)
+
+        # Заглушки об ошибках не кэшируются: до сюда доходит только настоящий ответ
+        if cache_key is not None and text:
+            await self.cache.put(cache_key, text)
+        return text
+
+    async def stream(
+        self,
+        prompt: str,
+        system: str | None = None,
+        history: list[dict[str, str]] | None = None,
+        use_cache: bool = True,
+        model: str | None = None,
+    ) -> AsyncIterator[str]:
+        """
+        Генерировать ответ по частям по мере их появления.
+
+        Ollama в режиме `"stream": true` отдаёт NDJSON: по одному JSON-объекту
+        на строку с очередным фрагментом в `message.content` и `"done": true`
+        в последнем объекте. Место в лимите одновременных запросов занято,
+        пока поток не дочитан.
+
+        Ответ из кэша отдаётся одним фрагментом. Бэкенд выбирается до
+        первого фрагмента (`BackendPool.call`); обрыв после него не
+        повторяется на другом бэкенде — текст уже отдан.
+
+        Ошибка до первого фрагмента отдаётся заглушкой вместо ответа, как в
+        `generate`. Ошибка после него поднимает `LLMStreamError`: вызывающий
+        сам решает, что делать с частичным текстом.
+
+        Yields:
+            Очередные фрагменты текста ответа
+
+        Raises:
+            LLMStreamError: Поток оборвался после первого фрагмента
+        """
+        model = model or self.model
+        cache_key = self._cache_key(prompt, system, history, model) if use_cache else None
+        if cache_key is not None:
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+
+        payload = self._payload(self._build_messages(prompt, system, history), stream=True, model=model)
+        self._touch(model)
+
+        chunks: list[str] = []
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            async with self._slot():
+                backend, opened = await self.pool.call(
+                    lambda b: self._open_stream(b, payload), "stream", discard=_OpenStream.aclose
+                )
+                error: BaseException | None = None
+                try:
+                    async for data in opened:
+                        chunk = data.get("message", {}).get("content", "")
+                        if chunk:
+                            if not chunks:
+                                metrics.LLM_TTFT_SECONDS.observe(time.perf_counter() - started)
+                            chunks.append(chunk)
+                            yield chunk
+                        if data.get("done"):
+                            self._record_usage(data)
+                            break
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    await opened.aclose()
+                    self.pool.release(backend, error)
+            outcome = "ok"
+        except Exception as e:
+            text = self._error_text(e, model)
+            if chunks:
+                raise LLMStreamError(text, e) from e
+            yield text
+            return
+        finally:
+            # Клиент мог перестать читать поток — такой запрос тоже считаем
+            metrics.LLM_SECONDS.observe(time.perf_counter() - started, "stream", outcome)
+
+        if cache_key is not None and chunks:
+            await self.cache.put(cache_key, "".join(chunks))
+
+    async def _post_chat(self, backend: Backend, payload: dict[str, Any]) -> dict[str, Any]:
+        resp = await self._get_client().post(f"{backend.url}/api/chat", json=payload)
+        resp.raise_for_status()
+        return resp.json()
+
+    async def _open_stream(self, backend: Backend, payload: dict[str, Any]) -> "_OpenStream":
+        """Открыть поток на `backend` и дочитать до первого фрагмента текста (или конца ответа)."""
+        stack = contextlib.AsyncExitStack()
+        try:
+            resp = await stack.enter_async_context(
+                self._get_client().stream("POST", f"{backend.url}/api/chat", json=payload)
+            )
+            resp.raise_for_status()
+            opened = _OpenStream(stack, resp.aiter_lines())
+            await opened.prefetch()
+            return opened
+        except BaseException:
+            await stack.aclose()
+            raise
+
+    @staticmethod
+    def _record_usage(data: dict[str, Any]) -> None:
+        """Учесть поля производительности из финального ответа Ollama (длительности в нс)."""
+        prompt_tokens = data.get("prompt_eval_count")
+        eval_tokens = data.get("eval_count")
+        eval_duration = data.get("eval_duration")
+        if prompt_tokens is not None:
+            metrics.LLM_PROMPT_TOKENS.observe(prompt_tokens)
+        if data.get("load_duration"):
+            # Заметная загрузка — запрос попал на выгруженную модель (см. ModelWarmer)
+            metrics.LLM_LOAD_SECONDS.observe(data["load_duration"] / 1e9, str(data.get("model", "")))
+        if data.get("prompt_eval_duration") is not None:
+            metrics.LLM_PROMPT_EVAL_SECONDS.observe(data["prompt_eval_duration"] / 1e9)
+        if eval_tokens is not None:
+            metrics.LLM_EVAL_TOKENS.observe(eval_tokens)
+            if eval_duration:
+                metrics.LLM_TOKENS_PER_SECOND.observe(eval_tokens / (eval_duration / 1e9))
+        logger.debug(
+            "trace=%s prompt_tokens=%s eval_tokens=%s eval_ms=%.0f",
+            metrics.trace_id.get(), prompt_tokens, eval_tokens, (eval_duration or 0) / 1e6,
+        )
+
+    def _payload(
+        self, messages: list[dict[str, str]], stream: bool, model: str | None = None
+    ) -> dict[str, Any]:
+        payload: dict[str, Any] = {
+            "model": model or self.model,
+            "messages": messages,
+            "stream": stream,
+            "keep_alive": self.keep_alive,
+        }
+        if self.options:
+            payload["options"] = self.options
+        return payload
+
+    def _cache_key(
+        self, prompt: str, system: str | None, history: list[dict[str, str]] | None, model: str
+    ) -> str | None:
+        if self.cache is None:
+            return None
+        return self.cache.make_key(model, system, prompt, history)
+
+    @staticmethod
+    def _build_messages(
+        prompt: str, system: str | None, history: list[dict[str, str]] | None
+    ) -> list[dict[str, str]]:
         messages = []
         if system:
             messages.append({"role": "system", "content": system})
         if history:
             messages.extend(history)
         messages.append({"role": "user", "content": prompt})
+        return messages
 
-        payload = {
-            "model": self.model,
-            "messages": messages,
-            "stream": False,
-        }
+    def _error_text(self, error: Exception, model: str) -> str:
+        """Заглушка вместо ответа модели `model` (той, которую выбрал маршрутизатор)."""
+        logger.warning("Модель %s не ответила: %r", model, error)
+        if isinstance(error, httpx.HTTPError):
+            return self._unavailable_text(error, model)
+        return f"[Ошибка LLM: {error}] Попробуй позже."
 
-        try:
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                resp = await client.post(
-                    f"{self.base_url.rstrip('/')}/api/chat",
-                    json=payload,
-                )
-                resp.raise_for_status()
-                data = resp.json()
-                return str(data.get("message", {}).get("content", ""))
-        except httpx.HTTPError as e:
-            # Если Ollama недоступна, возвращаем умную заглушку
-            return f"[LLM недоступен: {e}] Пока я работаю без локальной модели. Установи Ollama и запусти модель {self.model}, чтобы я стал умнее."
-        except Exception as e:
-            return f"[Ошибка LLM: {e}] Попробуй позже."
+    @staticmethod
+    def _unavailable_text(error: Exception, model: str) -> str:
+        return f"[LLM недоступен: {error}] Пока я работаю без локальной модели. Установи Ollama и запусти модель {model}, чтобы я стал умнее."
+
+
+class _OpenStream:
+    """NDJSON-поток Ollama, из которого уже прочитано начало (до первого фрагмента текста)."""
+
+    def __init__(self, stack: contextlib.AsyncExitStack, lines: AsyncIterator[str]) -> None:
+        self._stack = stack
+        self._lines = lines
+        self._head: list[dict[str, Any]] = []
+
+    async def _next(self) -> dict[str, Any] | None:
+        async for line in self._lines:
+            if line.strip():
+                data = json.loads(line)
+                if data.get("error"):
+                    raise RuntimeError(data["error"])
+                return data
+        return None
+
+    async def prefetch(self) -> None:
+        while (data := await self._next()) is not None:
+            self._head.append(data)
+            if data.get("message", {}).get("content") or data.get("done"):
+                return
+
+    async def __aiter__(self) -> AsyncIterator[dict[str, Any]]:
+        for data in self._head:
+            yield data
+        while (data := await self._next()) is not None:
+            yield data
+
+    async def aclose(self) -> None:
+        await self._stack.aclose()
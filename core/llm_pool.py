@@ -0,0 +1,404 @@
+"""Пул бэкендов Ollama: балансировка, проверки здоровья, circuit breaker, хеджирование."""
+
+import asyncio
+import collections
+import logging
+import os
+import time
+from collections.abc import Awaitable, Callable
+from typing import Any, Generic, TypeVar
+
+import httpx
+
+from core import metrics
+
+logger = logging.getLogger("core.llm_pool")
+
+T = TypeVar("T")
+
+
+class NoBackendAvailable(httpx.HTTPError):
+    """Ни один бэкенд пула не принимает запросы (все выключены breaker'ом или не отвечают)."""
+
+
+def is_backend_failure(exc: BaseException) -> bool:
+    """Ошибка бэкенда (сеть, таймаут, 5xx) — в отличие от ошибки самого запроса (4xx)."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500
+    return isinstance(exc, httpx.TransportError)
+
+
+class CircuitBreaker:
+    """
+    Автомат «закрыт → открыт → полуоткрыт» для одного бэкенда.
+
+    После `failure_threshold` ошибок подряд бэкенд выключается (open) на
+    `reset_timeout` секунд: запросы к нему не идут и не ждут таймаутов.
+    Затем (или раньше, если прошла проверка здоровья) пропускается один
+    пробный запрос (half_open): успех закрывает автомат, ошибка снова открывает.
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self._probing = False
+
+    def available(self) -> bool:
+        """Можно ли отправить запрос (без изменения состояния)."""
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            return time.monotonic() - self.opened_at >= self.reset_timeout
+        return not self._probing
+
+    def begin(self) -> None:
+        """Запрос отправлен: в открытом/полуоткрытом состоянии он становится пробным."""
+        if self.state == "open":
+            self.state = "half_open"
+        if self.state == "half_open":
+            self._probing = True
+
+    def half_open(self) -> None:
+        """Досрочно разрешить пробный запрос (бэкенд прошёл проверку здоровья)."""
+        if self.state == "open":
+            self.state = "half_open"
+            self._probing = False
+
+    def record_success(self) -> None:
+        self.state = "closed"
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self) -> bool:
+        """Учесть ошибку; True — если автомат только что открылся."""
+        self.failures += 1
+        self._probing = False
+        if self.state == "open" or (self.state == "closed" and self.failures < self.failure_threshold):
+            return False
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.opens += 1
+        return True
+
+    def release(self) -> None:
+        """Запрос завершился без вердикта (отменён, ошибка запроса) — пробу можно повторить."""
+        self._probing = False
+
+
+class Backend:
+    """Один сервер Ollama пула и его счётчики."""
+
+    def __init__(self, url: str, breaker: CircuitBreaker) -> None:
+        self.url = url.rstrip("/")
+        self.breaker = breaker
+        self.healthy = True
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.picked = 0
+
+    @property
+    def available(self) -> bool:
+        return self.healthy and self.breaker.available()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "url": self.url,
+            "state": self.breaker.state,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "breaker_opens": self.breaker.opens,
+        }
+
+
+class _Attempt(Generic[T]):
+    def __init__(self, backend: Backend, task: "asyncio.Task[T]", hedge: bool) -> None:
+        self.backend = backend
+        self.task = task
+        self.hedge = hedge
+        self.started = time.perf_counter()
+
+
+class BackendPool:
+    """
+    Набор бэкендов Ollama, между которыми `LLMClient` распределяет запросы.
+
+    - Балансировка — наименьшее число незавершённых запросов (least
+      outstanding requests), при равенстве — бэкенд, выбранный давнее всех.
+    - Ошибка бэкенда до первого токена (сеть, 5xx) — запрос сразу повторяется
+      на следующем; после `failure_threshold` ошибок подряд бэкенд выключается
+      `CircuitBreaker`'ом.
+    - Проверки здоровья (`GET /api/tags` раз в `health_interval` секунд)
+      снимают с балансировки неотвечающие бэкенды и досрочно возвращают
+      восстановившиеся.
+    - Хеджирование (`hedge_percentile` > 0): если первый бэкенд не дал
+      результат (первый токен потока или весь ответ) за `hedge_percentile`-й
+      перцентиль недавних задержек, тот же запрос отправляется второму
+      бэкенду со свободным местом; побеждает первый ответивший, второй
+      отменяется. Дублей не больше `hedge_max_ratio` от всех запросов.
+
+    Бэкенд со свободным местом — с числом незавершённых запросов меньше `capacity`.
+    """
+
+    def __init__(
+        self,
+        urls: list[str],
+        capacity: int = 2,
+        failure_threshold: int = 3,
+        reset_timeout: float = 30.0,
+        health_interval: float = 10.0,
+        health_timeout: float = 2.0,
+        hedge_percentile: float = 0.0,
+        hedge_max_ratio: float = 0.1,
+        hedge_min_samples: int = 20,
+        latency_window: int = 500,
+    ) -> None:
+        if not urls:
+            raise ValueError("Пул бэкендов пуст")
+        self.backends = [Backend(url, CircuitBreaker(failure_threshold, reset_timeout)) for url in urls]
+        self.capacity = capacity
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.hedge_percentile = hedge_percentile
+        self.hedge_max_ratio = hedge_max_ratio
+        self.hedge_min_samples = hedge_min_samples
+        # Недавние задержки до результата по видам запросов ("generate", "stream")
+        self._latencies: dict[str, collections.deque[float]] = collections.defaultdict(
+            lambda: collections.deque(maxlen=latency_window)
+        )
+        self._picks = 0
+        self._client: httpx.AsyncClient | None = None
+        self._task: asyncio.Task[None] | None = None
+
+        self.requests = 0
+        self.failovers = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    @classmethod
+    def from_env(cls, base_url: str, capacity: int) -> "BackendPool":
+        """Пул из списка URL через запятую (`OLLAMA_BASE_URL`) и настроек `OLLAMA_*` окружения."""
+        return cls(
+            [url.strip() for url in base_url.split(",") if url.strip()],
+            capacity=capacity,
+            failure_threshold=int(os.getenv("OLLAMA_BREAKER_FAILURES", "3")),
+            reset_timeout=float(os.getenv("OLLAMA_BREAKER_RESET", "30")),
+            health_interval=float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10")),
+            hedge_percentile=float(os.getenv("OLLAMA_HEDGE_PERCENTILE", "0")),
+            hedge_max_ratio=float(os.getenv("OLLAMA_HEDGE_MAX_RATIO", "0.1")),
+        )
+
+    def start(self, client: httpx.AsyncClient) -> None:
+        """Запустить проверки здоровья через `client` (нужен работающий event loop)."""
+        self._client = client
+        if self._task is None and self.health_interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_interval)
+            try:
+                await self.check_health()
+            except Exception:  # noqa: BLE001
+                logger.exception("Ошибка проверки бэкендов Ollama — повторим позже")
+
+    async def check_health(self) -> None:
+        """Опросить все бэкенды и обновить их признак `healthy`."""
+        assert self._client is not None
+
+        async def probe(backend: Backend) -> None:
+            try:
+                resp = await self._client.get(f"{backend.url}/api/tags", timeout=self.health_timeout)
+                healthy = resp.status_code < 500
+            except httpx.HTTPError:
+                healthy = False
+            if healthy != backend.healthy:
+                logger.warning("Бэкенд Ollama %s %s", backend.url, "снова доступен" if healthy else "не отвечает")
+            backend.healthy = healthy
+            if healthy:
+                backend.breaker.half_open()
+
+        await asyncio.gather(*(probe(backend) for backend in self.backends))
+
+    @property
+    def urls(self) -> list[str]:
+        return [backend.url for backend in self.backends]
+
+    def pick(self, exclude: set[Backend] | frozenset[Backend] = frozenset(), spare: bool = False) -> Backend | None:
+        """Доступный бэкенд с наименьшим числом незавершённых запросов (или None)."""
+        candidates = [
+            backend for backend in self.backends
+            if backend not in exclude and backend.available and (not spare or backend.outstanding < self.capacity)
+        ]
+        if not candidates:
+            return None
+        backend = min(candidates, key=lambda b: (b.outstanding, b.picked))
+        self._picks += 1
+        backend.picked = self._picks
+        return backend
+
+    def available(self) -> list[Backend]:
+        return [backend for backend in self.backends if backend.available]
+
+    def hedge_delay(self, kind: str) -> float | None:
+        """Через сколько секунд без результата дублировать запрос (None — не дублировать)."""
+        if self.hedge_percentile <= 0 or len(self.backends) < 2:
+            return None
+        if self.hedges >= self.hedge_max_ratio * max(self.requests, 1):
+            return None
+        samples = self._latencies[kind]
+        if len(samples) < self.hedge_min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile / 100))]
+
+    def _launch(
+        self, attempts: dict["asyncio.Task[T]", _Attempt[T]], call: Callable[[Backend], Awaitable[T]],
+        backend: Backend, hedge: bool,
+    ) -> None:
+        backend.outstanding += 1
+        backend.requests += 1
+        backend.breaker.begin()
+        task = asyncio.ensure_future(call(backend))
+        attempts[task] = _Attempt(backend, task, hedge)
+
+    def _finish(self, backend: Backend, error: BaseException | None) -> None:
+        """Запрос к бэкенду завершён: освободить место и учесть исход в breaker'е."""
+        backend.outstanding -= 1
+        if error is None:
+            backend.breaker.record_success()
+            metrics.LLM_BACKEND_REQUESTS.inc(backend.url, "ok")
+        elif is_backend_failure(error):
+            backend.failures += 1
+            metrics.LLM_BACKEND_REQUESTS.inc(backend.url, "error")
+            if backend.breaker.record_failure():
+                logger.warning("Бэкенд Ollama %s выключен после ошибок: %s", backend.url, error)
+        else:
+            backend.breaker.release()
+            metrics.LLM_BACKEND_REQUESTS.inc(backend.url, "cancelled")
+
+    async def call(
+        self,
+        call: Callable[[Backend], Awaitable[T]],
+        kind: str,
+        discard: Callable[[T], Awaitable[None]] | None = None,
+    ) -> tuple[Backend, T]:
+        """
+        Выполнить `call(backend)` на бэкенде пула с повтором и хеджированием.
+
+        `call` возвращает, когда бэкенд дал результат: весь ответ или, для
+        потока, открытый поток с первым токеном. Бэкенд победителя остаётся
+        занятым — вызывающий обязан вызвать `release()`, когда дочитает ответ.
+        Результат проигравшей попытки, если она успела завершиться,
+        освобождается через `discard`.
+
+        Raises:
+            NoBackendAvailable: Нет доступных бэкендов
+            Exception: Ошибка последней попытки, если ни одна не удалась
+        """
+        backend = self.pick()
+        if backend is None:
+            raise NoBackendAvailable("Все бэкенды Ollama недоступны")
+        self.requests += 1
+        attempts: dict[asyncio.Task[T], _Attempt[T]] = {}
+        tried = {backend}
+        self._launch(attempts, call, backend, hedge=False)
+        hedged = False
+        last_error: BaseException | None = None
+        winner: tuple[_Attempt[T], T] | None = None
+        try:
+            while attempts and winner is None:
+                delay = None if hedged else self.hedge_delay(kind)
+                done, _ = await asyncio.wait(attempts, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    backend = self.pick(exclude=tried, spare=True)
+                    if backend is not None:
+                        tried.add(backend)
+                        self.hedges += 1
+                        self._launch(attempts, call, backend, hedge=True)
+                    continue
+                # Успешные попытки первыми: победитель не зависит от порядка в `done`
+                for task in sorted(done, key=lambda task: task.exception() is not None):
+                    attempt = attempts.pop(task)
+                    error = task.exception()
+                    if error is None and winner is None:
+                        winner = (attempt, task.result())
+                        continue
+                    self._finish(attempt.backend, error)
+                    if error is None:
+                        if discard is not None:
+                            await discard(task.result())
+                    else:
+                        last_error = error
+                        # При готовом победителе ошибка проигравшей попытки уже не важна
+                        if winner is None and not is_backend_failure(error):
+                            raise error
+                if winner is None and not attempts:
+                    # Все начатые попытки упали до результата — следующий бэкенд
+                    backend = self.pick(exclude=tried)
+                    if backend is not None:
+                        tried.add(backend)
+                        self.failovers += 1
+                        self._launch(attempts, call, backend, hedge=False)
+        except BaseException:
+            # Выходим с ошибкой (например, отмена во время `discard`) — победителя
+            # никто не дочитает, его бэкенд и результат освобождаются здесь
+            if winner is not None:
+                self._finish(winner[0].backend, asyncio.CancelledError())
+                if discard is not None:
+                    await discard(winner[1])
+            raise
+        finally:
+            # Проигравшие и брошенные попытки отменяются; отмена не считается ошибкой бэкенда
+            for task in attempts:
+                task.cancel()
+            for task, attempt in attempts.items():
+                try:
+                    result = await task
+                except BaseException as error:  # noqa: BLE001
+                    self._finish(attempt.backend, error)
+                else:
+                    # Попытка успела завершиться до отмены
+                    self._finish(attempt.backend, asyncio.CancelledError())
+                    if discard is not None:
+                        await discard(result)
+        if winner is None:
+            assert last_error is not None
+            raise last_error
+        attempt, result = winner
+        self._latencies[kind].append(time.perf_counter() - attempt.started)
+        if attempt.hedge:
+            self.hedge_wins += 1
+        if hedged:
+            metrics.LLM_HEDGES.inc("won" if attempt.hedge else "lost")
+        return attempt.backend, result
+
+    def release(self, backend: Backend, error: BaseException | None = None) -> None:
+        """Ответ бэкенда, выбранного `call()`, дочитан (`error` — ошибка во время чтения)."""
+        self._finish(backend, error)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "failovers": self.failovers,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "available": len(self.available()),
+            "backends": [backend.stats() for backend in self.backends],
+        }
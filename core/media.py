@@ -0,0 +1,234 @@
+"""Хранилище медиафайлов: потоковая запись, адресация по содержимому, доступ через mmap."""
+
+import asyncio
+import contextlib
+import hashlib
+import logging
+import mmap
+import os
+import re
+import struct
+import tempfile
+from collections.abc import AsyncIterable, Iterator
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO
+
+logger = logging.getLogger("core.media")
+
+_DIGEST_RE = re.compile(r"[0-9a-f]{64}")
+
+
+class MediaTooLarge(Exception):
+    """Файл больше допустимого размера хранилища."""
+
+    def __init__(self, limit: int) -> None:
+        super().__init__(f"Файл больше {limit} байт")
+        self.limit = limit
+
+
+@dataclass(frozen=True)
+class StoredMedia:
+    """Результат загрузки файла в хранилище."""
+
+    sha256: str
+    size: int
+    # Такой файл уже был — новая копия на диск не записывалась
+    deduplicated: bool
+
+
+@dataclass(frozen=True)
+class MediaFile:
+    """
+    Ссылка на файл хранилища для инструментов.
+
+    Содержимое не копируется в память процесса: инструмент открывает файл
+    (`open`) или отображает его в память (`map`) и читает только нужные части.
+    """
+
+    sha256: str
+    path: Path
+    size: int
+
+    def open(self) -> BinaryIO:
+        return open(self.path, "rb")
+
+    @contextlib.contextmanager
+    def map(self) -> Iterator[mmap.mmap | bytes]:
+        """Отобразить файл в память только для чтения (пустой файл — `b""`)."""
+        if self.size == 0:
+            yield b""
+            return
+        with open(self.path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            yield buf
+
+
+class MediaStore:
+    """
+    Файлы пользователей на диске, адресованные SHA-256 содержимого.
+
+    Загрузка пишется потоком во временный файл рядом с хранилищем, хэш
+    считается по ходу записи; по окончании файл атомарно переименовывается
+    в `<root>/<первые 2 символа хэша>/<хэш>`. Если такой файл уже есть
+    (пользователь переслал то же фото или документ), временный файл просто
+    удаляется. Запись на диск и хэширование идут в потоке пачками по
+    `write_buffer` байт, чтобы не блокировать event loop и не гонять поток
+    на каждый мелкий фрагмент.
+    """
+
+    def __init__(
+        self,
+        root: str | Path = "data/media",
+        max_bytes: int | None = None,
+        write_buffer: int = 1 << 20,
+    ) -> None:
+        self.root = Path(root)
+        self.max_bytes = max_bytes or int(os.getenv("CORE_MEDIA_MAX_BYTES", str(50 << 20)))
+        self.write_buffer = write_buffer
+
+        self.saved = 0
+        self.deduplicated = 0
+        self.bytes_written = 0
+
+    def stats(self) -> dict[str, int]:
+        return {"saved": self.saved, "deduplicated": self.deduplicated, "bytes_written": self.bytes_written}
+
+    def _path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest
+
+    def get(self, digest: str) -> MediaFile | None:
+        """Файл по хэшу или None, если хэш некорректен или файла нет."""
+        if not isinstance(digest, str) or not _DIGEST_RE.fullmatch(digest):
+            return None
+        path = self._path(digest)
+        try:
+            size = path.stat().st_size
+        except OSError:
+            return None
+        return MediaFile(sha256=digest, path=path, size=size)
+
+    async def save(self, chunks: AsyncIterable[bytes]) -> StoredMedia:
+        """
+        Записать поток байтов в хранилище.
+
+        Raises:
+            MediaTooLarge: Поток длиннее `max_bytes` (временный файл удаляется)
+        """
+        tmp_dir = self.root / "tmp"
+        await asyncio.to_thread(tmp_dir.mkdir, parents=True, exist_ok=True)
+        fd, tmp_name = await asyncio.to_thread(tempfile.mkstemp, dir=tmp_dir)
+        tmp_path = Path(tmp_name)
+        hasher = hashlib.sha256()
+        size = 0
+        buffer = bytearray()
+        try:
+            with os.fdopen(fd, "wb") as file:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise MediaTooLarge(self.max_bytes)
+                    buffer += chunk
+                    if len(buffer) >= self.write_buffer:
+                        await asyncio.to_thread(self._write, file, hasher, bytes(buffer))
+                        buffer.clear()
+                if buffer:
+                    await asyncio.to_thread(self._write, file, hasher, bytes(buffer))
+            digest = hasher.hexdigest()
+            deduplicated = await asyncio.to_thread(self._commit, tmp_path, self._path(digest))
+        except BaseException:
+            await asyncio.to_thread(tmp_path.unlink, missing_ok=True)
+            raise
+
+        if deduplicated:
+            self.deduplicated += 1
+        else:
+            self.saved += 1
+            self.bytes_written += size
+        return StoredMedia(sha256=digest, size=size, deduplicated=deduplicated)
+
+    @staticmethod
+    def _write(file: BinaryIO, hasher: "hashlib._Hash", data: bytes) -> None:
+        # hashlib отпускает GIL на больших буферах — поток не мешает event loop
+        hasher.update(data)
+        file.write(data)
+
+    @staticmethod
+    def _commit(tmp_path: Path, path: Path) -> bool:
+        if path.exists():
+            tmp_path.unlink()
+            return True
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Одновременная загрузка того же файла даст то же содержимое — replace безопасен
+        os.replace(tmp_path, path)
+        return False
+
+
+_SIGNATURES: tuple[tuple[bytes, str], ...] = (
+    (b"%PDF-", "pdf"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"PK\x03\x04", "zip"),
+    (b"OggS", "ogg"),
+    (b"\x1a\x45\xdf\xa3", "webm"),
+    (b"ID3", "mp3"),
+)
+
+
+def sniff_format(buf: mmap.mmap | bytes) -> str | None:
+    """Формат файла по сигнатуре в первых байтах."""
+    head = buf[:16]
+    for signature, name in _SIGNATURES:
+        if head.startswith(signature):
+            return name
+    if head[4:8] == b"ftyp":
+        return "mp4"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def image_size(buf: mmap.mmap | bytes) -> tuple[int, int] | None:
+    """Ширина и высота PNG, GIF или JPEG по заголовку, без декодирования картинки."""
+    kind = sniff_format(buf)
+    if kind == "png" and len(buf) >= 24:
+        return struct.unpack(">II", buf[16:24])
+    if kind == "gif" and len(buf) >= 10:
+        return struct.unpack("<HH", buf[6:10])
+    if kind == "jpeg":
+        # Идём по сегментам до SOFn, где записаны размеры
+        pos = 2
+        while pos + 9 <= len(buf):
+            if buf[pos] != 0xFF:
+                return None
+            marker = buf[pos + 1]
+            length = struct.unpack(">H", buf[pos + 2:pos + 4])[0]
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                height, width = struct.unpack(">HH", buf[pos + 5:pos + 9])
+                return width, height
+            pos += 2 + length
+    return None
+
+
+def ogg_duration(buf: mmap.mmap | bytes, sample_rate: int = 48000) -> float | None:
+    """
+    Длительность Ogg/Opus (голосовые Telegram) по позиции последней страницы.
+
+    Последняя страница ищется с конца файла (`rfind`), так что через mmap
+    читаются только последние килобайты, а не весь файл.
+    """
+    pos = buf.rfind(b"OggS")
+    if pos < 0 or pos + 14 > len(buf):
+        return None
+    granule = struct.unpack("<q", buf[pos + 6:pos + 14])[0]
+    return granule / sample_rate if granule > 0 else None
+
+
+def text_preview(buf: mmap.mmap | bytes, limit: int = 1000) -> str | None:
+    """Начало файла как текст UTF-8 или None, если файл не похож на текст."""
+    head = buf[:limit * 4]
+    if b"\x00" in head:
+        return None
+    text = head.decode("utf-8", errors="ignore")[:limit]
+    return text if text.strip() else None
@@ -0,0 +1,152 @@
+"""Инструменты для вложений: анализ файлов (PDF, таблицы) и медиа.
+
+Модуль импортируется `ToolRouter` лениво — при первом сообщении с
+вложением (см. `core.tools.LazyTool`).
+"""
+
+import logging
+from collections.abc import AsyncIterator
+from typing import Any
+
+from core.media import MediaFile, image_size, ogg_duration, sniff_format, text_preview
+from core.offload import OffloadBusy, OffloadError, ProcessOffload
+from core.parsers import pdf_text, table_summary
+from core.tools import Tool
+
+logger = logging.getLogger("core.media_tools")
+
+
+class FileAnalysisTool(Tool):
+    """
+    Анализ присланных файлов.
+
+    Файл из `MediaStore` приходит в `input_data["file"]` ссылкой (`MediaFile`).
+    Сигнатура формата и начало текста читаются через mmap прямо в event loop —
+    это несколько килобайт. Разбор PDF и таблиц тяжёлый по CPU и выполняется
+    в процессах `ProcessOffload`: туда передаётся путь к файлу, текст PDF
+    возвращается постранично. Без файла — только метаданные клиента.
+    """
+
+    media_types = ("file", "document")
+    # Меньше AGENT_TOOL_TIMEOUT, чтобы уже разобранные страницы успели попасть в контекст
+    timeout = 2.5
+    preview_chars = 1000
+    max_chars = 4000
+    table_types = ("text/csv", "text/tab-separated-values")
+
+    def __init__(self, offload: ProcessOffload | None = None) -> None:
+        self.offload = offload
+
+    def name(self) -> str:
+        return "file_analysis"
+
+    def build_input(self, context: dict[str, Any]) -> dict[str, Any]:
+        return {**(context.get("media_data") or {}), "file": context.get("media_file")}
+
+    async def execute(self, input_data: dict[str, Any]) -> str:
+        """Анализ файла целиком (см. `stream`)."""
+        return "".join([part async for part in self.stream(input_data)])
+
+    def _is_table(self, input_data: dict[str, Any]) -> bool:
+        file_name = str(input_data.get("file_name") or "").lower()
+        return input_data.get("mime_type") in self.table_types or file_name.endswith((".csv", ".tsv"))
+
+    async def stream(self, input_data: dict[str, Any]) -> AsyncIterator[str]:
+        """Метаданные файла, затем его содержимое по мере разбора."""
+        file_name = input_data.get("file_name", "неизвестный файл")
+        mime_type = input_data.get("mime_type", "")
+        media_file: MediaFile | None = input_data.get("file")
+        file_size = media_file.size if media_file is not None else input_data.get("file_size", 0)
+
+        size_mb = file_size / (1024 * 1024) if file_size else 0
+        lines = [
+            "Файл получен:",
+            f"• Имя: {file_name}",
+            f"• Тип: {mime_type}",
+            f"• Размер: {size_mb:.2f} MB",
+        ]
+        if media_file is None:
+            yield "\n".join(lines + ["", "Содержимое файла недоступно (файл не загружен в ядро)."])
+            return
+
+        with media_file.map() as buf:
+            kind = sniff_format(buf)
+            preview = text_preview(buf, self.preview_chars) if kind is None else None
+        if kind is not None:
+            lines.append(f"• Формат: {kind}")
+        yield "\n".join(lines)
+
+        path = str(media_file.path)
+        try:
+            if kind == "pdf" and self.offload is not None:
+                yield "\n\nТекст PDF:"
+                async for page in self.offload.stream(pdf_text, path, self.max_chars):
+                    yield "\n" + page
+            elif preview is not None and self._is_table(input_data) and self.offload is not None:
+                yield "\n\n" + await self.offload.run(table_summary, path)
+            elif preview is not None:
+                yield f"\n\nНачало файла:\n{preview}"
+        except OffloadBusy:
+            yield "\n\nСодержимое не разобрано: обработчик файлов перегружен."
+        except OffloadError as exc:
+            logger.warning("Не удалось разобрать файл %s: %s", file_name, exc)
+            yield "\n\nСодержимое файла разобрать не удалось."
+
+
+class MediaAnalysisTool(Tool):
+    """
+    Анализ медиа (изображения, видео, голосовые).
+
+    Из файла хранилища через mmap читаются только заголовки: размеры
+    картинки, длительность голосового Ogg/Opus. Распознавание содержимого
+    (vision-модели, речь) пока не подключено.
+    """
+
+    media_types = ("image", "video", "voice")
+
+    def name(self) -> str:
+        return "media_analysis"
+
+    def build_input(self, context: dict[str, Any]) -> dict[str, Any]:
+        return {
+            **(context.get("media_data") or {}),
+            "media_type": context.get("media_type"),
+            "file": context.get("media_file"),
+        }
+
+    async def execute(self, input_data: dict[str, Any]) -> str:
+        """Анализ медиа-файла."""
+        media_type = input_data.get("media_type", "")
+        file_id = input_data.get("file_id", "")
+        media_file: MediaFile | None = input_data.get("file")
+
+        kind = size = duration = None
+        if media_file is not None:
+            with media_file.map() as buf:
+                kind = sniff_format(buf)
+                if media_type == "image":
+                    size = image_size(buf)
+                elif media_type == "voice" and kind == "ogg":
+                    duration = ogg_duration(buf)
+
+        if media_type == "image":
+            width, height = size or (input_data.get("width"), input_data.get("height"))
+            details = f", {width}×{height}" if width and height else ""
+            return (
+                f"Изображение получено (ID: {file_id}{details}).\n"
+                f"Анализ изображений через vision-модели будет добавлен позже."
+            )
+        elif media_type == "video":
+            duration = input_data.get("duration", 0)
+            return (
+                f"Видео получено (ID: {file_id}, длительность: {duration} сек).\n"
+                f"Анализ видео будет добавлен позже."
+            )
+        elif media_type == "voice":
+            duration = round(duration) if duration is not None else input_data.get("duration", 0)
+            return (
+                f"Голосовое сообщение получено (ID: {file_id}, длительность: {duration} сек).\n"
+                f"Распознавание речи будет добавлено позже."
+            )
+
+        return f"Медиа-файл получен, но тип '{media_type}' не поддерживается."
@@ -1,24 +1,66 @@
 """Память агента: хранение диалогов и профилей пользователей."""
 
+import asyncio
 import json
 import sqlite3
+from collections.abc import AsyncIterator
 from pathlib import Path
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
+from core.db import SQLiteEngine
 from core.models import MessageIn, MessageOut, UserProfile
+from core.profile_cache import ProfileCache
+from core.write_behind import INSERT_MESSAGE_SQL, InteractionLogger
+
+if TYPE_CHECKING:
+    from core.archive import HistoryArchive
 
 
 class Memory:
-    """Простая SQLite-память для диалогов и профилей."""
+    """SQLite-память для диалогов и профилей (асинхронный интерфейс)."""
 
-    def __init__(self, db_path: str = "data/core.db") -> None:
+    def __init__(
+        self,
+        db_path: str = "data/core.db",
+        engine: SQLiteEngine | None = None,
+        write_behind: bool = False,
+        profile_cache: ProfileCache | None = None,
+        archive: "HistoryArchive | None" = None,
+    ) -> None:
         self.db_path = Path(db_path)
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
-        self._init_db()
+        self.engine = engine or SQLiteEngine(self.db_path)
+        self.engine.write_sync(self._init_db)
+        # При write_behind история пишется пакетами в фоне, см. InteractionLogger
+        self.interaction_logger = InteractionLogger(self.engine) if write_behind else None
+        self.profile_cache = profile_cache or ProfileCache()
+        # Старые сообщения, перенесённые из БД (см. core.archive); чтения истории
+        # прозрачно дочитывают их оттуда
+        self.archive = archive
 
-    def _init_db(self) -> None:
-        """Инициализация таблиц БД."""
-        conn = sqlite3.connect(self.db_path)
+    @classmethod
+    def _init_db(cls, conn: sqlite3.Connection) -> None:
+        """
+        Привести схему БД к `SCHEMA_VERSION`.
+
+        Версия схемы хранится в `PRAGMA user_version`; применяются только
+        миграции новее неё. Все они и новая версия пишутся одной транзакцией
+        `BEGIN IMMEDIATE`: воркеры, одновременно открывшие новую БД, ждут
+        блокировку записи и перечитывают версию под ней, а процесс, упавший
+        посреди миграции, не оставляет схему без номера версии.
+        Если схема актуальна, DDL не выполняется вовсе.
+        """
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= len(cls._MIGRATIONS):
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, migration in enumerate(cls._MIGRATIONS[version:], start=version + 1):
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+
+    @staticmethod
+    def _migration_1_base(conn: sqlite3.Connection) -> None:
+        """Исходная схема: профили и сообщения (IF NOT EXISTS — БД до версионирования)."""
         cursor = conn.cursor()
 
         cursor.execute(
@@ -60,121 +102,255 @@ class Memory:
             "CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages(created_at)"
         )
 
-        conn.commit()
-        conn.close()
+    @staticmethod
+    def _migration_2_user_id_index(conn: sqlite3.Connection) -> None:
+        """
+        Составной индекс `(user_id, id)` для истории пользователя.
 
-    def get_or_create_profile(self, user_id: str) -> UserProfile:
-        """Получить или создать профиль пользователя."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        История упорядочивается по `id`: он растёт в порядке записи, а
+        `created_at` с точностью до секунды даёт ничьи. Выборка «сообщения
+        пользователя после/до id» идёт по индексу без сортировки во временном
+        B-дереве. Старый индекс по одному `user_id` — префикс нового, он не нужен.
+        """
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_user_id_id ON messages(user_id, id)")
+        conn.execute("DROP INDEX IF EXISTS idx_messages_user_id")
 
-        cursor.execute("SELECT * FROM profiles WHERE user_id = ?", (user_id,))
-        row = cursor.fetchone()
-
-        if row:
-            profile = UserProfile(
-                user_id=row[0],
-                telegram_id=row[1],
-                mac_username=row[2],
-                language=row[3] or "ru",
-                tone=row[4] or "friendly",
-                response_format=row[5] or "text",
-            )
-        else:
-            profile = UserProfile(user_id=user_id)
-            cursor.execute(
-                """
-                INSERT INTO profiles (user_id, language, tone, response_format)
-                VALUES (?, ?, ?, ?)
-                """,
-                (user_id, profile.language, profile.tone, profile.response_format),
+    @staticmethod
+    def _migration_3_model_profile(conn: sqlite3.Connection) -> None:
+        """Профиль выбора модели (`core.model_router.ModelRouter`) в профиле пользователя."""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(profiles)")}
+        if "model_profile" not in columns:
+            conn.execute("ALTER TABLE profiles ADD COLUMN model_profile TEXT DEFAULT 'auto'")
+
+    # Сводки и cache_responses появились до версионирования схемы, и прежний код
+    # создавал их в миграции 1. Поэтому обе миграции ниже проверяют, что объекта
+    # ещё нет: БД версий 1-3 могут уже иметь его, а могут и не иметь.
+
+    @staticmethod
+    def _migration_4_summaries(conn: sqlite3.Connection) -> None:
+        """Сводки старой истории (см. core.compaction): покрывают сообщения с id <= upto_id."""
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS summaries (
+                user_id TEXT PRIMARY KEY,
+                summary TEXT NOT NULL,
+                upto_id INTEGER NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
-            conn.commit()
+            """
+        )
+
+    @staticmethod
+    def _migration_5_cache_responses(conn: sqlite3.Connection) -> None:
+        """Разрешение отвечать пользователю из кэша ответов LLM (`core.response_cache`)."""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(profiles)")}
+        if "cache_responses" not in columns:
+            conn.execute("ALTER TABLE profiles ADD COLUMN cache_responses INTEGER DEFAULT 1")
+
+    # Миграция N переводит схему с версии N-1 на N; новые — только в конец списка
+    _MIGRATIONS = (
+        _migration_1_base,
+        _migration_2_user_id_index,
+        _migration_3_model_profile,
+        _migration_4_summaries,
+        _migration_5_cache_responses,
+    )
+    SCHEMA_VERSION = len(_MIGRATIONS)
+
+    async def flush(self) -> None:
+        """Записать в БД все взаимодействия из очереди write-behind."""
+        if self.interaction_logger is not None:
+            await self.interaction_logger.stop()
+
+    async def aclose(self) -> None:
+        """Сбросить очередь записи и закрыть соединения с БД."""
+        await self.flush()
+        await self.engine.aclose()
 
-        conn.close()
+    @staticmethod
+    def _row_to_profile(row: tuple[Any, ...]) -> UserProfile:
+        return UserProfile(
+            user_id=row[0],
+            telegram_id=row[1],
+            mac_username=row[2],
+            language=row[3] or "ru",
+            tone=row[4] or "friendly",
+            response_format=row[5] or "text",
+            cache_responses=bool(row[6]) if row[6] is not None else True,
+            model_profile=row[7] or "auto",
+        )
+
+    @staticmethod
+    def _select_profile(conn: sqlite3.Connection, user_id: str) -> tuple[Any, ...] | None:
+        return conn.execute(
+            """
+            SELECT user_id, telegram_id, mac_username, language, tone, response_format,
+                   cache_responses, model_profile
+            FROM profiles WHERE user_id = ?
+            """,
+            (user_id,),
+        ).fetchone()
+
+    @classmethod
+    def _create_profile(cls, conn: sqlite3.Connection, profile: UserProfile) -> tuple[Any, ...]:
+        # INSERT OR IGNORE: профиль мог успеть создать параллельный запрос
+        conn.execute(
+            """
+            INSERT OR IGNORE INTO profiles (user_id, language, tone, response_format)
+            VALUES (?, ?, ?, ?)
+            """,
+            (profile.user_id, profile.language, profile.tone, profile.response_format),
+        )
+        return cls._select_profile(conn, profile.user_id)
+
+    async def get_or_create_profile(self, user_id: str) -> UserProfile:
+        """Получить или создать профиль пользователя."""
+        profile = self.profile_cache.get(user_id)
+        if profile is not None:
+            return profile
+
+        row = await self.engine.read(self._select_profile, user_id)
+        if row is None:
+            row = await self.engine.write(self._create_profile, UserProfile(user_id=user_id))
+        profile = self._row_to_profile(row)
+        self.profile_cache.put(profile)
         return profile
 
-    def update_profile(
+    def invalidate_profile(self, user_id: str) -> None:
+        """
+        Сбросить закэшированный профиль.
+
+        Вызывается, когда профиль меняется в обход `update_profile`
+        (например, через `/v1/profile` другого процесса).
+        """
+        self.profile_cache.invalidate(user_id)
+
+    async def update_profile(
         self,
         user_id: str,
         telegram_id: str | None = None,
         mac_username: str | None = None,
         **kwargs: Any,
     ) -> None:
-        """Обновить профиль пользователя."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        updates = []
-        values = []
+        """
+        Обновить профиль пользователя.
 
+        В БД пишутся только поля, которые действительно изменились:
+        повторное `update_profile(telegram_id=...)` с тем же значением
+        не открывает транзакцию и не трогает `updated_at`.
+        """
+        requested: dict[str, Any] = {}
         if telegram_id is not None:
-            updates.append("telegram_id = ?")
-            values.append(telegram_id)
+            requested["telegram_id"] = telegram_id
         if mac_username is not None:
-            updates.append("mac_username = ?")
-            values.append(mac_username)
+            requested["mac_username"] = mac_username
         for key, value in kwargs.items():
-            if key in ("language", "tone", "response_format"):
-                updates.append(f"{key} = ?")
-                values.append(value)
-
-        if updates:
-            updates.append("updated_at = CURRENT_TIMESTAMP")
-            values.append(user_id)
-            cursor.execute(
-                f"UPDATE profiles SET {', '.join(updates)} WHERE user_id = ?", values
-            )
-            conn.commit()
+            if key in ("language", "tone", "response_format", "cache_responses", "model_profile"):
+                requested[key] = value
+
+        if not requested:
+            return
+
+        current = self.profile_cache.get(user_id)
+        if current is None:
+            row = await self.engine.read(self._select_profile, user_id)
+            if row is None:
+                return
+            current = self._row_to_profile(row)
+
+        changed = {
+            key: value for key, value in requested.items() if getattr(current, key) != value
+        }
+        if not changed:
+            self.profile_cache.put(current)
+            return
+
+        updates = [f"{key} = ?" for key in changed]
+        updates.append("updated_at = CURRENT_TIMESTAMP")
+        values = [*changed.values(), user_id]
+        sql = f"UPDATE profiles SET {', '.join(updates)} WHERE user_id = ?"
+        await self.engine.write(lambda conn: conn.execute(sql, values))
 
-        conn.close()
+        for key, value in changed.items():
+            setattr(current, key, value)
+        self.profile_cache.put(current)
 
-    def save_interaction(
+    @staticmethod
+    def _interaction_row(msg_in: MessageIn, msg_out: MessageOut) -> tuple[Any, ...]:
+        return (
+            msg_in.user_id,
+            msg_in.channel,
+            msg_in.media_type or "text",
+            msg_in.text,
+            msg_out.text,
+            json.dumps(msg_in.media_data) if msg_in.media_data else None,
+            json.dumps(msg_out.media_data) if msg_out.media_data else None,
+        )
+
+    async def save_interaction(
         self, msg_in: MessageIn, msg_out: MessageOut
     ) -> None:
         """Сохранить взаимодействие в историю."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        row = self._interaction_row(msg_in, msg_out)
+        if self.interaction_logger is not None:
+            await self.interaction_logger.enqueue(row)
+            return
+        await self.engine.write(lambda conn: conn.execute(INSERT_MESSAGE_SQL, row))
 
-        cursor.execute(
-            """
-            INSERT INTO messages (user_id, channel, message_type, input_text, output_text, input_media, output_media)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                msg_in.user_id,
-                msg_in.channel,
-                msg_in.media_type or "text",
-                msg_in.text,
-                msg_out.text,
-                json.dumps(msg_in.media_data) if msg_in.media_data else None,
-                json.dumps(msg_out.media_data) if msg_out.media_data else None,
-            ),
+    _HISTORY_SQL = """
+        SELECT id, channel, message_type, input_text, output_text, input_media, output_media
+        FROM messages
+        WHERE user_id = ?
+        ORDER BY id DESC
+        LIMIT ?
+    """
+
+    def _select_history(
+        self, conn: sqlite3.Connection, user_id: str, limit: int
+    ) -> list[tuple[Any, ...]]:
+        if self.interaction_logger is None:
+            rows = conn.execute(self._HISTORY_SQL, (user_id, limit)).fetchall()
+            return [row[1:] for row in reversed(rows)]
+
+        rows, pending = self.interaction_logger.read_consistent(
+            conn, user_id, self._HISTORY_SQL, (user_id, limit)
+        )
+        # Ещё не записанные строки новее всего, что есть в БД
+        merged = [row[1:] for row in reversed(rows)] + [row[1:] for row in pending]
+        return merged[-limit:] if limit > 0 else []
+
+    async def get_summary(self, user_id: str) -> tuple[str, int] | None:
+        """Сводка старой истории пользователя и id последнего вошедшего в неё сообщения."""
+        row = await self.engine.read(
+            lambda conn: conn.execute(
+                "SELECT summary, upto_id FROM summaries WHERE user_id = ?", (user_id,)
+            ).fetchone()
         )
+        return (row[0], row[1]) if row else None
 
-        conn.commit()
-        conn.close()
+    async def save_summary(self, user_id: str, summary: str, upto_id: int) -> None:
+        """Сохранить (заменить) сводку старой истории пользователя."""
+        await self.engine.write(
+            lambda conn: conn.execute(
+                """
+                INSERT INTO summaries (user_id, summary, upto_id) VALUES (?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    summary = excluded.summary,
+                    upto_id = excluded.upto_id,
+                    updated_at = CURRENT_TIMESTAMP
+                """,
+                (user_id, summary, upto_id),
+            )
+        )
 
-    def get_recent_history(
+    async def get_recent_history(
         self, user_id: str, limit: int = 10
     ) -> list[tuple[MessageIn, MessageOut]]:
-        """Получить последние N сообщений пользователя."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute(
-            """
-            SELECT channel, message_type, input_text, output_text, input_media, output_media
-            FROM messages
-            WHERE user_id = ?
-            ORDER BY created_at DESC
-            LIMIT ?
-            """,
-            (user_id, limit),
-        )
+        """Получить последние N сообщений пользователя (недостающие — из архива)."""
+        rows = await self.engine.read(self._select_history, user_id, limit)
 
         history = []
-        for row in reversed(cursor.fetchall()):
+        for row in rows:
             msg_in = MessageIn(
                 user_id=user_id,
                 channel=row[0],
@@ -188,5 +364,143 @@ class Memory:
             )
             history.append((msg_in, msg_out))
 
-        conn.close()
+        if (
+            self.archive is not None
+            and len(history) < limit
+            and await asyncio.to_thread(self.archive.last_id, user_id)
+        ):
+            # Пользователь давно не писал, и его история ушла в архив
+            oldest = await self.engine.read(
+                lambda conn: conn.execute(
+                    "SELECT MIN(id) FROM messages WHERE user_id = ?", (user_id,)
+                ).fetchone()[0]
+            )
+            archived = await asyncio.to_thread(
+                self.archive.tail, user_id, limit - len(history), oldest
+            )
+            history = [
+                (
+                    MessageIn(
+                        user_id=user_id,
+                        channel=record["channel"],
+                        text=record["input"],
+                        media_type=record["type"] if record["type"] != "text" else None,
+                        media_data=record["input_media"],
+                    ),
+                    MessageOut(text=record["output"] or "", media_data=record["output_media"]),
+                )
+                for record in archived
+            ] + history
+
         return history
+
+    # Колонки строки истории в порядке `history_record`
+    HISTORY_COLUMNS = (
+        "id, channel, message_type, input_text, output_text, input_media, output_media, created_at"
+    )
+
+    @staticmethod
+    def history_record(row: tuple[Any, ...]) -> dict[str, Any]:
+        """Строка `HISTORY_COLUMNS` в формате `/v1/history` (и архива)."""
+        return {
+            "id": row[0],
+            "channel": row[1],
+            "type": row[2],
+            "input": row[3],
+            "output": row[4],
+            "input_media": json.loads(row[5]) if row[5] else None,
+            "output_media": json.loads(row[6]) if row[6] else None,
+            "created_at": row[7],
+        }
+
+    @staticmethod
+    def _select_history_page(
+        conn: sqlite3.Connection,
+        user_id: str,
+        after: int | None,
+        before: int | None,
+        limit: int,
+        descending: bool,
+    ) -> list[tuple[Any, ...]]:
+        conditions = ["user_id = ?"]
+        params: list[Any] = [user_id]
+        if after is not None:
+            conditions.append("id > ?")
+            params.append(after)
+        if before is not None:
+            conditions.append("id < ?")
+            params.append(before)
+        params.append(limit)
+        return conn.execute(
+            f"""
+            SELECT {Memory.HISTORY_COLUMNS}
+            FROM messages
+            WHERE {" AND ".join(conditions)}
+            ORDER BY id {"DESC" if descending else "ASC"}
+            LIMIT ?
+            """,
+            params,
+        ).fetchall()
+
+    async def iter_history(
+        self,
+        user_id: str,
+        after: int | None = None,
+        before: int | None = None,
+        limit: int | None = None,
+        descending: bool = False,
+        page_size: int = 500,
+    ) -> AsyncIterator[dict[str, Any]]:
+        """
+        История пользователя с пагинацией по ключу (`id`), страница за страницей.
+
+        Каждая страница — отдельный короткий запрос «id > последнего
+        отданного» (или «<» при `descending`) по индексу `(user_id, id)`:
+        стоимость страницы не зависит от её номера, в памяти одна страница.
+        Видны только уже записанные в БД сообщения; очередь write-behind
+        догоняет БД за доли секунды, а id растут в порядке записи, так что
+        клиент, синхронизирующийся по `after`, ничего не пропустит.
+        Заархивированные сообщения (их id меньше всех оставшихся в БД)
+        дочитываются из архива: при движении вперёд — до БД, назад — после.
+
+        Args:
+            user_id: Пользователь
+            after: Отдавать сообщения с id больше этого
+            before: Отдавать сообщения с id меньше этого
+            limit: Сколько сообщений отдать всего (None — до конца истории)
+            descending: От новых к старым
+            page_size: Сообщений в одном запросе к БД
+        """
+        remaining = limit
+        if self.archive is not None and not descending:
+            async for record in self.archive.aread(user_id, after=after, before=before):
+                if remaining is not None and remaining <= 0:
+                    return
+                yield record
+                after = record["id"]
+                if remaining is not None:
+                    remaining -= 1
+
+        while remaining is None or remaining > 0:
+            size = page_size if remaining is None else min(page_size, remaining)
+            rows = await self.engine.read(
+                self._select_history_page, user_id, after, before, size, descending
+            )
+            for row in rows:
+                yield self.history_record(row)
+            if descending and rows:
+                before = rows[-1][0]
+            elif rows:
+                after = rows[-1][0]
+            if remaining is not None:
+                remaining -= len(rows)
+            if len(rows) < size:
+                break
+
+        if self.archive is not None and descending:
+            async for record in self.archive.aread(user_id, before=before, after=after, descending=True):
+                if remaining is not None and remaining <= 0:
+                    return
+                yield record
+                if remaining is not None:
+                    remaining -= 1
@@ -0,0 +1,248 @@
+"""Метрики ядра в формате Prometheus, trace-id запросов и сэмплирующий профилировщик."""
+
+import bisect
+import contextvars
+import sys
+import threading
+import time
+import uuid
+from collections import Counter as StackCounter
+from collections.abc import Callable, Iterator, Sequence
+
+# Trace-id текущего запроса: приходит от клиента в `X-Trace-Id` или создаётся ядром
+trace_id: contextvars.ContextVar[str] = contextvars.ContextVar("trace_id", default="-")
+
+# Границы по умолчанию, с: от долей миллисекунды (SQLite) до минуты (генерация)
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+TOKEN_BUCKETS = (8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 250, 500)
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными границами.
+
+    `observe` — поиск корзины бинарным поиском и пара инкрементов под
+    GIL, без блокировок и аллокаций на горячем пути (кроме первой встречи
+    набора меток), поэтому метрики можно не выключать под нагрузкой.
+    """
+
+    def __init__(
+        self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> None:
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # метки -> [счётчики по корзинам (+Inf последней), сумма, количество]
+        self._series: dict[tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series.setdefault(labels, [[0] * (len(self.buckets) + 1), 0.0, 0])
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def time(self, *labels: str) -> "_Timer":
+        """Замерить блок `with` в секундах."""
+        return _Timer(self, labels)
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total, count) in list(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, float("inf")), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                bucket_labels = _labels(self.labelnames, labels, 'le="' + le + '"')
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {count}"
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: tuple[str, ...]) -> None:
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self) -> None:
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc: object) -> None:
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class Counter:
+    """Монотонный счётчик с метками."""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in list(self._values.items()):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+
+class Registry:
+    """Набор метрик процесса и отрисовка в текстовый формат Prometheus."""
+
+    def __init__(self) -> None:
+        self._metrics: list[Histogram | Counter] = []
+        # Гауги считаются в момент запроса /metrics из stats() компонентов
+        self._gauges: dict[str, tuple[str, Callable[[], float]]] = {}
+
+    def histogram(
+        self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help_text: str, read: Callable[[], float]) -> None:
+        """Зарегистрировать (или заменить) гауг, значение которого читается при отрисовке."""
+        self._gauges[name] = (help_text, read)
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, (help_text, read) in list(self._gauges.items()):
+            try:
+                value = float(read())
+            except Exception:  # noqa: BLE001
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "core_agent_stage_seconds", "Длительность этапов Agent.process", ["stage"]
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "core_http_request_seconds", "Время обработки HTTP-запроса ядром", ["route", "status"]
+)
+SQLITE_SECONDS = REGISTRY.histogram(
+    "core_sqlite_seconds", "Время операции SQLite, включая ожидание потока", ["op"]
+)
+TOOL_SECONDS = REGISTRY.histogram(
+    "core_tool_seconds", "Время выполнения инструмента", ["tool", "outcome"]
+)
+LLM_SECONDS = REGISTRY.histogram(
+    "core_llm_request_seconds", "Полное время запроса к LLM", ["kind", "outcome"]
+)
+LLM_QUEUE_SECONDS = REGISTRY.histogram(
+    "core_llm_queue_wait_seconds", "Ожидание свободного места среди запросов к LLM"
+)
+LLM_TTFT_SECONDS = REGISTRY.histogram(
+    "core_llm_time_to_first_token_seconds", "Время до первого фрагмента потокового ответа"
+)
+LLM_PROMPT_EVAL_SECONDS = REGISTRY.histogram(
+    "core_llm_prompt_eval_seconds", "prompt_eval_duration из ответа Ollama"
+)
+LLM_PROMPT_TOKENS = REGISTRY.histogram(
+    "core_llm_prompt_tokens", "prompt_eval_count: заново вычисленные токены промпта", buckets=TOKEN_BUCKETS
+)
+LLM_EVAL_TOKENS = REGISTRY.histogram(
+    "core_llm_eval_tokens", "eval_count: сгенерированные токены", buckets=TOKEN_BUCKETS
+)
+LLM_TOKENS_PER_SECOND = REGISTRY.histogram(
+    "core_llm_tokens_per_second", "Скорость генерации (eval_count / eval_duration)", buckets=RATE_BUCKETS
+)
+LLM_LOAD_SECONDS = REGISTRY.histogram(
+    "core_llm_load_seconds", "load_duration из ответа Ollama: загрузка модели в память", ["model"]
+)
+LLM_ROUTES = REGISTRY.counter(
+    "core_llm_routes_total", "Запросы к LLM по выбранной модели и причине выбора", ["model", "reason"]
+)
+SHARD_WRITE_SECONDS = REGISTRY.histogram(
+    "core_shard_write_seconds", "Транзакции записи в шард (count — пропускная способность)", ["shard"]
+)
+SHARD_MESSAGES = REGISTRY.counter(
+    "core_shard_messages_total", "Сообщений, сохранённых в шард", ["shard"]
+)
+LLM_BACKEND_REQUESTS = REGISTRY.counter(
+    "core_llm_backend_requests_total", "Запросы к бэкендам Ollama по исходу (ok, error, cancelled)",
+    ["backend", "outcome"],
+)
+LLM_HEDGES = REGISTRY.counter(
+    "core_llm_hedges_total", "Хеджированные запросы: won — ответил дубль, lost — первый бэкенд", ["result"]
+)
+
+
+class SamplingProfiler:
+    """
+    Сэмплирующий профилировщик по требованию.
+
+    Фоновый поток раз в `interval` секунд снимает стек всех потоков
+    (`sys._current_frames`) и считает одинаковые стеки. Результат — формат
+    «collapsed stacks» (`кадр;кадр;кадр число`), который понимают flamegraph.pl
+    и speedscope. Пока профилировщик не запущен, он ничего не стоит.
+    """
+
+    def __init__(self, interval: float = 0.005) -> None:
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    def run(self, seconds: float) -> str:
+        """Снимать стеки `seconds` секунд (блокирует вызывающий поток)."""
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("Профилирование уже идёт")
+        try:
+            stacks: StackCounter[str] = StackCounter()
+            me = threading.get_ident()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    parts = []
+                    while frame is not None:
+                        code = frame.f_code
+                        parts.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+                        frame = frame.f_back
+                    parts.append(names.get(ident, str(ident)))
+                    stacks[";".join(reversed(parts))] += 1
+                time.sleep(self.interval)
+            return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()) + "\n"
+        finally:
+            self._lock.release()
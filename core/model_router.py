@@ -0,0 +1,324 @@
+"""Выбор модели под запрос и прогрев моделей в Ollama по наблюдаемому трафику."""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass, field, fields
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from core import metrics
+
+if TYPE_CHECKING:
+    from core.llm_client import LLMClient
+
+logger = logging.getLogger("core.model_router")
+
+# Слова, после которых короткий вопрос всё равно требует рассуждения
+DEFAULT_STRONG_KEYWORDS = (
+    "объясни", "почему", "проанализируй", "анализ", "сравни", "докажи", "напиши код",
+    "рассчитай", "посчитай", "составь план", "explain", "why", "analyze", "compare", "prove",
+)
+# Признаки кода, которых хватает одного: блок ```, определение функции или класса,
+# вызов вида print(...), SQL-запрос
+_CODE_RE = re.compile(
+    r"```"
+    r"|\b(?:def|function|func|fn)\s+\w+\s*\("
+    r"|\bclass\s+\w+\s*[:({]"
+    r"|\b(?:print|printf|println|console\.log)\("
+    r"|\bSELECT\b.+\bFROM\b",
+)
+# Строка, похожая на код: оканчивается скобкой блока, «вызов(...);» или «x = ...;»,
+# либо это импорт. Прозу, которая кончается на ; или }, так не спутать с кодом:
+# нужно несколько таких строк (`_CODE_MIN_LINES`)
+_CODE_LINE_RE = re.compile(
+    r"^.*[{}]\s*$"
+    r"|^.*(?:\w\(.*\)|=.*);\s*$"
+    r"|^\s*(?:import\s+\w|from\s+[\w.]+\s+import\s|#include\s*[<\"])",
+    re.MULTILINE,
+)
+_CODE_MIN_LINES = 2
+
+
+def looks_like_code(text: str) -> bool:
+    """Есть ли в тексте код: явный признак (`_CODE_RE`) или несколько похожих на код строк."""
+    if _CODE_RE.search(text):
+        return True
+    lines = 0
+    for _ in _CODE_LINE_RE.finditer(text):
+        lines += 1
+        if lines >= _CODE_MIN_LINES:
+            return True
+    return False
+
+
+@dataclass(frozen=True)
+class RoutingRules:
+    """
+    Правила выбора между быстрой и сильной моделью.
+
+    Запрос уходит сильной модели, если к нему приложен результат
+    инструмента (`strong_for_tools`), в тексте есть код (`strong_for_code`),
+    одно из `strong_keywords` или текст длиннее `max_fast_chars` символов;
+    иначе — быстрой. `force` ("fast" или "strong") отключает правила и
+    всегда выбирает одну модель.
+    """
+
+    force: str | None = None
+    max_fast_chars: int = 280
+    strong_keywords: tuple[str, ...] = DEFAULT_STRONG_KEYWORDS
+    strong_for_tools: bool = True
+    strong_for_code: bool = True
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "RoutingRules":
+        known = {f.name for f in fields(cls)}
+        unknown = set(data) - known
+        if unknown:
+            raise ValueError(f"Неизвестные поля правил маршрутизации: {', '.join(sorted(unknown))}")
+        if data.get("force") not in (None, "fast", "strong"):
+            raise ValueError(f"force должен быть fast или strong, а не {data['force']!r}")
+        if "strong_keywords" in data:
+            data = {**data, "strong_keywords": tuple(data["strong_keywords"])}
+        return cls(**data)
+
+
+# Встроенные профили; поле `model_profile` профиля пользователя выбирает один из них
+DEFAULT_PROFILES: dict[str, RoutingRules] = {
+    "auto": RoutingRules(),
+    "fast": RoutingRules(force="fast"),
+    "quality": RoutingRules(force="strong"),
+}
+
+
+@dataclass(frozen=True)
+class Route:
+    """Решение маршрутизатора: модель и причина (метка для метрик и логов)."""
+
+    model: str
+    reason: str
+
+
+class ModelRouter:
+    """
+    Маршрутизатор запросов между быстрой (маленькой) и сильной (большой) моделью.
+
+    Приветствие или короткий вопрос не должны ждать большую модель, а
+    длинный аналитический вопрос или ответ по результату поиска не должны
+    достаться маленькой. Решение принимается по тексту запроса и наличию
+    контекста инструментов — до сборки промпта, без обращений к LLM.
+    Правила — именованные профили (`RoutingRules`): встроенные `auto`,
+    `fast`, `quality` и свои из `LLM_ROUTING` (JSON или путь к JSON-файлу,
+    `{"имя": {"max_fast_chars": 500, ...}}`). Профиль выбирает пользователь
+    (`UserProfile.model_profile`); неизвестное имя — профиль по умолчанию.
+
+    Если быстрая модель не задана (`OLLAMA_FAST_MODEL`), обе роли играет
+    одна модель и поведение не отличается от клиента без маршрутизации.
+    """
+
+    def __init__(
+        self,
+        fast_model: str,
+        strong_model: str,
+        profiles: dict[str, RoutingRules] | None = None,
+        default_profile: str = "auto",
+    ) -> None:
+        self.fast_model = fast_model
+        self.strong_model = strong_model
+        self.profiles = {**DEFAULT_PROFILES, **(profiles or {})}
+        if default_profile not in self.profiles:
+            raise ValueError(f"Нет профиля маршрутизации {default_profile!r}")
+        self.default_profile = default_profile
+        self._keyword_res: dict[str, re.Pattern[str] | None] = {}
+
+    @classmethod
+    def from_env(cls, default_model: str) -> "ModelRouter":
+        """Маршрутизатор из `OLLAMA_FAST_MODEL`, `LLM_ROUTING` и `LLM_ROUTING_DEFAULT`."""
+        profiles: dict[str, RoutingRules] = {}
+        raw = os.getenv("LLM_ROUTING", "").strip()
+        if raw:
+            data = json.loads(raw if raw.startswith("{") else Path(raw).read_text(encoding="utf-8"))
+            profiles = {name: RoutingRules.from_dict(rules) for name, rules in data.items()}
+        return cls(
+            fast_model=os.getenv("OLLAMA_FAST_MODEL") or default_model,
+            strong_model=default_model,
+            profiles=profiles,
+            default_profile=os.getenv("LLM_ROUTING_DEFAULT", "auto"),
+        )
+
+    @property
+    def models(self) -> tuple[str, ...]:
+        """Модели маршрутизатора, быстрая первой (без повторов)."""
+        return tuple(dict.fromkeys((self.fast_model, self.strong_model)))
+
+    def _keywords(self, profile: str, rules: RoutingRules) -> re.Pattern[str] | None:
+        if profile not in self._keyword_res:
+            words = sorted(rules.strong_keywords, key=len, reverse=True)
+            self._keyword_res[profile] = (
+                re.compile("|".join(map(re.escape, words)), re.IGNORECASE) if words else None
+            )
+        return self._keyword_res[profile]
+
+    def route(self, text: str | None, profile: str | None = None, tool_result: str = "") -> Route:
+        """Выбрать модель для запроса с текстом `text` по правилам профиля `profile`."""
+        if profile not in self.profiles:
+            profile = self.default_profile
+        rules = self.profiles[profile]
+        text = text or ""
+
+        if rules.force is not None:
+            route = Route(self.strong_model if rules.force == "strong" else self.fast_model, "profile")
+        elif tool_result and rules.strong_for_tools:
+            route = Route(self.strong_model, "tools")
+        elif rules.strong_for_code and looks_like_code(text):
+            route = Route(self.strong_model, "code")
+        elif len(text) > rules.max_fast_chars:
+            route = Route(self.strong_model, "long")
+        elif (keywords := self._keywords(profile, rules)) is not None and keywords.search(text):
+            route = Route(self.strong_model, "keyword")
+        else:
+            route = Route(self.fast_model, "short")
+        metrics.LLM_ROUTES.inc(route.model, route.reason)
+        return route
+
+
+def parse_duration(value: str) -> float:
+    """Длительность в формате `keep_alive` Ollama ("30m", "1h", "45s", "300") в секундах."""
+    match = re.fullmatch(r"\s*(-?\d+(?:\.\d+)?)\s*([smh]?)\s*", str(value))
+    if match is None:
+        raise ValueError(f"Некорректная длительность: {value!r}")
+    return float(match.group(1)) * {"": 1, "s": 1, "m": 60, "h": 3600}[match.group(2)]
+
+
+@dataclass
+class _ModelTraffic:
+    seen_requests: int = 0
+    # Средние запросы по часам суток (экспоненциальное сглаживание по дням)
+    hourly: list[float] = field(default_factory=lambda: [0.0] * 24)
+    hour: int | None = None
+    hour_requests: int = 0
+    last_touch: float = 0.0
+
+
+class ModelWarmer:
+    """
+    Держит модели загруженными в Ollama, пока ими пользуются.
+
+    Ollama выгружает модель через `keep_alive` после последнего запроса;
+    первое сообщение после паузы ждёт загрузки модели — секунды и десятки
+    секунд для больших моделей. При старте ядро загружает все модели
+    маршрутизатора (`CORE_WARMUP`), а прогревщик раз в `interval` секунд
+    для каждой модели решает, загрузить ли её или продлить ей жизнь
+    запросом без генерации (`LLMClient.warmup`):
+
+    - модель нужна, если ей были запросы в последние `active_window`
+      секунд или если в этот или следующий час суток к ней обычно
+      приходит хотя бы `min_hourly` запросов (часовая статистика
+      сглаживается по дням и живёт в памяти процесса);
+    - продлевается, только когда с последнего обращения к ней прошло
+      больше `refresh_ratio` от `keep_alive` — при живом трафике
+      лишних запросов нет;
+    - ненужную модель не трогает: Ollama выгрузит её сама и освободит память.
+    """
+
+    def __init__(
+        self,
+        llm: "LLMClient",
+        models: tuple[str, ...],
+        interval: float = 60.0,
+        active_window: float = 7200.0,
+        min_hourly: float = 1.0,
+        refresh_ratio: float = 0.8,
+        smoothing: float = 0.3,
+    ) -> None:
+        self.llm = llm
+        self.models = models
+        self.interval = interval
+        self.active_window = active_window
+        self.min_hourly = min_hourly
+        self.refresh_ratio = refresh_ratio
+        self.smoothing = smoothing
+        self._traffic = {model: _ModelTraffic() for model in models}
+        self._task: asyncio.Task[None] | None = None
+
+        self.refreshes = 0
+        self.failures = 0
+
+    def start(self) -> None:
+        """Запустить прогрев (нужен работающий event loop)."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.tick()
+            except Exception:  # noqa: BLE001
+                logger.exception("Ошибка прогрева моделей — повторим позже")
+
+    async def _load(self, model: str) -> bool:
+        loaded = await self.llm.warmup(model)
+        if loaded:
+            self._traffic[model].last_touch = time.monotonic()
+        else:
+            self.failures += 1
+            logger.warning("Не удалось загрузить модель %s", model)
+        return loaded
+
+    def _observe(self, model: str, traffic: _ModelTraffic) -> None:
+        """Перенести новые запросы к модели в часовую статистику."""
+        total = self.llm.model_requests.get(model, 0)
+        new, traffic.seen_requests = total - traffic.seen_requests, total
+        hour = time.localtime(time.time()).tm_hour
+        if traffic.hour is not None and hour != traffic.hour:
+            # Час закончился: сглаживаем его итог с тем же часом прошлых дней
+            old = traffic.hourly[traffic.hour]
+            traffic.hourly[traffic.hour] = old + self.smoothing * (traffic.hour_requests - old)
+            traffic.hour_requests = 0
+        traffic.hour = hour
+        traffic.hour_requests += new
+
+    def wanted(self, model: str) -> bool:
+        """Нужна ли модель сейчас (см. описание класса)."""
+        traffic = self._traffic[model]
+        last_used = self.llm.last_used.get(model)
+        if last_used is not None and time.monotonic() - last_used <= self.active_window:
+            return True
+        hour = time.localtime(time.time()).tm_hour
+        return max(traffic.hourly[hour], traffic.hourly[(hour + 1) % 24]) >= self.min_hourly
+
+    async def tick(self) -> list[str]:
+        """Один проход: обновить статистику и продлить нужные модели; вернуть продлённые."""
+        keep_alive = parse_duration(self.llm.keep_alive)
+        refreshed = []
+        for model, traffic in self._traffic.items():
+            self._observe(model, traffic)
+            if keep_alive < 0 or not self.wanted(model):
+                # Отрицательный keep_alive — Ollama держит модель всегда
+                continue
+            touched = max(traffic.last_touch, self.llm.last_used.get(model, 0.0))
+            if time.monotonic() - touched >= keep_alive * self.refresh_ratio:
+                if await self._load(model):
+                    self.refreshes += 1
+                    refreshed.append(model)
+        return refreshed
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "wanted": [model for model in self.models if self.wanted(model)],
+        }
@@ -22,6 +22,7 @@ class MessageOut:
     text: str
     media_type: str | None = None
     media_data: dict[str, Any] | None = None
+    timings: dict[str, float] | None = None  # длительности этапов, мс (в БД не сохраняются)
 
 
 @dataclass
@@ -34,3 +35,5 @@ class UserProfile:
     language: str = "ru"
     tone: str = "friendly"  # "friendly" | "formal" | "casual"
     response_format: str = "text"  # "text" | "voice" | "auto"
+    cache_responses: bool = True  # можно ли отвечать из кэша ответов LLM
+    model_profile: str = "auto"  # профиль выбора модели, см. core.model_router
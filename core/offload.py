@@ -0,0 +1,230 @@
+"""Пул процессов для CPU-тяжёлой работы инструментов (разбор PDF, таблиц, медиа)."""
+
+import asyncio
+import inspect
+import logging
+import multiprocessing
+import os
+import time
+from collections.abc import AsyncIterator, Callable
+from multiprocessing.connection import Connection
+from typing import Any
+
+logger = logging.getLogger("core.offload")
+
+
+class OffloadBusy(Exception):
+    """Очередь задач пула заполнена — задачу не принимаем."""
+
+
+class OffloadError(Exception):
+    """Задача упала в рабочем процессе или процесс завершился."""
+
+
+def _worker_main(conn: Connection) -> None:
+    """Цикл рабочего процесса: задача → результат (или части результата генератора)."""
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            return
+        if job is None:
+            return
+        func, args = job
+        try:
+            result = func(*args)
+            if inspect.isgenerator(result):
+                for item in result:
+                    conn.send(("item", item))
+            else:
+                conn.send(("item", result))
+            conn.send(("done", None))
+        except Exception as exc:  # noqa: BLE001
+            # Исключение передаём строкой: не всякое исключение сериализуется
+            conn.send(("error", f"{type(exc).__name__}: {exc}"))
+
+
+class _Worker:
+    def __init__(self, context: multiprocessing.context.BaseContext) -> None:
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+
+    async def recv(self) -> tuple[str, Any]:
+        if not self.conn.poll():
+            loop = asyncio.get_running_loop()
+            ready = loop.create_future()
+            fd = self.conn.fileno()
+            loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+            try:
+                await ready
+            finally:
+                loop.remove_reader(fd)
+        try:
+            return self.conn.recv()
+        except (EOFError, OSError) as exc:
+            raise OffloadError(f"Рабочий процесс завершился (код {self.process.exitcode})") from exc
+
+    def stop(self) -> None:
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.conn.close()
+
+    def kill(self) -> None:
+        """Убить процесс; дождаться его (`process.join`) — забота вызывающего, вне event loop."""
+        self.process.kill()
+        self.conn.close()
+
+
+class ProcessOffload:
+    """
+    Вынос CPU-тяжёлых функций из event loop в отдельные процессы.
+
+    Разбор большого PDF в потоке ядра держал бы GIL и останавливал ответы
+    всем пользователям; здесь он идёт в одном из `workers` процессов
+    (по умолчанию — по числу ядер). Процессы запускаются лениво и
+    переиспользуются между задачами.
+
+    - Очередь ограничена: если все процессы заняты и ждут уже `max_queue`
+      задач, `stream`/`run` сразу бросают `OffloadBusy`.
+    - У задачи есть таймаут; при таймауте, отмене вызывающей корутины или
+      если потребитель перестал читать результат, процесс с задачей
+      убивается и при следующей задаче запускается новый — CPU не тратится
+      на ответ, который уже никому не нужен.
+    - Функция-генератор отдаёт результат частями, `stream` выдаёт их по
+      мере готовности.
+
+    Функция и аргументы передаются в процесс через pickle, поэтому функция
+    должна быть на уровне модуля (см. `core.parsers`), а большие данные
+    передаются путём к файлу, а не байтами. Процессы создаются методом
+    `spawn`: fork процесса с потоками SQLite и uvicorn небезопасен.
+    """
+
+    def __init__(
+        self,
+        workers: int | None = None,
+        max_queue: int | None = None,
+        timeout: float | None = None,
+    ) -> None:
+        self.workers = workers or int(os.getenv("OFFLOAD_WORKERS", "0")) or os.cpu_count() or 1
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv("OFFLOAD_MAX_QUEUE", "16"))
+        self.timeout = timeout or float(os.getenv("OFFLOAD_TIMEOUT", "30"))
+        self._context = multiprocessing.get_context("spawn")
+        self._idle: list[_Worker] = []
+        self._busy: set[_Worker] = set()
+        self._slots: asyncio.Semaphore | None = None
+        self._waiting = 0
+        self._closed = False
+        # Фоновые join убитых процессов (см. `_kill`)
+        self._reaping: set[asyncio.Task[None]] = set()
+
+        self.completed = 0
+        self.failed = 0
+        self.killed = 0
+        self.rejected = 0
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "workers": len(self._idle) + len(self._busy),
+            "busy": len(self._busy),
+            "waiting": self._waiting,
+            "completed": self.completed,
+            "failed": self.failed,
+            "killed": self.killed,
+            "rejected": self.rejected,
+        }
+
+    async def run(self, func: Callable[..., Any], *args: Any, timeout: float | None = None) -> Any:
+        """Выполнить `func(*args)` в процессе и вернуть результат (для генератора — список частей)."""
+        items = [item async for item in self.stream(func, *args, timeout=timeout)]
+        return items if inspect.isgeneratorfunction(func) else items[0]
+
+    async def stream(
+        self, func: Callable[..., Any], *args: Any, timeout: float | None = None
+    ) -> AsyncIterator[Any]:
+        """
+        Выполнить `func(*args)` в процессе, отдавая части результата по мере готовности.
+
+        Raises:
+            OffloadBusy: Все процессы заняты и очередь заполнена
+            OffloadError: Функция бросила исключение или процесс умер
+            TimeoutError: Задача не уложилась в `timeout` (по умолчанию `self.timeout`)
+        """
+        if self._closed:
+            raise OffloadError("Пул остановлен")
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        if self._slots.locked() and self._waiting >= self.max_queue:
+            self.rejected += 1
+            raise OffloadBusy(f"В очереди уже {self._waiting} задач")
+
+        deadline = time.monotonic() + (timeout or self.timeout)
+        self._waiting += 1
+        try:
+            async with asyncio.timeout(deadline - time.monotonic()):
+                await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+
+        worker: _Worker | None = None
+        finished = False
+        try:
+            worker = self._idle.pop() if self._idle else await asyncio.to_thread(_Worker, self._context)
+            self._busy.add(worker)
+            worker.conn.send((func, args))
+            while True:
+                async with asyncio.timeout(deadline - time.monotonic()):
+                    kind, value = await worker.recv()
+                if kind == "item":
+                    yield value
+                    continue
+                finished = True
+                if kind == "error":
+                    self.failed += 1
+                    raise OffloadError(value)
+                self.completed += 1
+                return
+        finally:
+            if worker is not None:
+                self._busy.discard(worker)
+                if finished and not self._closed:
+                    self._idle.append(worker)
+                else:
+                    # Задача ещё выполняется (таймаут, отмена, потребитель ушёл) или процесс умер
+                    self.killed += 1
+                    self._kill(worker)
+            self._slots.release()
+
+    def _kill(self, worker: _Worker) -> None:
+        """
+        Убить процесс и дождаться его завершения в фоновом потоке.
+
+        Вызывается из `finally` генератора `stream` (таймаут, отмена, `aclose`
+        потребителя), где ждать нельзя: `join` прямо здесь остановил бы event
+        loop, а `await` в `finally` брошенного генератора невозможен.
+        """
+        worker.kill()
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Event loop уже нет — блокировать некого
+            worker.process.join(timeout=1.0)
+            return
+        reaping = loop.create_task(asyncio.to_thread(worker.process.join, 1.0))
+        self._reaping.add(reaping)
+        reaping.add_done_callback(self._reaping.discard)
+
+    async def aclose(self) -> None:
+        """Остановить свободные процессы и убить занятые."""
+        self._closed = True
+        idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.stop()
+        for worker in list(self._busy):
+            self._kill(worker)
+        await asyncio.gather(
+            *(asyncio.to_thread(w.process.join, 5.0) for w in idle), *list(self._reaping)
+        )
@@ -0,0 +1,117 @@
+"""Разбор файлов для инструментов: функции выполняются в процессах `ProcessOffload`.
+
+Модуль импортируется каждым рабочим процессом, поэтому зависит только от
+стандартной библиотеки (pypdf подключается, если установлен). Файлы
+передаются путём и читаются через mmap; функции-генераторы отдают
+результат частями — `ToolRouter` получает их по мере готовности.
+"""
+
+import csv
+import mmap
+import re
+import zlib
+from collections.abc import Iterator
+
+_STREAM_RE = re.compile(rb"stream\r?\n")
+_TEXT_OP_RE = re.compile(rb"\((?:\\.|[^\\)])*\)\s*(?:Tj|'|\")|\[(?:\\.|[^\]])*\]\s*TJ", re.DOTALL)
+_STRING_RE = re.compile(rb"\((?:\\.|[^\\)])*\)", re.DOTALL)
+_ESCAPES = {b"n": b"\n", b"r": b"\r", b"t": b"\t", b"b": b"\b", b"f": b"\f"}
+_ESCAPE_RE = re.compile(rb"\\([0-7]{1,3}|.)", re.DOTALL)
+
+
+def _unescape(raw: bytes) -> str:
+    def replace(match: re.Match[bytes]) -> bytes:
+        value = match.group(1)
+        if value[:1].isdigit():
+            return bytes([int(value, 8) & 0xFF])
+        return _ESCAPES.get(value, value)
+
+    return _ESCAPE_RE.sub(replace, raw).decode("latin-1")
+
+
+def _content_text(content: bytes) -> str:
+    """Текст операторов Tj/TJ одного потока содержимого страницы."""
+    parts = []
+    for op in _TEXT_OP_RE.finditer(content):
+        parts.append("".join(_unescape(s[1:-1]) for s in _STRING_RE.findall(op.group(0))))
+    return " ".join(part for part in parts if part.strip())
+
+
+def _pdf_streams(buf: mmap.mmap) -> Iterator[bytes]:
+    """Потоки PDF-файла, распакованные, если сжаты FlateDecode."""
+    pos = 0
+    while (match := _STREAM_RE.search(buf, pos)) is not None:
+        start = match.end()
+        end = buf.find(b"endstream", start)
+        if end < 0:
+            return
+        # Словарь объекта — перед ключевым словом stream
+        header = buf[max(0, match.start() - 512):match.start()]
+        data = buf[start:end]
+        if b"/FlateDecode" in header[header.rfind(b"<<"):]:
+            try:
+                data = zlib.decompressobj().decompress(data)
+            except zlib.error:
+                data = b""
+        yield data
+        pos = end + len(b"endstream")
+
+
+def pdf_text(path: str, max_chars: int = 20000) -> Iterator[str]:
+    """
+    Извлекать текст PDF по страницам (или потокам содержимого), пока не наберётся `max_chars`.
+
+    С pypdf — его `extract_text`; без него — собственный разбор: распаковка
+    FlateDecode-потоков и строки операторов Tj/TJ. Такой разбор понимает
+    простые PDF (отчёты, выгрузки), но не шрифты с CID-кодировкой.
+    """
+    remaining = max_chars
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        PdfReader = None
+
+    if PdfReader is not None:
+        for page in PdfReader(path).pages:
+            text = (page.extract_text() or "").strip()
+            if text:
+                yield text[:remaining]
+                remaining -= len(text)
+                if remaining <= 0:
+                    return
+        return
+
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        for content in _pdf_streams(buf):
+            text = _content_text(content).strip()
+            if text:
+                yield text[:remaining]
+                remaining -= len(text)
+                if remaining <= 0:
+                    return
+
+
+def table_summary(path: str, max_rows: int = 5) -> str:
+    """Размер CSV/TSV-таблицы, заголовок и первые строки."""
+    with open(path, encoding="utf-8", errors="replace", newline="") as file:
+        sample = file.read(65536)
+        file.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.reader(file, dialect)
+        head: list[list[str]] = []
+        rows = 0
+        columns = 0
+        for row in reader:
+            if len(head) <= max_rows:
+                head.append(row)
+            rows += 1
+            columns = max(columns, len(row))
+
+    lines = [f"Таблица: {max(0, rows - 1)} строк данных, {columns} столбцов"]
+    if head:
+        lines.append("Заголовок: " + " | ".join(head[0]))
+        lines += [" | ".join(row) for row in head[1:]]
+    return "\n".join(lines)
@@ -0,0 +1,70 @@
+"""Кэш профилей пользователей в памяти процесса (LRU + TTL)."""
+
+import dataclasses
+import time
+from collections import OrderedDict
+
+from core.models import UserProfile
+
+
+class ProfileCache:
+    """
+    LRU-кэш `UserProfile` с ограничением времени жизни записей.
+
+    Возвращает копии профилей, чтобы изменения у вызывающего кода не
+    протекали в кэш мимо `Memory.update_profile`. Счётчики `hits`,
+    `misses` и `evictions` помогают подобрать `max_size` и `ttl`.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 300.0) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: OrderedDict[str, tuple[float, UserProfile]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id: str) -> UserProfile | None:
+        """Получить профиль из кэша или None при промахе/истёкшей записи."""
+        item = self._items.get(user_id)
+        if item is None:
+            self.misses += 1
+            return None
+
+        expires_at, profile = item
+        if expires_at <= time.monotonic():
+            del self._items[user_id]
+            self.misses += 1
+            return None
+
+        self._items.move_to_end(user_id)
+        self.hits += 1
+        return dataclasses.replace(profile)
+
+    def put(self, profile: UserProfile) -> None:
+        """Положить (или обновить) профиль в кэше."""
+        self._items[profile.user_id] = (
+            time.monotonic() + self.ttl,
+            dataclasses.replace(profile),
+        )
+        self._items.move_to_end(profile.user_id)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, user_id: str) -> None:
+        """Удалить профиль из кэша (например, после изменения через API)."""
+        self._items.pop(user_id, None)
+
+    def clear(self) -> None:
+        self._items.clear()
+
+    def stats(self) -> dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._items),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
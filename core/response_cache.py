@@ -0,0 +1,186 @@
+"""Кэш ответов LLM: точные и нормализованные ключи, память + опциональный диск."""
+
+import hashlib
+import json
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from core.db import SQLiteEngine
+
+_SPACE_RE = re.compile(r"\s+")
+# Только концевые знаки: «2+2» и «2*2», «c++» и «c#» — разные вопросы
+_TRAILING_RE = re.compile(r"[\s?!.…]+$")
+
+
+def normalize_prompt(text: str) -> str:
+    """
+    Нормализовать текст запроса для ключа кэша.
+
+    «Привет!», «привет» и «  ПРИВЕТ ?» дают один и тот же ключ: не влияют
+    регистр, повторные пробелы и знаки `?!.…` в конце. Остальные символы
+    (операторы, «ё», знаки внутри текста) сохраняются — они меняют смысл.
+    """
+    text = _SPACE_RE.sub(" ", text.casefold()).strip()
+    return _TRAILING_RE.sub("", text)
+
+
+class ResponseCache:
+    """
+    Двухуровневый кэш сгенерированных ответов.
+
+    Первый уровень — LRU в памяти процесса с TTL и ограничением размера,
+    второй (если задан `disk_path`) — таблица SQLite, переживающая рестарты.
+    Ключ строится из модели, системного промпта, нормализованного текста
+    запроса и (если `include_history`) хэша истории диалога.
+
+    Просроченная строка диска удаляется, как только на неё попал поиск, а
+    каждые `purge_every` записей — все просроченные разом; если строк всё
+    равно больше `max_disk_rows`, удаляются те, что истекают раньше всех.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 2048,
+        ttl: float = 3600.0,
+        disk_path: str | Path | None = None,
+        include_history: bool = True,
+        max_disk_rows: int = 50_000,
+        purge_every: int = 256,
+    ) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.include_history = include_history
+        self.max_disk_rows = max_disk_rows
+        self.purge_every = purge_every
+        self._puts = 0
+        self._items: OrderedDict[str, tuple[float, str]] = OrderedDict()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.purged = 0
+
+        self._disk: SQLiteEngine | None = None
+        if disk_path is not None:
+            Path(disk_path).parent.mkdir(parents=True, exist_ok=True)
+            self._disk = SQLiteEngine(disk_path, readers=2)
+            self._disk.write_sync(self._init_disk)
+
+    def _init_disk(self, conn: sqlite3.Connection) -> None:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_expires_at ON response_cache(expires_at)")
+        self._purge(conn)
+
+    def _purge(self, conn: sqlite3.Connection) -> None:
+        """Удалить просроченные строки диска и лишние сверх `max_disk_rows`."""
+        deleted = conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+        excess = conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0] - self.max_disk_rows
+        if excess > 0:
+            deleted += conn.execute(
+                """
+                DELETE FROM response_cache WHERE key IN (
+                    SELECT key FROM response_cache ORDER BY expires_at LIMIT ?
+                )
+                """,
+                (excess,),
+            ).rowcount
+        self.purged += deleted
+
+    def make_key(
+        self,
+        model: str,
+        system: str | None,
+        prompt: str,
+        history: list[dict[str, str]] | None = None,
+    ) -> str:
+        """Построить ключ кэша для запроса к LLM."""
+        parts = [model, system or "", normalize_prompt(prompt)]
+        if self.include_history:
+            parts.append(json.dumps(history or [], ensure_ascii=False, sort_keys=True))
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> str | None:
+        """Найти ответ в памяти, затем на диске; найденное на диске поднимается в память."""
+        item = self._items.get(key)
+        if item is not None:
+            expires_at, response = item
+            if expires_at > time.monotonic():
+                self._items.move_to_end(key)
+                self.hits += 1
+                return response
+            del self._items[key]
+
+        if self._disk is not None:
+            row = await self._disk.read(
+                lambda conn: conn.execute(
+                    "SELECT response, expires_at FROM response_cache WHERE key = ?", (key,)
+                ).fetchone()
+            )
+            if row is not None and row[1] > time.time():
+                self._remember(key, row[0], ttl=row[1] - time.time())
+                self.hits += 1
+                self.disk_hits += 1
+                return row[0]
+            if row is not None:
+                await self._disk.write(self._delete_expired, key)
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, response: str) -> None:
+        """Сохранить ответ на обоих уровнях."""
+        self._remember(key, response, ttl=self.ttl)
+        if self._disk is not None:
+            self._puts += 1
+            await self._disk.write(
+                self._store, key, response, time.time() + self.ttl, self._puts % self.purge_every == 0
+            )
+
+    def _store(self, conn: sqlite3.Connection, key: str, response: str, expires_at: float, purge: bool) -> None:
+        conn.execute(
+            "INSERT OR REPLACE INTO response_cache (key, response, expires_at) VALUES (?, ?, ?)",
+            (key, response, expires_at),
+        )
+        if purge:
+            self._purge(conn)
+
+    def _delete_expired(self, conn: sqlite3.Connection, key: str) -> None:
+        # Условие на срок: строку могли перезаписать свежим ответом после чтения
+        self.purged += conn.execute(
+            "DELETE FROM response_cache WHERE key = ? AND expires_at <= ?", (key, time.time())
+        ).rowcount
+
+    def _remember(self, key: str, response: str, ttl: float) -> None:
+        self._items[key] = (time.monotonic() + ttl, response)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._items),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "purged": self.purged,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    async def aclose(self) -> None:
+        if self._disk is not None:
+            await self._disk.aclose()
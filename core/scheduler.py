@@ -0,0 +1,254 @@
+"""Планировщик запросов к агенту: порядок внутри пользователя и честная очередь между ними."""
+
+import asyncio
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+
+from core.models import MessageIn, MessageOut
+
+
+class SchedulerBusy(Exception):
+    """Очередь переполнена или ожидание превысит SLO — клиенту стоит повторить позже."""
+
+    def __init__(self, reason: str, retry_after: float) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+@dataclass(eq=False)
+class Ticket:
+    """Место в очереди планировщика для одного сообщения."""
+
+    msg_in: MessageIn
+    mergeable: bool
+    enqueued_at: float = field(default_factory=time.monotonic)
+    started_at: float = 0.0
+    granted: asyncio.Future["Ticket"] = field(
+        default_factory=lambda: asyncio.get_running_loop().create_future()
+    )
+    # Сообщения того же пользователя, объединённые с этим в один промпт
+    followers: list["Ticket"] = field(default_factory=list)
+    result: asyncio.Future[MessageOut] | None = None
+    released: bool = False
+
+
+class Scheduler:
+    """
+    Планировщик обработки сообщений.
+
+    - Сообщения одного `user_id` обрабатываются строго по очереди: следующее
+      начинается только после ответа на предыдущее, поэтому история не
+      собирается из полузаписанного состояния.
+    - Между пользователями — round-robin: пользователь с десятью сообщениями
+      в очереди не задерживает того, у кого одно.
+    - Одновременно обрабатывается не больше `max_concurrency` сообщений.
+    - Если очередь пользователя или общая очередь переполнена, либо оценка
+      ожидания превышает `latency_slo`, сообщение сразу отклоняется
+      `SchedulerBusy` вместо бесконечного ожидания.
+    - При `coalesce` текстовые сообщения, накопившиеся у пользователя, пока
+      обрабатывалось предыдущее, объединяются в один промпт с общим ответом.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[MessageIn], Awaitable[MessageOut]],
+        max_concurrency: int = 4,
+        max_user_queue: int = 5,
+        max_queue: int = 100,
+        latency_slo: float = 60.0,
+        coalesce: bool = True,
+        max_merge: int = 5,
+    ) -> None:
+        self.handler = handler
+        self.max_concurrency = max_concurrency
+        self.max_user_queue = max_user_queue
+        self.max_queue = max_queue
+        self.latency_slo = latency_slo
+        self.coalesce = coalesce
+        self.max_merge = max_merge
+
+        self._queues: dict[str, deque[Ticket]] = {}
+        self._ready: deque[str] = deque()
+        self._active: set[str] = set()
+        self._running = 0
+        self._queued = 0
+
+        self.submitted = 0
+        self.rejected = 0
+        self.merged = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.dispatched = 0
+        # Сглаженное время обслуживания одного сообщения, с
+        self.service_time: float | None = None
+
+    async def submit(self, msg_in: MessageIn) -> MessageOut:
+        """Дождаться очереди и обработать сообщение через `handler`."""
+        ticket = self.admit(msg_in, mergeable=self.coalesce)
+        leader = await self.wait(ticket)
+        if leader is not ticket:
+            # Сообщение объединено с более ранним — ответ общий
+            assert leader.result is not None
+            return await asyncio.shield(leader.result)
+
+        try:
+            result = await self.handler(self._merged_message(ticket))
+        except BaseException as exc:
+            if ticket.result is not None and not ticket.result.done():
+                if isinstance(exc, asyncio.CancelledError):
+                    ticket.result.cancel()
+                else:
+                    ticket.result.set_exception(exc)
+            raise
+        finally:
+            self.release(ticket)
+
+        if ticket.result is not None and not ticket.result.done():
+            ticket.result.set_result(result)
+        return result
+
+    def admit(self, msg_in: MessageIn, mergeable: bool = False) -> Ticket:
+        """
+        Поставить сообщение в очередь или сразу отказать.
+
+        Raises:
+            SchedulerBusy: очередь переполнена или ожидание превысит SLO
+        """
+        user_queue = self._queues.get(msg_in.user_id)
+        if user_queue is not None and len(user_queue) >= self.max_user_queue:
+            self._reject("user_queue_full")
+        if self._queued >= self.max_queue:
+            self._reject("queue_full")
+        estimated = self.estimated_wait()
+        if estimated > self.latency_slo:
+            self._reject("latency_slo", estimated)
+
+        ticket = Ticket(
+            msg_in=msg_in,
+            mergeable=mergeable and bool(msg_in.text) and not msg_in.media_type,
+        )
+        if user_queue is None:
+            user_queue = self._queues[msg_in.user_id] = deque()
+        user_queue.append(ticket)
+        self._queued += 1
+        self.submitted += 1
+        if msg_in.user_id not in self._active and len(user_queue) == 1:
+            self._ready.append(msg_in.user_id)
+        self._dispatch()
+        return ticket
+
+    async def wait(self, ticket: Ticket) -> Ticket:
+        """
+        Дождаться своей очереди.
+
+        Возвращает сам билет или билет-«лидер», с которым сообщение объединено.
+        """
+        try:
+            return await asyncio.shield(ticket.granted)
+        except asyncio.CancelledError:
+            self.release(ticket)
+            raise
+
+    def release(self, ticket: Ticket) -> None:
+        """Освободить место (или убрать из очереди). Повторный вызов безопасен."""
+        if ticket.released:
+            return
+        ticket.released = True
+
+        if not ticket.granted.done():
+            ticket.granted.cancel()
+            user_queue = self._queues.get(ticket.msg_in.user_id)
+            if user_queue is not None and ticket in user_queue:
+                user_queue.remove(ticket)
+                self._queued -= 1
+                if not user_queue:
+                    del self._queues[ticket.msg_in.user_id]
+                    if ticket.msg_in.user_id in self._ready:
+                        self._ready.remove(ticket.msg_in.user_id)
+            return
+
+        if ticket.granted.result() is not ticket:
+            return  # объединённое сообщение, место занимал лидер
+
+        elapsed = time.monotonic() - ticket.started_at
+        self.service_time = (
+            elapsed if self.service_time is None else 0.8 * self.service_time + 0.2 * elapsed
+        )
+        self._running -= 1
+        user_id = ticket.msg_in.user_id
+        self._active.discard(user_id)
+        if user_id in self._queues:
+            self._ready.append(user_id)
+        self._dispatch()
+
+    def estimated_wait(self) -> float:
+        """Оценка ожидания нового сообщения, с (по сглаженному времени обслуживания)."""
+        if self.service_time is None or self._running < self.max_concurrency:
+            return 0.0
+        return (self._queued / self.max_concurrency + 1) * self.service_time
+
+    def _reject(self, reason: str, retry_after: float | None = None) -> None:
+        self.rejected += 1
+        raise SchedulerBusy(reason, retry_after or self.service_time or 1.0)
+
+    def _dispatch(self) -> None:
+        while self._running < self.max_concurrency and self._ready:
+            user_id = self._ready.popleft()
+            user_queue = self._queues[user_id]
+            ticket = user_queue.popleft()
+            self._queued -= 1
+
+            if ticket.mergeable:
+                while (
+                    user_queue
+                    and user_queue[0].mergeable
+                    and len(ticket.followers) < self.max_merge
+                ):
+                    follower = user_queue.popleft()
+                    self._queued -= 1
+                    ticket.followers.append(follower)
+                if ticket.followers:
+                    ticket.result = asyncio.get_running_loop().create_future()
+                    for follower in ticket.followers:
+                        follower.granted.set_result(ticket)
+                    self.merged += len(ticket.followers)
+
+            if not user_queue:
+                del self._queues[user_id]
+
+            ticket.started_at = time.monotonic()
+            waited = ticket.started_at - ticket.enqueued_at
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            self.dispatched += 1
+            self._running += 1
+            self._active.add(user_id)
+            ticket.granted.set_result(ticket)
+
+    @staticmethod
+    def _merged_message(ticket: Ticket) -> MessageIn:
+        if not ticket.followers:
+            return ticket.msg_in
+        texts = [ticket.msg_in.text or ""] + [f.msg_in.text or "" for f in ticket.followers]
+        return MessageIn(
+            user_id=ticket.msg_in.user_id,
+            channel=ticket.msg_in.channel,
+            text="\n".join(texts),
+        )
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "running": self._running,
+            "queued": self._queued,
+            "users_waiting": len(self._queues),
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "merged": self.merged,
+            "avg_wait": self.total_wait / self.dispatched if self.dispatched else 0.0,
+            "max_wait": self.max_wait,
+            "service_time": self.service_time or 0.0,
+            "estimated_wait": self.estimated_wait(),
+        }
@@ -0,0 +1,205 @@
+"""Веб-поиск: подключаемые бэкенды, кэш результатов с объединением запросов и инструмент `WebSearchTool`."""
+
+import asyncio
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+import httpx
+
+from core.response_cache import normalize_prompt
+from core.tools import Tool
+
+
+class SearchBackend(ABC):
+    """Источник результатов поиска."""
+
+    @abstractmethod
+    async def search(self, query: str) -> str | None:
+        """
+        Найти краткий ответ на запрос.
+
+        Returns:
+            Текст результата или None, если ничего не найдено
+
+        Raises:
+            httpx.HTTPError: бэкенд недоступен
+        """
+
+    async def aclose(self) -> None:
+        """Освободить ресурсы бэкенда."""
+
+
+class DuckDuckGoBackend(SearchBackend):
+    """
+    DuckDuckGo Instant Answer API.
+
+    Адрес берётся из `DDG_BASE_URL`, поэтому вместо настоящего API
+    можно подставить локальный HTTP-стенд (например, в тестах и бенчмарках).
+    """
+
+    def __init__(
+        self, base_url: str | None = None, http_client: httpx.AsyncClient | None = None
+    ) -> None:
+        self.base_url = base_url or os.getenv("DDG_BASE_URL", "https://api.duckduckgo.com/")
+        self._client = http_client
+        self._owns_client = http_client is None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=10.0,
+                limits=httpx.Limits(max_connections=10, max_keepalive_connections=5),
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None and self._owns_client:
+            await self._client.aclose()
+        self._client = None
+
+    async def search(self, query: str) -> str | None:
+        params = {
+            "q": query,
+            "format": "json",
+            "no_html": "1",
+            "skip_disambig": "1",
+        }
+        resp = await self._get_client().get(self.base_url, params=params)
+        resp.raise_for_status()
+        data = resp.json()
+
+        abstract = data.get("AbstractText", "")
+        if abstract:
+            return abstract
+
+        related = data.get("RelatedTopics", [])
+        if related:
+            first_result = related[0].get("Text", "")
+            if first_result:
+                return first_result
+
+        return None
+
+
+class SearchCache:
+    """
+    Кэш результатов поиска с TTL и объединением одинаковых запросов.
+
+    - Найденные результаты живут `ttl` секунд, пустые — `negative_ttl`
+      (негативное кэширование: повторный запрос без результатов не идёт в API).
+    - Ошибки бэкенда не кэшируются.
+    - Одновременные одинаковые запросы (после нормализации) выполняются
+      одним обращением к бэкенду (singleflight); отмена одного из ожидающих
+      не отменяет общий запрос.
+    """
+
+    def __init__(
+        self, max_size: int = 1024, ttl: float = 600.0, negative_ttl: float = 60.0
+    ) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._items: OrderedDict[str, tuple[float, str | None]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Task[str | None]] = {}
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def get_or_fetch(
+        self, query: str, fetch: Callable[[], Awaitable[str | None]]
+    ) -> str | None:
+        """Вернуть результат из кэша или получить его через `fetch`."""
+        key = normalize_prompt(query)
+
+        item = self._items.get(key)
+        if item is not None:
+            expires_at, value = item
+            if expires_at > time.monotonic():
+                self._items.move_to_end(key)
+                if value is None:
+                    self.negative_hits += 1
+                else:
+                    self.hits += 1
+                return value
+            del self._items[key]
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.create_task(self._fetch(key, fetch))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key: str, fetch: Callable[[], Awaitable[str | None]]) -> str | None:
+        value = await fetch()
+        ttl = self.ttl if value else self.negative_ttl
+        self._items[key] = (time.monotonic() + ttl, value or None)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+        return value or None
+
+    def _finish(self, key: str, task: asyncio.Task[str | None]) -> None:
+        self._inflight.pop(key, None)
+        # Забираем исключение, даже если все ожидающие уже отменены
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict[str, float]:
+        lookups = self.hits + self.negative_hits + self.misses + self.coalesced
+        return {
+            "size": len(self._items),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._inflight),
+            "hit_rate": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+        }
+
+
+class WebSearchTool(Tool):
+    """Веб-поиск через бесплатные API (по умолчанию DuckDuckGo) с кэшем результатов."""
+
+    keywords = ("найди", "поиск", "найти", "search", "find")
+
+    def __init__(
+        self, backend: SearchBackend | None = None, cache: SearchCache | None = None
+    ) -> None:
+        self.backend = backend or DuckDuckGoBackend()
+        self.cache = cache or SearchCache()
+
+    async def aclose(self) -> None:
+        await self.backend.aclose()
+
+    def name(self) -> str:
+        return "web_search"
+
+    def build_input(self, context: dict[str, Any]) -> dict[str, Any]:
+        return {"query": context.get("text") or ""}
+
+    async def execute(self, input_data: dict[str, Any]) -> str:
+        """Поиск в интернете (через кэш и singleflight, см. SearchCache)."""
+        query = input_data.get("query", "")
+        if not query:
+            return "Ошибка: не указан поисковый запрос."
+
+        try:
+            result = await self.cache.get_or_fetch(query, lambda: self.backend.search(query))
+        except httpx.HTTPError as e:
+            return f"Ошибка при поиске: {e}"
+        except Exception as e:
+            return f"Неожиданная ошибка при поиске: {e}"
+
+        if result:
+            return f"Результат поиска по запросу '{query}':\n\n{result}"
+        return f"По запросу '{query}' ничего не найдено."
@@ -0,0 +1,492 @@
+"""Долговременная семантическая память: эмбеддинги взаимодействий и поиск похожих."""
+
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+import httpx
+import numpy as np
+
+from core.memory import Memory
+
+logger = logging.getLogger("core.semantic")
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class Embedder(ABC):
+    """Преобразует тексты в векторы фиксированной размерности."""
+
+    # Имя и размерность входят в путь индекса: векторы разных моделей не смешиваются
+    name: str
+    dim: int
+
+    @abstractmethod
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        """
+        Получить эмбеддинги текстов.
+
+        Returns:
+            Матрица float32 формы (len(texts), dim)
+        """
+
+    async def aclose(self) -> None:
+        """Освободить ресурсы."""
+
+
+class HashEmbedder(Embedder):
+    """
+    Детерминированный локальный эмбеддер без модели.
+
+    Слова и их символьные триграммы хэшируются в `dim` корзин (hashing trick),
+    поэтому тексты с общими словами получаются близкими. Годится для тестов,
+    бенчмарков и работы без Ollama; смысловой близости не понимает.
+    """
+
+    name = "hash"
+
+    def __init__(self, dim: int = 256) -> None:
+        self.dim = dim
+
+    def _embed_one(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in _WORD_RE.findall(text.casefold().replace("ё", "е")):
+            features = [word] + [word[i : i + 3] for i in range(max(0, len(word) - 2))]
+            for feature in features:
+                digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                value = int.from_bytes(digest, "little")
+                vector[value % self.dim] += 1.0 if (value >> 63) else -1.0
+        return vector
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.stack([self._embed_one(text) for text in texts])
+
+
+class OllamaEmbedder(Embedder):
+    """
+    Эмбеддинги через Ollama (`POST /api/embed`).
+
+    Модель — `OLLAMA_EMBED_MODEL` (по умолчанию nomic-embed-text), её
+    размерность — `OLLAMA_EMBED_DIM` (768).
+    """
+
+    def __init__(
+        self,
+        base_url: str | None = None,
+        model: str | None = None,
+        dim: int | None = None,
+        http_client: httpx.AsyncClient | None = None,
+    ) -> None:
+        # Эмбеддинги считает первый бэкенд из списка OLLAMA_BASE_URL
+        self.base_url = base_url or os.getenv("OLLAMA_BASE_URL", "http://localhost:11434").split(",")[0].strip()
+        self.model = model or os.getenv("OLLAMA_EMBED_MODEL", "nomic-embed-text")
+        self.dim = dim or int(os.getenv("OLLAMA_EMBED_DIM", "768"))
+        self.name = self.model.replace(":", "_").replace("/", "_")
+        self._client = http_client
+        self._owns_client = http_client is None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=30.0,
+                limits=httpx.Limits(max_connections=4, max_keepalive_connections=2),
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None and self._owns_client:
+            await self._client.aclose()
+        self._client = None
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        resp = await self._get_client().post(
+            f"{self.base_url}/api/embed", json={"model": self.model, "input": texts}
+        )
+        resp.raise_for_status()
+        vectors = np.asarray(resp.json()["embeddings"], dtype=np.float32)
+        if vectors.shape != (len(texts), self.dim):
+            raise ValueError(
+                f"Модель {self.model} вернула эмбеддинги формы {vectors.shape}, "
+                f"ожидалось ({len(texts)}, {self.dim}) — проверьте OLLAMA_EMBED_DIM"
+            )
+        return vectors
+
+
+class VectorIndex:
+    """
+    Векторный индекс на диске, по файлу на пользователя.
+
+    Векторы нормализуются и хранятся в float32 (`<user>.vec`), рядом — id
+    сообщений в int64 (`<user>.ids`). Файлы только дописываются, а читаются
+    через `numpy.memmap`, так что индекс не держится в памяти процесса целиком.
+    Поиск идёт блоками по `chunk_rows` строк: одно матричное умножение прямо
+    по отображению и частичная сортировка (`argpartition`) для top-k.
+    float16 был бы вдвое компактнее, но преобразование типа на каждом поиске
+    обходится дороже самого умножения.
+    Методы синхронные — из event loop их нужно вызывать через `asyncio.to_thread`.
+    """
+
+    def __init__(self, root: str | Path, dim: int, chunk_rows: int = 32768, max_open: int = 256) -> None:
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.dim = dim
+        self.chunk_rows = chunk_rows
+        self.max_open = max_open
+        self._lock = threading.Lock()
+        # user_id -> (число строк, векторы, id); отображения переоткрываются после дописывания
+        self._maps: OrderedDict[str, tuple[int, np.ndarray, np.ndarray]] = OrderedDict()
+
+    def _paths(self, user_id: str) -> tuple[Path, Path]:
+        stem = hashlib.sha1(user_id.encode("utf-8")).hexdigest()[:20]
+        return self.root / f"{stem}.vec", self.root / f"{stem}.ids"
+
+    def _count(self, user_id: str) -> int:
+        vec_path, ids_path = self._paths(user_id)
+        if not ids_path.exists():
+            return 0
+        # id дописываются после векторов: строка без id считается недописанной
+        return min(
+            vec_path.stat().st_size // (self.dim * 4),
+            ids_path.stat().st_size // 8,
+        )
+
+    def _open(self, user_id: str) -> tuple[int, np.ndarray, np.ndarray]:
+        with self._lock:
+            cached = self._maps.get(user_id)
+            count = self._count(user_id)
+            if cached is not None and cached[0] == count:
+                self._maps.move_to_end(user_id)
+                return cached
+
+            if count == 0:
+                opened = (0, np.zeros((0, self.dim), np.float32), np.zeros(0, np.int64))
+            else:
+                vec_path, ids_path = self._paths(user_id)
+                opened = (
+                    count,
+                    np.memmap(vec_path, dtype=np.float32, mode="r", shape=(count, self.dim)),
+                    np.memmap(ids_path, dtype=np.int64, mode="r", shape=(count,)),
+                )
+            self._maps[user_id] = opened
+            self._maps.move_to_end(user_id)
+            while len(self._maps) > self.max_open:
+                self._maps.popitem(last=False)
+            return opened
+
+    def users(self) -> int:
+        """Число пользователей с непустым индексом."""
+        return sum(1 for _ in self.root.glob("*.ids"))
+
+    def size(self, user_id: str) -> int:
+        return self._count(user_id)
+
+    def last_id(self, user_id: str) -> int:
+        """Id последнего проиндексированного сообщения пользователя (0, если индекса нет)."""
+        count, _, ids = self._open(user_id)
+        return int(ids[count - 1]) if count else 0
+
+    def add(self, user_id: str, message_ids: list[int], vectors: np.ndarray) -> None:
+        """Дописать векторы сообщений пользователя."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.shape != (len(message_ids), self.dim):
+            raise ValueError(f"Ожидались векторы формы ({len(message_ids)}, {self.dim}), получено {vectors.shape}")
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = (vectors / np.maximum(norms, 1e-12)).astype(np.float32)
+
+        vec_path, ids_path = self._paths(user_id)
+        with self._lock:
+            # Обрезаем хвост от прерванной записи, чтобы строки и id не разъехались
+            count = self._count(user_id)
+            with open(vec_path, "ab") as vec_file:
+                vec_file.truncate(count * self.dim * 4)
+                vec_file.write(vectors.tobytes())
+            with open(ids_path, "ab") as ids_file:
+                ids_file.truncate(count * 8)
+                ids_file.write(np.asarray(message_ids, dtype=np.int64).tobytes())
+
+    def move_user(self, user_id: str, other: "VectorIndex") -> bool:
+        """
+        Перенести векторы пользователя в индекс `other` (перенос между шардами).
+
+        Файлы переименовываются; устаревшие векторы пользователя в `other`
+        заменяются. Нет векторов — ничего не делает.
+        """
+        if other.dim != self.dim:
+            raise ValueError(f"Размерность индексов различается: {self.dim} и {other.dim}")
+        with self._lock:
+            if not self._paths(user_id)[1].exists():
+                return False
+            for source, target in zip(self._paths(user_id), other._paths(user_id)):
+                source.replace(target)
+            self._maps.pop(user_id, None)
+        with other._lock:
+            other._maps.pop(user_id, None)
+        return True
+
+    def search(self, user_id: str, query: np.ndarray, k: int = 3) -> list[tuple[int, float]]:
+        """
+        Найти `k` ближайших по косинусу векторов пользователя.
+
+        Returns:
+            Пары (id сообщения, сходство) по убыванию сходства
+        """
+        count, vectors, ids = self._open(user_id)
+        if count == 0 or k <= 0:
+            return []
+
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+        best_scores = np.empty(0, dtype=np.float32)
+        best_rows = np.empty(0, dtype=np.int64)
+        for start in range(0, count, self.chunk_rows):
+            scores = vectors[start : start + self.chunk_rows] @ query
+            if len(scores) > k:
+                top = np.argpartition(scores, -k)[-k:]
+            else:
+                top = np.arange(len(scores))
+            best_scores = np.concatenate([best_scores, scores[top]])
+            best_rows = np.concatenate([best_rows, top + start])
+            if len(best_scores) > k:
+                keep = np.argpartition(best_scores, -k)[-k:]
+                best_scores, best_rows = best_scores[keep], best_rows[keep]
+
+        order = np.argsort(-best_scores)
+        return [(int(ids[best_rows[i]]), float(best_scores[i])) for i in order]
+
+
+def _read_cursor(path: Path) -> int:
+    try:
+        return int(path.read_text())
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def _write_cursor(path: Path, value: int) -> None:
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(str(value))
+    tmp.replace(path)
+
+
+class SemanticMemory:
+    """
+    Семантическая память поверх `Memory`.
+
+    Фоновый индексатор дочитывает новые строки таблицы messages (после
+    курсора — id последнего обработанного сообщения), считает эмбеддинги
+    пачками по `batch_size` и дописывает их в `VectorIndex`. Так индексируются
+    и записи, попавшие в БД через write-behind, а после рестарта индексация
+    продолжается с места остановки.
+
+    `search` возвращает тексты прошлых взаимодействий пользователя, похожих
+    на запрос, со сходством не ниже `min_score`.
+    """
+
+    def __init__(
+        self,
+        memory: Memory,
+        embedder: Embedder | None = None,
+        index_dir: str | Path = "data/semantic",
+        batch_size: int = 64,
+        interval: float = 2.0,
+        min_score: float = 0.3,
+    ) -> None:
+        self.memory = memory
+        self.embedder = embedder or HashEmbedder()
+        self.index = VectorIndex(Path(index_dir) / f"{self.embedder.name}-{self.embedder.dim}", self.embedder.dim)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.min_score = min_score
+        self._cursor_path = self.index.root / "cursor"
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task[None] | None = None
+        self._sync_lock = asyncio.Lock()
+
+        self.indexed = 0
+        self.searches = 0
+
+    def start(self) -> None:
+        """Запустить фоновую индексацию (нужен работающий event loop)."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Остановить индексацию и закрыть эмбеддер."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.embedder.aclose()
+
+    def notify(self) -> None:
+        """Сообщить, что появились новые взаимодействия."""
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        delay = self.interval
+        while True:
+            try:
+                async with asyncio.timeout(delay):
+                    await self._wakeup.wait()
+            except TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.sync()
+            except Exception:  # noqa: BLE001
+                # Например, модель эмбеддингов не загружена — не долбим Ollama каждые пару секунд
+                delay = min(delay * 2, 60.0)
+                logger.exception("Ошибка индексации семантической памяти — повтор через %.0f с", delay)
+            else:
+                delay = self.interval
+
+    def _read_cursor(self) -> int:
+        return _read_cursor(self._cursor_path)
+
+    def _write_cursor(self, value: int) -> None:
+        _write_cursor(self._cursor_path, value)
+
+    @staticmethod
+    def _select_new(conn: sqlite3.Connection, after_id: int, limit: int) -> list[tuple[Any, ...]]:
+        return conn.execute(
+            """
+            SELECT id, user_id, input_text, output_text FROM messages
+            WHERE id > ? ORDER BY id LIMIT ?
+            """,
+            (after_id, limit),
+        ).fetchall()
+
+    @staticmethod
+    def document(input_text: str | None, output_text: str | None) -> str:
+        """Текст взаимодействия в том виде, в каком он индексируется и попадает в промпт."""
+        parts = []
+        if input_text:
+            parts.append(f"Пользователь: {input_text}")
+        if output_text:
+            parts.append(f"Ассистент: {output_text}")
+        return "\n".join(parts)
+
+    async def sync(self) -> int:
+        """Проиндексировать все ещё не обработанные сообщения. Возвращает их число."""
+        async with self._sync_lock:
+            total = 0
+            cursor = await asyncio.to_thread(self._read_cursor)
+            while True:
+                rows = await self.memory.engine.read(self._select_new, cursor, self.batch_size)
+                if not rows:
+                    return total
+
+                docs = [(row[0], row[1], self.document(row[2], row[3])) for row in rows]
+                docs = await asyncio.to_thread(self._unindexed, [doc for doc in docs if doc[2]])
+                vectors = await self.embedder.embed([text for _, _, text in docs])
+
+                by_user: dict[str, tuple[list[int], list[int]]] = {}
+                for position, (message_id, user_id, _) in enumerate(docs):
+                    ids, positions = by_user.setdefault(user_id, ([], []))
+                    ids.append(message_id)
+                    positions.append(position)
+                await asyncio.to_thread(self._append, by_user, vectors)
+
+                cursor = rows[-1][0]
+                await asyncio.to_thread(self._write_cursor, cursor)
+                total += len(docs)
+                self.indexed += len(docs)
+                if len(rows) < self.batch_size:
+                    return total
+
+    def _unindexed(self, docs: list[tuple[int, str, str]]) -> list[tuple[int, str, str]]:
+        # После сбоя между записью индекса и курсора, а также после переноса
+        # пользователя между шардами (курсор отмотан назад) пачка может прийти
+        # повторно: уже проиндексированное отбрасываем до вызова эмбеддера
+        last_ids: dict[str, int] = {}
+        for _, user_id, _ in docs:
+            if user_id not in last_ids:
+                last_ids[user_id] = self.index.last_id(user_id)
+        return [doc for doc in docs if doc[0] > last_ids[doc[1]]]
+
+    def _append(self, by_user: dict[str, tuple[list[int], list[int]]], vectors: np.ndarray) -> None:
+        for user_id, (ids, positions) in by_user.items():
+            if ids:
+                self.index.add(user_id, ids, vectors[positions])
+
+    @staticmethod
+    def _select_texts(conn: sqlite3.Connection, user_id: str, ids: list[int]) -> dict[int, tuple[str | None, str | None]]:
+        placeholders = ",".join("?" * len(ids))
+        rows = conn.execute(
+            f"SELECT id, input_text, output_text FROM messages WHERE user_id = ? AND id IN ({placeholders})",
+            (user_id, *ids),
+        ).fetchall()
+        return {row[0]: (row[1], row[2]) for row in rows}
+
+    async def search(self, user_id: str, query: str, k: int = 3) -> list[str]:
+        """
+        Найти прошлые взаимодействия пользователя, похожие на `query`.
+
+        Returns:
+            До `k` текстов вида «Пользователь: …\\nАссистент: …», самые похожие первыми
+        """
+        if not query or self.index.size(user_id) == 0:
+            return []
+        self.searches += 1
+        vector = (await self.embedder.embed([query]))[0]
+        hits = await asyncio.to_thread(self.index.search, user_id, vector, k)
+        hits = [(message_id, score) for message_id, score in hits if score >= self.min_score]
+        if not hits:
+            return []
+
+        texts = await self.memory.engine.read(self._select_texts, user_id, [i for i, _ in hits])
+        missing = [message_id for message_id, _ in hits if message_id not in texts]
+        if missing and self.memory.archive is not None:
+            # Старые сообщения уже перенесены в архив, а их векторы в индексе остались
+            archived = await asyncio.to_thread(self.memory.archive.lookup, user_id, missing)
+            texts.update(
+                (message_id, (record["input"], record["output"])) for message_id, record in archived.items()
+            )
+        return [
+            self.document(*texts[message_id]) for message_id, _ in hits if message_id in texts
+        ]
+
+    def stats(self) -> dict[str, float]:
+        return {"indexed": self.indexed, "searches": self.searches, "users": self.index.users()}
+
+
+def move_user_index(source_dir: str | Path, target_dir: str | Path, user_id: str, last_id: int) -> None:
+    """
+    Перенести семантический индекс пользователя между шардами (синхронно).
+
+    `source_dir`/`target_dir` — каталоги `index_dir` шардов; переносятся
+    векторы каждого найденного в них индекса (`<эмбеддер>-<размерность>`).
+    Id сообщений при переносе не меняются, поэтому векторы остаются
+    верными. Сообщения с id до `last_id`, которые индексатор источника ещё
+    не успел обработать, в цели лежат ниже её курсора — тогда курсор цели
+    отматывается к курсору источника, а уже проиндексированное при
+    повторном проходе пропускается без вызова эмбеддера.
+    """
+    source_dir, target_dir = Path(source_dir), Path(target_dir)
+    if not source_dir.is_dir():
+        return
+    for root in sorted(source_dir.iterdir()):
+        _, _, dim = root.name.rpartition("-")
+        if not root.is_dir() or not dim.isdigit():
+            continue
+        target = VectorIndex(target_dir / root.name, int(dim))
+        VectorIndex(root, int(dim)).move_user(user_id, target)
+        source_cursor = _read_cursor(root / "cursor")
+        target_cursor = _read_cursor(target.root / "cursor")
+        if source_cursor < last_id and source_cursor < target_cursor:
+            _write_cursor(target.root / "cursor", source_cursor)
@@ -0,0 +1,496 @@
+"""Шардирование хранилища по пользователям: консистентное хэширование, ShardedMemory, перенос."""
+
+import asyncio
+import bisect
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import sqlite3
+from collections.abc import AsyncIterator, Iterator
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Generic, TypeVar
+
+from core import metrics
+from core.archive import HistoryArchive
+from core.db import SQLiteEngine
+from core.memory import Memory
+from core.models import MessageIn, MessageOut, UserProfile
+
+if TYPE_CHECKING:
+    from core.archive import RetentionManager
+    from core.semantic import SemanticMemory
+
+logger = logging.getLogger("core.sharding")
+
+S = TypeVar("S")
+
+LAYOUT_FILE = "shards.json"
+LOCK_FILE = ".lock"
+# Каждый шард выдаёт id сообщений из своего блока: id уникальны во всём
+# каталоге шардов и не меняются при переносе пользователя
+ID_BLOCK = 1 << 40
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def parse_shards(spec: str) -> dict[str, float]:
+    """
+    Шарды из строки `CORE_SHARDS`: число ("4" → shard-0…shard-3) или
+    имена через запятую с необязательным весом ("a,b,c:2").
+    """
+    spec = spec.strip()
+    if spec.isdigit():
+        return {f"shard-{index}": 1.0 for index in range(int(spec))}
+    shards: dict[str, float] = {}
+    for item in spec.split(","):
+        name, _, weight = item.strip().partition(":")
+        if not name:
+            continue
+        if name in shards:
+            raise ValueError(f"Шард {name!r} указан дважды")
+        shards[name] = float(weight) if weight else 1.0
+    if not shards:
+        raise ValueError(f"Пустой список шардов: {spec!r}")
+    return shards
+
+
+class HashRing:
+    """
+    Кольцо консистентного хэширования: пользователь → шард.
+
+    Каждый шард занимает на кольце `vnodes × вес` точек; пользователь
+    принадлежит шарду первой точки по часовой стрелке от хэша своего id.
+    При добавлении шарда к нему переезжают только ~1/N пользователей,
+    остальные остаются на месте.
+    """
+
+    def __init__(self, shards: dict[str, float], vnodes: int = 256) -> None:
+        if not shards:
+            raise ValueError("Кольцо без шардов")
+        self.shards = dict(shards)
+        self.vnodes = vnodes
+        points = sorted(
+            (_hash(f"{name}#{index}"), name)
+            for name, weight in shards.items()
+            for index in range(max(1, round(vnodes * weight)))
+        )
+        self._points = [point for point, _ in points]
+        self._names = [name for _, name in points]
+
+    def shard_for(self, user_id: str) -> str:
+        index = bisect.bisect_right(self._points, _hash(user_id))
+        return self._names[index % len(self._names)]
+
+    def layout(self) -> dict[str, Any]:
+        return {"shards": self.shards, "vnodes": self.vnodes}
+
+
+def read_layout(root: Path) -> HashRing | None:
+    """Кольцо, с которым записаны шарды в каталоге `root` (None — каталог новый)."""
+    try:
+        data = json.loads((root / LAYOUT_FILE).read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return None
+    return HashRing({name: float(weight) for name, weight in data["shards"].items()}, int(data["vnodes"]))
+
+
+def write_layout(root: Path, ring: HashRing) -> None:
+    tmp = root / f"{LAYOUT_FILE}.tmp"
+    tmp.write_text(json.dumps(ring.layout(), ensure_ascii=False, indent=2), encoding="utf-8")
+    tmp.replace(root / LAYOUT_FILE)
+
+
+@contextlib.contextmanager
+def exclusive_layout(root: Path) -> Iterator[None]:
+    """Монопольный доступ к каталогу шардов: ни один процесс ядра не должен их держать."""
+    root.mkdir(parents=True, exist_ok=True)
+    with open(root / LOCK_FILE, "a") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise RuntimeError(f"Шарды в {root} открыты работающим ядром — остановите его") from None
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def open_shard(
+    root: Path,
+    name: str,
+    write_behind: bool = False,
+    archive_dir: Path | None = None,
+    id_block: int | None = None,
+) -> Memory:
+    """
+    `Memory` одного шарда: `<root>/<name>.db` и архив `<archive_dir>/<name>`.
+
+    `id_block` — блок id нового шарда: если шард ещё не выдал ни одного id,
+    его сообщения начнутся с `id_block * ID_BLOCK + 1`.
+    """
+    path = root / f"{name}.db"
+    memory = Memory(
+        str(path),
+        engine=SQLiteEngine(path, name=name),
+        write_behind=write_behind,
+        archive=HistoryArchive(archive_dir / name) if archive_dir is not None else None,
+    )
+    if id_block is not None:
+        memory.engine.write_sync(_reserve_ids, id_block * ID_BLOCK)
+    return memory
+
+
+def _message_seq(conn: sqlite3.Connection) -> int | None:
+    """Последний выданный шардом id сообщения (None — шард ещё не выдавал id)."""
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'messages'").fetchone()
+    return row[0] if row else None
+
+
+def _reserve_ids(conn: sqlite3.Connection, start: int) -> None:
+    if _message_seq(conn) is None:
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('messages', ?)", (start,))
+
+
+def _raise_seq(conn: sqlite3.Connection, value: int) -> None:
+    """Следующие id сообщений шарда — больше `value`."""
+    if _message_seq(conn) is None:
+        _reserve_ids(conn, value)
+    else:
+        conn.execute("UPDATE sqlite_sequence SET seq = max(seq, ?) WHERE name = 'messages'", (value,))
+
+
+class ShardedMemory:
+    """
+    Память, разложенная по нескольким файлам SQLite по пользователям.
+
+    Один файл БД сериализует записи всех пользователей на одной блокировке
+    и одном потоке-писателе. Здесь каждый шард — обычная `Memory` со своим
+    файлом `<root>/<имя>.db`, писателем, очередью write-behind и архивом;
+    пользователь закреплён за шардом кольцом `HashRing`. Интерфейс тот же,
+    что у `Memory`, так что `Agent` и HTTP-ручки не знают о шардах.
+
+    Раскладка (шарды, веса, число виртуальных узлов) сохраняется в
+    `<root>/shards.json`; ядро не стартует, если конфигурация с ней
+    расходится, — иначе часть пользователей «потеряла» бы историю. Смена
+    числа шардов — через `scripts/shard_rebalance.py` при остановленном
+    ядре (процессы ядра держат разделяемую блокировку `<root>/.lock`).
+
+    Id сообщений уникальны во всём каталоге: каждый шард выдаёт их из своего
+    блока в `ID_BLOCK` id (`shard-0` нового каталога — с `ID_BLOCK + 1`,
+    `shard-1` — с `2 × ID_BLOCK + 1`, …). Поэтому при переносе пользователь
+    сохраняет id истории, и клиент, синхронизирующийся по `after`, не видит
+    переноса.
+    """
+
+    def __init__(
+        self,
+        root: str | Path,
+        shards: dict[str, float],
+        write_behind: bool = False,
+        archive_dir: str | Path | None = None,
+        vnodes: int = 256,
+    ) -> None:
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.ring = HashRing(shards, vnodes)
+        self._lock = open(self.root / LOCK_FILE, "a")
+        fcntl.flock(self._lock, fcntl.LOCK_SH)
+        try:
+            saved = read_layout(self.root)
+            blocks: dict[str, int | None] = dict.fromkeys(self.ring.shards)
+            if saved is None:
+                write_layout(self.root, self.ring)
+                # Блоки новых шардов — по порядку; у шардов, уже выдававших id, не меняются
+                blocks = {name: index for index, name in enumerate(self.ring.shards, start=1)}
+            elif saved.layout() != self.ring.layout():
+                raise RuntimeError(
+                    f"Шарды в {self.root} записаны для {saved.layout()}, а настроено {self.ring.layout()}: "
+                    "перенесите пользователей scripts/shard_rebalance.py"
+                )
+            archive_root = Path(archive_dir) if archive_dir is not None else None
+            self.shards = {
+                name: open_shard(self.root, name, write_behind, archive_root, blocks[name])
+                for name in self.ring.shards
+            }
+        except BaseException:
+            self._lock.close()
+            raise
+        self.messages = dict.fromkeys(self.shards, 0)
+
+    def shard_name(self, user_id: str) -> str:
+        return self.ring.shard_for(user_id)
+
+    def for_user(self, user_id: str) -> Memory:
+        """Шард, в котором живут данные пользователя."""
+        return self.shards[self.ring.shard_for(user_id)]
+
+    async def flush(self) -> None:
+        await asyncio.gather(*(shard.flush() for shard in self.shards.values()))
+
+    async def aclose(self) -> None:
+        """Сбросить очереди записи, закрыть все шарды и снять блокировку каталога."""
+        await asyncio.gather(*(shard.aclose() for shard in self.shards.values()))
+        self._lock.close()
+
+    async def get_or_create_profile(self, user_id: str) -> UserProfile:
+        return await self.for_user(user_id).get_or_create_profile(user_id)
+
+    def invalidate_profile(self, user_id: str) -> None:
+        self.for_user(user_id).invalidate_profile(user_id)
+
+    async def update_profile(self, user_id: str, **kwargs: Any) -> None:
+        await self.for_user(user_id).update_profile(user_id, **kwargs)
+
+    async def save_interaction(self, msg_in: MessageIn, msg_out: MessageOut) -> None:
+        name = self.ring.shard_for(msg_in.user_id)
+        await self.shards[name].save_interaction(msg_in, msg_out)
+        self.messages[name] += 1
+        metrics.SHARD_MESSAGES.inc(name)
+
+    async def get_summary(self, user_id: str) -> tuple[str, int] | None:
+        return await self.for_user(user_id).get_summary(user_id)
+
+    async def save_summary(self, user_id: str, summary: str, upto_id: int) -> None:
+        await self.for_user(user_id).save_summary(user_id, summary, upto_id)
+
+    async def get_recent_history(self, user_id: str, limit: int = 10) -> list[tuple[MessageIn, MessageOut]]:
+        return await self.for_user(user_id).get_recent_history(user_id, limit)
+
+    def iter_history(self, user_id: str, **kwargs: Any) -> AsyncIterator[dict[str, Any]]:
+        return self.for_user(user_id).iter_history(user_id, **kwargs)
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        return {
+            name: {"messages": self.messages[name], "writes": shard.engine.writes}
+            for name, shard in self.shards.items()
+        }
+
+
+class ShardedService(Generic[S]):
+    """Фоновый компонент (индексатор, сжатие, архив) — по экземпляру на шард."""
+
+    def __init__(self, memory: ShardedMemory, parts: dict[str, S]) -> None:
+        self.memory = memory
+        self.parts = parts
+
+    def for_user(self, user_id: str) -> S:
+        return self.parts[self.memory.shard_name(user_id)]
+
+    async def stop(self) -> None:
+        await asyncio.gather(*(part.stop() for part in self.parts.values()))  # type: ignore[attr-defined]
+
+    def stats(self) -> dict[str, float]:
+        """Сумма числовых `stats()` всех шардов."""
+        total: dict[str, float] = {}
+        for part in self.parts.values():
+            for key, value in part.stats().items():  # type: ignore[attr-defined]
+                if isinstance(value, (int, float)):
+                    total[key] = total.get(key, 0) + value
+        return total
+
+
+class ShardedSemantic(ShardedService["SemanticMemory"]):
+    """
+    Семантическая память по шардам: индекс каждого шарда строится из его БД.
+
+    При переносе пользователя его векторы переезжают в индекс нового шарда
+    вместе с историей (`rebalance(..., semantic_dir=...)`): id сообщений не
+    меняются, так что заново считать эмбеддинги не нужно.
+    """
+
+    def notify(self) -> None:
+        for part in self.parts.values():
+            part.notify()
+
+    def document(self, input_text: str | None, output_text: str | None) -> str:
+        return next(iter(self.parts.values())).document(input_text, output_text)
+
+    async def search(self, user_id: str, query: str, k: int = 3) -> list[str]:
+        return await self.for_user(user_id).search(user_id, query, k)
+
+
+class ShardedRetention(ShardedService["RetentionManager"]):
+    """Перенос старой истории в архив по шардам (у каждого шарда свой архив)."""
+
+    @property
+    def archived_messages(self) -> int:
+        return sum(part.archived_messages for part in self.parts.values())
+
+    async def run_once(self) -> int:
+        return sum([await part.run_once() for part in self.parts.values()])
+
+
+# Строки таблицы вместе с именами колонок: перенос не зависит от версии схемы
+Rows = tuple[list[str], list[tuple[Any, ...]]]
+
+
+def _select_user_rows(conn: sqlite3.Connection, table: str, user_id: str) -> Rows:
+    cursor = conn.execute(f"SELECT * FROM {table} WHERE user_id = ?", (user_id,))
+    return [column[0] for column in cursor.description], cursor.fetchall()
+
+
+def _insert_rows(conn: sqlite3.Connection, table: str, columns: list[str], rows: list[tuple[Any, ...]]) -> None:
+    conn.executemany(
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", rows
+    )
+
+
+def _delete_user(conn: sqlite3.Connection, user_id: str) -> None:
+    for table in ("messages", "summaries", "profiles"):
+        conn.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+
+
+def _users(conn: sqlite3.Connection) -> list[str]:
+    return [
+        row[0] for row in conn.execute(
+            "SELECT user_id FROM profiles UNION SELECT user_id FROM messages UNION SELECT user_id FROM summaries"
+        )
+    ]
+
+
+def _copy_user(
+    conn: sqlite3.Connection, user_id: str, profiles: Rows, messages: Rows, summaries: Rows, floor_id: int
+) -> int:
+    """Записать данные пользователя в целевой шард одной транзакцией; вернуть число сообщений."""
+    # Остатки прерванного прошлого переноса: источник всё ещё полон
+    _delete_user(conn, user_id)
+    _insert_rows(conn, "messages", *messages)
+    _insert_rows(conn, "profiles", *profiles)
+    _insert_rows(conn, "summaries", *summaries)
+    # Новые сообщения пользователя — после всех прежних, в том числе архивных
+    _raise_seq(conn, floor_id)
+    return len(messages[1])
+
+
+async def move_user(
+    source: Memory, target: Memory, user_id: str, semantic_dirs: tuple[Path, Path] | None = None
+) -> int:
+    """
+    Перенести пользователя между шардами: профиль, сводку, историю и архив.
+
+    Сообщения сохраняют свои id (они уникальны во всём каталоге шардов,
+    см. `ID_BLOCK`), так что граница сводки, архив и курсор `after`
+    клиентов остаются верными; новые сообщения пользователя в цели получат
+    id больше всех прежних. `semantic_dirs` — каталоги семантического
+    индекса источника и цели: векторы пользователя переезжают вместе с ним.
+    Порядок: копия в цель (одна транзакция, сначала стирает остатки
+    прерванной попытки) → перенос каталога архива и векторов → удаление из
+    источника. Повторный запуск после сбоя безопасен. Возвращает число
+    перенесённых сообщений из БД.
+    """
+    profiles = await source.engine.read(_select_user_rows, "profiles", user_id)
+    messages = await source.engine.read(_select_user_rows, "messages", user_id)
+    summaries = await source.engine.read(_select_user_rows, "summaries", user_id)
+    id_index = messages[0].index("id")
+    floor_id = max((row[id_index] for row in messages[1]), default=0)
+    if source.archive is not None:
+        floor_id = max(floor_id, await asyncio.to_thread(source.archive.last_id, user_id))
+
+    try:
+        moved = await target.engine.write(_copy_user, user_id, profiles, messages, summaries, floor_id)
+    except sqlite3.IntegrityError as exc:
+        raise RuntimeError(
+            f"Id сообщений пользователя {user_id} уже заняты в целевом шарде: "
+            "шарды выдают id из пересекающихся блоков"
+        ) from exc
+    if source.archive is not None and target.archive is not None:
+        await asyncio.to_thread(source.archive.move_user, user_id, target.archive)
+    if semantic_dirs is not None:
+        from core.semantic import move_user_index
+
+        await asyncio.to_thread(move_user_index, *semantic_dirs, user_id, floor_id)
+    await source.engine.write(_delete_user, user_id)
+    source.invalidate_profile(user_id)
+    return moved
+
+
+async def _assign_id_blocks(opened: dict[str, Memory], live: list[str]) -> None:
+    """
+    Дать каждому шарду раскладки собственный блок id.
+
+    Приняв пользователя из шарда с блоком старше своего, шард продолжает
+    выдавать id в чужом блоке (AUTOINCREMENT идёт от наибольшего id) — такой
+    шард, как и новый, переводится на свежий блок, старше всех занятых.
+    """
+    seqs = {name: await memory.engine.read(_message_seq) for name, memory in opened.items()}
+    next_block = max((seq // ID_BLOCK for seq in seqs.values() if seq is not None), default=0) + 1
+    owned: set[int] = set()
+    for name in live:
+        seq = seqs[name]
+        if seq is not None and seq // ID_BLOCK not in owned:
+            owned.add(seq // ID_BLOCK)
+            continue
+        await opened[name].engine.write(_raise_seq, next_block * ID_BLOCK)
+        owned.add(next_block)
+        next_block += 1
+
+
+async def rebalance(
+    root: str | Path,
+    shards: dict[str, float],
+    archive_dir: str | Path | None = None,
+    vnodes: int = 256,
+    dry_run: bool = False,
+    semantic_dir: str | Path | None = None,
+) -> dict[str, Any]:
+    """
+    Перевести каталог шардов на новую раскладку, перенеся пользователей.
+
+    Пользователи, которых новое кольцо оставляет на месте, не трогаются;
+    при добавлении шарда переезжает ~1/N. Шарды, исключённые из раскладки,
+    опустошаются, их файлы остаются (в отчёте — `retired`). Новая раскладка
+    записывается в `shards.json` в конце; прерванный перенос можно
+    запустить заново с теми же аргументами. `semantic_dir` — корень
+    семантических индексов шардов (`SEMANTIC_INDEX_DIR`): векторы
+    переносятся вместе с пользователями.
+    """
+    root = Path(root)
+    archive_root = Path(archive_dir) if archive_dir is not None else None
+    semantic_root = Path(semantic_dir) if semantic_dir is not None else None
+    new_ring = HashRing(shards, vnodes)
+    with exclusive_layout(root):
+        old_ring = read_layout(root)
+        names = dict.fromkeys([*(old_ring.shards if old_ring else ()), *new_ring.shards])
+        opened = {
+            name: await asyncio.to_thread(open_shard, root, name, False, archive_root)
+            for name in names
+            # Пробный прогон не создаёт файлы новых шардов
+            if not dry_run or (root / f"{name}.db").exists()
+        }
+        plan: dict[tuple[str, str], list[str]] = {}
+        try:
+            # Сканируются все шарды, а не только старые: так прерванный перенос продолжается
+            for name, memory in opened.items():
+                users = set(await memory.engine.read(_users))
+                if memory.archive is not None:
+                    users.update(await asyncio.to_thread(memory.archive.users))
+                for user_id in sorted(users):
+                    target = new_ring.shard_for(user_id)
+                    if target != name:
+                        plan.setdefault((name, target), []).append(user_id)
+
+            moved_users = moved_messages = 0
+            if not dry_run:
+                for (source, target), users in plan.items():
+                    dirs = (semantic_root / source, semantic_root / target) if semantic_root is not None else None
+                    for user_id in users:
+                        moved_messages += await move_user(opened[source], opened[target], user_id, dirs)
+                        moved_users += 1
+                    logger.info("%s → %s: перенесено %d пользователей", source, target, len(users))
+                await _assign_id_blocks(opened, list(new_ring.shards))
+                write_layout(root, new_ring)
+        finally:
+            for memory in opened.values():
+                await memory.aclose()
+
+    return {
+        "moves": {f"{source}->{target}": len(users) for (source, target), users in plan.items()},
+        "users": sum(len(users) for users in plan.values()),
+        "moved_users": moved_users,
+        "moved_messages": moved_messages,
+        "retired": [name for name in names if name not in new_ring.shards],
+    }
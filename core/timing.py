@@ -0,0 +1,32 @@
+"""Замер длительности этапов обработки запроса."""
+
+import contextlib
+import time
+from collections.abc import Iterator
+
+
+class StageTimer:
+    """
+    Накопитель длительностей этапов одного запроса (в миллисекундах).
+
+    Этапы могут выполняться параллельно: каждый замеряется независимо,
+    а `total` показывает реальное время от создания таймера.
+    """
+
+    def __init__(self) -> None:
+        self._started = time.perf_counter()
+        self.stages: dict[str, float] = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = (time.perf_counter() - started) * 1000
+
+    def total(self) -> float:
+        return (time.perf_counter() - self._started) * 1000
+
+    def as_dict(self) -> dict[str, float]:
+        return {**{k: round(v, 2) for k, v in self.stages.items()}, "total": round(self.total(), 2)}
@@ -1,156 +1,310 @@
-"""Инструменты агента: веб-поиск, анализ файлов, мультимодальность."""
-
-import os
+"""Инструменты агента: базовый интерфейс, ленивая регистрация и движок `ToolRouter`.
+
+Сами инструменты живут в своих модулях (`core.search`, `core.media_tools`)
+и импортируются при первом использовании, см. `LazyTool`.
+"""
+
+import asyncio
+import contextlib
+import importlib
+import logging
+import re
+import time
 from abc import ABC, abstractmethod
+from collections.abc import AsyncIterator
 from typing import Any
 
-import httpx
+from core.metrics import TOOL_SECONDS
+from core.offload import ProcessOffload
+
+logger = logging.getLogger("core.tools")
 
 
 class Tool(ABC):
-    """Базовый интерфейс инструмента."""
+    """
+    Базовый интерфейс инструмента.
+
+    Инструмент сам объявляет, когда он нужен: `keywords` — подстроки текста
+    (без учёта регистра), `media_types` — типы вложений. `ToolRouter`
+    компилирует их один раз при регистрации.
+    """
+
+    keywords: tuple[str, ...] = ()
+    media_types: tuple[str, ...] = ()
+    # Сколько секунд ждать инструмент, прежде чем продолжить без него
+    timeout: float = 5.0
 
     @abstractmethod
     def name(self) -> str:
         """Имя инструмента."""
 
+    def build_input(self, context: dict[str, Any]) -> dict[str, Any]:
+        """Подготовить входные данные из контекста запроса (контекст не изменяется)."""
+        return dict(context.get("media_data") or {})
+
     @abstractmethod
     async def execute(self, input_data: dict[str, Any]) -> str:
         """Выполнить инструмент и вернуть результат."""
 
+    async def stream(self, input_data: dict[str, Any]) -> AsyncIterator[str]:
+        """
+        Выполнить инструмент, отдавая результат частями.
 
-class WebSearchTool(Tool):
-    """Веб-поиск через бесплатные API (DuckDuckGo)."""
+        По умолчанию — одна часть из `execute`. Инструменты с долгой
+        обработкой отдают части по мере готовности: если инструмент не
+        уложится в `timeout`, в контекст попадёт уже полученное.
+        """
+        yield await self.execute(input_data)
+
+    async def aclose(self) -> None:
+        """Освободить ресурсы инструмента (HTTP-клиенты и т.п.)."""
+
+
+class LazyTool(Tool):
+    """
+    Инструмент, модуль которого импортируется при первом использовании.
+
+    Для выбора инструмента `ToolRouter` нужны только имя, `keywords` и
+    `media_types` — они объявлены здесь. Модуль с реализацией (и его
+    зависимости: HTTP-клиент поиска, разбор PDF) импортируется, а
+    инструмент создаётся, когда он впервые выбран для запроса; воркер,
+    которому инструмент не понадобился, не платит за него ни при старте,
+    ни памятью.
+
+    Args:
+        name: Имя инструмента (совпадает с `name()` реализации)
+        target: Класс реализации в виде "модуль:Класс"
+        keywords, media_types, timeout: Как у реализации
+        **kwargs: Аргументы конструктора реализации
+    """
+
+    def __init__(
+        self,
+        name: str,
+        target: str,
+        keywords: tuple[str, ...] = (),
+        media_types: tuple[str, ...] = (),
+        timeout: float = Tool.timeout,
+        **kwargs: Any,
+    ) -> None:
+        self._name = name
+        self.target = target
+        self.keywords = keywords
+        self.media_types = media_types
+        self.timeout = timeout
+        self.kwargs = kwargs
+        self._tool: Tool | None = None
 
     def name(self) -> str:
-        return "web_search"
+        return self._name
+
+    @property
+    def loaded(self) -> bool:
+        return self._tool is not None
+
+    def load(self) -> Tool:
+        """Импортировать модуль и создать инструмент (один раз)."""
+        if self._tool is None:
+            module_name, _, class_name = self.target.partition(":")
+            tool = getattr(importlib.import_module(module_name), class_name)(**self.kwargs)
+            if (tool.name(), tool.keywords, tool.media_types) != (self._name, self.keywords, self.media_types):
+                logger.warning("Объявление ленивого инструмента %s расходится с %s", self._name, self.target)
+            self.timeout = tool.timeout
+            self._tool = tool
+        return self._tool
+
+    def build_input(self, context: dict[str, Any]) -> dict[str, Any]:
+        return self.load().build_input(context)
 
     async def execute(self, input_data: dict[str, Any]) -> str:
-        """Поиск в интернете через DuckDuckGo."""
-        query = input_data.get("query", "")
-        if not query:
-            return "Ошибка: не указан поисковый запрос."
-
-        try:
-            url = "https://api.duckduckgo.com/"
-            params = {
-                "q": query,
-                "format": "json",
-                "no_html": "1",
-                "skip_disambig": "1",
-            }
-
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                resp = await client.get(url, params=params)
-                resp.raise_for_status()
-                data = resp.json()
-
-                abstract = data.get("AbstractText", "")
-                if abstract:
-                    return f"Результат поиска по запросу '{query}':\n\n{abstract}"
-
-                related = data.get("RelatedTopics", [])
-                if related:
-                    first_result = related[0].get("Text", "")
-                    if first_result:
-                        return f"Результат поиска по запросу '{query}':\n\n{first_result}"
-
-                return f"По запросу '{query}' ничего не найдено."
-
-        except httpx.HTTPError as e:
-            return f"Ошибка при поиске: {e}"
-        except Exception as e:
-            return f"Неожиданная ошибка при поиске: {e}"
+        return await self.load().execute(input_data)
+
+    async def stream(self, input_data: dict[str, Any]) -> AsyncIterator[str]:
+        async with contextlib.aclosing(self.load().stream(input_data)) as stream:
+            async for part in stream:
+                yield part
+
+    async def aclose(self) -> None:
+        if self._tool is not None:
+            await self._tool.aclose()
+
+
+def default_tools(offload: ProcessOffload | None = None) -> list[Tool]:
+    """Встроенные инструменты ядра (лениво импортируемые)."""
+    return [
+        LazyTool(
+            "web_search",
+            "core.search:WebSearchTool",
+            keywords=("найди", "поиск", "найти", "search", "find"),
+        ),
+        LazyTool(
+            "file_analysis",
+            "core.media_tools:FileAnalysisTool",
+            media_types=("file", "document"),
+            timeout=2.5,
+            offload=offload,
+        ),
+        LazyTool(
+            "media_analysis",
+            "core.media_tools:MediaAnalysisTool",
+            media_types=("image", "video", "voice"),
+        ),
+    ]
+
+
+# Прежние имена `core.tools.<Инструмент>` — без импорта модулей инструментов заранее
+_MOVED_TOOLS = {
+    "WebSearchTool": "core.search",
+    "FileAnalysisTool": "core.media_tools",
+    "MediaAnalysisTool": "core.media_tools",
+}
+
+
+def __getattr__(name: str) -> Any:
+    if name in _MOVED_TOOLS:
+        return getattr(importlib.import_module(_MOVED_TOOLS[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
-class FileAnalysisTool(Tool):
-    """Базовый анализ файлов (пока заглушка, позже добавим реальную обработку)."""
-
-    def name(self) -> str:
-        return "file_analysis"
-
-    async def execute(self, input_data: dict[str, Any]) -> str:
-        """Анализ файла по метаданным."""
-        file_name = input_data.get("file_name", "неизвестный файл")
-        mime_type = input_data.get("mime_type", "")
-        file_size = input_data.get("file_size", 0)
-
-        size_mb = file_size / (1024 * 1024) if file_size else 0
-        return (
-            f"Файл получен:\n"
-            f"• Имя: {file_name}\n"
-            f"• Тип: {mime_type}\n"
-            f"• Размер: {size_mb:.2f} MB\n\n"
-            f"Полный анализ файлов будет добавлен позже (PDF, таблицы, документы)."
+class ToolRouter:
+    """
+    Движок инструментов: выбирает все подходящие инструменты и запускает их параллельно.
+
+    Ключевые слова всех инструментов собираются в одно регулярное выражение,
+    поэтому выбор стоит один проход по тексту независимо от числа инструментов.
+    Каждый инструмент выполняется со своим таймаутом; не уложившийся отменяется,
+    и в контекст попадают только части, которые он успел отдать (`Tool.stream`).
+    Результаты склеиваются в пределах `budget_chars` символов, чтобы
+    инструменты не раздували промпт. CPU-тяжёлую работу инструменты отдают
+    общему пулу процессов `offload`. Встроенные инструменты (`default_tools`)
+    регистрируются лениво: их модули импортируются при первом выборе.
+    """
+
+    def __init__(
+        self,
+        tools: list[Tool] | None = None,
+        budget_chars: int = 2000,
+        offload: ProcessOffload | None = None,
+    ) -> None:
+        # Процессы пула запускаются только при первой тяжёлой задаче
+        self.offload = offload or ProcessOffload()
+        if tools is None:
+            tools = default_tools(self.offload)
+        self.budget_chars = budget_chars
+        self.tools: dict[str, Tool] = {}
+        for tool in tools:
+            self.tools[tool.name()] = tool
+        self._compile()
+
+    def register(self, tool: Tool) -> None:
+        """Добавить инструмент и пересобрать матчер."""
+        self.tools[tool.name()] = tool
+        self._compile()
+
+    def _compile(self) -> None:
+        self._by_keyword: dict[str, list[Tool]] = {}
+        self._by_media: dict[str, list[Tool]] = {}
+        for tool in self.tools.values():
+            for keyword in tool.keywords:
+                self._by_keyword.setdefault(keyword.lower(), []).append(tool)
+            for media_type in tool.media_types:
+                self._by_media.setdefault(media_type, []).append(tool)
+
+        # Длинные ключевые слова раньше коротких, чтобы «найти» не съедалось «най…»
+        keywords = sorted(self._by_keyword, key=len, reverse=True)
+        self._matcher = (
+            re.compile("|".join(map(re.escape, keywords)), re.IGNORECASE) if keywords else None
         )
 
+    async def aclose(self) -> None:
+        """Закрыть ресурсы всех инструментов и пул процессов."""
+        for tool in self.tools.values():
+            await tool.aclose()
+        await self.offload.aclose()
 
-class MediaAnalysisTool(Tool):
-    """Анализ медиа (изображения, видео) через локальные модели или API."""
-
-    def name(self) -> str:
-        return "media_analysis"
-
-    async def execute(self, input_data: dict[str, Any]) -> str:
-        """Анализ медиа-файла."""
-        media_type = input_data.get("media_type", "")
-        file_id = input_data.get("file_id", "")
-
-        if media_type == "image":
-            return (
-                f"Изображение получено (ID: {file_id}).\n"
-                f"Анализ изображений через vision-модели будет добавлен позже."
-            )
-        elif media_type == "video":
-            duration = input_data.get("duration", 0)
-            return (
-                f"Видео получено (ID: {file_id}, длительность: {duration} сек).\n"
-                f"Анализ видео будет добавлен позже."
-            )
-        elif media_type == "voice":
-            duration = input_data.get("duration", 0)
-            return (
-                f"Голосовое сообщение получено (ID: {file_id}, длительность: {duration} сек).\n"
-                f"Распознавание речи будет добавлено позже."
-            )
-
-        return f"Медиа-файл получен, но тип '{media_type}' не поддерживается."
+    def select(self, context: dict[str, Any]) -> list[Tool]:
+        """Инструменты, применимые к запросу, в порядке регистрации."""
+        selected: dict[str, Tool] = {}
 
+        text = context.get("text") or ""
+        if text and self._matcher is not None:
+            for match in self._matcher.finditer(text):
+                for tool in self._by_keyword[match.group(0).lower()]:
+                    selected[tool.name()] = tool
 
-class ToolRouter:
-    """Маршрутизатор инструментов: выбирает нужный инструмент по контексту."""
+        media_type = context.get("media_type")
+        if media_type:
+            for tool in self._by_media.get(media_type, ()):
+                selected[tool.name()] = tool
 
-    def __init__(self) -> None:
-        self.tools: dict[str, Tool] = {
-            "web_search": WebSearchTool(),
-            "file_analysis": FileAnalysisTool(),
-            "media_analysis": MediaAnalysisTool(),
-        }
+        return [tool for name, tool in self.tools.items() if name in selected]
 
-    async def route(self, context: dict[str, Any]) -> str:
+    async def route(self, context: dict[str, Any], timeout: float | None = None) -> str:
         """
-        Выбрать и выполнить подходящий инструмент.
+        Выбрать и выполнить подходящие инструменты.
 
         Args:
             context: Контекст запроса (тип сообщения, данные и т.д.)
+            timeout: Общий бюджет этапа: таймаут каждого инструмента не больше
+                него, так что частичные результаты собираются до дедлайна агента
 
         Returns:
-            Результат выполнения инструмента
+            Объединённый результат инструментов (пустая строка, если их нет)
         """
-        # Если есть явный запрос на поиск
-        text = context.get("text", "").lower()
-        if any(keyword in text for keyword in ["найди", "поиск", "найти", "search", "find"]):
-            return await self.tools["web_search"].execute({"query": context.get("text", "")})
-
-        # Если есть медиа
-        if context.get("media_type"):
-            media_data = context.get("media_data", {})
-            media_data["media_type"] = context.get("media_type")
-            return await self.tools["media_analysis"].execute(media_data)
-
-        # Если есть файл
-        if context.get("media_type") == "file":
-            return await self.tools["file_analysis"].execute(context.get("media_data", {}))
-
-        # По умолчанию ничего не делаем
+        tools = self.select(context)
+        if not tools:
+            return ""
+
+        results = await asyncio.gather(*(self._run(tool, context, timeout) for tool in tools))
+        return self._merge([(tool.name(), result) for tool, result in zip(tools, results)])
+
+    async def _run(self, tool: Tool, context: dict[str, Any], budget: float | None = None) -> str:
+        started = time.perf_counter()
+        outcome = "error"
+        parts: list[str] = []
+        timeout = tool.timeout if budget is None else min(tool.timeout, budget)
+        try:
+            async with asyncio.timeout(timeout):
+                async with contextlib.aclosing(tool.stream(tool.build_input(context))) as stream:
+                    async for part in stream:
+                        parts.append(part)
+            result = "".join(parts)
+            outcome = "ok" if result else "empty"
+            return result
+        except TimeoutError:
+            # Части, полученные до таймаута, всё равно полезны
+            outcome = "partial" if parts else "timeout"
+            logger.warning("Инструмент %s не уложился в %.1f с", tool.name(), timeout)
+            return "".join(parts)
+        except Exception:  # noqa: BLE001
+            logger.exception("Инструмент %s завершился ошибкой", tool.name())
+        finally:
+            TOOL_SECONDS.observe(time.perf_counter() - started, tool.name(), outcome)
         return ""
+
+    def _merge(self, results: list[tuple[str, str]]) -> str:
+        results = [(name, text) for name, text in results if text]
+        if not results:
+            return ""
+        if len(results) == 1:
+            return self._truncate(results[0][1], self.budget_chars)
+
+        # Делим бюджет поровну; что не потратили короткие результаты, достаётся длинным
+        limits: dict[str, int] = {}
+        budget = self.budget_chars
+        remaining = sorted(results, key=lambda item: len(item[1]))
+        while remaining:
+            share = budget // len(remaining)
+            name, text = remaining.pop(0)
+            limits[name] = min(len(text), share)
+            budget -= limits[name]
+
+        return "\n\n".join(
+            f"[{name}] {self._truncate(text, limits[name])}" for name, text in results
+        )
+
+    @staticmethod
+    def _truncate(text: str, limit: int) -> str:
+        if len(text) <= limit:
+            return text
+        return text[: max(0, limit - 1)] + "…"
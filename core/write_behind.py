@@ -0,0 +1,239 @@
+"""Отложенная пакетная запись истории диалогов (write-behind)."""
+
+import asyncio
+import logging
+import sqlite3
+import threading
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from typing import Any
+
+from core.db import SQLiteEngine
+
+logger = logging.getLogger("core.write_behind")
+
+INSERT_MESSAGE_SQL = """
+    INSERT INTO messages (user_id, channel, message_type, input_text, output_text, input_media, output_media)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Строка таблицы messages в порядке колонок INSERT_MESSAGE_SQL
+Row = tuple[Any, ...]
+
+
+@dataclass
+class _Pending:
+    """Строка в очереди записи; `id` известен, когда строка вставлена в ещё не зафиксированную транзакцию."""
+
+    row: Row
+    id: int | None = None
+
+
+class InteractionLogger:
+    """
+    Очередь взаимодействий, сбрасываемая в БД пакетами.
+
+    Строки копятся в ограниченной очереди и пишутся одним `executemany`
+    в одной транзакции, когда набирается `batch_size` строк или проходит
+    `flush_interval` секунд с первой строки пакета. Если очередь заполнена,
+    `enqueue` ждёт (backpressure), а не растит память без ограничений.
+
+    Пока строка не зафиксирована в БД, она лежит в `_pending` и видна
+    через `read_consistent` — так `get_recent_history` сразу видит
+    только что сохранённые сообщения.
+
+    Если запись пакета не удалась (SQLITE_BUSY, нет места на диске), пакет
+    остаётся в `_pending` и повторяется с нарастающей паузой до
+    `max_retry_delay`; очередь тем временем заполняется, и `enqueue`
+    притормаживает отправителей. Отбрасываются строки только при остановке,
+    если БД так и не приняла их за `shutdown_retries` попыток.
+    """
+
+    def __init__(
+        self,
+        engine: SQLiteEngine,
+        max_queue: int = 1000,
+        batch_size: int = 64,
+        flush_interval: float = 0.5,
+        retry_delay: float = 0.1,
+        max_retry_delay: float = 5.0,
+        shutdown_retries: int = 3,
+    ) -> None:
+        self.engine = engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.shutdown_retries = shutdown_retries
+        self._queue: asyncio.Queue[_Pending] = asyncio.Queue(maxsize=max_queue)
+        self._pending: dict[str, deque[_Pending]] = defaultdict(deque)
+        # Защищает _pending и снимок чтения в read_consistent; коммит идёт без неё
+        self._lock = threading.Lock()
+        self._task: asyncio.Task[None] | None = None
+        # Пакет, который фоновая задача собирает или пишет прямо сейчас
+        self._collecting: list[_Pending] = []
+        self.flushed_rows = 0
+        self.flushed_batches = 0
+        self.failed_batches = 0
+        self.dropped_rows = 0
+
+    def start(self) -> None:
+        """Запустить фоновый сброс очереди (нужен работающий event loop)."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Остановить фоновый сброс и записать всё, что осталось в очереди."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        # Недописанный пакет фоновой задачи (в том числе ждущий повтора) — первым
+        batch, self._collecting = self._collecting, []
+        while not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+            if len(batch) >= self.batch_size:
+                await self._flush_with_retry(batch, self.shutdown_retries)
+                batch = []
+        if batch:
+            await self._flush_with_retry(batch, self.shutdown_retries)
+
+    async def enqueue(self, row: Row) -> None:
+        """Поставить строку в очередь; ждёт, если очередь заполнена."""
+        self.start()
+        entry = _Pending(row)
+        with self._lock:
+            self._pending[row[0]].append(entry)
+        try:
+            await self._queue.put(entry)
+        except asyncio.CancelledError:
+            with self._lock:
+                self._pending[row[0]].remove(entry)
+                if not self._pending[row[0]]:
+                    del self._pending[row[0]]
+            raise
+
+    @property
+    def queue_size(self) -> int:
+        return self._queue.qsize()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = self._collecting = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                # asyncio.timeout, а не wait_for: в 3.11 wait_for может проглотить
+                # отмену задачи, и stop() зависнет в ожидании фоновой задачи
+                try:
+                    async with asyncio.timeout(timeout):
+                        batch.append(await self._queue.get())
+                except TimeoutError:
+                    break
+            await self._flush_with_retry(batch)
+            self._collecting = []
+
+    async def _flush_with_retry(self, batch: list[_Pending], attempts: int | None = None) -> None:
+        """Записывать пакет, пока не получится (`attempts` — предел попыток при остановке)."""
+        delay = self.retry_delay
+        attempt = 1
+        while not await self._flush(batch):
+            if attempts is not None and attempt >= attempts:
+                logger.error(
+                    "Остановка: %d взаимодействий не записаны за %d попыток и потеряны", len(batch), attempt
+                )
+                self.dropped_rows += len(batch)
+                self._forget(batch)
+                return
+            # Отмена во время паузы оставляет пакет в _collecting — его допишет stop()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_retry_delay)
+            attempt += 1
+
+    async def _flush(self, batch: list[_Pending]) -> bool:
+        """Одна попытка записать пакет; False — пакет остался в очереди для повтора."""
+        if not batch:
+            return True
+        write = asyncio.ensure_future(self.engine.write(self._write_batch, batch))
+        try:
+            await asyncio.shield(write)
+        except asyncio.CancelledError:
+            # Пакет уже у потока-писателя: дожидаемся исхода, чтобы stop() не записал его второй раз
+            try:
+                await write
+            except Exception:  # noqa: BLE001
+                pass
+            else:
+                batch.clear()
+            raise
+        except Exception:  # noqa: BLE001
+            self.failed_batches += 1
+            logger.exception("Не удалось записать пакет из %d взаимодействий — повторим", len(batch))
+            return False
+        self.flushed_rows += len(batch)
+        self.flushed_batches += 1
+        return True
+
+    def _write_batch(self, conn: sqlite3.Connection, batch: list[_Pending]) -> None:
+        conn.executemany(INSERT_MESSAGE_SQL, [entry.row for entry in batch])
+        # Один писатель и AUTOINCREMENT: строки пакета получили подряд идущие id
+        last = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        with self._lock:
+            for offset, entry in enumerate(batch):
+                entry.id = last - len(batch) + 1 + offset
+        # Коммит без блокировки: контрольная точка WAL может занять время, а
+        # enqueue и read_consistent берут блокировку из event loop. Читатель,
+        # попавший между коммитом и _forget, видит строку и в БД, и в очереди —
+        # read_consistent отбрасывает такие дубли по id.
+        try:
+            conn.commit()
+        except BaseException:
+            with self._lock:
+                for entry in batch:
+                    entry.id = None
+            raise
+        self._forget(batch)
+
+    def _forget(self, batch: list[_Pending]) -> None:
+        with self._lock:
+            # Очередь FIFO, поэтому строки пакета — самые старые в _pending своего пользователя
+            for entry in batch:
+                user_pending = self._pending.get(entry.row[0])
+                if user_pending:
+                    user_pending.popleft()
+                    if not user_pending:
+                        del self._pending[entry.row[0]]
+
+    def read_consistent(
+        self, conn: sqlite3.Connection, user_id: str, sql: str, params: tuple[Any, ...]
+    ) -> tuple[list[Row], list[Row]]:
+        """
+        Выполнить запрос и получить согласованный с ним срез очереди.
+
+        Снимок чтения WAL фиксируется первым SELECT внутри транзакции,
+        поэтому под блокировкой открываем транзакцию и копируем `_pending`,
+        а сам (возможно, долгий) запрос выполняем уже без блокировки.
+        Первая колонка `sql` — `id` сообщения: строки очереди, которые
+        снимок уже видит в БД (коммит прошёл, `_forget` ещё нет), в срез
+        очереди не попадают.
+        """
+        conn.execute("BEGIN")
+        try:
+            with self._lock:
+                conn.execute("SELECT 1 FROM messages LIMIT 1").fetchall()
+                pending = [(entry.id, entry.row) for entry in self._pending.get(user_id, ())]
+            rows = conn.execute(sql, params).fetchall()
+        finally:
+            conn.execute("COMMIT")
+        seen = {row[0] for row in rows}
+        return rows, [row for message_id, row in pending if message_id is None or message_id not in seen]
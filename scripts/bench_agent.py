@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Бенчмарк `Agent.process`: разбивка по этапам и выигрыш от параллельных этапов.
+
+LLM и инструмент заменены имитациями с заданными задержками, память —
+настоящая `Memory` во временной БД, чтения которой можно искусственно
+замедлить (`--memory-delay`). Для каждого сообщения сравнивается сумма
+длительностей этапов подготовки (столько заняло бы последовательное
+выполнение) с фактическим временем подготовки.
+
+Запуск из корня репозитория:
+
+    python scripts/bench_agent.py --messages 20 --tool-delay 0.3 --llm-delay 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core.agent import Agent  # noqa: E402
+from core.llm_client import LLMClient  # noqa: E402
+from core.memory import Memory  # noqa: E402
+from core.models import MessageIn  # noqa: E402
+
+
+class FakeLLM(LLMClient):
+    def __init__(self, delay: float) -> None:
+        super().__init__()
+        self.delay = delay
+
+    async def generate(self, prompt: str, *args: Any, **kwargs: Any) -> str:
+        await asyncio.sleep(self.delay)
+        return f"ответ на: {prompt[:20]}"
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--tool-delay", type=float, default=0.3, help="задержка инструмента, с")
+    parser.add_argument("--llm-delay", type=float, default=0.2, help="задержка LLM, с")
+    parser.add_argument(
+        "--memory-delay", type=float, default=0.05, help="доп. задержка чтений памяти (медленный диск), с"
+    )
+    parser.add_argument("--tool-timeout", type=float, default=3.0, help="дедлайн инструмента, с")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    async def slow_tool(context: dict[str, Any]) -> str:
+        await asyncio.sleep(args.tool_delay)
+        return "результат поиска"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        agent = Agent(
+            llm_client=FakeLLM(args.llm_delay),
+            memory=Memory(str(Path(tmp) / "bench.db"), write_behind=True),
+            tool_timeout=args.tool_timeout,
+        )
+        agent.tool_router.route = slow_tool  # type: ignore[method-assign]
+
+        memory_reads = (agent.memory.get_or_create_profile, agent.memory.get_recent_history)
+
+        def slowed(fn: Any) -> Any:
+            async def wrapper(*a: Any, **kw: Any) -> Any:
+                await asyncio.sleep(args.memory_delay)
+                return await fn(*a, **kw)
+            return wrapper
+
+        agent.memory.get_or_create_profile, agent.memory.get_recent_history = map(slowed, memory_reads)
+
+        samples: list[dict[str, float]] = []
+        for i in range(args.messages):
+            msg_out = await agent.process(
+                MessageIn(user_id="bench", channel="telegram", text=f"найди что-нибудь {i}")
+            )
+            samples.append(msg_out.timings or {})
+        await agent.aclose()
+
+    stages = ["profile", "tools", "history", "llm", "total"]
+    summary = {stage: round(statistics.median(s[stage] for s in samples), 2) for stage in stages}
+    prepare_sequential = summary["profile"] + summary["tools"] + summary["history"]
+    prepare_actual = round(summary["total"] - summary["llm"], 2)
+    summary["prepare_sequential_ms"] = round(prepare_sequential, 2)
+    summary["prepare_concurrent_ms"] = prepare_actual
+
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+        return 0
+
+    print(f"Медианы по {args.messages} сообщениям, мс:")
+    for stage in stages:
+        print(f"  {stage:<10}{summary[stage]:>10}")
+    print(f"\nПодготовка последовательно (сумма этапов): {prepare_sequential:.2f} мс")
+    print(f"Подготовка параллельно (фактически):       {prepare_actual:.2f} мс")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
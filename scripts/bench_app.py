@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""Бенчмарк HTTP-приложения ядра: время старта и задержка запросов.
+
+Приложение собирается через `core.app.create_app` с настоящей `Memory`
+во временной БД и имитацией Ollama (httpx.MockTransport с задержкой).
+Запросы идут через ASGI-транспорт httpx, без сети, поэтому цифры
+отражают накладные расходы самого ядра.
+
+Запуск из корня репозитория:
+
+    python scripts/bench_app.py --requests 500 --concurrency 20
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+def measure_import_time() -> float:
+    """Время `import core.app` в свежем интерпретаторе, мс."""
+    code = "import time; t = time.perf_counter(); import core.app; print(time.perf_counter() - t)"
+    out = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    return float(out.stdout.strip()) * 1000
+
+
+def percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--llm-delay", type=float, default=0.0, help="задержка имитации Ollama, с")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    from core.agent import Agent
+    from core.app import create_app
+    from core.llm_client import LLMClient
+    from core.memory import Memory
+
+    async def fake_ollama(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(args.llm_delay)
+        return httpx.Response(200, json={"message": {"role": "assistant", "content": "ответ"}})
+
+    results: dict[str, float] = {"import_ms": round(measure_import_time(), 2)}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        async def factory() -> Agent:
+            memory = await asyncio.to_thread(Memory, str(Path(tmp) / "core.db"), write_behind=True)
+            llm = LLMClient(
+                max_in_flight=args.concurrency,
+                http_client=httpx.AsyncClient(transport=httpx.MockTransport(fake_ollama)),
+            )
+            return Agent(llm_client=llm, memory=memory)
+
+        app = create_app(agent_factory=factory)
+        started = time.perf_counter()
+        async with app.router.lifespan_context(app):
+            results["startup_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://core") as client:
+                semaphore = asyncio.Semaphore(args.concurrency)
+                latencies: list[float] = []
+
+                async def one(i: int) -> None:
+                    payload = {"user_id": f"u{i % args.users}", "channel": "telegram", "text": f"вопрос {i}"}
+                    async with semaphore:
+                        t = time.perf_counter()
+                        resp = await client.post("/v1/messages", json=payload)
+                        resp.raise_for_status()
+                        latencies.append((time.perf_counter() - t) * 1000)
+
+                # Первый запрос отдельно: прогрев кэшей и соединений
+                await one(0)
+                latencies.clear()
+
+                wall = time.perf_counter()
+                await asyncio.gather(*(one(i) for i in range(1, args.requests + 1)))
+                wall = time.perf_counter() - wall
+
+    results.update(
+        {
+            "requests": args.requests,
+            "throughput_rps": round(args.requests / wall, 1),
+            "latency_p50_ms": round(statistics.median(latencies), 2),
+            "latency_p95_ms": round(percentile(latencies, 95), 2),
+            "latency_p99_ms": round(percentile(latencies, 99), 2),
+        }
+    )
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        for key, value in results.items():
+            print(f"{key:<18}{value:>12}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
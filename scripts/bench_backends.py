@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""Бенчмарк пула бэкендов Ollama: масштабирование, отказ бэкенда, хеджирование.
+
+Все бэкенды — имитации `scripts/fake_ollama.py` на локальных сокетах, клиент —
+`LLMClient` с `BackendPool`. Три сценария:
+
+- `scale` — пропускная способность `generate` при 1…N бэкендах с одним слотом
+  каждый и одинаковой нагрузкой (`--concurrency` одновременных запросов);
+- `failover` — N бэкендов, на середине прогона один начинает отвечать 500:
+  сколько ответов пользователю оказались заглушкой «LLM недоступен»,
+  сколько запросов ушло на упавший бэкенд до срабатывания breaker'а;
+- `hedge` — потоковые запросы к бэкендам, где доля `--stall-rate` запросов
+  «зависает» на `--stall-ms` перед первым токеном: p50/p95/p99 времени до
+  первого токена и число «медленных» ответов (дольше половины зависания)
+  без хеджирования и с ним (`--hedge-percentile`).
+
+Запуск из корня репозитория:
+
+    python scripts/bench_backends.py --backends 3
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from core.llm_client import LLMClient  # noqa: E402
+from core.llm_pool import BackendPool  # noqa: E402
+from scripts.fake_ollama import FakeOllama, serve  # noqa: E402
+
+
+@contextlib.asynccontextmanager
+async def fake_backends(count: int, **kwargs: Any) -> Any:
+    """Поднять `count` имитаций Ollama; отдаёт список (имитация, URL)."""
+    async with contextlib.AsyncExitStack() as stack:
+        backends = []
+        for index in range(count):
+            fake = FakeOllama(seed=index, **kwargs)
+            backends.append((fake, await stack.enter_async_context(serve(fake.app))))
+        yield backends
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+async def run_load(llm: LLMClient, requests: int, concurrency: int, prefix: str) -> list[str]:
+    """`requests` запросов `generate`, не больше `concurrency` одновременно."""
+    queue = iter(range(requests))
+    replies: list[str] = []
+
+    async def user() -> None:
+        for i in queue:
+            replies.append(await llm.generate(f"{prefix} вопрос {i}", use_cache=False))
+
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return replies
+
+
+async def bench_scale(args: argparse.Namespace) -> dict[str, Any]:
+    results: dict[str, Any] = {}
+    for count in range(1, args.backends + 1):
+        async with fake_backends(count, prompt_eval_per_token=0.0, eval_per_token=args.eval_ms / 1000) as backends:
+            pool = BackendPool([url for _, url in backends], capacity=1, health_interval=0)
+            llm = LLMClient(pool=pool, max_in_flight=1)
+            started = time.perf_counter()
+            await run_load(llm, args.requests, args.concurrency, "scale")
+            elapsed = time.perf_counter() - started
+            await llm.aclose()
+            results[str(count)] = {
+                "rps": round(args.requests / elapsed, 1),
+                "per_backend": [fake.requests for fake, _ in backends],
+            }
+    return results
+
+
+async def bench_failover(args: argparse.Namespace) -> dict[str, Any]:
+    async with fake_backends(args.backends, prompt_eval_per_token=0.0, eval_per_token=args.eval_ms / 1000) as backends:
+        pool = BackendPool([url for _, url in backends], capacity=1, health_interval=0.5, reset_timeout=5.0)
+        llm = LLMClient(pool=pool, max_in_flight=1)
+        await llm.connect()
+        broken, _ = backends[0]
+
+        async def break_later() -> None:
+            await asyncio.sleep(args.requests * args.eval_ms * 30 / 1000 / args.backends / args.concurrency / 2)
+            broken.failing = True
+
+        breaker = asyncio.create_task(break_later())
+        replies = await run_load(llm, args.requests, args.concurrency, "failover")
+        await breaker
+        stats = pool.stats()
+        await llm.aclose()
+    return {
+        "unavailable_replies": sum("LLM недоступен" in reply for reply in replies),
+        "requests_to_broken": broken.failed,
+        "failovers": stats["failovers"],
+        "breaker_opens": stats["backends"][0]["breaker_opens"],
+    }
+
+
+async def bench_hedge(args: argparse.Namespace) -> dict[str, Any]:
+    results: dict[str, Any] = {}
+    for percentile_value in (0.0, args.hedge_percentile):
+        async with fake_backends(
+            args.backends, slots=4, prompt_eval_per_token=0.0, eval_per_token=args.eval_ms / 1000,
+            stall_rate=args.stall_rate, stall=args.stall_ms / 1000,
+        ) as backends:
+            pool = BackendPool(
+                [url for _, url in backends], capacity=4, health_interval=0,
+                hedge_percentile=percentile_value, hedge_max_ratio=args.hedge_max_ratio,
+            )
+            llm = LLMClient(pool=pool, max_in_flight=4)
+            ttft: list[float] = []
+
+            async def user(index: int) -> None:
+                for i in range(args.requests // args.concurrency):
+                    started = time.perf_counter()
+                    first = None
+                    async for _ in llm.stream(f"hedge {index} {i}", use_cache=False):
+                        if first is None:
+                            first = time.perf_counter() - started
+                    ttft.append(first or 0.0)
+
+            await user(-1)  # накопить задержки для перцентиля
+            ttft.clear()
+            await asyncio.gather(*(user(index) for index in range(args.concurrency)))
+            stats = pool.stats()
+            await llm.aclose()
+        results["hedged" if percentile_value else "plain"] = {
+            "ttft_p50_ms": round(statistics.median(ttft) * 1000, 1),
+            "ttft_p95_ms": round(percentile(ttft, 0.95) * 1000, 1),
+            "ttft_p99_ms": round(percentile(ttft, 0.99) * 1000, 1),
+            "ttft_max_ms": round(max(ttft) * 1000, 1),
+            "slow": sum(value > args.stall_ms / 2000 for value in ttft),
+            "hedges": stats["hedges"],
+            "hedge_wins": stats["hedge_wins"],
+            "stalled": sum(fake.stalled for fake, _ in backends),
+        }
+    return results
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backends", type=int, default=3)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=6)
+    parser.add_argument("--eval-ms", type=float, default=1.0, help="на токен ответа (30 токенов)")
+    parser.add_argument("--stall-rate", type=float, default=0.05)
+    parser.add_argument("--stall-ms", type=float, default=500.0)
+    parser.add_argument("--hedge-percentile", type=float, default=90.0)
+    parser.add_argument("--hedge-max-ratio", type=float, default=0.2)
+    parser.add_argument("--scenarios", nargs="+", default=["scale", "failover", "hedge"])
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    scenarios = {"scale": bench_scale, "failover": bench_failover, "hedge": bench_hedge}
+    results = {name: await scenarios[name](args) for name in args.scenarios}
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return 0
+    if "scale" in results:
+        print(f"Пропускная способность generate ({args.concurrency} одновременных):")
+        for count, r in results["scale"].items():
+            print(f"  {count} бэкенд(а): {r['rps']:>7.1f} запр/с  по бэкендам {r['per_backend']}")
+    if "failover" in results:
+        r = results["failover"]
+        print(f"Отказ одного из {args.backends} бэкендов: заглушек {r['unavailable_replies']}, "
+              f"запросов на упавший {r['requests_to_broken']}, повторов {r['failovers']}, "
+              f"срабатываний breaker {r['breaker_opens']}")
+    if "hedge" in results:
+        print(f"Время до первого токена, {args.stall_rate:.0%} запросов зависают на {args.stall_ms:.0f} мс:")
+        for name, r in results["hedge"].items():
+            print(f"  {name:<7} p50={r['ttft_p50_ms']} p95={r['ttft_p95_ms']} p99={r['ttft_p99_ms']} "
+                  f"max={r['ttft_max_ms']} мс; медленных {r['slow']}; "
+                  f"дублей {r['hedges']}, из них выиграли {r['hedge_wins']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
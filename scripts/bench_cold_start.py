@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""Бенчмарк холодного старта ядра: импорт, lifespan и первый запрос в свежем процессе.
+
+Каждый прогон — новый интерпретатор (так стартует воркер uvicorn или
+тестовый процесс), который замеряет:
+
+- `import_ms` — `import core.app`;
+- `startup_ms` — lifespan приложения (`build_agent`: открытие БД, схема, клиенты);
+- `first_request_ms` / `second_request_ms` — `POST /v1/messages` сразу после
+  старта и повторный, чтобы отделить разовые затраты от обычной задержки;
+- `deferred` — какие лениво подключаемые модули (инструменты, numpy) оказались
+  импортированы к концу первого запроса без вложений и поиска.
+
+Первый прогон создаёт БД (миграции схемы), остальные открывают готовую — по
+ним считаются медианы. Ollama — имитация `scripts/fake_ollama.py` на
+локальном сокете без задержек. Если медиана превышает порог (`--max-*`) или
+отложенный модуль импортирован заранее, скрипт завершается с кодом 1 —
+так его можно ставить в CI как проверку регрессий.
+
+Запуск из корня репозитория:
+
+    python scripts/bench_cold_start.py --runs 10
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# Модули, которые не должны импортироваться, пока они не понадобились запросу
+DEFERRED_MODULES = ("core.search", "core.media_tools", "core.parsers", "core.semantic", "numpy")
+
+
+async def child() -> dict[str, Any]:
+    """Один холодный старт (выполняется в отдельном процессе)."""
+    started = time.perf_counter()
+    import core.app
+
+    imported = time.perf_counter()
+    import httpx
+
+    app = core.app.create_app(warmup_llm=False)
+    result: dict[str, Any] = {"import_ms": (imported - started) * 1000}
+    began = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        result["startup_ms"] = (time.perf_counter() - began) * 1000
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://core") as client:
+            for key, text in (("first_request_ms", "привет"), ("second_request_ms", "как дела?")):
+                began = time.perf_counter()
+                response = await client.post("/v1/messages", json={"user_id": "cold", "text": text})
+                response.raise_for_status()
+                result[key] = (time.perf_counter() - began) * 1000
+        result["deferred"] = sorted(name for name in DEFERRED_MODULES if name in sys.modules)
+    result["total_ms"] = (time.perf_counter() - started) * 1000
+    return result
+
+
+def run_child(env: dict[str, str]) -> dict[str, Any]:
+    out = subprocess.run(
+        [sys.executable, str(Path(__file__).resolve()), "--child"],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr.strip().splitlines()[-1] if out.stderr.strip() else f"exit {out.returncode}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10, help="прогонов на готовой БД")
+    parser.add_argument("--max-import-ms", type=float, default=400.0)
+    parser.add_argument("--max-startup-ms", type=float, default=400.0)
+    parser.add_argument("--max-first-request-ms", type=float, default=150.0)
+    parser.add_argument("--semantic", default="0", help="SEMANTIC_MEMORY для ядра (0, hash, ollama)")
+    parser.add_argument("--json", action="store_true")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(await child()))
+        return 0
+
+    from scripts.fake_ollama import FakeOllama, serve
+
+    ollama = FakeOllama(prompt_eval_per_token=0.0, eval_per_token=0.0)
+    async with serve(ollama.app) as ollama_url:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = {
+                **os.environ,
+                "OLLAMA_BASE_URL": ollama_url,
+                "CORE_DB_PATH": str(Path(tmp) / "core.db"),
+                "ARCHIVE_DIR": str(Path(tmp) / "archive"),
+                "CORE_MEDIA_DIR": str(Path(tmp) / "media"),
+                "SEMANTIC_INDEX_DIR": str(Path(tmp) / "semantic"),
+                "SEMANTIC_MEMORY": args.semantic,
+                "CORE_WARMUP": "0",
+            }
+            # Дочерние процессы блокируют только пул потоков, имитация Ollama отвечает из этого loop
+            fresh = await asyncio.to_thread(run_child, env)
+            runs = [await asyncio.to_thread(run_child, env) for _ in range(args.runs)]
+
+    keys = ("import_ms", "startup_ms", "first_request_ms", "second_request_ms", "total_ms")
+    results: dict[str, Any] = {
+        "fresh_db": {key: round(fresh[key], 2) for key in keys},
+        **{key: round(statistics.median(run[key] for run in runs), 2) for key in keys},
+        "deferred_loaded": sorted({name for run in runs for name in run["deferred"]}),
+    }
+    limits = {
+        "import_ms": args.max_import_ms,
+        "startup_ms": args.max_startup_ms,
+        "first_request_ms": args.max_first_request_ms,
+    }
+    failures = [f"{key} = {results[key]} > {limit}" for key, limit in limits.items() if results[key] > limit]
+    # С семантической памятью numpy нужен с самого старта
+    expected = {"core.semantic", "numpy"} if args.semantic != "0" else set()
+    unexpected = sorted(set(results["deferred_loaded"]) - expected)
+    if unexpected:
+        failures.append(f"импортированы заранее: {', '.join(unexpected)}")
+    results["failures"] = failures
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print(f"Холодный старт ядра, медианы {args.runs} прогонов (в скобках — первый запуск на новой БД):")
+        for key in keys:
+            print(f"  {key:<18} {results[key]:>8.1f} мс  ({results['fresh_db'][key]:.1f})")
+        for failure in failures:
+            print(f"РЕГРЕССИЯ: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""Нагрузочный тест ядра: `/v1/messages` под смесью реалистичных сессий.
+
+Ядро запускается отдельным процессом (`uvicorn core.app:create_app --factory`)
+с временной БД; Ollama и DuckDuckGo заменены имитациями
+(`scripts/fake_ollama.py`, `scripts/fake_ddg.py`) на локальных сокетах.
+Виртуальные пользователи ведут сессии: несколько сообщений подряд с паузами
+«на чтение», затем перерыв. Часть сообщений — запросы поиска, часть
+запрашивает потоковый ответ (SSE).
+
+Отчёт: p50/p95/p99 задержки (для потоковых — и до первого фрагмента),
+пропускная способность, доля отказов 503 и скорость записи в SQLite.
+`--output` сохраняет результат в JSON для сравнения между коммитами
+(см. `scripts/bench_suite.py`).
+
+Запуск из корня репозитория:
+
+    python scripts/bench_load.py --users 20 --duration 20
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from scripts.fake_ddg import FakeDuckDuckGo  # noqa: E402
+from scripts.fake_ollama import FakeOllama, serve  # noqa: E402
+
+TEXTS = [
+    "Привет!",
+    "Как дела?",
+    "Объясни, пожалуйста, чем отличается процесс от потока",
+    "Помоги составить план на неделю: работа, спорт, чтение",
+    "Напиши короткое поздравление коллеге с днём рождения",
+    "Что посоветуешь почитать про историю Древнего Рима?",
+    "Переведи на английский: «давай встретимся завтра в десять»",
+]
+SEARCHES = [
+    "найди погоду в Москве",
+    "найди курс евро",
+    "поиск рецепт борща",
+    "найди расписание электричек до Твери",
+]
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def latency_summary(values: list[float]) -> dict[str, float]:
+    return {
+        "count": len(values),
+        "p50_ms": round(statistics.median(values), 2) if values else 0.0,
+        "p95_ms": round(percentile(values, 95), 2),
+        "p99_ms": round(percentile(values, 99), 2),
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def count_messages(db_path: Path) -> int:
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=5)
+    except sqlite3.OperationalError:
+        return 0
+    try:
+        return conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0
+    finally:
+        conn.close()
+
+
+class LoadGenerator:
+    """Закрытый цикл: каждый виртуальный пользователь ждёт ответа перед следующим сообщением."""
+
+    def __init__(self, client: httpx.AsyncClient, args: argparse.Namespace) -> None:
+        self.client = client
+        self.args = args
+        self.latencies: dict[str, list[float]] = {"text": [], "search": [], "stream": []}
+        self.ttft: list[float] = []
+        self.rejected = 0
+        self.errors = 0
+
+    async def send(self, user_id: str, rng: random.Random) -> None:
+        if rng.random() < self.args.search_share:
+            kind, text = "search", rng.choice(SEARCHES)
+        else:
+            kind, text = "text", rng.choice(TEXTS)
+        stream = rng.random() < self.args.stream_share
+        payload = {"user_id": user_id, "channel": "telegram", "text": text, "stream": stream}
+
+        started = time.perf_counter()
+        try:
+            if stream:
+                async with self.client.stream("POST", "/v1/messages", json=payload) as resp:
+                    if resp.status_code == 503:
+                        self.rejected += 1
+                        return
+                    resp.raise_for_status()
+                    first = True
+                    async for line in resp.aiter_lines():
+                        if first and line.startswith("data:"):
+                            self.ttft.append((time.perf_counter() - started) * 1000)
+                            first = False
+                kind = "stream"
+            else:
+                resp = await self.client.post("/v1/messages", json=payload)
+                if resp.status_code == 503:
+                    self.rejected += 1
+                    return
+                resp.raise_for_status()
+        except httpx.HTTPError:
+            self.errors += 1
+            return
+        self.latencies[kind].append((time.perf_counter() - started) * 1000)
+
+    @staticmethod
+    async def pause(rng: random.Random, mean: float, deadline: float) -> None:
+        delay = rng.expovariate(1 / mean) if mean > 0 else 0.0
+        await asyncio.sleep(max(0.0, min(delay, deadline - time.perf_counter())))
+
+    async def user(self, index: int, deadline: float) -> None:
+        rng = random.Random(self.args.seed * 100_003 + index)
+        user_id = f"load-{index}"
+        # Пользователи приходят не одновременно
+        await self.pause(rng, self.args.think, deadline)
+        while time.perf_counter() < deadline:
+            for _ in range(max(1, int(rng.expovariate(1 / self.args.session_length)))):
+                if time.perf_counter() >= deadline:
+                    return
+                await self.send(user_id, rng)
+                await self.pause(rng, self.args.think, deadline)
+            await self.pause(rng, self.args.session_gap, deadline)
+
+
+async def wait_healthy(base_url: str, process: subprocess.Popen[bytes], timeout: float = 60.0) -> float:
+    started = time.perf_counter()
+    async with httpx.AsyncClient(base_url=base_url, timeout=1.0) as client:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"Ядро завершилось с кодом {process.returncode}")
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    return time.perf_counter() - started
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.05)
+    raise TimeoutError("Ядро не ответило на /health")
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20, help="виртуальных пользователей")
+    parser.add_argument("--duration", type=float, default=20.0, help="длительность замера, с")
+    parser.add_argument("--think", type=float, default=0.5, help="средняя пауза между сообщениями, с")
+    parser.add_argument("--session-length", type=float, default=4, help="среднее число сообщений в сессии")
+    parser.add_argument("--session-gap", type=float, default=2.0, help="средний перерыв между сессиями, с")
+    parser.add_argument("--search-share", type=float, default=0.2)
+    parser.add_argument("--stream-share", type=float, default=0.3)
+    parser.add_argument("--ollama-latency-ms", type=float, default=20.0)
+    parser.add_argument("--token-rate", type=float, default=300.0, help="токенов ответа в секунду")
+    parser.add_argument("--prompt-eval-ms", type=float, default=0.2, help="на токен промпта")
+    parser.add_argument("--reply-tokens", type=int, default=30)
+    parser.add_argument("--ollama-slots", type=int, default=4)
+    parser.add_argument("--ddg-latency-ms", type=float, default=150.0)
+    parser.add_argument("--workers", type=int, default=1, help="воркеров uvicorn у ядра")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="куда сохранить результат (JSON)")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    ollama = FakeOllama(
+        slots=args.ollama_slots,
+        latency=args.ollama_latency_ms / 1000,
+        prompt_eval_per_token=args.prompt_eval_ms / 1000,
+        eval_per_token=1 / args.token_rate,
+        reply_tokens=args.reply_tokens,
+    )
+    ddg = FakeDuckDuckGo(latency=args.ddg_latency_ms / 1000)
+
+    async with serve(ollama.app) as ollama_url, serve(ddg.app) as ddg_url:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = Path(tmp) / "core.db"
+            port = free_port()
+            env = {
+                **os.environ,
+                "OLLAMA_BASE_URL": ollama_url,
+                "DDG_BASE_URL": ddg_url + "/",
+                "CORE_DB_PATH": str(db_path),
+                "SEMANTIC_INDEX_DIR": str(Path(tmp) / "semantic"),
+                # Лимиты ядра рассчитаны на один GPU; под нагрузкой их задаёт сама имитация
+                "OLLAMA_MAX_IN_FLIGHT": os.getenv("OLLAMA_MAX_IN_FLIGHT", str(args.ollama_slots)),
+            }
+            core = subprocess.Popen(
+                [
+                    sys.executable, "-m", "uvicorn", "core.app:create_app", "--factory",
+                    "--host", "127.0.0.1", "--port", str(port),
+                    "--workers", str(args.workers), "--no-access-log", "--log-level", "warning",
+                ],
+                cwd=ROOT,
+                env=env,
+                # stdout отдан под отчёт (`--json`); логи ядра идут в stderr
+                stdout=subprocess.DEVNULL,
+            )
+            base_url = f"http://127.0.0.1:{port}"
+            try:
+                startup_s = await wait_healthy(base_url, core)
+
+                limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+                async with httpx.AsyncClient(base_url=base_url, timeout=120.0, limits=limits) as client:
+                    load = LoadGenerator(client, args)
+                    rows_before = count_messages(db_path)
+                    started = time.perf_counter()
+                    deadline = started + args.duration
+                    await asyncio.gather(*(load.user(i, deadline) for i in range(args.users)))
+                    wall = time.perf_counter() - started
+                    rows_during = count_messages(db_path) - rows_before
+            finally:
+                # SIGINT — штатная остановка: очередь write-behind сбрасывается в БД
+                core.send_signal(2)
+                try:
+                    core.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    core.kill()
+            rows_total = count_messages(db_path)
+
+    all_latencies = [v for values in load.latencies.values() for v in values]
+    completed = len(all_latencies)
+    results: dict[str, Any] = {
+        "startup_s": round(startup_s, 2),
+        "duration_s": round(wall, 2),
+        "completed": completed,
+        "rejected_503": load.rejected,
+        "errors": load.errors,
+        "throughput_rps": round(completed / wall, 2),
+        "latency": latency_summary(all_latencies),
+        "latency_by_kind": {kind: latency_summary(values) for kind, values in load.latencies.items()},
+        "stream_ttft": latency_summary(load.ttft),
+        "sqlite_rows_per_s": round(rows_during / wall, 2),
+        "sqlite_rows_total": rows_total,
+        "ollama": ollama.stats(),
+        "ddg_requests": ddg.requests,
+    }
+
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.output).write_text(json.dumps({"args": vars(args), "results": results}, ensure_ascii=False, indent=2))
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print(f"Завершено {completed} запросов за {wall:.1f} с ({results['throughput_rps']} rps), "
+              f"отказов 503: {load.rejected}, ошибок: {load.errors}")
+        for name, summary in [("все", results["latency"]), *results["latency_by_kind"].items(),
+                              ("ttft (stream)", results["stream_ttft"])]:
+            print(f"  {name:<14} n={summary['count']:<6} p50={summary['p50_ms']:>8} "
+                  f"p95={summary['p95_ms']:>8} p99={summary['p99_ms']:>8} мс")
+        print(f"SQLite: {results['sqlite_rows_per_s']} строк/с во время замера, всего {rows_total}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""Бенчмарк памяти ядра: сообщений в секунду при конкурентных пользователях.
+
+Сравнивает старую схему (новое sqlite3-соединение на каждый вызов прямо
+в event loop) с `core.memory.Memory` на `SQLiteEngine`.
+
+Запуск из корня репозитория:
+
+    python scripts/bench_memory.py --users 50 --messages 20
+"""
+
+import argparse
+import asyncio
+import json
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core.memory import Memory  # noqa: E402
+from core.models import MessageIn, MessageOut  # noqa: E402
+
+
+class LegacyMemory:
+    """Копия прежней реализации: connect/commit/close на каждый вызов."""
+
+    def __init__(self, db_path: Path) -> None:
+        self.db_path = db_path
+        # Схема та же — создаём её через новую реализацию и сразу закрываем
+        Memory(str(db_path)).engine.close()
+
+    def get_or_create_profile(self, user_id: str) -> None:
+        conn = sqlite3.connect(self.db_path)
+        row = conn.execute("SELECT * FROM profiles WHERE user_id = ?", (user_id,)).fetchone()
+        if not row:
+            conn.execute("INSERT OR IGNORE INTO profiles (user_id) VALUES (?)", (user_id,))
+            conn.commit()
+        conn.close()
+
+    def update_profile(self, user_id: str, telegram_id: str) -> None:
+        conn = sqlite3.connect(self.db_path)
+        conn.execute(
+            "UPDATE profiles SET telegram_id = ?, updated_at = CURRENT_TIMESTAMP WHERE user_id = ?",
+            (telegram_id, user_id),
+        )
+        conn.commit()
+        conn.close()
+
+    def save_interaction(self, msg_in: MessageIn, msg_out: MessageOut) -> None:
+        conn = sqlite3.connect(self.db_path)
+        conn.execute(
+            """
+            INSERT INTO messages (user_id, channel, message_type, input_text, output_text)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (msg_in.user_id, msg_in.channel, "text", msg_in.text, msg_out.text),
+        )
+        conn.commit()
+        conn.close()
+
+    def get_recent_history(self, user_id: str, limit: int) -> list[Any]:
+        conn = sqlite3.connect(self.db_path)
+        rows = conn.execute(
+            "SELECT * FROM messages WHERE user_id = ? ORDER BY created_at DESC LIMIT ?",
+            (user_id, limit),
+        ).fetchall()
+        conn.close()
+        return rows
+
+
+async def _maybe_await(value: Any) -> Any:
+    if asyncio.iscoroutine(value):
+        return await value
+    return value
+
+
+async def _user_session(memory: Any, user_id: str, messages: int, llm_delay: float) -> None:
+    """Повторяет обращения `Agent.process` к памяти для одного пользователя."""
+    for i in range(messages):
+        msg_in = MessageIn(user_id=user_id, channel="telegram", text=f"сообщение {i}")
+        await _maybe_await(memory.get_or_create_profile(user_id))
+        await _maybe_await(memory.update_profile(user_id, telegram_id=user_id))
+        await _maybe_await(memory.get_recent_history(user_id, 5))
+        await asyncio.sleep(llm_delay)  # имитация генерации LLM
+        await _maybe_await(memory.save_interaction(msg_in, MessageOut(text=f"ответ {i}")))
+
+
+async def _loop_lag_probe(stop: asyncio.Event, samples: list[float], interval: float = 0.005) -> None:
+    """Замеряет, насколько event loop опаздывает с пробуждением."""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - started - interval)
+
+
+async def run_case(memory: Any, users: int, messages: int, llm_delay: float) -> dict[str, float]:
+    stop = asyncio.Event()
+    lags: list[float] = []
+    probe = asyncio.create_task(_loop_lag_probe(stop, lags))
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(_user_session(memory, f"user-{u}", messages, llm_delay) for u in range(users))
+    )
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await probe
+    total = users * messages
+    return {
+        "messages": total,
+        "seconds": round(elapsed, 3),
+        "messages_per_sec": round(total / elapsed, 1),
+        "max_loop_lag_ms": round(max(lags, default=0.0) * 1000, 2),
+    }
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50, help="число конкурентных пользователей")
+    parser.add_argument("--messages", type=int, default=20, help="сообщений на пользователя")
+    parser.add_argument("--llm-delay", type=float, default=0.01, help="имитация LLM, секунд")
+    parser.add_argument("--json", action="store_true", help="вывести результат в JSON")
+    args = parser.parse_args()
+
+    results: dict[str, dict[str, float]] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = LegacyMemory(Path(tmp) / "legacy.db")
+        results["per_call_connect"] = await run_case(legacy, args.users, args.messages, args.llm_delay)
+
+        memory = Memory(str(Path(tmp) / "engine.db"))
+        try:
+            results["sqlite_engine"] = await run_case(memory, args.users, args.messages, args.llm_delay)
+        finally:
+            await memory.aclose()
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return 0
+
+    print(f"Пользователей: {args.users}, сообщений на пользователя: {args.messages}\n")
+    print(f"{'вариант':<20}{'msg/s':>10}{'время, с':>12}{'макс. лаг loop, мс':>22}")
+    for name, r in results.items():
+        print(f"{name:<20}{r['messages_per_sec']:>10}{r['seconds']:>12}{r['max_loop_lag_ms']:>22}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""Бенчмарк отзывчивости event loop, пока разбирается большой PDF.
+
+Генерируется PDF на `--pages` страниц текста (FlateDecode), затем один и тот
+же разбор (`core.parsers.pdf_text`) выполняется тремя способами:
+
+- `inline` — прямо в event loop, как если бы инструмент не выносил работу;
+- `thread` — в `asyncio.to_thread` (разбор на чистом Python держит GIL);
+- `offload` — в процессе `ProcessOffload`.
+
+Всё это время фоновая задача «тикает» каждые `--tick-ms` и измеряет, на
+сколько просыпается позже положенного: это задержка, которую в тот момент
+получил бы любой другой пользователь ядра.
+
+Запуск из корня репозитория:
+
+    python scripts/bench_offload.py --pages 2000
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import tempfile
+import time
+import zlib
+from pathlib import Path
+from typing import Any
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from core.offload import ProcessOffload  # noqa: E402
+from core.parsers import pdf_text  # noqa: E402
+
+
+def make_pdf(path: Path, pages: int, lines: int = 50) -> int:
+    """Записать PDF с `pages` страницами по `lines` строк текста; вернуть размер в байтах."""
+    objects: list[bytes] = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"",  # /Pages — заполняется ниже, когда известны номера страниц
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for page in range(pages):
+        ops = [b"BT /F1 10 Tf 50 800 Td 12 TL"]
+        for line in range(lines):
+            text = f"Page {page + 1}, line {line + 1}: quarterly report, revenue {page * lines + line} units"
+            ops.append(b"(" + text.encode("latin-1") + b") Tj T*")
+        ops.append(b"ET")
+        content = zlib.compress(b"\n".join(ops))
+        objects.append(b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(content) + content + b"\nendstream")
+        content_ref = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_ref
+        )
+        kids.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Count %d /Kids [%s] >>" % (pages, b" ".join(kids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    path.write_bytes(out)
+    return len(out)
+
+
+class LagProbe:
+    """Фоновая задача, измеряющая опоздание пробуждений event loop."""
+
+    def __init__(self, tick: float) -> None:
+        self.tick = tick
+        self.lags: list[float] = []
+        self._task: asyncio.Task[None] | None = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.tick
+            await asyncio.sleep(self.tick)
+            self.lags.append(max(0.0, loop.time() - expected) * 1000)
+
+    def __enter__(self) -> "LagProbe":
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        assert self._task is not None
+        self._task.cancel()
+
+    def summary(self) -> dict[str, float]:
+        ordered = sorted(self.lags) or [0.0]
+        return {
+            "ticks": len(self.lags),
+            "lag_p50_ms": round(statistics.median(ordered), 2),
+            "lag_p99_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))], 2),
+            "lag_max_ms": round(ordered[-1], 2),
+        }
+
+
+async def measure(mode: str, path: Path, offload: ProcessOffload, tick: float) -> dict[str, Any]:
+    max_chars = 10**9
+    with LagProbe(tick) as probe:
+        # Даём пробе сделать пару тиков до начала разбора
+        await asyncio.sleep(tick * 3)
+        started = time.perf_counter()
+        if mode == "inline":
+            parts = list(pdf_text(str(path), max_chars))
+        elif mode == "thread":
+            parts = await asyncio.to_thread(lambda: list(pdf_text(str(path), max_chars)))
+        else:
+            parts = await offload.run(pdf_text, str(path), max_chars)
+        elapsed = time.perf_counter() - started
+        await asyncio.sleep(tick * 3)
+    return {"parse_ms": round(elapsed * 1000, 1), "chunks": len(parts), **probe.summary()}
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--tick-ms", type=float, default=10.0, help="период пробы event loop")
+    parser.add_argument("--modes", nargs="+", default=["inline", "thread", "offload"])
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    offload = ProcessOffload(workers=1, timeout=600)
+    results: dict[str, Any] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "report.pdf"
+        size = make_pdf(path, args.pages)
+        results["pdf_bytes"] = size
+        # Процесс пула запускается заранее, чтобы не мерить его старт
+        await offload.run(len, "warmup")
+        for mode in args.modes:
+            results[mode] = await measure(mode, path, offload, args.tick_ms / 1000)
+    await offload.aclose()
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print(f"PDF: {args.pages} страниц, {size / 1e6:.1f} МБ")
+        for mode in args.modes:
+            r = results[mode]
+            print(f"  {mode:<8} разбор {r['parse_ms']:>8.1f} мс; задержка loop: p50={r['lag_p50_ms']} "
+                  f"p99={r['lag_p99_ms']} max={r['lag_max_ms']} мс ({r['ticks']} тиков)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Бенчмарк стабильности префикса промпта: переиспользование KV-кэша Ollama.
+
+Один и тот же диалог (`--turns` сообщений от каждого из `--users`
+пользователей) прогоняется через `Agent.process_stream` дважды: со
+скользящим окном истории и в режиме `stable_prefix`. Модель — имитация
+Ollama (`scripts/fake_ollama.py`) на локальном сокете, которая вычисляет
+заново только токены после общего с прошлым запросом префикса.
+Сравниваются время до первого фрагмента ответа (TTFT) и суммарное время
+вычисления промптов.
+
+Запуск из корня репозитория:
+
+    python scripts/bench_prefix.py --turns 40 --budget 600
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from core.agent import Agent  # noqa: E402
+from core.context import ContextBuilder  # noqa: E402
+from core.llm_client import LLMClient  # noqa: E402
+from core.memory import Memory  # noqa: E402
+from core.models import MessageIn  # noqa: E402
+from scripts.fake_ollama import FakeOllama, serve  # noqa: E402
+
+
+def percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run(args: argparse.Namespace, stable: bool) -> dict[str, float]:
+    fake = FakeOllama(
+        slots=args.users,
+        prompt_eval_per_token=args.prompt_eval_ms / 1000,
+        eval_per_token=args.eval_ms / 1000,
+        reply_tokens=args.reply_tokens,
+    )
+    ttft: list[float] = []
+    async with serve(fake.app) as base_url:
+        with tempfile.TemporaryDirectory() as tmp:
+            agent = Agent(
+                llm_client=LLMClient(base_url=base_url, max_in_flight=args.users),
+                memory=Memory(str(Path(tmp) / "core.db")),
+                context_builder=ContextBuilder(args.budget, stable_prefix=stable),
+                history_limit=args.history_limit,
+            )
+
+            async def user(index: int) -> None:
+                for turn in range(args.turns):
+                    msg_in = MessageIn(
+                        user_id=f"u{index}",
+                        channel="telegram",
+                        text=f"Сообщение {turn}: расскажи ещё что-нибудь про тему номер {turn % 7}",
+                    )
+                    started = time.perf_counter()
+                    first = True
+                    async for _ in agent.process_stream(msg_in):
+                        if first:
+                            ttft.append((time.perf_counter() - started) * 1000)
+                            first = False
+                    # Следующее сообщение должно видеть этот ответ в истории
+                    await asyncio.gather(*agent._background)
+
+            await asyncio.gather(*(user(i) for i in range(args.users)))
+            rewindows = agent.context_builder.rewindows
+            await agent.aclose()
+
+    stats = fake.stats()
+    return {
+        "ttft_p50_ms": round(statistics.median(ttft), 2),
+        "ttft_p95_ms": round(percentile(ttft, 95), 2),
+        "prompt_eval_s": stats["prompt_eval_seconds"],
+        "prompt_tokens": stats["prompt_tokens"],
+        "evaluated_tokens": stats["prompt_tokens"] - stats["cached_tokens"],
+        "prefix_hit_rate": round(stats["prefix_hit_rate"], 3),
+        "rewindows": rewindows,
+    }
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2)
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--budget", type=int, default=600, help="бюджет контекста, токенов")
+    parser.add_argument("--history-limit", type=int, default=20)
+    parser.add_argument("--prompt-eval-ms", type=float, default=1.0, help="на токен промпта")
+    parser.add_argument("--eval-ms", type=float, default=1.0, help="на токен ответа")
+    parser.add_argument("--reply-tokens", type=int, default=30)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    results = {
+        "sliding": await run(args, stable=False),
+        "stable_prefix": await run(args, stable=True),
+    }
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return 0
+    keys = list(results["sliding"])
+    print(f"{'':<20}{'sliding':>14}{'stable_prefix':>16}")
+    for key in keys:
+        print(f"{key:<20}{results['sliding'][key]:>14}{results['stable_prefix'][key]:>16}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
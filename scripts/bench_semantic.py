@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""Бенчмарк векторного индекса семантической памяти: скорость поиска top-k.
+
+Индекс одного пользователя заполняется `--vectors` случайными векторами
+размерности `--dim` (как у модели эмбеддингов), после чего замеряется
+задержка `VectorIndex.search` — поиск идёт по memory-mapped файлу блоками.
+
+Запуск из корня репозитория:
+
+    python scripts/bench_semantic.py --vectors 100000 --dim 768
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core.semantic import VectorIndex  # noqa: E402
+
+
+def percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--vectors", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        index = VectorIndex(tmp, args.dim)
+
+        started = time.perf_counter()
+        batch = 10_000
+        for start in range(0, args.vectors, batch):
+            rows = min(batch, args.vectors - start)
+            ids = list(range(start + 1, start + rows + 1))
+            index.add("bench", ids, rng.standard_normal((rows, args.dim), dtype=np.float32))
+        add_s = time.perf_counter() - started
+
+        queries = rng.standard_normal((args.queries, args.dim), dtype=np.float32)
+        index.search("bench", queries[0], args.k)  # прогрев страничного кэша
+        latencies = []
+        for query in queries:
+            t = time.perf_counter()
+            index.search("bench", query, args.k)
+            latencies.append((time.perf_counter() - t) * 1000)
+
+        size_mb = sum(p.stat().st_size for p in Path(tmp).iterdir()) / 1024 / 1024
+
+    results = {
+        "vectors": args.vectors,
+        "dim": args.dim,
+        "index_mb": round(size_mb, 1),
+        "add_vectors_per_s": round(args.vectors / add_s),
+        "search_p50_ms": round(statistics.median(latencies), 2),
+        "search_p95_ms": round(percentile(latencies, 95), 2),
+    }
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        for key, value in results.items():
+            print(f"{key:<20}{value:>12}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
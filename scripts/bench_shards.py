@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""Бенчмарк шардированного хранилища: запись сообщений при 1…N шардах.
+
+`ShardedMemory` с каждым числом шардов из `--shards` принимает поток
+`save_interaction` от `--users` одновременных пользователей (без
+write-behind: каждое сообщение — своя транзакция, как при синхронной
+записи). Два режима:
+
+- `raw` — как есть на этой машине. На tmpfs и в кэше страниц коммит SQLite
+  стоит микросекунды, и пропускную способность ограничивает CPU процесса
+  (разбор SQL, event loop), а не блокировка БД — рост от шардов виден
+  только при нескольких ядрах;
+- `commit` — модель дорогого коммита (`--commit-ms`, как fsync на
+  реальном диске): писатель шарда держит транзакцию заданное время. Здесь
+  один файл упирается в `1000 / commit-ms` транзакций в секунду, а шарды
+  коммитят параллельно — видно, масштабируется ли запись с числом шардов.
+
+`balance_limit` — предел ускорения при данном распределении пользователей
+по шардам: самый загруженный шард всё равно пишет свою долю один.
+
+Запуск из корня репозитория:
+
+    python scripts/bench_shards.py --shards 1 2 4 8
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, TypeVar
+from unittest import mock
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from core import sharding  # noqa: E402
+from core.db import SQLiteEngine  # noqa: E402
+from core.models import MessageIn, MessageOut  # noqa: E402
+
+T = TypeVar("T")
+
+
+class SlowCommitEngine(SQLiteEngine):
+    """`SQLiteEngine`, у которого каждая транзакция записи держит писателя `commit_delay` секунд."""
+
+    commit_delay = 0.0
+
+    def _run_write(self, fn: Callable[..., T], args: tuple[Any, ...]) -> T:
+        def slow(conn: sqlite3.Connection, *inner: Any) -> T:
+            result = fn(conn, *inner)
+            time.sleep(self.commit_delay)
+            return result
+
+        return super()._run_write(slow, args)
+
+
+async def run(shards: int, args: argparse.Namespace, commit_ms: float) -> dict[str, Any]:
+    with tempfile.TemporaryDirectory() as tmp:
+        SlowCommitEngine.commit_delay = commit_ms / 1000
+        engine = SlowCommitEngine if commit_ms else SQLiteEngine
+        with mock.patch.object(sharding, "SQLiteEngine", engine):
+            memory = await asyncio.to_thread(sharding.ShardedMemory, tmp, sharding.parse_shards(str(shards)))
+
+        async def user(index: int) -> None:
+            for i in range(args.messages):
+                await memory.save_interaction(
+                    MessageIn(f"user-{index}", "telegram", f"сообщение {i}"), MessageOut(f"ответ {i}")
+                )
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user(index) for index in range(args.users)))
+        elapsed = time.perf_counter() - started
+        stats = memory.stats()
+        await memory.aclose()
+    total = args.users * args.messages
+    per_shard = [shard["messages"] for shard in stats.values()]
+    return {
+        "msgs_per_s": round(total / elapsed, 1),
+        "per_shard": per_shard,
+        # Потолок ускорения: самый загруженный шард пишет свою долю последовательно
+        "balance_limit": round(total / max(per_shard), 2),
+    }
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--users", type=int, default=256)
+    parser.add_argument("--messages", type=int, default=5, help="сообщений на пользователя")
+    parser.add_argument("--commit-ms", type=float, default=2.0, help="длительность коммита в режиме commit")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    results: dict[str, Any] = {"cpus": os.cpu_count()}
+    for mode, commit_ms in (("raw", 0.0), ("commit", args.commit_ms)):
+        results[mode] = {str(count): await run(count, args, commit_ms) for count in args.shards}
+        base = results[mode][str(args.shards[0])]["msgs_per_s"]
+        for result in results[mode].values():
+            result["speedup"] = round(result["msgs_per_s"] / base, 2)
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return 0
+    print(f"Запись сообщений, {args.users} пользователей × {args.messages}, CPU: {results['cpus']}")
+    for mode, title in (("raw", "как есть"), ("commit", f"коммит {args.commit_ms:g} мс")):
+        print(f"  {title}:")
+        for count, r in results[mode].items():
+            print(f"    {count} шард(ов): {r['msgs_per_s']:>8.1f} сообщ/с  ×{r['speedup']:<5} "
+                  f"(потолок по балансу ×{r['balance_limit']})  по шардам {r['per_shard']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
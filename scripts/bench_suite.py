@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Набор бенчмарков ядра с сохранением результатов для сравнения между коммитами.
+
+Запускает бенчмарки `Memory`, `ToolRouter`, пула процессов, `Agent`, HTTP-приложения,
+холодного старта, пула бэкендов Ollama, шардов хранилища и нагрузочный тест (`scripts/bench_*.py --json`) и складывает их результаты
+в один JSON вместе с хэшем коммита: `bench-results/<время>-<коммит>.json`.
+С `--compare` печатает изменения числовых метрик относительно прошлого файла.
+
+Запуск из корня репозитория:
+
+    python scripts/bench_suite.py
+    python scripts/bench_suite.py --only memory tools --compare bench-results/<файл>.json
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Имя → аргументы; параметры подобраны так, чтобы весь набор шёл пару минут
+BENCHMARKS: dict[str, list[str]] = {
+    "memory": ["bench_memory.py", "--users", "50", "--messages", "20"],
+    "tools": ["bench_tools.py", "--tools", "4", "--delay", "0.1"],
+    "offload": ["bench_offload.py", "--pages", "1000"],
+    "agent": ["bench_agent.py", "--messages", "20"],
+    "app": ["bench_app.py", "--requests", "500", "--concurrency", "20"],
+    "cold_start": ["bench_cold_start.py", "--runs", "5"],
+    "backends": ["bench_backends.py", "--backends", "3", "--requests", "300"],
+    "shards": ["bench_shards.py", "--shards", "1", "2", "4", "--users", "128"],
+    "load": ["bench_load.py", "--users", "20", "--duration", "20"],
+}
+
+
+def git_revision() -> str:
+    try:
+        sha = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                               capture_output=True, text=True).stdout.strip()
+        return f"{sha}-dirty" if dirty else sha
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_benchmark(name: str) -> dict[str, Any]:
+    script, *args = BENCHMARKS[name]
+    started = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, str(ROOT / "scripts" / script), *args, "--json"],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if out.returncode != 0:
+        return {"error": out.stderr.strip().splitlines()[-1:] or [f"exit {out.returncode}"]}
+    result = json.loads(out.stdout)
+    result["_wall_s"] = round(time.perf_counter() - started, 1)
+    return result
+
+
+def flatten(data: Any, prefix: str = "") -> dict[str, float]:
+    """Числовые листья вложенного словаря: {"load.latency.p95_ms": 12.3, ...}."""
+    flat: dict[str, float] = {}
+    if isinstance(data, dict):
+        for key, value in data.items():
+            flat.update(flatten(value, f"{prefix}.{key}" if prefix else str(key)))
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        flat[prefix] = float(data)
+    return flat
+
+
+def compare(current: dict[str, Any], baseline: dict[str, Any]) -> None:
+    now = flatten(current["benchmarks"])
+    before = flatten(baseline["benchmarks"])
+    print(f"\nСравнение с {baseline.get('revision', '?')} ({baseline.get('timestamp', '?')}):")
+    for key in sorted(now.keys() & before.keys()):
+        if key.endswith("_wall_s"):
+            continue
+        old, new = before[key], now[key]
+        delta = (new - old) / old * 100 if old else 0.0
+        mark = "  " if abs(delta) < 10 else "!!"
+        print(f"  {mark} {key:<45}{old:>12.2f} → {new:<12.2f}{delta:+7.1f}%")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="запустить только эти")
+    parser.add_argument("--output-dir", default=str(ROOT / "bench-results"))
+    parser.add_argument("--compare", help="файл результатов, с которым сравнить")
+    args = parser.parse_args()
+
+    report: dict[str, Any] = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "benchmarks": {},
+    }
+    for name in args.only or list(BENCHMARKS):
+        print(f"→ {name} ...", flush=True)
+        report["benchmarks"][name] = run_benchmark(name)
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    path = output_dir / f"{time.strftime('%Y%m%d-%H%M%S')}-{report['revision']}.json"
+    path.write_text(json.dumps(report, ensure_ascii=False, indent=2))
+    print(f"Результаты: {path}")
+
+    if args.compare:
+        compare(report, json.loads(Path(args.compare).read_text()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
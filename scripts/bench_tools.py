@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Бенчмарк `ToolRouter`: стоимость выбора инструментов и выигрыш от параллельного запуска.
+
+1. Выбор: сколько микросекунд уходит на сопоставление текста с ключевыми
+   словами всех инструментов (одно скомпилированное регулярное выражение).
+2. Выполнение: `--tools` инструментов-имитаций с задержкой `--delay` срабатывают
+   на одно сообщение; сравнивается последовательный запуск с `route()`.
+
+Запуск из корня репозитория:
+
+    python scripts/bench_tools.py --tools 4 --delay 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core.tools import Tool, ToolRouter  # noqa: E402
+
+
+class SleepTool(Tool):
+    def __init__(self, index: int, delay: float) -> None:
+        self.index = index
+        self.delay = delay
+        self.keywords = (f"инструмент{index}", "все")
+
+    def name(self) -> str:
+        return f"sleep_{self.index}"
+
+    async def execute(self, input_data: dict[str, Any]) -> str:
+        await asyncio.sleep(self.delay)
+        return f"результат {self.index}"
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tools", type=int, default=4)
+    parser.add_argument("--delay", type=float, default=0.2, help="задержка каждого инструмента, с")
+    parser.add_argument("--messages", type=int, default=20000, help="сообщений для замера выбора")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    tools = [SleepTool(i, args.delay) for i in range(args.tools)]
+    router = ToolRouter(tools)
+
+    texts = [
+        "Привет! Как дела, что нового?",
+        "найди мне, пожалуйста, расписание поездов",
+        "Расскажи длинную историю про " + "очень " * 50 + "далёкие страны",
+    ]
+    started = time.perf_counter()
+    for i in range(args.messages):
+        router.select({"text": texts[i % len(texts)]})
+    select_us = (time.perf_counter() - started) / args.messages * 1e6
+
+    context = {"text": "запусти все"}
+    started = time.perf_counter()
+    for tool in router.select(context):
+        await tool.execute(tool.build_input(context))
+    sequential = time.perf_counter() - started
+
+    started = time.perf_counter()
+    await router.route(context)
+    concurrent = time.perf_counter() - started
+
+    results = {
+        "tools": args.tools,
+        "select_us_per_msg": round(select_us, 2),
+        "sequential_ms": round(sequential * 1000, 2),
+        "concurrent_ms": round(concurrent * 1000, 2),
+        "speedup": round(sequential / concurrent, 2),
+    }
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        for key, value in results.items():
+            print(f"{key:<20}{value:>10}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""Имитация DuckDuckGo Instant Answer API для бенчмарков.
+
+Отвечает на `GET /?q=...&format=json` так же, как настоящий API:
+`AbstractText` или `RelatedTopics`, а для доли запросов (`--empty-share`)
+— пустым результатом. Ядро направляется на имитацию через `DDG_BASE_URL`.
+
+    python scripts/fake_ddg.py --port 8900 --latency-ms 150
+"""
+
+import argparse
+import asyncio
+import hashlib
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+
+class FakeDuckDuckGo:
+    """Состояние и ASGI-приложение имитации."""
+
+    def __init__(self, latency: float = 0.1, empty_share: float = 0.2) -> None:
+        self.latency = latency
+        self.empty_share = empty_share
+        self.requests = 0
+        self.app = Starlette(routes=[Route("/", self.search, methods=["GET"])])
+
+    def stats(self) -> dict[str, float]:
+        return {"requests": self.requests}
+
+    async def search(self, request: Request) -> Response:
+        self.requests += 1
+        query = request.query_params.get("q", "")
+        await asyncio.sleep(self.latency)
+
+        # Пустой ли ответ, зависит только от запроса — как у настоящего API
+        bucket = hashlib.blake2b(query.encode(), digest_size=2).digest()[0] / 255
+        if bucket < self.empty_share:
+            return JSONResponse({"AbstractText": "", "RelatedTopics": []})
+        return JSONResponse(
+            {
+                "AbstractText": f"{query} — краткая справка из имитации DuckDuckGo.",
+                "RelatedTopics": [{"Text": f"Связанная тема: {query}"}],
+            }
+        )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=100.0)
+    parser.add_argument("--empty-share", type=float, default=0.2)
+    args = parser.parse_args()
+
+    fake = FakeDuckDuckGo(latency=args.latency_ms / 1000, empty_share=args.empty_share)
+    uvicorn.run(fake.app, host=args.host, port=args.port, log_level="warning")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
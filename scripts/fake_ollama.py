@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""Имитация Ollama для бенчмарков: `/api/chat`, `/api/embed`, `/api/tags`.
+
+Поведение приближено к настоящему серверу:
+
+- одновременно обрабатывается не больше `--slots` запросов (как
+  `OLLAMA_NUM_PARALLEL`), остальные ждут;
+- у каждого слота свой KV-кэш: из промпта заново «вычисляются» только токены
+  после общего с прошлым запросом этого слота префикса, запрос попадает в слот
+  с самым длинным совпадением — так видно, насколько стабилен префикс;
+- `latency` — фиксированная задержка перед обработкой (сеть, планирование),
+  стоимость вычисления промпта и генерации задаётся на токен, в ответе те же
+  поля `prompt_eval_count`, `prompt_eval_duration`, `eval_count`, … что у Ollama;
+- сбои для проверки пула бэкендов: `failing` — все запросы отвечают 500,
+  `stall_rate` — доля запросов, которые перед ответом «зависают» на `stall`
+  секунд (хвост задержек).
+
+Отдельный сервер (по умолчанию на порту Ollama):
+
+    python scripts/fake_ollama.py --port 11434
+
+В бенчмарках — через `FakeOllama(...).app` и `serve()`.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import json
+import random
+import re
+import time
+from collections.abc import AsyncIterator
+from typing import Any
+
+import numpy as np
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import ClientDisconnect, Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+def tokenize(messages: list[dict[str, Any]]) -> list[str]:
+    """Грубая токенизация чата: роль-разделитель и слова/знаки содержимого."""
+    tokens: list[str] = []
+    for message in messages:
+        tokens.append(f"<|{message.get('role', 'user')}|>")
+        tokens.extend(_TOKEN_RE.findall(str(message.get("content", ""))))
+    return tokens
+
+
+def _common_prefix(a: list[str], b: list[str]) -> int:
+    n = min(len(a), len(b))
+    for i in range(n):
+        if a[i] != b[i]:
+            return i
+    return n
+
+
+class FakeOllama:
+    """Состояние и ASGI-приложение имитации."""
+
+    def __init__(
+        self,
+        model: str = "llama3.2",
+        slots: int = 1,
+        prompt_eval_per_token: float = 0.0005,
+        eval_per_token: float = 0.005,
+        reply_tokens: int = 30,
+        embed_dim: int = 768,
+        load_delay: float = 0.0,
+        latency: float = 0.0,
+        stall_rate: float = 0.0,
+        stall: float = 1.0,
+        seed: int | None = None,
+    ) -> None:
+        self.model = model
+        self.latency = latency
+        self.stall_rate = stall_rate
+        self.stall = stall
+        self.failing = False
+        self._random = random.Random(seed)
+        self.prompt_eval_per_token = prompt_eval_per_token
+        self.eval_per_token = eval_per_token
+        self.reply_tokens = reply_tokens
+        self.embed_dim = embed_dim
+        self.load_delay = load_delay
+        self._loaded = False
+        self._semaphore = asyncio.Semaphore(slots)
+        # KV-кэш слотов: последовательность токенов и время последнего использования
+        self._slots: list[tuple[list[str], float]] = [([], 0.0) for _ in range(slots)]
+        self._busy: set[int] = set()
+
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.prompt_eval_seconds = 0.0
+        self.embed_requests = 0
+        self.failed = 0
+        self.stalled = 0
+
+        self.app = Starlette(
+            routes=[
+                Route("/", self.root, methods=["GET"]),
+                Route("/api/tags", self.tags, methods=["GET"]),
+                Route("/api/chat", self.chat, methods=["POST"]),
+                Route("/api/embed", self.embed, methods=["POST"]),
+            ]
+        )
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "prefix_hit_rate": self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+            "prompt_eval_seconds": round(self.prompt_eval_seconds, 3),
+            "embed_requests": self.embed_requests,
+            "failed": self.failed,
+            "stalled": self.stalled,
+        }
+
+    def reset_stats(self) -> None:
+        self.requests = self.prompt_tokens = self.cached_tokens = self.embed_requests = 0
+        self.failed = self.stalled = 0
+        self.prompt_eval_seconds = 0.0
+
+    async def root(self, _: Request) -> Response:
+        return Response("Ollama is running")
+
+    async def tags(self, _: Request) -> Response:
+        if self.failing:
+            return JSONResponse({"error": "fake failure"}, status_code=500)
+        return JSONResponse({"models": [{"name": f"{self.model}:latest", "model": f"{self.model}:latest"}]})
+
+    def _acquire_slot(self, tokens: list[str]) -> tuple[int, int]:
+        best, best_prefix = -1, -1
+        for index, (cached, used_at) in enumerate(self._slots):
+            if index in self._busy:
+                continue
+            prefix = _common_prefix(cached, tokens)
+            # При равном совпадении берём давно не использованный слот
+            if prefix > best_prefix or (prefix == best_prefix and used_at < self._slots[best][1]):
+                best, best_prefix = index, prefix
+        self._busy.add(best)
+        return best, best_prefix
+
+    def _reply(self, messages: list[dict[str, Any]]) -> list[str]:
+        last = str(messages[-1].get("content", "")) if messages else ""
+        seed = int.from_bytes(hashlib.blake2b(last.encode(), digest_size=4).digest(), "little")
+        words = ["ответ", "на", "вопрос"] + [f"слово{(seed + i) % 97}" for i in range(self.reply_tokens)]
+        return [w + " " for w in words[: self.reply_tokens]]
+
+    async def chat(self, request: Request) -> Response:
+        try:
+            body = json.loads(await request.body())
+        except ClientDisconnect:
+            # Клиент отменил запрос (например, проигравший дубль хеджирования)
+            return Response(status_code=499)
+        messages = body.get("messages") or []
+        stream = body.get("stream", True)
+        started = time.perf_counter()
+
+        if self.failing:
+            self.failed += 1
+            return JSONResponse({"error": "fake failure"}, status_code=500)
+        if not self._loaded:
+            await asyncio.sleep(self.load_delay)
+            self._loaded = True
+        if not messages:
+            return JSONResponse({"model": self.model, "done": True, "done_reason": "load", "message": {"role": "assistant", "content": ""}})
+
+        tokens = tokenize(messages)
+        reply = self._reply(messages)
+
+        async def run() -> AsyncIterator[dict[str, Any]]:
+            async with self._semaphore:
+                slot, cached = self._acquire_slot(tokens)
+                try:
+                    await asyncio.sleep(self.latency)
+                    if self.stall_rate and self._random.random() < self.stall_rate:
+                        self.stalled += 1
+                        await asyncio.sleep(self.stall)
+                    evaluated = len(tokens) - cached
+                    eval_started = time.perf_counter()
+                    await asyncio.sleep(evaluated * self.prompt_eval_per_token)
+                    prompt_eval = time.perf_counter() - eval_started
+
+                    self.requests += 1
+                    self.prompt_tokens += len(tokens)
+                    self.cached_tokens += cached
+                    self.prompt_eval_seconds += prompt_eval
+
+                    gen_started = time.perf_counter()
+                    for piece in reply:
+                        await asyncio.sleep(self.eval_per_token)
+                        yield {"model": self.model, "message": {"role": "assistant", "content": piece}, "done": False}
+                    generated = tokens + ["<|assistant|>"] + _TOKEN_RE.findall("".join(reply))
+                    self._slots[slot] = (generated, time.monotonic())
+                    yield {
+                        "model": self.model,
+                        "message": {"role": "assistant", "content": ""},
+                        "done": True,
+                        "done_reason": "stop",
+                        "total_duration": int((time.perf_counter() - started) * 1e9),
+                        "load_duration": 0,
+                        "prompt_eval_count": evaluated,
+                        "prompt_eval_duration": int(prompt_eval * 1e9),
+                        "eval_count": len(reply),
+                        "eval_duration": int((time.perf_counter() - gen_started) * 1e9),
+                    }
+                finally:
+                    self._busy.discard(slot)
+
+        if stream:
+            async def lines() -> AsyncIterator[bytes]:
+                async for item in run():
+                    yield json.dumps(item, ensure_ascii=False).encode() + b"\n"
+
+            return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+        content: list[str] = []
+        final: dict[str, Any] = {}
+        async for item in run():
+            content.append(item["message"]["content"])
+            final = item
+        final["message"] = {"role": "assistant", "content": "".join(content)}
+        return JSONResponse(final)
+
+    async def embed(self, request: Request) -> Response:
+        body = json.loads(await request.body())
+        inputs = body.get("input") or []
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        self.embed_requests += 1
+        vectors = []
+        for text in inputs:
+            seed = int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "little")
+            vectors.append(np.random.default_rng(seed).standard_normal(self.embed_dim).round(5).tolist())
+        return JSONResponse({"model": body.get("model"), "embeddings": vectors})
+
+
+@contextlib.asynccontextmanager
+async def serve(app: Any, host: str = "127.0.0.1", port: int = 0) -> AsyncIterator[str]:
+    """Запустить ASGI-приложение на настоящем сокете в текущем event loop; отдаёт базовый URL."""
+    config = uvicorn.Config(app, host=host, port=port, log_level="warning", lifespan="off")
+    server = uvicorn.Server(config)
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.01)
+    bound_port = server.servers[0].sockets[0].getsockname()[1]
+    try:
+        yield f"http://{host}:{bound_port}"
+    finally:
+        server.should_exit = True
+        await task
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--slots", type=int, default=1)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="задержка перед обработкой")
+    parser.add_argument("--prompt-eval-ms", type=float, default=0.5, help="на токен промпта")
+    parser.add_argument("--eval-ms", type=float, default=5.0, help="на токен ответа")
+    parser.add_argument("--reply-tokens", type=int, default=30)
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="доля «зависающих» запросов")
+    parser.add_argument("--stall-ms", type=float, default=1000.0, help="длительность зависания")
+    args = parser.parse_args()
+
+    fake = FakeOllama(
+        slots=args.slots,
+        prompt_eval_per_token=args.prompt_eval_ms / 1000,
+        eval_per_token=args.eval_ms / 1000,
+        reply_tokens=args.reply_tokens,
+        latency=args.latency_ms / 1000,
+        stall_rate=args.stall_rate,
+        stall=args.stall_ms / 1000,
+    )
+    uvicorn.run(fake.app, host=args.host, port=args.port, log_level="warning")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
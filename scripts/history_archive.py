@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""Обслуживание архива истории: перенос, выгрузка, загрузка, статистика.
+
+Запуск из корня репозитория (пути — как у ядра, из `CORE_DB_PATH` и `ARCHIVE_DIR`):
+
+    python scripts/history_archive.py archive --days 90
+    python scripts/history_archive.py export history.jsonl.zst
+    python scripts/history_archive.py import history.jsonl.zst
+    python scripts/history_archive.py import other-node.jsonl.zst --remap
+    python scripts/history_archive.py stats
+
+Выгрузка сжимается по расширению файла: `.zst` (нужен zstandard), `.gz`
+или без сжатия; `-` — в stdout / из stdin. Перенос можно запускать при
+работающем ядре: архивирует только один процесс (файловая блокировка).
+"""
+
+import argparse
+import asyncio
+import contextlib
+import gzip
+import io
+import json
+import os
+import sys
+from collections.abc import Iterator
+from pathlib import Path
+from typing import IO
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from core.archive import HistoryArchive, ImportConflict, RetentionManager, export_jsonl, import_jsonl  # noqa: E402
+from core.memory import Memory  # noqa: E402
+
+
+@contextlib.contextmanager
+def open_stream(name: str, mode: str) -> Iterator[IO[bytes]]:
+    """Файл выгрузки (`mode` — "rb"/"wb") со сжатием по расширению."""
+    if name == "-":
+        yield sys.stdout.buffer if mode == "wb" else sys.stdin.buffer
+        return
+    if name.endswith(".gz"):
+        with gzip.open(name, mode) as file:
+            yield file
+        return
+    if name.endswith(".zst"):
+        import zstandard
+
+        with open(name, mode) as raw:
+            if mode == "wb":
+                with zstandard.ZstdCompressor().stream_writer(raw) as file:
+                    yield file
+            else:
+                # Потоковый распаковщик не умеет readline — построчное чтение даёт буфер
+                with io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw)) as file:
+                    yield file
+        return
+    with open(name, mode) as file:
+        yield file
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=os.getenv("CORE_DB_PATH", "data/core.db"))
+    parser.add_argument("--archive", default=os.getenv("ARCHIVE_DIR", "data/archive"))
+    parser.add_argument("--json", action="store_true")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    archive_cmd = commands.add_parser("archive", help="перенести старые сообщения в архив")
+    archive_cmd.add_argument("--days", type=float, default=float(os.getenv("RETENTION_DAYS", "90")))
+    archive_cmd.add_argument("--keep-recent", type=int, default=int(os.getenv("AGENT_HISTORY_LIMIT", "20")))
+    export_cmd = commands.add_parser("export", help="выгрузить всю историю в JSONL")
+    export_cmd.add_argument("path")
+    export_cmd.add_argument("--user", action="append", help="только эти пользователи")
+    import_cmd = commands.add_parser("import", help="загрузить JSONL-выгрузку в БД")
+    import_cmd.add_argument("path")
+    import_cmd.add_argument(
+        "--remap", action="store_true", help="строкам с занятыми id выдать новые (слияние выгрузок)"
+    )
+    commands.add_parser("stats", help="размер архива и БД")
+    args = parser.parse_args()
+
+    archive = HistoryArchive(args.archive)
+    memory = await asyncio.to_thread(Memory, args.db, archive=archive)
+    try:
+        if args.command == "archive":
+            retention = RetentionManager(memory, archive, max_age_days=args.days, keep_recent=args.keep_recent)
+            result = {"archived": await retention.run_once()}
+        elif args.command == "export":
+            with open_stream(args.path, "wb") as out:
+                result = {"exported": await export_jsonl(memory, out.write, args.user)}
+        elif args.command == "import":
+            with open_stream(args.path, "rb") as src:
+                result = await import_jsonl(memory, src, remap=args.remap)
+        else:
+            hot = await memory.engine.read(lambda conn: conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0])
+            result = {"hot_messages": hot, **await asyncio.to_thread(archive.stats)}
+    except ImportConflict as exc:
+        print(exc, file=sys.stderr)
+        return 1
+    finally:
+        await memory.aclose()
+
+    # При выгрузке в stdout отчёт уходит в stderr, чтобы не смешиваться с данными
+    report = sys.stderr if getattr(args, "path", None) == "-" else sys.stdout
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False), file=report)
+    else:
+        for key, value in result.items():
+            print(f"{key}: {value}", file=report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
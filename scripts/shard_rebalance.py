@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Обслуживание шардов хранилища: перенос пользователей на новую раскладку, статистика.
+
+Запуск из корня репозитория (пути — как у ядра, из `CORE_SHARD_DIR`, `ARCHIVE_DIR`
+и `SEMANTIC_INDEX_DIR`):
+
+    python scripts/shard_rebalance.py stats
+    python scripts/shard_rebalance.py rebalance --shards 6 --dry-run
+    python scripts/shard_rebalance.py rebalance --shards 6
+
+`rebalance` требует остановленного ядра (проверяется по блокировке
+каталога шардов) и переносит только пользователей, которых новое кольцо
+отдаёт другому шарду; после него ядро запускается с `CORE_SHARDS=6`.
+`stats` можно запускать при работающем ядре.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Any
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from core.sharding import LAYOUT_FILE, open_shard, parse_shards, read_layout, rebalance  # noqa: E402
+
+
+async def shard_stats(root: Path, archive_dir: Path) -> dict[str, Any]:
+    """Пользователи, сообщения и размер файлов каждого шарда текущей раскладки."""
+    ring = read_layout(root)
+    if ring is None:
+        raise SystemExit(f"В {root} нет {LAYOUT_FILE}: шарды ещё не создавались")
+    result: dict[str, Any] = {}
+    for name in ring.shards:
+        memory = await asyncio.to_thread(open_shard, root, name, False, archive_dir)
+        try:
+            users, messages = await memory.engine.read(
+                lambda conn: conn.execute("SELECT COUNT(DISTINCT user_id), COUNT(*) FROM messages").fetchone()
+            )
+            archive = await asyncio.to_thread(memory.archive.stats) if memory.archive is not None else {}
+        finally:
+            await memory.aclose()
+        result[name] = {
+            "weight": ring.shards[name],
+            "users": users,
+            "hot_messages": messages,
+            "db_bytes": (root / f"{name}.db").stat().st_size,
+            "archive_users": archive.get("users", 0),
+            "archive_bytes": archive.get("compressed_bytes", 0),
+        }
+    return result
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dir", default=os.getenv("CORE_SHARD_DIR", "data/shards"))
+    parser.add_argument("--archive", default=os.getenv("ARCHIVE_DIR", "data/archive"))
+    parser.add_argument("--semantic", default=os.getenv("SEMANTIC_INDEX_DIR", "data/semantic"))
+    parser.add_argument("--json", action="store_true")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rebalance_cmd = commands.add_parser("rebalance", help="перенести пользователей на новую раскладку")
+    rebalance_cmd.add_argument("--shards", required=True, help="как CORE_SHARDS: число или имена[:вес] через запятую")
+    rebalance_cmd.add_argument("--dry-run", action="store_true", help="только показать план переноса")
+    commands.add_parser("stats", help="размер шардов текущей раскладки")
+    args = parser.parse_args()
+
+    root, archive_dir = Path(args.dir), Path(args.archive)
+    if args.command == "rebalance":
+        try:
+            result = await rebalance(
+                root, parse_shards(args.shards), archive_dir, dry_run=args.dry_run, semantic_dir=Path(args.semantic)
+            )
+        except RuntimeError as exc:
+            print(exc, file=sys.stderr)
+            return 1
+    else:
+        result = await shard_stats(root, archive_dir)
+
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+    else:
+        for key, value in result.items():
+            print(f"{key}: {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
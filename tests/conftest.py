@@ -0,0 +1,36 @@
+"""Общие настройки тестов ядра: корень репозитория в `sys.path`, как у scripts/, и фабрика агента."""
+
+import sys
+from collections.abc import Callable
+from pathlib import Path
+
+import httpx
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from core.agent import Agent  # noqa: E402
+from core.llm_client import LLMClient  # noqa: E402
+from core.llm_pool import BackendPool  # noqa: E402
+from core.media import MediaStore  # noqa: E402
+from core.memory import Memory  # noqa: E402
+
+OLLAMA_URL = "http://ollama.test"
+
+
+@pytest.fixture
+def make_agent(tmp_path: Path) -> Callable[..., Agent]:
+    """Агент с памятью и медиа во временном каталоге и Ollama на `httpx.MockTransport(handler)`."""
+
+    def make(handler: Callable[[httpx.Request], httpx.Response], **kwargs) -> Agent:
+        llm = LLMClient(
+            base_url=OLLAMA_URL,
+            pool=BackendPool([OLLAMA_URL], health_interval=0),
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        )
+        if "memory" not in kwargs:
+            kwargs["memory"] = Memory(str(tmp_path / "core.db"))
+        return Agent(llm_client=llm, media_store=MediaStore(tmp_path / "media"), **kwargs)
+
+    return make
@@ -0,0 +1,136 @@
+"""`Agent`: параллельные этапы с дедлайнами, потоковая обработка и сохранение ответа в память."""
+
+import asyncio
+import json
+import time
+from collections.abc import Callable
+from typing import Any
+
+import httpx
+import pytest
+
+from core.agent import Agent
+from core.llm_client import LLMStreamError
+from core.models import MessageIn, MessageOut
+
+
+def ndjson(*chunks: dict) -> Callable[[httpx.Request], httpx.Response]:
+    """Обработчик Ollama, отвечающий на каждый запрос одними и теми же строками NDJSON."""
+    body = "".join(json.dumps(chunk) + "\n" for chunk in chunks).encode()
+    return lambda request: httpx.Response(200, content=body)
+
+
+async def _outputs(agent: Agent, user_id: str) -> list[str]:
+    await asyncio.gather(*agent._background)
+    return [msg_out.text for _, msg_out in await agent.memory.get_recent_history(user_id)]
+
+
+def test_stream_saves_full_reply(make_agent: Callable[..., Agent]) -> None:
+    async def scenario() -> None:
+        agent = make_agent(ndjson(
+            {"message": {"content": "Привет, "}}, {"message": {"content": "мир"}, "done": True},
+        ))
+        try:
+            chunks = [chunk async for chunk in agent.process_stream(MessageIn("u1", "telegram", "привет"))]
+            assert chunks == ["Привет, ", "мир"]
+            assert await _outputs(agent, "u1") == ["Привет, мир"]
+        finally:
+            await agent.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_broken_stream_saves_only_partial_text(make_agent: Callable[..., Agent]) -> None:
+    async def scenario() -> None:
+        agent = make_agent(ndjson({"message": {"content": "Привет, "}}, {"error": "boom"}))
+        try:
+            chunks: list[str] = []
+            with pytest.raises(LLMStreamError):
+                async for chunk in agent.process_stream(MessageIn("u1", "telegram", "привет")):
+                    chunks.append(chunk)
+            assert chunks == ["Привет, "]
+            # Заглушка об ошибке в историю не попадает
+            assert await _outputs(agent, "u1") == ["Привет, "]
+        finally:
+            await agent.aclose()
+
+    asyncio.run(scenario())
+
+
+def _replying(payloads: list[dict]) -> Callable[[httpx.Request], httpx.Response]:
+    def handler(request: httpx.Request) -> httpx.Response:
+        payloads.append(json.loads(request.content))
+        return httpx.Response(200, json={"message": {"content": "ответ"}, "done": True})
+
+    return handler
+
+
+def test_independent_stages_run_concurrently(make_agent: Callable[..., Agent]) -> None:
+    async def scenario() -> None:
+        agent = make_agent(_replying([]))
+        profile, history = agent.memory.get_or_create_profile, agent.memory.get_recent_history
+
+        async def slow_profile(user_id: str) -> Any:
+            await asyncio.sleep(0.2)
+            return await profile(user_id)
+
+        async def slow_history(user_id: str, limit: int = 10) -> Any:
+            await asyncio.sleep(0.2)
+            return await history(user_id, limit)
+
+        agent.memory.get_or_create_profile = slow_profile
+        agent.memory.get_recent_history = slow_history
+        try:
+            started = time.perf_counter()
+            msg_out = await agent.process(MessageIn("u1", "mac_client", "привет"))
+            # Этапы по 0.2 с идут параллельно, а не друг за другом
+            assert time.perf_counter() - started < 0.35
+            assert msg_out.text == "ответ"
+            assert {"profile", "history", "tools", "llm"} <= msg_out.timings.keys()
+        finally:
+            await agent.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_slow_stage_degrades_to_default(make_agent: Callable[..., Agent]) -> None:
+    async def scenario() -> None:
+        payloads: list[dict] = []
+        agent = make_agent(_replying(payloads), memory_timeout=0.05)
+        await agent.memory.save_interaction(MessageIn("u1", "telegram", "раньше"), MessageOut("давно"))
+
+        async def stuck_history(user_id: str, limit: int = 10) -> Any:
+            await asyncio.sleep(10)
+
+        agent.memory.get_recent_history = stuck_history
+        try:
+            started = time.perf_counter()
+            msg_out = await agent.process(MessageIn("u1", "mac_client", "привет"))
+            assert time.perf_counter() - started < 1.0
+            assert msg_out.text == "ответ"
+            # Ответ собран без истории, а не ждал её
+            assert "давно" not in json.dumps(payloads[0], ensure_ascii=False)
+        finally:
+            await agent.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_stuck_tools_are_cut_by_outer_deadline(make_agent: Callable[..., Agent]) -> None:
+    async def scenario() -> None:
+        agent = make_agent(_replying([]), tool_timeout=0.05)
+
+        async def stuck_route(context: dict, timeout: float | None = None) -> str:
+            await asyncio.sleep(10)
+            return "не дождались"
+
+        agent.tool_router.route = stuck_route
+        try:
+            started = time.perf_counter()
+            msg_out = await agent.process(MessageIn("u1", "mac_client", "найди новости"))
+            assert time.perf_counter() - started < 1.5
+            assert msg_out.text == "ответ"
+        finally:
+            await agent.aclose()
+
+    asyncio.run(scenario())
@@ -0,0 +1,167 @@
+"""HTTP-приложение ядра: lifespan с одним агентом, `/v1/messages` целиком и потоком SSE."""
+
+import asyncio
+import contextlib
+import json
+from collections.abc import AsyncIterator, Callable
+
+import httpx
+import pytest
+
+from core.agent import Agent
+from core.app import create_app
+
+
+def ndjson(*chunks: dict) -> Callable[[httpx.Request], httpx.Response]:
+    body = "".join(json.dumps(chunk) + "\n" for chunk in chunks).encode()
+    return lambda request: httpx.Response(200, content=body)
+
+
+@contextlib.asynccontextmanager
+async def serve(agent: Agent, built: list[Agent] | None = None) -> AsyncIterator[httpx.AsyncClient]:
+    """Приложение с готовым агентом: lifespan запущен, клиент ходит в него без сети."""
+
+    async def factory() -> Agent:
+        if built is not None:
+            built.append(agent)
+        return agent
+
+    app = create_app(agent_factory=factory, warmup_llm=False)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://core") as client:
+            yield client
+
+
+def _events(body: str) -> list[tuple[str | None, dict]]:
+    events = []
+    for block in body.strip().split("\n\n"):
+        event = None
+        for line in block.splitlines():
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                events.append((event, json.loads(line[len("data:"):])))
+    return events
+
+
+async def _post(agent: Agent, payload: dict) -> httpx.Response:
+    async with serve(agent) as client:
+        return await client.post("/v1/messages", json=payload)
+
+
+def test_stream_ends_with_done(make_agent: Callable[..., Agent]) -> None:
+    agent = make_agent(ndjson({"message": {"content": "При"}}, {"message": {"content": "вет"}, "done": True}))
+    resp = asyncio.run(_post(agent, {"user_id": "u1", "text": "привет", "stream": True}))
+    assert resp.headers["content-type"].startswith("text/event-stream")
+    assert _events(resp.text) == [(None, {"delta": "При"}), (None, {"delta": "вет"}), ("done", {"text": "Привет"})]
+
+
+def test_broken_stream_ends_with_error_event(make_agent: Callable[..., Agent]) -> None:
+    agent = make_agent(ndjson({"message": {"content": "При"}}, {"error": "boom"}))
+    resp = asyncio.run(_post(agent, {"user_id": "u1", "text": "привет", "stream": True}))
+    events = _events(resp.text)
+    assert events[0] == (None, {"delta": "При"})
+    event, data = events[-1]
+    assert event == "error"
+    assert data["text"] == "При"
+    assert "boom" in data["error"]
+    assert all(event != "done" for event, _ in events)
+
+
+def test_one_agent_serves_all_requests(make_agent: Callable[..., Agent]) -> None:
+    async def scenario() -> None:
+        built: list[Agent] = []
+        agent = make_agent(lambda request: httpx.Response(200, json={"message": {"content": "ответ"}, "done": True}))
+        async with serve(agent, built) as client:
+            assert (await client.get("/health")).json() == {"status": "ok"}
+            for index in range(3):
+                resp = await client.post("/v1/messages", json={"user_id": "u1", "text": f"вопрос {index}"})
+                assert resp.status_code == 200
+                assert resp.json() == {"text": "ответ"}
+        assert built == [agent]
+        # Остановка приложения закрыла память агента
+        assert agent.memory.engine._closed
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("body", [b"{", b"\xff", b"[1]", b'"text"', b'{"text": 5}', b'{"media_data": "x"}'])
+def test_malformed_body_is_rejected(make_agent: Callable[..., Agent], body: bytes) -> None:
+    async def scenario() -> httpx.Response:
+        agent = make_agent(lambda request: httpx.Response(500))
+        async with serve(agent) as client:
+            return await client.post("/v1/messages", content=body)
+
+    resp = asyncio.run(scenario())
+    assert resp.status_code == 400
+    assert "error" in resp.json()
+
+
+def test_metrics_and_trace_id(make_agent: Callable[..., Agent]) -> None:
+    async def scenario() -> None:
+        agent = make_agent(lambda request: httpx.Response(200, json={"message": {"content": "ответ"}, "done": True}))
+        async with serve(agent) as client:
+            resp = await client.get("/health", headers={"X-Trace-Id": "abc123"})
+            assert resp.headers["x-trace-id"] == "abc123"
+            assert len((await client.get("/health")).headers["x-trace-id"]) == 16
+            text = (await client.get("/metrics")).text
+            assert 'core_http_request_seconds_count{route="/health",status="200"}' in text
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("seconds", ["abc", "0", "-5", "nan", ""])
+def test_profile_rejects_bad_duration(
+    make_agent: Callable[..., Agent], monkeypatch: pytest.MonkeyPatch, seconds: str
+) -> None:
+    monkeypatch.setenv("CORE_PROFILING", "1")
+
+    async def scenario() -> httpx.Response:
+        agent = make_agent(lambda request: httpx.Response(500))
+        async with serve(agent) as client:
+            return await client.get("/debug/profile", params={"seconds": seconds})
+
+    resp = asyncio.run(scenario())
+    assert resp.status_code == 400
+    assert "error" in resp.json()
+
+
+def test_profile_is_disabled_by_default(make_agent: Callable[..., Agent], monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.delenv("CORE_PROFILING", raising=False)
+
+    async def scenario() -> tuple[httpx.Response, httpx.Response]:
+        agent = make_agent(lambda request: httpx.Response(500))
+        async with serve(agent) as client:
+            disabled = await client.get("/debug/profile")
+            monkeypatch.setenv("CORE_PROFILING", "1")
+            enabled = await client.get("/debug/profile", params={"seconds": "0.05"})
+            return disabled, enabled
+
+    disabled, enabled = asyncio.run(scenario())
+    assert disabled.status_code == 404
+    assert enabled.status_code == 200
+
+
+def test_media_upload(make_agent: Callable[..., Agent]) -> None:
+    async def scenario() -> list[httpx.Response]:
+        agent = make_agent(lambda request: httpx.Response(500))
+        agent.media_store.max_bytes = 10
+        async with serve(agent) as client:
+
+            async def body(data: bytes) -> AsyncIterator[bytes]:
+                yield data
+
+            return [
+                await client.post("/v1/media", content=b"photo"),
+                await client.post("/v1/media", content=body(b"photo")),
+                await client.post("/v1/media", content=b"x" * 11),
+                await client.post("/v1/media", content=body(b"x" * 11)),
+            ]
+
+    created, repeated, declared, streamed = asyncio.run(scenario())
+    assert created.status_code == 201
+    assert repeated.status_code == 200
+    assert repeated.json()["sha256"] == created.json()["sha256"]
+    assert repeated.json()["deduplicated"]
+    # Слишком большой файл отклоняется и по Content-Length, и по ходу чтения
+    assert declared.status_code == streamed.status_code == 413
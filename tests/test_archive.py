@@ -0,0 +1,152 @@
+"""Архив истории: перенос `RetentionManager`, чтение через границу архив/БД, импорт JSONL."""
+
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from core.archive import HistoryArchive, ImportConflict, RetentionManager, export_jsonl, import_jsonl
+from core.memory import Memory
+from core.models import MessageIn, MessageOut
+
+# Граница «старее» в будущем: архивируется всё, кроме keep_recent последних
+FUTURE = "2999-01-01 00:00:00"
+
+
+def _memory(root: Path, name: str = "core") -> Memory:
+    return Memory(str(root / f"{name}.db"), archive=HistoryArchive(root / f"{name}-archive"))
+
+
+async def _chat(memory: Memory, user_id: str, count: int, prefix: str = "сообщение") -> None:
+    for index in range(count):
+        await memory.save_interaction(
+            MessageIn(user_id, "telegram", f"{prefix} {index}"), MessageOut(f"ответ {index}")
+        )
+
+
+async def _ids(memory: Memory, user_id: str, **kwargs) -> list[int]:
+    return [record["id"] async for record in memory.iter_history(user_id, **kwargs)]
+
+
+async def _hot_ids(memory: Memory, user_id: str) -> list[int]:
+    return await memory.engine.read(
+        lambda conn: [
+            row[0] for row in conn.execute("SELECT id FROM messages WHERE user_id = ? ORDER BY id", (user_id,))
+        ]
+    )
+
+
+def test_iter_history_across_archive_boundary(tmp_path: Path) -> None:
+    async def scenario() -> None:
+        memory = _memory(tmp_path)
+        try:
+            await _chat(memory, "u1", 10)
+            await _chat(memory, "u2", 2)
+            ids = await _ids(memory, "u1")
+
+            retention = RetentionManager(memory, memory.archive, keep_recent=3)
+            assert await retention.archive_user("u1", FUTURE) == 7
+            assert await _hot_ids(memory, "u1") == ids[7:]
+            assert memory.archive.last_id("u1") == ids[6]
+
+            records = [record async for record in memory.iter_history("u1")]
+            assert [record["id"] for record in records] == ids
+            assert [record["input"] for record in records] == [f"сообщение {index}" for index in range(10)]
+            assert await _ids(memory, "u1", descending=True) == ids[::-1]
+            # Курсоры и лимит работают поперёк границы в обе стороны
+            assert await _ids(memory, "u1", after=ids[4]) == ids[5:]
+            assert await _ids(memory, "u1", after=ids[4], limit=3) == ids[5:8]
+            assert await _ids(memory, "u1", before=ids[9], limit=4, descending=True) == ids[8:4:-1]
+            assert await _ids(memory, "u1", limit=8) == ids[:8]
+            # Другого пользователя проход не трогает
+            assert len(await _hot_ids(memory, "u2")) == 2
+            # Повторный проход ничего не переносит
+            assert await retention.archive_user("u1", FUTURE) == 0
+        finally:
+            await memory.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_repeat_pass_deletes_only_archived_rows(tmp_path: Path) -> None:
+    """Строки после сбоя между архивом и удалением: из БД уходят только те, что есть в архиве."""
+
+    async def scenario() -> None:
+        memory = _memory(tmp_path)
+        try:
+            await _chat(memory, "u1", 5)
+            ids = await _ids(memory, "u1")
+            records = [record async for record in memory.iter_history("u1")]
+            # Архив записан, а строки из БД не удалены; ids[2] в архив не попал
+            memory.archive.append("u1", [records[0], records[1], records[3]])
+
+            retention = RetentionManager(memory, memory.archive, keep_recent=10)
+            assert await retention.archive_user("u1", FUTURE) == 0
+            assert await _hot_ids(memory, "u1") == [ids[2], ids[4]]
+        finally:
+            await memory.aclose()
+
+    asyncio.run(scenario())
+
+
+async def _export(memory: Memory) -> list[bytes]:
+    lines: list[bytes] = []
+    await export_jsonl(memory, lines.append)
+    return lines
+
+
+def test_import_skips_existing_rows(tmp_path: Path) -> None:
+    async def scenario() -> None:
+        source, target = _memory(tmp_path, "source"), _memory(tmp_path, "target")
+        try:
+            await _chat(source, "u1", 6)
+            await RetentionManager(source, source.archive, keep_recent=2).archive_user("u1", FUTURE)
+            lines = await _export(source)
+            assert len(lines) == 6
+
+            assert await import_jsonl(target, lines) == {"imported": 6, "skipped": 0, "remapped": 0}
+            assert await _ids(target, "u1") == await _ids(source, "u1")
+            assert await import_jsonl(target, lines) == {"imported": 0, "skipped": 6, "remapped": 0}
+
+            # После архивации в цели строки лежат в архиве — повторный импорт их узнаёт
+            await RetentionManager(target, target.archive, keep_recent=1).archive_user("u1", FUTURE)
+            assert await import_jsonl(target, lines) == {"imported": 0, "skipped": 6, "remapped": 0}
+            assert len(await _ids(target, "u1")) == 6
+        finally:
+            await source.aclose()
+            await target.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_import_conflict_and_remap(tmp_path: Path) -> None:
+    async def scenario() -> None:
+        source, target = _memory(tmp_path, "source"), _memory(tmp_path, "target")
+        try:
+            await _chat(source, "u1", 4, prefix="с узла A")
+            await _chat(target, "u1", 3, prefix="с узла B")
+            lines = await _export(source)
+            before = await _ids(target, "u1")
+
+            # Те же id заняты другими сообщениями: без перенумерации — ошибка, ничего не вставлено
+            with pytest.raises(ImportConflict):
+                await import_jsonl(target, lines)
+            assert await _ids(target, "u1") == before
+
+            result = await import_jsonl(target, lines, remap=True)
+            # id 4 свободен в цели, но его занимает перенумерованная строка — тоже новый id
+            assert result == {"imported": 4, "skipped": 0, "remapped": 4}
+            records = [record async for record in target.iter_history("u1")]
+            assert [record["input"] for record in records] == [
+                *(f"с узла B {index}" for index in range(3)),
+                *(f"с узла A {index}" for index in range(4)),
+            ]
+            assert [record["id"] for record in records] == sorted(record["id"] for record in records)
+
+            # Повторный импорт узнаёт и перенумерованные, и вставленные как есть строки
+            assert await import_jsonl(target, lines, remap=True) == {"imported": 0, "skipped": 4, "remapped": 0}
+        finally:
+            await source.aclose()
+            await target.aclose()
+
+    asyncio.run(scenario())
@@ -0,0 +1,76 @@
+"""`HistoryCompactor`: сводка старой истории без последних `keep_recent` сообщений."""
+
+import asyncio
+import json
+
+import httpx
+
+from core.compaction import HistoryCompactor
+from core.llm_client import LLMClient
+from core.llm_pool import BackendPool
+from core.memory import Memory
+from core.models import MessageIn, MessageOut
+
+URL = "http://ollama.test"
+
+
+def _llm(prompts: list[str], fail: bool = False) -> LLMClient:
+    def handler(request: httpx.Request) -> httpx.Response:
+        if fail:
+            return httpx.Response(500)
+        prompts.append(json.loads(request.content)["messages"][-1]["content"])
+        return httpx.Response(200, json={"message": {"content": f"сводка {len(prompts)}"}, "done": True})
+
+    return LLMClient(
+        base_url=URL,
+        pool=BackendPool([URL], health_interval=0),
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+
+
+async def _fill(memory: Memory, user_id: str, count: int, start: int = 0) -> None:
+    for index in range(start, start + count):
+        await memory.save_interaction(MessageIn(user_id, "telegram", f"{user_id}-{index}"), MessageOut("ок"))
+
+
+def test_compacts_in_batches_and_keeps_recent(tmp_path) -> None:
+    async def scenario() -> None:
+        memory = Memory(str(tmp_path / "core.db"))
+        await _fill(memory, "u", 30)
+        await _fill(memory, "v", 5)
+        prompts: list[str] = []
+        llm = _llm(prompts)
+        compactor = HistoryCompactor(memory, llm, keep_recent=5, min_batch=5, max_batch=10)
+
+        assert await compactor.compact_all() == 1
+        summary, upto_id = await memory.get_summary("u")
+        assert summary == "сводка 1"
+        assert "u-0" in prompts[0] and "u-9" in prompts[0] and "u-10" not in prompts[0]
+
+        # Следующие пачки продолжают с прошлой сводки и не трогают последние 5 сообщений
+        assert await compactor.compact_user("u")
+        assert "сводка 1" in prompts[1] and "u-10" in prompts[1] and "u-19" in prompts[1]
+        assert await compactor.compact_user("u")
+        assert "u-20" in prompts[2] and "u-24" in prompts[2] and "u-25" not in prompts[2]
+        assert not await compactor.compact_user("u")
+        assert await memory.get_summary("v") is None
+        assert compactor.stats() == {"users": 3, "messages": 25}
+
+        await llm.aclose()
+        await memory.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_llm_failure_keeps_previous_summary(tmp_path) -> None:
+    async def scenario() -> None:
+        memory = Memory(str(tmp_path / "core.db"))
+        await _fill(memory, "u", 30)
+        llm = _llm([], fail=True)
+        compactor = HistoryCompactor(memory, llm, keep_recent=5, min_batch=5)
+        assert await compactor.compact_all() == 0
+        assert await memory.get_summary("u") is None
+        await llm.aclose()
+        await memory.aclose()
+
+    asyncio.run(scenario())
@@ -0,0 +1,90 @@
+"""`ContextBuilder`: упаковка контекста в бюджет токенов по приоритетам."""
+
+from core.context import ContextBuilder, count_tokens, truncate_to_tokens
+
+
+def _history(count: int, words: int = 10) -> list[tuple[str, str]]:
+    return [(f"вопрос {i} " + "слово " * words, f"ответ {i} " + "слово " * words) for i in range(count)]
+
+
+def test_truncate_fits_limit() -> None:
+    text = "длинный текст " * 200
+    cut = truncate_to_tokens(text, 50)
+    assert cut.endswith("…")
+    assert count_tokens(cut) <= 51
+    assert truncate_to_tokens("коротко", 50) == "коротко"
+    assert truncate_to_tokens("что угодно", 0) == ""
+
+
+def test_everything_fits_in_large_budget() -> None:
+    built = ContextBuilder(budget_tokens=10_000).build(
+        "система", "вопрос", history=_history(3), summary="сводка", memories=["было"], tool_result="данные"
+    )
+    assert built.included == {"history": 3, "memories": 1, "summary": 1, "tool": 1}
+    assert built.history[0]["role"] == "system"
+    assert built.prompt.startswith("вопрос")
+    assert "[Контекст от инструмента: данные]" in built.prompt
+
+
+def test_history_keeps_newest_whole_exchanges() -> None:
+    history = _history(50)
+    built = ContextBuilder(budget_tokens=300).build("система", "вопрос", history=history)
+    kept = built.included["history"]
+    assert 0 < kept < 50
+    assert built.tokens <= 300
+    # Берутся последние обмены, вопрос и ответ — вместе
+    assert built.history[-1]["content"] == history[-1][1]
+    assert built.history[0]["content"] == history[-kept][0]
+    assert len(built.history) == 2 * kept
+
+
+def test_tool_result_is_capped_by_share() -> None:
+    builder = ContextBuilder(budget_tokens=400, tool_share=0.25)
+    built = builder.build("система", "вопрос", history=_history(50), tool_result="факт " * 1000)
+    assert built.included["tool"] == 1
+    assert count_tokens(built.prompt) <= 400 * 0.25 + 10
+    # История занимает оставшийся бюджет
+    assert built.included["history"] > 0
+    assert built.tokens <= 400
+
+
+def test_long_request_is_truncated_to_half_budget() -> None:
+    built = ContextBuilder(budget_tokens=200).build("система", "очень длинный вопрос " * 200)
+    assert count_tokens(built.prompt) <= 100
+    assert built.tokens <= 200
+
+
+def test_stable_prefix_appends_until_overflow() -> None:
+    builder = ContextBuilder(budget_tokens=400, stable_prefix=True)
+    history = _history(3)
+    previous = builder.build("система", "вопрос", history=history, user_id="u").history
+    turns = 0
+    while builder.rewindows == 0:
+        history = history + [(f"новый вопрос {turns}", f"новый ответ {turns}")]
+        current = builder.build("система", "вопрос", history=history, user_id="u").history
+        turns += 1
+        if builder.rewindows == 0:
+            # Начало окна не меняется, новые обмены только дописываются
+            assert current[: len(previous)] == previous
+            assert current[-1]["content"] == history[-1][1]
+        previous = current
+    assert turns > 3
+
+    # После переполнения окно занимает не больше refill_share бюджета истории
+    assert sum(count_tokens(m["content"]) for m in previous) <= 400 * builder.refill_share
+    assert previous[-1]["content"] == history[-1][1]
+
+
+def test_sliding_window_moves_every_turn() -> None:
+    builder = ContextBuilder(budget_tokens=300, stable_prefix=False)
+    first = builder.build("система", "вопрос", history=_history(50), user_id="u").history
+    second = builder.build("система", "вопрос", history=_history(51), user_id="u").history
+    # Без якоря новый обмен вытесняет самый старый — префикс промпта меняется
+    assert second[0] != first[0]
+
+
+def test_anchor_is_per_user() -> None:
+    builder = ContextBuilder(budget_tokens=400, stable_prefix=True, max_anchors=1)
+    builder.build("система", "вопрос", history=_history(3), user_id="u")
+    builder.build("система", "вопрос", history=_history(3), user_id="v")
+    assert list(builder._anchors) == ["v"]
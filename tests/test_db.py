@@ -0,0 +1,67 @@
+"""`SQLiteEngine`: запросы вне event loop, транзакции писателя, прагмы соединений."""
+
+import asyncio
+import sqlite3
+import threading
+from pathlib import Path
+
+import pytest
+
+from core.db import SQLiteEngine
+
+
+def _create(conn: sqlite3.Connection) -> None:
+    conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)")
+
+
+def _names(conn: sqlite3.Connection) -> list[str]:
+    return [row[0] for row in conn.execute("SELECT name FROM items ORDER BY id")]
+
+
+def test_write_commits_and_readers_see_it(tmp_path: Path) -> None:
+    engine = SQLiteEngine(tmp_path / "core.db")
+    engine.write_sync(_create)
+
+    async def scenario() -> None:
+        loop_thread = threading.get_ident()
+        thread = await engine.write(
+            lambda conn: (conn.execute("INSERT INTO items (name) VALUES ('a')"), threading.get_ident())[1]
+        )
+        # Запрос выполняется в потоке-писателе, а не в event loop
+        assert thread != loop_thread
+        assert await engine.read(_names) == ["a"]
+        assert engine.writes == 1
+        await engine.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_failed_write_rolls_back(tmp_path: Path) -> None:
+    engine = SQLiteEngine(tmp_path / "core.db")
+    engine.write_sync(_create)
+
+    def broken(conn: sqlite3.Connection) -> None:
+        conn.execute("INSERT INTO items (name) VALUES ('lost')")
+        raise RuntimeError("сбой посреди транзакции")
+
+    async def scenario() -> None:
+        with pytest.raises(RuntimeError):
+            await engine.write(broken)
+        await engine.write(lambda conn: conn.execute("INSERT INTO items (name) VALUES ('kept')"))
+        assert await engine.read(_names) == ["kept"]
+        await engine.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_connections_use_wal_and_close_once(tmp_path: Path) -> None:
+    engine = SQLiteEngine(tmp_path / "core.db", readers=2)
+
+    async def scenario() -> None:
+        mode = await engine.read(lambda conn: conn.execute("PRAGMA journal_mode").fetchone()[0])
+        assert mode == "wal"
+        await engine.aclose()
+        # Повторное закрытие ничего не делает
+        await engine.aclose()
+
+    asyncio.run(scenario())
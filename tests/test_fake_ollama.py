@@ -0,0 +1,52 @@
+"""Имитация Ollama из scripts/: ответы в формате Ollama и кэш префикса по слотам."""
+
+import asyncio
+
+import httpx
+
+from core.llm_client import LLMClient
+from core.llm_pool import BackendPool
+from scripts.fake_ollama import FakeOllama
+
+URL = "http://ollama.test"
+
+
+def _client(fake: FakeOllama) -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=fake.app), base_url=URL)
+
+
+def test_repeated_prefix_is_not_evaluated_again() -> None:
+    async def scenario() -> None:
+        fake = FakeOllama(slots=1, prompt_eval_per_token=0, eval_per_token=0, reply_tokens=5)
+        async with _client(fake) as client:
+            first = [{"role": "system", "content": "ты помощник"}, {"role": "user", "content": "привет"}]
+            resp = await client.post("/api/chat", json={"messages": first, "stream": False})
+            # Роли — отдельные токены: <|system|> ты помощник <|user|> привет
+            assert resp.json()["prompt_eval_count"] == 5
+
+            # Следующий ход продолжает тот же диалог: вычисляется только новый хвост
+            reply = resp.json()["message"]
+            second = first + [reply, {"role": "user", "content": "как дела"}]
+            resp = await client.post("/api/chat", json={"messages": second, "stream": False})
+            assert resp.json()["prompt_eval_count"] == 3
+        assert fake.stats()["cached_tokens"] > 0
+
+    asyncio.run(scenario())
+
+
+def test_llm_client_talks_to_fake() -> None:
+    async def scenario() -> None:
+        fake = FakeOllama(prompt_eval_per_token=0, eval_per_token=0, reply_tokens=4)
+        llm = LLMClient(base_url=URL, pool=BackendPool([URL], health_interval=0), http_client=_client(fake))
+        assert await llm.warmup()
+        answer = await llm.generate("вопрос", use_cache=False)
+        assert answer.startswith("ответ на вопрос")
+        streamed = [chunk async for chunk in llm.stream("вопрос")]
+        assert "".join(streamed) == answer
+
+        fake.failing = True
+        assert not await llm.warmup()
+        assert fake.stats()["failed"] == 1
+        await llm.aclose()
+
+    asyncio.run(scenario())
@@ -0,0 +1,73 @@
+"""История пользователя: постраничное чтение по ключу и эндпоинт `/v1/history`."""
+
+import asyncio
+import json
+from collections.abc import Callable
+
+import httpx
+import pytest
+
+from core.agent import Agent
+from core.memory import Memory
+from core.models import MessageIn, MessageOut
+from test_app import serve
+
+
+async def _fill(memory: Memory) -> None:
+    for index in range(7):
+        await memory.save_interaction(MessageIn("u", "telegram", f"q{index}"), MessageOut(f"a{index}"))
+        await memory.save_interaction(MessageIn("v", "mac", f"чужое {index}"), MessageOut("нет"))
+
+
+def test_iter_history_pages_by_id(tmp_path) -> None:
+    async def scenario() -> None:
+        memory = Memory(str(tmp_path / "core.db"))
+        await _fill(memory)
+
+        async def inputs(**kwargs) -> list[str]:
+            return [record["input"] async for record in memory.iter_history("u", page_size=2, **kwargs)]
+
+        assert await inputs() == [f"q{index}" for index in range(7)]
+        assert await inputs(descending=True, limit=3) == ["q6", "q5", "q4"]
+
+        # Докачка с id последней полученной строки: ни пропусков, ни повторов
+        first = [record async for record in memory.iter_history("u", limit=3, page_size=2)]
+        rest = [record async for record in memory.iter_history("u", after=first[-1]["id"], page_size=2)]
+        assert [record["input"] for record in first + rest] == [f"q{index}" for index in range(7)]
+        assert await inputs(after=first[0]["id"], before=first[-1]["id"]) == ["q1"]
+        assert set(first[0]) == {
+            "id", "channel", "type", "input", "output", "input_media", "output_media", "created_at"
+        }
+        await memory.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_history_endpoint_streams_ndjson(make_agent: Callable[..., Agent]) -> None:
+    async def scenario() -> None:
+        agent = make_agent(lambda request: httpx.Response(500))
+        await _fill(agent.memory)
+        async with serve(agent) as client:
+            resp = await client.get("/v1/history", params={"user_id": "u", "limit": 2, "order": "desc"})
+            assert resp.headers["content-type"].startswith("application/x-ndjson")
+            records = [json.loads(line) for line in resp.text.splitlines()]
+            assert [record["output"] for record in records] == ["a6", "a5"]
+
+            resp = await client.get("/v1/history", params={"user_id": "u", "after": records[0]["id"]})
+            assert resp.text == ""
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize(
+    "params",
+    [{}, {"user_id": "u", "after": "-1"}, {"user_id": "u", "limit": "x"}, {"user_id": "u", "order": "sideways"}],
+)
+def test_history_endpoint_rejects_bad_params(make_agent: Callable[..., Agent], params: dict) -> None:
+    async def scenario() -> httpx.Response:
+        async with serve(make_agent(lambda request: httpx.Response(500))) as client:
+            return await client.get("/v1/history", params=params)
+
+    resp = asyncio.run(scenario())
+    assert resp.status_code == 400
+    assert "error" in resp.json()
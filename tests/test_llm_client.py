@@ -0,0 +1,149 @@
+"""`LLMClient`: общий пул соединений, лимит одновременных запросов, потоковые ответы."""
+
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from core.llm_client import LLMClient, LLMStreamError
+from core.llm_pool import BackendPool
+
+URL = "http://ollama.test"
+
+
+class FakeOllama:
+    """Обработчик `httpx.MockTransport`, считающий одновременные запросы к /api/chat."""
+
+    def __init__(self, delay: float = 0.0, chunks: list[dict] | None = None) -> None:
+        self.delay = delay
+        self.chunks = chunks
+        self.active = 0
+        self.peak = 0
+        self.payloads: list[dict] = []
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        payload = json.loads(request.content)
+        self.payloads.append(payload)
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.active -= 1
+        if payload.get("stream"):
+            body = "".join(json.dumps(chunk) + "\n" for chunk in self.chunks or [])
+            return httpx.Response(200, content=body.encode())
+        return httpx.Response(200, json={"message": {"content": "ответ"}, "done": True})
+
+
+def _client(fake: FakeOllama, max_in_flight: int = 2) -> LLMClient:
+    return LLMClient(
+        base_url=URL,
+        max_in_flight=max_in_flight,
+        pool=BackendPool([URL], capacity=max_in_flight, health_interval=0),
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(fake)),
+    )
+
+
+def test_concurrent_requests_are_capped() -> None:
+    async def scenario() -> None:
+        fake = FakeOllama(delay=0.02)
+        llm = _client(fake, max_in_flight=2)
+        answers = await asyncio.gather(*(llm.generate(f"вопрос {index}", use_cache=False) for index in range(6)))
+        assert answers == ["ответ"] * 6
+        assert fake.peak == 2
+        stats = llm.stats()
+        assert stats["requests"] == 6
+        assert stats["in_flight"] == 0
+        assert stats["max_wait"] > 0
+        await llm.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_requests_share_one_client() -> None:
+    async def scenario() -> None:
+        llm = _client(FakeOllama())
+        client = llm._get_client()
+        await llm.generate("раз", use_cache=False)
+        await llm.generate("два", use_cache=False)
+        # Один и тот же клиент (и пул соединений) на все запросы
+        assert llm._get_client() is client
+        await llm.aclose()
+        # Переданный снаружи клиент закрывает его владелец
+        assert not client.is_closed
+        await client.aclose()
+
+        owned = LLMClient(base_url=URL, pool=BackendPool([URL], health_interval=0))
+        own_client = owned._get_client()
+        await owned.aclose()
+        assert own_client.is_closed
+
+    asyncio.run(scenario())
+
+
+async def _collect(llm: LLMClient, prompt: str) -> list[str]:
+    return [chunk async for chunk in llm.stream(prompt, use_cache=False)]
+
+
+def test_every_request_sends_same_keep_alive_and_options() -> None:
+    async def scenario() -> None:
+        fake = FakeOllama(chunks=[{"message": {"content": "a"}, "done": True}])
+        llm = LLMClient(
+            base_url=URL,
+            pool=BackendPool([URL], health_interval=0),
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(fake)),
+            keep_alive="1h",
+            options={"num_ctx": 4096},
+        )
+        assert await llm.warmup()
+        await llm.generate("раз", use_cache=False)
+        async for _ in llm.stream("два"):
+            pass
+        # Другой num_ctx перезагрузил бы модель, поэтому он одинаков везде, включая прогрев
+        assert len(fake.payloads) == 3
+        assert all(p["keep_alive"] == "1h" and p["options"] == {"num_ctx": 4096} for p in fake.payloads)
+        assert fake.payloads[0]["messages"] == []
+        await llm.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_stream_yields_chunks_in_order() -> None:
+    async def scenario() -> None:
+        fake = FakeOllama(chunks=[
+            {"message": {"content": "При"}}, {"message": {"content": "вет"}}, {"message": {"content": ""}, "done": True},
+        ])
+        llm = _client(fake)
+        assert await _collect(llm, "привет") == ["При", "вет"]
+        assert fake.payloads[0]["stream"] is True
+        await llm.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_stream_error_before_first_chunk_is_a_stub() -> None:
+    async def scenario() -> None:
+        llm = _client(FakeOllama(chunks=[{"error": "model not found"}]))
+        chunks = await _collect(llm, "привет")
+        assert len(chunks) == 1 and chunks[0].startswith("[Ошибка LLM: model not found]")
+        await llm.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_stream_error_after_first_chunk_raises() -> None:
+    async def scenario() -> None:
+        llm = _client(FakeOllama(chunks=[{"message": {"content": "Нача"}}, {"error": "out of memory"}]))
+        received: list[str] = []
+        with pytest.raises(LLMStreamError) as caught:
+            async for chunk in llm.stream("привет", use_cache=False):
+                received.append(chunk)
+        # Заглушка не дописывается к уже отданному тексту
+        assert received == ["Нача"]
+        assert "out of memory" in caught.value.text
+        assert llm.pool.backends[0].outstanding == 0
+        await llm.aclose()
+
+    asyncio.run(scenario())
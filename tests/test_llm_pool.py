@@ -0,0 +1,181 @@
+"""`BackendPool`: балансировка, повтор на другом бэкенде, circuit breaker, хеджирование."""
+
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from core.llm_pool import Backend, BackendPool, CircuitBreaker, NoBackendAvailable
+
+
+def _failure(url: str) -> httpx.HTTPError:
+    return httpx.ConnectError(f"{url} не отвечает")
+
+
+def test_least_outstanding_backend_is_picked() -> None:
+    pool = BackendPool(["http://a", "http://b"], health_interval=0)
+    first = pool.pick()
+    first.outstanding += 1
+    second = pool.pick()
+    assert second is not first
+    second.outstanding += 1
+    # При равенстве — бэкенд, выбранный давнее
+    assert pool.pick() is first
+    assert pool.pick(exclude={first}) is second
+
+
+def test_failed_backend_is_retried_on_next() -> None:
+    async def scenario() -> None:
+        pool = BackendPool(["http://a", "http://b"], health_interval=0)
+
+        async def call(backend: Backend) -> str:
+            if backend.url == "http://a":
+                raise _failure(backend.url)
+            return "ответ"
+
+        for _ in range(2):
+            backend, result = await pool.call(call, "generate")
+            assert (backend.url, result) == ("http://b", "ответ")
+            pool.release(backend)
+        assert pool.stats()["failovers"] >= 1
+        assert [b.outstanding for b in pool.backends] == [0, 0]
+
+    asyncio.run(scenario())
+
+
+def test_request_errors_are_not_retried() -> None:
+    async def scenario() -> None:
+        pool = BackendPool(["http://a", "http://b"], health_interval=0)
+        calls: list[str] = []
+
+        async def call(backend: Backend) -> str:
+            calls.append(backend.url)
+            request = httpx.Request("POST", backend.url)
+            raise httpx.HTTPStatusError("400", request=request, response=httpx.Response(400, request=request))
+
+        with pytest.raises(httpx.HTTPStatusError):
+            await pool.call(call, "generate")
+        assert len(calls) == 1
+        # Ошибка запроса — не повод выключать бэкенд
+        assert all(b.breaker.state == "closed" and b.outstanding == 0 for b in pool.backends)
+
+    asyncio.run(scenario())
+
+
+def test_breaker_opens_and_probes_once() -> None:
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    assert not breaker.record_failure()
+    assert breaker.record_failure()
+    assert breaker.state == "open" and not breaker.available()
+
+    time.sleep(0.06)
+    assert breaker.available()
+    breaker.begin()
+    # Пока идёт пробный запрос, других не пускаем
+    assert breaker.state == "half_open" and not breaker.available()
+    assert breaker.record_failure()
+    assert breaker.state == "open"
+
+    breaker.half_open()
+    breaker.begin()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.available()
+
+
+def test_open_breakers_leave_no_backend() -> None:
+    async def scenario() -> None:
+        pool = BackendPool(["http://a"], failure_threshold=1, reset_timeout=60, health_interval=0)
+
+        async def call(backend: Backend) -> str:
+            raise _failure(backend.url)
+
+        with pytest.raises(httpx.ConnectError):
+            await pool.call(call, "generate")
+        with pytest.raises(NoBackendAvailable):
+            await pool.call(call, "generate")
+
+    asyncio.run(scenario())
+
+
+def _hedging_pool() -> BackendPool:
+    pool = BackendPool(
+        ["http://slow", "http://fast"], health_interval=0,
+        hedge_percentile=50, hedge_min_samples=1, hedge_max_ratio=1.0,
+    )
+    # Недавние задержки: дубль уходит через 20 мс без результата
+    for kind in ("generate", "stream"):
+        pool._latencies[kind].extend([0.02] * 5)
+    return pool
+
+
+def test_slow_request_is_hedged() -> None:
+    async def scenario() -> None:
+        pool = _hedging_pool()
+        cancelled: list[str] = []
+
+        async def call(backend: Backend) -> str:
+            try:
+                await asyncio.sleep(1.0 if backend.url == "http://slow" else 0.01)
+            except asyncio.CancelledError:
+                cancelled.append(backend.url)
+                raise
+            return backend.url
+
+        started = time.perf_counter()
+        backend, result = await pool.call(call, "generate")
+        pool.release(backend)
+        assert time.perf_counter() - started < 0.5
+        assert result == "http://fast"
+        assert cancelled == ["http://slow"]
+        assert pool.stats()["hedges"] == pool.stats()["hedge_wins"] == 1
+        # Отменённый дубль не считается ошибкой бэкенда
+        assert [(b.outstanding, b.failures, b.breaker.state) for b in pool.backends] == [(0, 0, "closed")] * 2
+
+    asyncio.run(scenario())
+
+
+def test_losing_attempt_error_does_not_drop_winner() -> None:
+    """Дубль упал ошибкой запроса одновременно с ответом победителя: победитель не теряется."""
+
+    async def scenario() -> tuple[str, list[str], list[int]]:
+        pool = _hedging_pool()
+        ready = asyncio.Event()
+        discarded: list[str] = []
+
+        async def call(backend: Backend) -> str:
+            if backend.url == "http://fast":
+                asyncio.get_running_loop().call_soon(ready.set)
+            await ready.wait()
+            if backend.url == "http://slow":
+                raise ValueError("ошибка запроса")
+            return "поток"
+
+        async def discard(result: str) -> None:
+            discarded.append(result)
+
+        backend, result = await pool.call(call, "stream", discard=discard)
+        pool.release(backend)
+        return result, discarded, [b.outstanding for b in pool.backends]
+
+    for _ in range(5):
+        assert asyncio.run(scenario()) == ("поток", [], [0, 0])
+
+
+def test_health_check_takes_backend_out() -> None:
+    async def scenario() -> None:
+        def handler(request: httpx.Request) -> httpx.Response:
+            return httpx.Response(500 if request.url.host == "a" else 200, json={"models": []})
+
+        pool = BackendPool(["http://a", "http://b"], failure_threshold=1, health_interval=0)
+        pool.backends[1].breaker.record_failure()
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            pool.start(client)
+            await pool.check_health()
+        a, b = pool.backends
+        assert not a.healthy and a.breaker.state == "closed"
+        # Ответивший бэкенд возвращается досрочно, не дожидаясь reset_timeout
+        assert b.healthy and b.breaker.state == "half_open"
+        assert pool.available() == [b]
+
+    asyncio.run(scenario())
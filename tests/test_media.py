@@ -0,0 +1,68 @@
+"""`MediaStore`: потоковая запись по SHA-256, дедупликация, лимит размера; разбор заголовков файлов."""
+
+import asyncio
+import hashlib
+import struct
+from collections.abc import AsyncIterator
+
+import pytest
+
+from core.media import MediaStore, MediaTooLarge, image_size, ogg_duration, sniff_format, text_preview
+
+
+async def _chunks(*parts: bytes) -> AsyncIterator[bytes]:
+    for part in parts:
+        yield part
+
+
+def test_save_streams_to_content_address(tmp_path) -> None:
+    store = MediaStore(tmp_path, write_buffer=4)
+    data = b"%PDF-1.7 " + b"x" * 20
+    stored = asyncio.run(store.save(_chunks(data[:5], data[5:12], data[12:])))
+    assert stored.sha256 == hashlib.sha256(data).hexdigest()
+    assert (stored.size, stored.deduplicated) == (len(data), False)
+
+    media = store.get(stored.sha256)
+    assert media.path == tmp_path / stored.sha256[:2] / stored.sha256
+    with media.map() as buf:
+        assert sniff_format(buf) == "pdf"
+        assert buf[:] == data
+
+
+def test_same_content_is_stored_once(tmp_path) -> None:
+    store = MediaStore(tmp_path)
+    first = asyncio.run(store.save(_chunks(b"photo")))
+    second = asyncio.run(store.save(_chunks(b"ph", b"oto")))
+    assert second.sha256 == first.sha256
+    assert second.deduplicated
+    assert store.stats() == {"saved": 1, "deduplicated": 1, "bytes_written": 5}
+    assert list((tmp_path / "tmp").iterdir()) == []
+
+
+def test_too_large_upload_leaves_nothing(tmp_path) -> None:
+    store = MediaStore(tmp_path, max_bytes=8)
+    with pytest.raises(MediaTooLarge):
+        asyncio.run(store.save(_chunks(b"12345", b"67890")))
+    assert list((tmp_path / "tmp").iterdir()) == []
+    assert store.stats()["saved"] == 0
+
+
+@pytest.mark.parametrize("digest", ["", "../etc/passwd", "A" * 64, "0" * 63, None])
+def test_get_rejects_bad_digests(tmp_path, digest) -> None:
+    assert MediaStore(tmp_path).get(digest) is None
+    assert MediaStore(tmp_path).get("0" * 64) is None
+
+
+def test_headers_are_parsed_without_decoding() -> None:
+    png = b"\x89PNG\r\n\x1a\n" + b"\x00\x00\x00\rIHDR" + struct.pack(">II", 640, 480)
+    assert image_size(png) == (640, 480)
+    gif = b"GIF89a" + struct.pack("<HH", 32, 16)
+    assert image_size(gif) == (32, 16)
+    jpeg = b"\xff\xd8" + b"\xff\xc0\x00\x11\x08" + struct.pack(">HH", 200, 300) + b"\x00" * 10
+    assert image_size(jpeg) == (300, 200)
+
+    ogg = b"OggS\x00\x00" + struct.pack("<q", 48000 * 3) + b"\x00" * 20
+    assert ogg_duration(b"OggS" + b"\x00" * 30 + ogg) == 3.0
+    assert text_preview("привет".encode()) == "привет"
+    assert text_preview(b"\x00\x01") is None
+    assert sniff_format(b"plain text") is None
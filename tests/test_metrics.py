@@ -0,0 +1,55 @@
+"""Метрики в формате Prometheus и сэмплирующий профилировщик."""
+
+import threading
+import time
+
+import pytest
+
+from core.metrics import Registry, SamplingProfiler
+
+
+def test_histogram_renders_cumulative_buckets() -> None:
+    registry = Registry()
+    histogram = registry.histogram("t_seconds", "Тест", ["stage"], buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value, "a")
+    lines = registry.render().splitlines()
+    assert 't_seconds_bucket{stage="a",le="0.1"} 1' in lines
+    assert 't_seconds_bucket{stage="a",le="1.0"} 3' in lines
+    assert 't_seconds_bucket{stage="a",le="+Inf"} 4' in lines
+    assert 't_seconds_count{stage="a"} 4' in lines
+
+
+def test_counter_escapes_labels_and_gauge_errors_are_skipped() -> None:
+    registry = Registry()
+    counter = registry.counter("t_total", "Тест", ["model"])
+    counter.inc('llama"3')
+    counter.inc('llama"3', amount=2)
+    registry.gauge("t_ok", "Работает", lambda: 7)
+    registry.gauge("t_broken", "Падает", lambda: 1 / 0)
+    text = registry.render()
+    assert 't_total{model="llama\\"3"} 3.0' in text
+    assert "t_ok 7.0" in text
+    assert "t_broken" not in text
+
+
+def test_profiler_collects_stacks_and_runs_once_at_a_time() -> None:
+    profiler = SamplingProfiler(interval=0.001)
+    stop = threading.Event()
+
+    def busy_worker() -> None:
+        while not stop.is_set():
+            time.sleep(0.001)
+
+    worker = threading.Thread(target=busy_worker, name="busy")
+    worker.start()
+    results: list[str] = []
+    first = threading.Thread(target=lambda: results.append(profiler.run(0.1)))
+    first.start()
+    time.sleep(0.02)
+    with pytest.raises(RuntimeError):
+        profiler.run(0.01)
+    first.join()
+    stop.set()
+    worker.join()
+    assert any(line.startswith("busy;") and "busy_worker" in line for line in results[0].splitlines())
@@ -0,0 +1,197 @@
+"""Миграции схемы `Memory`: перевод БД любой прежней версии на `SCHEMA_VERSION`."""
+
+import asyncio
+import sqlite3
+import threading
+from pathlib import Path
+
+import pytest
+
+from core.memory import Memory
+
+
+def _legacy_db(path: Path) -> None:
+    """БД до версионирования схемы: без `cache_responses`, `model_profile` и `user_version`."""
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        """
+        CREATE TABLE profiles (
+            user_id TEXT PRIMARY KEY,
+            telegram_id TEXT,
+            mac_username TEXT,
+            language TEXT DEFAULT 'ru',
+            tone TEXT DEFAULT 'friendly',
+            response_format TEXT DEFAULT 'text',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            channel TEXT NOT NULL,
+            message_type TEXT NOT NULL,
+            input_text TEXT,
+            output_text TEXT,
+            input_media TEXT,
+            output_media TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        INSERT INTO profiles (user_id, language) VALUES ('u1', 'en');
+        INSERT INTO messages (user_id, channel, message_type, input_text, output_text)
+            VALUES ('u1', 'telegram', 'text', 'привет', 'здравствуй');
+        """
+    )
+    conn.close()
+
+
+def _versioned_db(path: Path, version: int, early_additions: bool = False) -> None:
+    """
+    БД, созданная кодом со схемой версии `version`.
+
+    `early_additions` — БД прежнего кода, миграция 1 которого уже создавала
+    `summaries` и колонку `cache_responses`.
+    """
+    conn = sqlite3.connect(path)
+    for migration in Memory._MIGRATIONS[:version]:
+        migration(conn)
+    if early_additions:
+        Memory._migration_4_summaries(conn)
+        Memory._migration_5_cache_responses(conn)
+    conn.execute(f"PRAGMA user_version = {version}")
+    conn.execute("INSERT INTO profiles (user_id, language) VALUES ('u1', 'en')")
+    conn.execute(
+        "INSERT INTO messages (user_id, channel, message_type, input_text, output_text) "
+        "VALUES ('u1', 'telegram', 'text', 'привет', 'здравствуй')"
+    )
+    conn.commit()
+    conn.close()
+
+
+def _schema(path: Path) -> tuple[int, set[str], set[str], set[str]]:
+    conn = sqlite3.connect(path)
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(profiles)")}
+        indexes = {row[1] for row in conn.execute("PRAGMA index_list(messages)")}
+    finally:
+        conn.close()
+    return version, tables, columns, indexes
+
+
+@pytest.mark.parametrize(
+    ("version", "early_additions"),
+    [(0, False)]
+    + [(version, False) for version in range(1, len(Memory._MIGRATIONS))]
+    + [(version, True) for version in (1, 2, 3)],
+)
+def test_upgrade_from_old_version(tmp_path: Path, version: int, early_additions: bool) -> None:
+    path = tmp_path / "core.db"
+    if version == 0:
+        _legacy_db(path)
+    else:
+        _versioned_db(path, version, early_additions)
+
+    async def scenario() -> None:
+        memory = Memory(str(path))
+        try:
+            profile = await memory.get_or_create_profile("u1")
+            history = [record async for record in memory.iter_history("u1")]
+        finally:
+            await memory.aclose()
+        # Данные прежней версии сохранились, новые колонки получили значения по умолчанию
+        assert profile.language == "en"
+        assert profile.cache_responses
+        assert profile.model_profile == "auto"
+        assert [(record["input"], record["output"]) for record in history] == [("привет", "здравствуй")]
+
+    asyncio.run(scenario())
+
+    schema_version, tables, columns, indexes = _schema(path)
+    assert schema_version == Memory.SCHEMA_VERSION
+    assert "summaries" in tables
+    assert {"cache_responses", "model_profile"} <= columns
+    assert "idx_messages_user_id_id" in indexes
+    assert "idx_messages_user_id" not in indexes
+
+
+def test_new_db_and_reopen(tmp_path: Path) -> None:
+    path = tmp_path / "core.db"
+
+    async def scenario() -> None:
+        for _ in range(2):
+            memory = Memory(str(path))
+            await memory.aclose()
+
+    asyncio.run(scenario())
+    assert _schema(path)[0] == Memory.SCHEMA_VERSION
+
+
+
+def test_half_applied_migration_is_repeatable(tmp_path: Path) -> None:
+    """Колонка уже добавлена, а номер версии — нет: миграция 3 не падает на повторе."""
+    path = tmp_path / "core.db"
+    _versioned_db(path, 2)
+    conn = sqlite3.connect(path)
+    conn.execute("ALTER TABLE profiles ADD COLUMN model_profile TEXT DEFAULT 'auto'")
+    conn.commit()
+    conn.close()
+
+    async def scenario() -> None:
+        memory = Memory(str(path))
+        await memory.aclose()
+
+    asyncio.run(scenario())
+    assert _schema(path)[0] == Memory.SCHEMA_VERSION
+
+
+def test_failed_migration_rolls_back_whole_upgrade(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    path = tmp_path / "core.db"
+    _versioned_db(path, 1)
+
+    def broken(conn: sqlite3.Connection) -> None:
+        conn.execute("CREATE TABLE half_done (id INTEGER)")
+        raise sqlite3.OperationalError("сбой посреди миграции")
+
+    monkeypatch.setattr(Memory, "_MIGRATIONS", (*Memory._MIGRATIONS, broken))
+    with pytest.raises(sqlite3.OperationalError):
+        Memory(str(path))
+
+    # Ни одна из миграций 2..N не осталась применённой наполовину
+    version, tables, columns, indexes = _schema(path)
+    assert version == 1
+    assert "half_done" not in tables and "summaries" not in tables
+    assert "idx_messages_user_id_id" not in indexes
+
+    monkeypatch.undo()
+    asyncio.run(Memory(str(path)).aclose())
+    assert _schema(path)[0] == Memory.SCHEMA_VERSION
+
+
+def test_concurrent_openers_migrate_once(tmp_path: Path) -> None:
+    path = tmp_path / "core.db"
+    _legacy_db(path)
+    errors: list[BaseException] = []
+    memories: list[Memory] = []
+    barrier = threading.Barrier(4)
+
+    def open_memory() -> None:
+        barrier.wait()
+        try:
+            memories.append(Memory(str(path)))
+        except BaseException as exc:  # noqa: BLE001
+            errors.append(exc)
+
+    threads = [threading.Thread(target=open_memory) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    async def close_all() -> None:
+        for memory in memories:
+            await memory.aclose()
+
+    asyncio.run(close_all())
+    assert errors == []
+    assert _schema(path)[0] == Memory.SCHEMA_VERSION
@@ -0,0 +1,81 @@
+"""`ModelRouter`: выбор быстрой или сильной модели; заглушка называет выбранную модель."""
+
+import asyncio
+from collections.abc import Callable
+
+import httpx
+import pytest
+
+from core.agent import Agent
+from core.model_router import ModelRouter, Route, RoutingRules, looks_like_code, parse_duration
+from core.models import MessageIn
+
+
+@pytest.fixture
+def router() -> ModelRouter:
+    return ModelRouter(fast_model="small", strong_model="big")
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "Сегодня купил хлеб; завтра куплю молоко;",
+        "Напомни про встречу (в пятницу);",
+        "Список дел:\n- купить хлеб;\n- позвонить маме (вечером);\n- забрать посылку.",
+        "Мой ник в игре — {Кот}",
+        "I went to the store for (some) milk; then home;",
+    ],
+)
+def test_prose_with_code_punctuation_is_not_code(router: ModelRouter, text: str) -> None:
+    assert not looks_like_code(text)
+    assert router.route(text).reason != "code"
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "```\nx\n```",
+        "почини def parse(line): ...",
+        "что не так: print(x)",
+        "class Foo(Base): pass",
+        "SELECT id FROM users",
+        "почему падает:\nint x = 1;\nfoo(x);",
+        "if (ok) {\n  go();\n}",
+        "import os\nfrom pathlib import Path",
+    ],
+)
+def test_code_goes_to_strong_model(router: ModelRouter, text: str) -> None:
+    assert looks_like_code(text)
+    assert router.route(text) == Route("big", "code")
+
+
+def test_routing_rules(router: ModelRouter) -> None:
+    assert router.route("привет").model == "small"
+    assert router.route("объясни, как это работает").reason == "keyword"
+    assert router.route("а" * 300).reason == "long"
+    assert router.route("привет", tool_result="результат поиска").reason == "tools"
+    assert router.route("объясни", profile="fast").model == "small"
+    assert router.route("привет", profile="quality").model == "big"
+    # Неизвестный профиль — профиль по умолчанию
+    assert router.route("привет", profile="нет такого").reason == "short"
+
+    with pytest.raises(ValueError):
+        RoutingRules.from_dict({"force": "medium"})
+    with pytest.raises(ValueError):
+        RoutingRules.from_dict({"unknown": 1})
+    assert parse_duration("30m") == 1800
+
+
+def test_stub_names_routed_model(make_agent: Callable[..., Agent]) -> None:
+    def handler(request: httpx.Request) -> httpx.Response:
+        raise httpx.ConnectError("нет связи")
+
+    async def scenario() -> str:
+        agent = make_agent(handler, model_router=ModelRouter(fast_model="small", strong_model="big"))
+        try:
+            return (await agent.process(MessageIn("u", "telegram", "print(x) не работает"))).text
+        finally:
+            await agent.aclose()
+
+    text = asyncio.run(scenario())
+    assert "запусти модель big" in text
@@ -0,0 +1,120 @@
+"""`ProcessOffload`: результат из процесса, ошибки, таймаут и досрочный уход потребителя."""
+
+import asyncio
+import multiprocessing.process
+import time
+from collections.abc import Iterator
+
+import pytest
+
+from core.offload import OffloadBusy, OffloadError, ProcessOffload
+
+
+# Функции уровня модуля: процесс `spawn` импортирует их по имени
+def square(value: int) -> int:
+    return value * value
+
+
+def fail(message: str) -> None:
+    raise ValueError(message)
+
+
+def count_slowly(count: int, delay: float) -> Iterator[int]:
+    for index in range(count):
+        time.sleep(delay)
+        yield index
+
+
+async def _guard_loop(ticks: list[float]) -> None:
+    """Отмечать, насколько event loop опаздывает с пробуждением."""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        ticks.append(time.perf_counter() - started)
+
+
+def test_results_errors_and_reuse() -> None:
+    async def scenario() -> None:
+        offload = ProcessOffload(workers=1, timeout=30)
+        try:
+            assert await offload.run(square, 7) == 49
+            assert await offload.run(count_slowly, 3, 0) == [0, 1, 2]
+            with pytest.raises(OffloadError, match="ValueError: плохо"):
+                await offload.run(fail, "плохо")
+            # Ошибка функции не убивает процесс: он обслуживает следующие задачи
+            assert await offload.run(square, 3) == 9
+            assert offload.stats()["workers"] == 1
+            assert offload.stats()["killed"] == 0
+        finally:
+            await offload.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_timeout_kills_worker_without_blocking_loop(monkeypatch: pytest.MonkeyPatch) -> None:
+    join = multiprocessing.process.BaseProcess.join
+
+    def slow_join(self, timeout: float | None = None) -> None:
+        # Завершения процесса ждут заметно долго — в event loop это было бы видно
+        time.sleep(0.3)
+        join(self, timeout)
+
+    monkeypatch.setattr(multiprocessing.process.BaseProcess, "join", slow_join)
+
+    async def scenario() -> None:
+        offload = ProcessOffload(workers=1, timeout=30)
+        ticks: list[float] = []
+        try:
+            await offload.run(square, 1)
+            guard = asyncio.create_task(_guard_loop(ticks))
+            with pytest.raises(TimeoutError):
+                await offload.run(time.sleep, 10, timeout=0.3)
+            await asyncio.sleep(0.05)
+            guard.cancel()
+            assert offload.stats()["killed"] == 1
+            assert offload.stats()["workers"] == 0
+            # Убитый процесс заменяется новым
+            assert await offload.run(square, 4) == 16
+        finally:
+            await offload.aclose()
+        assert max(ticks) < 0.2
+
+    asyncio.run(scenario())
+
+
+def test_consumer_leaving_stream_kills_worker() -> None:
+    async def scenario() -> None:
+        offload = ProcessOffload(workers=1, timeout=30)
+        try:
+            stream = offload.stream(count_slowly, 100, 0.05)
+            assert await anext(stream) == 0
+            await stream.aclose()
+            assert offload.stats() == {**offload.stats(), "busy": 0, "killed": 1}
+
+            task = asyncio.create_task(offload.run(time.sleep, 10))
+            await asyncio.sleep(0.3)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            assert offload.stats()["killed"] == 2
+        finally:
+            await offload.aclose()
+        assert not offload._reaping
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_rejects() -> None:
+    async def scenario() -> None:
+        offload = ProcessOffload(workers=1, max_queue=0, timeout=30)
+        try:
+            running = asyncio.create_task(offload.run(time.sleep, 0.3))
+            await asyncio.sleep(0)
+            with pytest.raises(OffloadBusy):
+                await offload.run(square, 2)
+            await running
+            assert offload.stats()["rejected"] == 1
+        finally:
+            await offload.aclose()
+
+    asyncio.run(scenario())
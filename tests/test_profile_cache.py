@@ -0,0 +1,77 @@
+"""Кэш профилей: LRU и TTL `ProfileCache`, запись только изменившихся полей в `Memory.update_profile`."""
+
+import asyncio
+import sqlite3
+from pathlib import Path
+
+from core.memory import Memory
+from core.models import UserProfile
+from core.profile_cache import ProfileCache
+
+
+def test_cache_returns_copies_and_evicts_oldest() -> None:
+    cache = ProfileCache(max_size=2)
+    cache.put(UserProfile(user_id="a"))
+    cache.put(UserProfile(user_id="b"))
+
+    profile = cache.get("a")
+    profile.language = "en"
+    # Изменение копии не протекает в кэш
+    assert cache.get("a").language == "ru"
+
+    cache.put(UserProfile(user_id="c"))
+    # "a" читали недавно, вытеснен "b"
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_cache_entries_expire() -> None:
+    cache = ProfileCache(ttl=0.0)
+    cache.put(UserProfile(user_id="a"))
+    assert cache.get("a") is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_update_profile_writes_only_changes(tmp_path: Path) -> None:
+    async def scenario() -> None:
+        memory = Memory(str(tmp_path / "core.db"))
+        try:
+            await memory.get_or_create_profile("u1")
+            writes = memory.engine.writes
+
+            await memory.update_profile("u1", telegram_id="42", language="en")
+            assert memory.engine.writes == writes + 1
+            # Те же значения — без транзакции
+            await memory.update_profile("u1", telegram_id="42", language="en")
+            assert memory.engine.writes == writes + 1
+
+            profile = await memory.get_or_create_profile("u1")
+            assert (profile.telegram_id, profile.language) == ("42", "en")
+            assert memory.profile_cache.stats()["hits"] >= 1
+        finally:
+            await memory.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_invalidate_rereads_external_change(tmp_path: Path) -> None:
+    path = tmp_path / "core.db"
+
+    async def scenario() -> None:
+        memory = Memory(str(path))
+        try:
+            await memory.get_or_create_profile("u1")
+            # Профиль изменён в обход update_profile (другим процессом)
+            conn = sqlite3.connect(path)
+            conn.execute("UPDATE profiles SET tone = 'formal' WHERE user_id = 'u1'")
+            conn.commit()
+            conn.close()
+
+            assert (await memory.get_or_create_profile("u1")).tone == "friendly"
+            memory.invalidate_profile("u1")
+            assert (await memory.get_or_create_profile("u1")).tone == "formal"
+        finally:
+            await memory.aclose()
+
+    asyncio.run(scenario())
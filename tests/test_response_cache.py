@@ -0,0 +1,102 @@
+"""`ResponseCache`: нормализация ключей, TTL, дисковый уровень и его очистка."""
+
+import asyncio
+import sqlite3
+from pathlib import Path
+
+from core.response_cache import ResponseCache, normalize_prompt
+
+
+def test_normalize_ignores_case_spaces_and_trailing_marks() -> None:
+    assert normalize_prompt("  ПРИВЕТ ?") == normalize_prompt("Привет!") == "привет"
+    assert normalize_prompt("как  дела\n сегодня…") == "как дела сегодня"
+
+
+def test_normalize_keeps_meaningful_symbols() -> None:
+    assert normalize_prompt("2+2") != normalize_prompt("2*2")
+    assert normalize_prompt("c++") != normalize_prompt("c#")
+    assert normalize_prompt("всё") != normalize_prompt("все")
+
+
+def test_key_depends_on_model_system_and_history() -> None:
+    cache = ResponseCache()
+    key = cache.make_key("llama", "system", "Привет!")
+    assert key == cache.make_key("llama", "system", "привет")
+    assert key != cache.make_key("qwen", "system", "привет")
+    assert key != cache.make_key("llama", "другой", "привет")
+    assert key != cache.make_key("llama", "system", "привет", [{"role": "user", "content": "раньше"}])
+    assert ResponseCache(include_history=False).make_key("llama", "s", "x", [{"role": "user", "content": "a"}]) == (
+        ResponseCache(include_history=False).make_key("llama", "s", "x")
+    )
+
+
+def test_memory_entries_expire() -> None:
+    async def scenario() -> None:
+        cache = ResponseCache(ttl=0.0)
+        await cache.put("k", "ответ")
+        assert await cache.get("k") is None
+        assert cache.stats()["misses"] == 1
+
+    asyncio.run(scenario())
+
+
+def _disk_rows(path: Path) -> int:
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_disk_tier_survives_restart(tmp_path: Path) -> None:
+    path = tmp_path / "cache.db"
+
+    async def scenario() -> None:
+        cache = ResponseCache(disk_path=path)
+        await cache.put("k", "ответ")
+        await cache.aclose()
+
+        cache = ResponseCache(disk_path=path)
+        assert await cache.get("k") == "ответ"
+        assert cache.stats()["disk_hits"] == 1
+        await cache.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_expired_disk_row_is_deleted_on_lookup(tmp_path: Path) -> None:
+    path = tmp_path / "cache.db"
+
+    async def scenario() -> None:
+        cache = ResponseCache(ttl=0.0, disk_path=path)
+        await cache.put("k", "ответ")
+        assert _disk_rows(path) == 1
+        assert await cache.get("k") is None
+        assert _disk_rows(path) == 0
+        await cache.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_periodic_purge_caps_rows(tmp_path: Path) -> None:
+    path = tmp_path / "cache.db"
+
+    async def scenario() -> None:
+        cache = ResponseCache(disk_path=path, max_disk_rows=5, purge_every=4)
+        for index in range(8):
+            await cache.put(f"k{index}", f"ответ {index}")
+        # Очистка после 4-й и 8-й записи оставляет 5 строк, истекающих позже всех
+        assert _disk_rows(path) == 5
+        assert cache.stats()["purged"] == 3
+        cache._items.clear()
+        assert await cache.get("k7") == "ответ 7"
+        assert await cache.get("k0") is None
+
+        expired = ResponseCache(ttl=0.0, disk_path=tmp_path / "expired.db", purge_every=3)
+        for index in range(3):
+            await expired.put(f"k{index}", "ответ")
+        assert _disk_rows(tmp_path / "expired.db") == 0
+        await cache.aclose()
+        await expired.aclose()
+
+    asyncio.run(scenario())
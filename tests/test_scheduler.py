@@ -0,0 +1,127 @@
+"""`Scheduler`: порядок внутри пользователя, round-robin, объединение сообщений, отказы."""
+
+import asyncio
+
+import pytest
+
+from core.models import MessageIn, MessageOut
+from core.scheduler import Scheduler, SchedulerBusy
+
+
+class Recorder:
+    """Обработчик, записывающий начало и конец каждого сообщения; `gate` держит обработку."""
+
+    def __init__(self) -> None:
+        self.events: list[str] = []
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def __call__(self, msg_in: MessageIn) -> MessageOut:
+        self.events.append(f"start {msg_in.text}")
+        await self.gate.wait()
+        await asyncio.sleep(0)
+        self.events.append(f"end {msg_in.text}")
+        return MessageOut(f"ответ на {msg_in.text}")
+
+
+def _msg(user_id: str, text: str) -> MessageIn:
+    return MessageIn(user_id, "telegram", text)
+
+
+def test_messages_of_one_user_run_in_order() -> None:
+    async def scenario() -> None:
+        handler = Recorder()
+        scheduler = Scheduler(handler, max_concurrency=4, coalesce=False)
+        answers = await asyncio.gather(*(scheduler.submit(_msg("a", f"a{index}")) for index in range(3)))
+        assert [answer.text for answer in answers] == ["ответ на a0", "ответ на a1", "ответ на a2"]
+        # Следующее сообщение начинается только после ответа на предыдущее
+        assert handler.events == ["start a0", "end a0", "start a1", "end a1", "start a2", "end a2"]
+
+    asyncio.run(scenario())
+
+
+def test_users_take_turns() -> None:
+    async def scenario() -> None:
+        handler = Recorder()
+        scheduler = Scheduler(handler, max_concurrency=1, coalesce=False)
+        tasks = [asyncio.create_task(scheduler.submit(_msg("a", f"a{index}"))) for index in range(3)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(scheduler.submit(_msg("b", "b0"))))
+        await asyncio.gather(*tasks)
+        starts = [event.split()[1] for event in handler.events if event.startswith("start")]
+        # "a" уже стоял в очереди готовых до прихода "b", но дальше они чередуются:
+        # единственное сообщение "b" не ждёт, пока "a" разберёт всю свою очередь
+        assert starts == ["a0", "a1", "b0", "a2"]
+
+    asyncio.run(scenario())
+
+
+def test_queued_messages_are_coalesced() -> None:
+    async def scenario() -> None:
+        handler = Recorder()
+        handler.gate.clear()
+        scheduler = Scheduler(handler, max_concurrency=2, coalesce=True)
+        first = asyncio.create_task(scheduler.submit(_msg("a", "a0")))
+        await asyncio.sleep(0)
+        rest = [asyncio.create_task(scheduler.submit(_msg("a", f"a{index}"))) for index in (1, 2)]
+        await asyncio.sleep(0)
+        handler.gate.set()
+        answers = await asyncio.gather(first, *rest)
+
+        assert handler.events == ["start a0", "end a0", "start a1\na2", "end a1\na2"]
+        assert answers[1] is answers[2]
+        assert answers[1].text == "ответ на a1\na2"
+        assert scheduler.merged == 1
+
+    asyncio.run(scenario())
+
+
+def test_full_queues_reject_immediately() -> None:
+    async def scenario() -> None:
+        handler = Recorder()
+        handler.gate.clear()
+        scheduler = Scheduler(handler, max_concurrency=1, max_user_queue=1, max_queue=2, coalesce=False)
+        running = asyncio.create_task(scheduler.submit(_msg("a", "a0")))
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(scheduler.submit(_msg("a", "a1")))
+        await asyncio.sleep(0)
+
+        with pytest.raises(SchedulerBusy) as caught:
+            scheduler.admit(_msg("a", "a2"))
+        assert caught.value.reason == "user_queue_full"
+
+        other = asyncio.create_task(scheduler.submit(_msg("b", "b0")))
+        await asyncio.sleep(0)
+        with pytest.raises(SchedulerBusy) as caught:
+            scheduler.admit(_msg("c", "c0"))
+        assert caught.value.reason == "queue_full"
+        assert scheduler.rejected == 2
+
+        handler.gate.set()
+        await asyncio.gather(running, queued, other)
+        assert scheduler.stats()["queued"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_queue() -> None:
+    async def scenario() -> None:
+        handler = Recorder()
+        handler.gate.clear()
+        scheduler = Scheduler(handler, max_concurrency=1, coalesce=False)
+        running = asyncio.create_task(scheduler.submit(_msg("a", "a0")))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(scheduler.submit(_msg("b", "b0")))
+        await asyncio.sleep(0)
+        assert scheduler.stats()["queued"] == 1
+
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert scheduler.stats()["queued"] == 0
+        handler.gate.set()
+        await running
+        assert "start b0" not in handler.events
+        assert scheduler.stats()["running"] == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,97 @@
+"""`SearchCache`: объединение одинаковых запросов, TTL и негативное кэширование."""
+
+import asyncio
+
+import httpx
+import pytest
+
+from core.search import SearchBackend, SearchCache, WebSearchTool
+
+
+class SlowBackend(SearchBackend):
+    """Бэкенд с задержкой, считающий обращения."""
+
+    def __init__(self, answers: dict[str, str | None], delay: float = 0.05) -> None:
+        self.answers = answers
+        self.delay = delay
+        self.calls: list[str] = []
+
+    async def search(self, query: str) -> str | None:
+        self.calls.append(query)
+        await asyncio.sleep(self.delay)
+        if query == "сломано":
+            raise httpx.ConnectError("нет связи")
+        return self.answers.get(query)
+
+
+def test_concurrent_identical_queries_share_one_fetch() -> None:
+    async def scenario() -> None:
+        backend = SlowBackend({"погода": "солнечно"})
+        tool = WebSearchTool(backend=backend)
+        results = await asyncio.gather(
+            *(tool.execute({"query": query}) for query in ("погода", "  ПОГОДА ", "погода"))
+        )
+        assert backend.calls == ["погода"]
+        assert all("солнечно" in result for result in results)
+        assert tool.cache.stats()["coalesced"] == 2
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_does_not_cancel_shared_fetch() -> None:
+    async def scenario() -> None:
+        cache = SearchCache()
+        backend = SlowBackend({"q": "ответ"})
+        first = asyncio.create_task(cache.get_or_fetch("q", lambda: backend.search("q")))
+        second = asyncio.create_task(cache.get_or_fetch("q", lambda: backend.search("q")))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert await second == "ответ"
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        assert backend.calls == ["q"]
+
+    asyncio.run(scenario())
+
+
+def test_empty_results_use_negative_ttl() -> None:
+    async def scenario() -> None:
+        cache = SearchCache(ttl=60.0, negative_ttl=0.05)
+        backend = SlowBackend({"есть": "ответ"}, delay=0)
+
+        for _ in range(2):
+            assert await cache.get_or_fetch("есть", lambda: backend.search("есть")) == "ответ"
+            assert await cache.get_or_fetch("нет", lambda: backend.search("нет")) is None
+        assert backend.calls == ["есть", "нет"]
+        assert cache.stats()["negative_hits"] == 1
+
+        # Пустой результат истекает раньше найденного
+        await asyncio.sleep(0.06)
+        await cache.get_or_fetch("есть", lambda: backend.search("есть"))
+        await cache.get_or_fetch("нет", lambda: backend.search("нет"))
+        assert backend.calls == ["есть", "нет", "нет"]
+
+    asyncio.run(scenario())
+
+
+def test_backend_errors_are_not_cached() -> None:
+    async def scenario() -> None:
+        backend = SlowBackend({}, delay=0)
+        tool = WebSearchTool(backend=backend)
+        for _ in range(2):
+            assert (await tool.execute({"query": "сломано"})).startswith("Ошибка при поиске")
+        assert backend.calls == ["сломано", "сломано"]
+        assert tool.cache.stats()["in_flight"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_cache_evicts_least_recently_used() -> None:
+    async def scenario() -> None:
+        cache = SearchCache(max_size=2)
+        backend = SlowBackend({"a": "1", "b": "2", "c": "3"}, delay=0)
+        for query in ("a", "b", "a", "c", "a", "b"):
+            await cache.get_or_fetch(query, lambda query=query: backend.search(query))
+        assert backend.calls == ["a", "b", "c", "b"]
+
+    asyncio.run(scenario())
@@ -0,0 +1,70 @@
+"""Семантическая память: векторный индекс на диске и фоновая индексация истории."""
+
+import asyncio
+
+import numpy as np
+
+from core.memory import Memory
+from core.models import MessageIn, MessageOut
+from core.semantic import SemanticMemory, VectorIndex
+
+
+def test_chunked_search_matches_brute_force(tmp_path) -> None:
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((1000, 16)).astype(np.float32)
+    index = VectorIndex(tmp_path, dim=16, chunk_rows=128)
+    index.add("u", list(range(1, 501)), vectors[:500])
+    index.add("u", list(range(501, 1001)), vectors[500:])
+
+    query = rng.standard_normal(16).astype(np.float32)
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    expected = np.argsort(-(normalized @ (query / np.linalg.norm(query))))[:5] + 1
+
+    hits = index.search("u", query, k=5)
+    assert [message_id for message_id, _ in hits] == expected.tolist()
+    assert index.last_id("u") == 1000
+    assert index.search("другой", query) == []
+
+
+def test_torn_append_is_ignored_and_overwritten(tmp_path) -> None:
+    index = VectorIndex(tmp_path, dim=4)
+    index.add("u", [1], np.eye(4, dtype=np.float32)[:1])
+    vec_path, _ = index._paths("u")
+    # Вектор дописан, а id — нет: так выглядит запись, прерванная на середине
+    with open(vec_path, "ab") as vec_file:
+        vec_file.write(np.ones(4, dtype=np.float32).tobytes())
+    assert index.size("u") == 1
+
+    index.add("u", [2], np.eye(4, dtype=np.float32)[1:2])
+    assert index.size("u") == 2
+    assert index.search("u", np.eye(4, dtype=np.float32)[1], k=1)[0][0] == 2
+
+
+def test_sync_indexes_new_messages_and_resumes(tmp_path) -> None:
+    async def scenario() -> None:
+        memory = Memory(str(tmp_path / "core.db"))
+        for text, answer in [
+            ("как приготовить борщ", "свёкла, капуста, бульон"),
+            ("погода в москве", "облачно"),
+            ("рецепт борща со сметаной", "добавьте сметану в конце"),
+        ]:
+            await memory.save_interaction(MessageIn("u", "telegram", text), MessageOut(answer))
+        await memory.save_interaction(MessageIn("v", "telegram", "борщ"), MessageOut("чужой"))
+
+        semantic = SemanticMemory(memory, index_dir=tmp_path / "semantic", batch_size=2, min_score=0.1)
+        assert await semantic.sync() == 4
+        found = await semantic.search("u", "борщ рецепт", k=2)
+        assert len(found) == 2
+        assert all("борщ" in text for text in found)
+        assert all("чужой" not in text for text in found)
+        await semantic.stop()
+
+        # После рестарта индексируются только новые сообщения
+        await memory.save_interaction(MessageIn("u", "telegram", "ещё про борщ"), MessageOut("ок"))
+        restarted = SemanticMemory(memory, index_dir=tmp_path / "semantic", batch_size=2)
+        assert await restarted.sync() == 1
+        assert restarted.index.size("u") == 4
+        await restarted.stop()
+        await memory.aclose()
+
+    asyncio.run(scenario())
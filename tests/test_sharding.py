@@ -0,0 +1,231 @@
+"""Шарды хранилища: кольцо, перенос пользователя между шардами и ребалансировка."""
+
+import asyncio
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from core.archive import HistoryArchive, RetentionManager
+from core.memory import Memory
+from core.models import MessageIn, MessageOut
+from core.semantic import SemanticMemory
+from core.sharding import ID_BLOCK, HashRing, ShardedMemory, move_user, open_shard, parse_shards, rebalance
+
+FUTURE = "2999-01-01 00:00:00"
+
+
+def _memory(root: Path, name: str, id_block: int | None = None) -> Memory:
+    return open_shard(root, name, archive_dir=root / "archive", id_block=id_block)
+
+
+async def _chat(memory: Memory | ShardedMemory, user_id: str, count: int, prefix: str = "сообщение") -> None:
+    for index in range(count):
+        await memory.save_interaction(
+            MessageIn(user_id, "telegram", f"{prefix} {index}"), MessageOut(f"ответ {index}")
+        )
+
+
+def _count(conn: sqlite3.Connection, table: str, user_id: str) -> int:
+    return conn.execute(f"SELECT COUNT(*) FROM {table} WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+
+def test_ring_moves_few_users_when_shard_added() -> None:
+    users = [f"user-{index}" for index in range(2000)]
+    old, new = HashRing(parse_shards("4")), HashRing(parse_shards("5"))
+    moved = [user for user in users if old.shard_for(user) != new.shard_for(user)]
+    # Переезжают только пользователи нового шарда (~1/5)
+    assert all(new.shard_for(user) == "shard-4" for user in moved)
+    assert 0.1 < len(moved) / len(users) < 0.3
+
+
+def test_move_user_keeps_ids_and_summary(tmp_path: Path) -> None:
+    async def scenario() -> None:
+        # У цели блок id младше, чем у источника: id пользователя больше всех id цели
+        source, target = _memory(tmp_path, "a", id_block=2), _memory(tmp_path, "b", id_block=1)
+        try:
+            await _chat(target, "other", 5)
+            await _chat(source, "u1", 2)
+            await _chat(source, "x", 3)
+            await _chat(source, "u1", 3, prefix="потом")
+            old_ids = [record["id"] async for record in source.iter_history("u1")]
+            base = 2 * ID_BLOCK
+            assert old_ids == [base + 1, base + 2, base + 6, base + 7, base + 8]
+            await source.get_or_create_profile("u1")
+            await source.update_profile("u1", language="en")
+            # Сводка покрывает три первых сообщения пользователя
+            await source.save_summary("u1", "сводка", old_ids[2])
+
+            assert await move_user(source, target, "u1") == 5
+
+            records = [record async for record in target.iter_history("u1")]
+            assert [record["id"] for record in records] == old_ids
+            assert [record["input"] for record in records] == [
+                "сообщение 0", "сообщение 1", "потом 0", "потом 1", "потом 2"
+            ]
+            assert await target.get_summary("u1") == ("сводка", old_ids[2])
+            assert (await target.get_or_create_profile("u1")).language == "en"
+            # Клиент, уже синхронизированный до последнего id, не получает ничего повторно
+            assert [record async for record in target.iter_history("u1", after=old_ids[-1])] == []
+
+            # Новые сообщения — после всех прежних, в том числе у других пользователей цели
+            await _chat(target, "u1", 1, prefix="после")
+            await _chat(target, "other", 1, prefix="после")
+            fresh = [record async for record in target.iter_history("u1", after=old_ids[-1])]
+            assert [record["input"] for record in fresh] == ["после 0"]
+            assert fresh[0]["id"] > old_ids[-1]
+
+            for table in ("messages", "summaries", "profiles"):
+                assert await source.engine.read(_count, table, "u1") == 0
+            assert await source.engine.read(_count, "messages", "x") == 3
+        finally:
+            await source.aclose()
+            await target.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_move_user_refuses_overlapping_id_blocks(tmp_path: Path) -> None:
+    async def scenario() -> None:
+        # Оба шарда выдают id с единицы: сохранить id при переносе нельзя
+        source, target = _memory(tmp_path, "a"), _memory(tmp_path, "b")
+        try:
+            await _chat(target, "other", 2)
+            await _chat(source, "u1", 2)
+            with pytest.raises(RuntimeError):
+                await move_user(source, target, "u1")
+            assert await source.engine.read(_count, "messages", "u1") == 2
+            assert await target.engine.read(_count, "messages", "u1") == 0
+        finally:
+            await source.aclose()
+            await target.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_move_user_with_archive(tmp_path: Path) -> None:
+    async def scenario() -> None:
+        source, target = _memory(tmp_path, "a", id_block=1), _memory(tmp_path, "b", id_block=2)
+        try:
+            await _chat(source, "u1", 6)
+            old_ids = [record["id"] async for record in source.iter_history("u1")]
+            await RetentionManager(source, source.archive, keep_recent=2).archive_user("u1", FUTURE)
+            # Граница сводки внутри архива
+            await source.save_summary("u1", "сводка", old_ids[1])
+
+            assert await move_user(source, target, "u1") == 2
+
+            records = [record async for record in target.iter_history("u1")]
+            assert [record["input"] for record in records] == [f"сообщение {index}" for index in range(6)]
+            assert [record["id"] for record in records] == old_ids
+            assert await target.get_summary("u1") == ("сводка", old_ids[1])
+            assert source.archive.last_id("u1") == 0
+            assert target.archive.last_id("u1") == old_ids[3]
+        finally:
+            await source.aclose()
+            await target.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_move_user_moves_vectors_and_rewinds_cursor(tmp_path: Path) -> None:
+    async def scenario() -> None:
+        source, target = _memory(tmp_path, "a", id_block=1), _memory(tmp_path, "b", id_block=2)
+        dirs = (tmp_path / "semantic" / "a", tmp_path / "semantic" / "b")
+        try:
+            await _chat(source, "u1", 2)
+            await _chat(target, "other", 2)
+            await SemanticMemory(source, index_dir=dirs[0]).sync()
+            await SemanticMemory(target, index_dir=dirs[1]).sync()
+            # Последнее сообщение источник проиндексировать не успел; его id ниже курсора цели
+            await _chat(source, "u1", 1, prefix="ещё")
+
+            await move_user(source, target, "u1", dirs)
+
+            semantic = SemanticMemory(target, index_dir=dirs[1])
+            assert semantic.index.size("u1") == 2
+            assert await semantic.sync() == 1
+            assert semantic.index.size("u1") == 3
+            assert await semantic.search("u1", "ещё 0", k=1) == [semantic.document("ещё 0", "ответ 0")]
+            assert SemanticMemory(source, index_dir=dirs[0]).index.size("u1") == 0
+        finally:
+            await source.aclose()
+            await target.aclose()
+
+    asyncio.run(scenario())
+
+
+def _semantic(memory: ShardedMemory, root: Path) -> dict[str, SemanticMemory]:
+    return {name: SemanticMemory(shard, index_dir=root / name) for name, shard in memory.shards.items()}
+
+
+def test_rebalance_keeps_every_history(tmp_path: Path) -> None:
+    root, archive, semantic_dir = tmp_path / "shards", tmp_path / "archive", tmp_path / "semantic"
+    users = [f"user-{index}" for index in range(30)]
+
+    async def scenario() -> None:
+        memory = ShardedMemory(root, parse_shards("2"), archive_dir=archive)
+        try:
+            for user_id in users:
+                await _chat(memory, user_id, 2, prefix=user_id)
+            for semantic in _semantic(memory, semantic_dir).values():
+                await semantic.sync()
+            # Третье сообщение индексатор старого шарда уже не увидит
+            for user_id in users:
+                await _chat(memory, user_id, 1, prefix=f"{user_id} ещё")
+            ids = {user_id: [record["id"] async for record in memory.iter_history(user_id)] for user_id in users}
+        finally:
+            await memory.aclose()
+
+        plan = await rebalance(root, parse_shards("3"), archive, dry_run=True)
+        assert plan["moved_users"] == 0
+        assert plan["users"] > 0
+        result = await rebalance(root, parse_shards("3"), archive, semantic_dir=semantic_dir)
+        assert result["moved_users"] == plan["users"]
+        assert result["moved_messages"] == 3 * plan["users"]
+
+        # Старая раскладка больше не принимается
+        with pytest.raises(RuntimeError):
+            ShardedMemory(root, parse_shards("2"), archive_dir=archive)
+
+        memory = ShardedMemory(root, parse_shards("3"), archive_dir=archive)
+        try:
+            for user_id in users:
+                records = [record async for record in memory.iter_history(user_id)]
+                assert [record["input"] for record in records] == [
+                    f"{user_id} 0", f"{user_id} 1", f"{user_id} ещё 0"
+                ]
+                assert [record["id"] for record in records] == ids[user_id]
+                # Данные только в шарде нового кольца
+                for name, shard in memory.shards.items():
+                    expected = 3 if name == memory.shard_name(user_id) else 0
+                    assert await shard.engine.read(_count, "messages", user_id) == expected
+
+            # Векторы переехали: новые шарды досчитывают только непроиндексированные сообщения
+            semantics = _semantic(memory, semantic_dir)
+            assert sum([await semantic.sync() for semantic in semantics.values()]) == len(users)
+            for user_id in users:
+                index = semantics[memory.shard_name(user_id)].index
+                assert index.size(user_id) == 3
+                assert index.last_id(user_id) == ids[user_id][-1]
+
+            # Каждый шард выдаёт новые id из своего блока — после всех прежних
+            for user_id in users:
+                await _chat(memory, user_id, 1, prefix="после")
+            fresh = {}
+            for user_id in users:
+                records = [record async for record in memory.iter_history(user_id, after=ids[user_id][-1])]
+                assert [record["input"] for record in records] == ["после 0"]
+                fresh[user_id] = records[0]["id"]
+            all_ids = [i for user_ids in ids.values() for i in user_ids] + list(fresh.values())
+            assert len(set(all_ids)) == len(all_ids)
+            blocks = {
+                name: {fresh[user_id] // ID_BLOCK for user_id in users if memory.shard_name(user_id) == name}
+                for name in memory.shards
+            }
+            assert all(len(block) == 1 for block in blocks.values())
+            assert len(set.union(*blocks.values())) == len(memory.shards)
+        finally:
+            await memory.aclose()
+
+    asyncio.run(scenario())
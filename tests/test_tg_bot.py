@@ -0,0 +1,103 @@
+"""tg_bot: общий клиент к ядру, ответы при сбоях ядра и лимит одновременных обновлений."""
+
+import asyncio
+
+import httpx
+import pytest
+
+from tg_bot import main as bot
+
+
+@pytest.fixture
+def core(monkeypatch: pytest.MonkeyPatch):
+    """Подменить общий клиент к ядру клиентом на `httpx.MockTransport(handler)`."""
+
+    def install(handler) -> None:
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://core")
+        monkeypatch.setattr(bot, "_core_client", client)
+
+    yield install
+    asyncio.run(bot.close_core_client())
+
+
+def test_core_client_is_shared() -> None:
+    async def scenario() -> None:
+        client = bot.get_core_client()
+        assert bot.get_core_client() is client
+        await bot.close_core_client()
+        assert client.is_closed
+        assert bot._core_client is None
+
+    asyncio.run(scenario())
+
+
+def test_call_core_passes_trace_id(core) -> None:
+    seen: list[httpx.Request] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen.append(request)
+        return httpx.Response(200, json={"text": "ответ"})
+
+    core(handler)
+    assert asyncio.run(bot.call_core("привет", 42, trace_id="t1")) == "ответ"
+    assert seen[0].headers["X-Trace-Id"] == "t1"
+    assert seen[0].url.path == "/v1/messages"
+
+
+@pytest.mark.parametrize(
+    ("error", "expected"),
+    [
+        (httpx.ReadTimeout("медленно"), "Ответ готовится слишком долго"),
+        (httpx.ConnectTimeout("нет"), "Эхо (ядро недоступно): привет"),
+        (httpx.ConnectError("нет"), "Эхо (ядро недоступно): привет"),
+    ],
+)
+def test_core_failures_have_distinct_replies(core, error: Exception, expected: str) -> None:
+    def handler(request: httpx.Request) -> httpx.Response:
+        raise error
+
+    core(handler)
+    assert asyncio.run(bot.call_core("привет", 42)).startswith(expected)
+
+
+def test_busy_core_asks_to_retry(core) -> None:
+    core(lambda request: httpx.Response(503, headers={"Retry-After": "7"}, json={"error": "busy"}))
+    assert "через 7 с" in asyncio.run(bot.call_core("привет", 42))
+
+
+def test_stream_core_stops_on_error_event(core) -> None:
+    body = (
+        'data: {"delta": "При"}\n\n'
+        'data: {"delta": "вет"}\n\n'
+        'event: error\ndata: {"error": "boom", "text": "Привет"}\n\n'
+    )
+    core(lambda request: httpx.Response(200, text=body, headers={"content-type": "text/event-stream"}))
+
+    async def collect() -> list[str]:
+        return [delta async for delta in bot.stream_core("привет", 42)]
+
+    assert asyncio.run(collect()) == ["При", "вет"]
+
+
+def test_split_for_telegram() -> None:
+    parts = bot.split_for_telegram("а" * (bot.TELEGRAM_MESSAGE_LIMIT + 10))
+    assert [len(part) for part in parts] == [bot.TELEGRAM_MESSAGE_LIMIT, 10]
+    assert bot.split_for_telegram("") == [""]
+
+
+def test_middleware_caps_concurrent_updates() -> None:
+    async def scenario() -> int:
+        middleware = bot.ConcurrencyLimitMiddleware(2)
+        active = peak = 0
+
+        async def handler(event, data) -> None:
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+
+        await asyncio.gather(*(middleware(handler, object(), {}) for _ in range(6)))
+        return peak
+
+    assert asyncio.run(scenario()) == 2
@@ -0,0 +1,145 @@
+"""`ToolRouter`: выбор инструментов, параллельный запуск, таймауты и бюджет контекста."""
+
+import asyncio
+import subprocess
+import sys
+import time
+from collections.abc import AsyncIterator
+from pathlib import Path
+from typing import Any
+
+from core.tools import LazyTool, Tool, ToolRouter, default_tools
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+class FakeTool(Tool):
+    """Инструмент, отдающий `parts` с паузой `delay` перед каждой частью."""
+
+    def __init__(
+        self,
+        name: str,
+        parts: list[str],
+        delay: float = 0.0,
+        keywords: tuple[str, ...] = (),
+        media_types: tuple[str, ...] = (),
+        timeout: float = 1.0,
+        fail: bool = False,
+    ) -> None:
+        self._name = name
+        self.parts = parts
+        self.delay = delay
+        self.keywords = keywords
+        self.media_types = media_types
+        self.timeout = timeout
+        self.fail = fail
+        self.inputs: list[dict[str, Any]] = []
+
+    def name(self) -> str:
+        return self._name
+
+    async def execute(self, input_data: dict[str, Any]) -> str:
+        return "".join([part async for part in self.stream(input_data)])
+
+    async def stream(self, input_data: dict[str, Any]) -> AsyncIterator[str]:
+        self.inputs.append(input_data)
+        for part in self.parts:
+            await asyncio.sleep(self.delay)
+            if self.fail:
+                raise RuntimeError("сбой инструмента")
+            yield part
+
+
+def _route(router: ToolRouter, context: dict[str, Any], timeout: float | None = None) -> str:
+    async def scenario() -> str:
+        try:
+            return await router.route(context, timeout)
+        finally:
+            await router.aclose()
+
+    return asyncio.run(scenario())
+
+
+def test_selects_every_matching_tool() -> None:
+    search = FakeTool("search", ["найдено"], keywords=("найди",))
+    files = FakeTool("files", ["файл"], media_types=("document",))
+    other = FakeTool("other", ["лишнее"], keywords=("погода",))
+    router = ToolRouter([search, files, other])
+
+    assert router.select({"text": "НАЙДИ отчёт", "media_type": "document"}) == [search, files]
+    assert router.select({"text": None}) == []
+    assert _route(router, {"text": "привет"}) == ""
+
+
+def test_tools_run_concurrently_and_merge() -> None:
+    tools = [FakeTool(name, [name.upper()], delay=0.1, keywords=("найди",)) for name in ("a", "b", "c")]
+    router = ToolRouter(tools)
+    started = time.perf_counter()
+    result = _route(router, {"text": "найди"})
+    assert time.perf_counter() - started < 0.25
+    assert result == "[a] A\n\n[b] B\n\n[c] C"
+
+
+def test_slow_tool_keeps_parts_received_before_timeout() -> None:
+    slow = FakeTool("slow", ["раз ", "два ", "три"], delay=0.1, keywords=("найди",), timeout=0.25)
+    broken = FakeTool("broken", ["x"], keywords=("найди",), fail=True)
+    fast = FakeTool("fast", ["готово"], keywords=("найди",))
+    result = _route(ToolRouter([slow, broken, fast]), {"text": "найди"})
+    # Упавший инструмент пропадает, медленный отдаёт то, что успел
+    assert result == "[slow] раз два \n\n[fast] готово"
+
+
+def test_stage_budget_caps_tool_timeouts() -> None:
+    slow = FakeTool("slow", ["раз ", "два"], delay=0.1, keywords=("найди",), timeout=5.0)
+    started = time.perf_counter()
+    result = _route(ToolRouter([slow]), {"text": "найди"}, timeout=0.15)
+    assert time.perf_counter() - started < 0.5
+    assert result == "раз "
+
+
+def test_merged_result_fits_budget() -> None:
+    short = FakeTool("short", ["коротко"], keywords=("найди",))
+    long = FakeTool("long", ["д" * 500], keywords=("найди",))
+    result = _route(ToolRouter([short, long], budget_chars=100), {"text": "найди"})
+    short_part, long_part = result.split("\n\n")
+    # Остаток бюджета короткого результата достаётся длинному
+    assert short_part == "[short] коротко"
+    assert long_part == "[long] " + "д" * 92 + "…"
+
+
+def test_tool_input_does_not_mutate_context() -> None:
+    tool = FakeTool("files", ["ok"], media_types=("document",))
+    context = {"text": None, "media_type": "document", "media_data": {"path": "a.pdf"}}
+    _route(ToolRouter([tool]), context)
+    tool.inputs[0]["path"] = "b.pdf"
+    assert context["media_data"] == {"path": "a.pdf"}
+
+
+def test_default_tools_import_nothing_until_selected() -> None:
+    code = (
+        "import sys\n"
+        "from core.tools import ToolRouter\n"
+        "router = ToolRouter()\n"
+        "assert router.select({'text': 'привет'}) == []\n"
+        "heavy = {'core.search', 'core.media_tools', 'core.parsers'} & set(sys.modules)\n"
+        "assert not heavy, heavy\n"
+        "assert [tool.name() for tool in router.select({'text': 'найди кота'})] == ['web_search']\n"
+        "assert 'core.search' not in sys.modules\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=ROOT)
+    assert result.returncode == 0, result.stderr
+
+
+def test_lazy_tool_loads_once_on_first_use() -> None:
+    tool = LazyTool("web_search", "core.search:WebSearchTool", keywords=("найди", "поиск", "найти", "search", "find"))
+    assert not tool.loaded
+    assert tool.build_input({"text": "найди кота"}) == {"query": "найди кота"}
+    assert tool.loaded
+    assert tool.load() is tool.load()
+
+
+def test_lazy_declarations_match_implementations() -> None:
+    for tool in default_tools():
+        loaded = tool.load()
+        assert (loaded.name(), loaded.keywords, loaded.media_types) == (tool.name(), tool.keywords, tool.media_types)
+        assert tool.timeout == loaded.timeout
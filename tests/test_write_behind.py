@@ -0,0 +1,160 @@
+"""Write-behind очередь истории: чтение своих записей, повтор неудачной записи, коммит без блокировки."""
+
+import asyncio
+import sqlite3
+from pathlib import Path
+from typing import Any
+
+from core.memory import Memory
+from core.models import MessageIn, MessageOut
+from core.write_behind import InteractionLogger, _Pending
+
+
+async def _chat(memory: Memory, user_id: str, count: int) -> None:
+    for index in range(count):
+        await memory.save_interaction(
+            MessageIn(user_id, "telegram", f"сообщение {index}"), MessageOut(f"ответ {index}")
+        )
+
+
+async def _inputs(memory: Memory, user_id: str, limit: int = 10) -> list[str | None]:
+    return [msg_in.text for msg_in, _ in await memory.get_recent_history(user_id, limit)]
+
+
+async def _stored(memory: Memory, user_id: str) -> int:
+    return await memory.engine.read(
+        lambda conn: conn.execute("SELECT COUNT(*) FROM messages WHERE user_id = ?", (user_id,)).fetchone()[0]
+    )
+
+
+def _memory(tmp_path: Path) -> Memory:
+    memory = Memory(str(tmp_path / "core.db"), write_behind=True)
+    memory.interaction_logger.flush_interval = 60.0
+    memory.interaction_logger.retry_delay = 0.01
+    return memory
+
+
+def test_recent_history_sees_queued_rows(tmp_path: Path) -> None:
+    async def scenario() -> None:
+        memory = _memory(tmp_path)
+        try:
+            await _chat(memory, "u1", 3)
+            assert await _stored(memory, "u1") == 0
+            assert await _inputs(memory, "u1") == ["сообщение 0", "сообщение 1", "сообщение 2"]
+            assert await _inputs(memory, "u1", limit=2) == ["сообщение 1", "сообщение 2"]
+
+            await memory.flush()
+            assert await _stored(memory, "u1") == 3
+            assert await _inputs(memory, "u1") == ["сообщение 0", "сообщение 1", "сообщение 2"]
+        finally:
+            await memory.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_committed_rows_still_queued_are_not_duplicated(tmp_path: Path) -> None:
+    """Читатель между коммитом и удалением из очереди видит строку один раз."""
+
+    async def scenario() -> None:
+        memory = _memory(tmp_path)
+        interaction_logger = memory.interaction_logger
+        forget = interaction_logger._forget
+        interaction_logger._forget = lambda batch: None
+        try:
+            await _chat(memory, "u1", 2)
+            await interaction_logger.stop()
+            assert await _stored(memory, "u1") == 2
+            assert len(interaction_logger._pending["u1"]) == 2
+            assert await _inputs(memory, "u1") == ["сообщение 0", "сообщение 1"]
+        finally:
+            interaction_logger._forget = forget
+            interaction_logger._pending.clear()
+            await memory.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_failed_batch_is_retried(tmp_path: Path) -> None:
+    async def scenario() -> None:
+        memory = _memory(tmp_path)
+        interaction_logger = memory.interaction_logger
+        write = memory.engine.write
+        failures = 2
+
+        async def flaky_write(fn: Any, *args: Any) -> Any:
+            nonlocal failures
+            if failures:
+                failures -= 1
+                raise sqlite3.OperationalError("database is locked")
+            return await write(fn, *args)
+
+        memory.engine.write = flaky_write
+        try:
+            interaction_logger.flush_interval = 0.01
+            await _chat(memory, "u1", 2)
+            for _ in range(200):
+                if await _stored(memory, "u1") == 2:
+                    break
+                # Пока пакет ждёт повтора, строки видны из очереди
+                assert await _inputs(memory, "u1") == ["сообщение 0", "сообщение 1"]
+                await asyncio.sleep(0.01)
+            assert await _stored(memory, "u1") == 2
+            assert interaction_logger.failed_batches == 2
+            assert interaction_logger.dropped_rows == 0
+            assert await _inputs(memory, "u1") == ["сообщение 0", "сообщение 1"]
+        finally:
+            await memory.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_rows_are_dropped_only_on_shutdown(tmp_path: Path) -> None:
+    async def scenario() -> None:
+        memory = _memory(tmp_path)
+        interaction_logger = memory.interaction_logger
+
+        async def broken_write(fn: Any, *args: Any) -> Any:
+            raise sqlite3.OperationalError("database or disk is full")
+
+        write, memory.engine.write = memory.engine.write, broken_write
+        await _chat(memory, "u1", 3)
+        await interaction_logger.stop()
+        assert interaction_logger.dropped_rows == 3
+        assert interaction_logger.failed_batches == interaction_logger.shutdown_retries
+        assert not interaction_logger._pending
+        memory.engine.write = write
+        await memory.aclose()
+
+    asyncio.run(scenario())
+
+
+class _CommitProbe:
+    """Соединение, проверяющее, что коммит идёт без блокировки очереди."""
+
+    def __init__(self, interaction_logger: InteractionLogger) -> None:
+        self.interaction_logger = interaction_logger
+        self.locked_on_commit: bool | None = None
+
+    def executemany(self, sql: str, rows: list[Any]) -> None:
+        self.rows = rows
+
+    def execute(self, sql: str) -> Any:
+        return sqlite3.connect(":memory:").execute("SELECT ?", (len(self.rows),))
+
+    def commit(self) -> None:
+        self.locked_on_commit = self.interaction_logger._lock.locked()
+
+
+def test_commit_runs_without_queue_lock(tmp_path: Path) -> None:
+    memory = Memory(str(tmp_path / "core.db"))
+    interaction_logger = InteractionLogger(memory.engine)
+    batch = [_Pending(("u1", "telegram", "text", "a", "b", None, None))]
+    interaction_logger._pending["u1"].append(batch[0])
+    probe = _CommitProbe(interaction_logger)
+
+    interaction_logger._write_batch(probe, batch)
+
+    assert probe.locked_on_commit is False
+    assert batch[0].id == 1
+    assert not interaction_logger._pending
+    asyncio.run(memory.aclose())
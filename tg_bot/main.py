@@ -1,37 +1,238 @@
 import asyncio
+import json
 import logging
 import os
-from typing import Final
+import time
+import uuid
+from collections.abc import AsyncIterator, Awaitable, Callable
+from typing import Any, Final
 
 import httpx
-from aiogram import Bot, Dispatcher, types
+from aiogram import BaseMiddleware, Bot, Dispatcher, F, types
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import CommandStart
-from aiogram.types import Message
+from aiogram.types import Document, Message, PhotoSize, TelegramObject, Video, Voice
+from aiogram.utils.chat_action import ChatActionSender
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("tg_bot")
 
 CORE_BASE_URL: Final[str] = os.getenv("CORE_BASE_URL", "http://localhost:8000")
+# Потоковые ответы: сообщение в Telegram дописывается по мере генерации
+CORE_STREAM: Final[bool] = os.getenv("CORE_STREAM", "1") != "0"
+# Не чаще одного edit_message_text в EDIT_INTERVAL секунд на сообщение
+EDIT_INTERVAL: Final[float] = float(os.getenv("TG_EDIT_INTERVAL", "1.0"))
+TELEGRAM_MESSAGE_LIMIT: Final[int] = 4096
 
+# Таймауты обращения к ядру, с. Обычный запрос ждёт ответ целиком, поэтому
+# CORE_TIMEOUT рассчитан на медленную локальную генерацию; у потокового
+# ограничено только ожидание следующего фрагмента (CORE_STREAM_READ_TIMEOUT).
+CORE_CONNECT_TIMEOUT: Final[float] = float(os.getenv("CORE_CONNECT_TIMEOUT", "5"))
+CORE_TIMEOUT: Final[float] = float(os.getenv("CORE_TIMEOUT", "300"))
+CORE_STREAM_READ_TIMEOUT: Final[float] = float(os.getenv("CORE_STREAM_READ_TIMEOUT", "120"))
+# Индикатор «печатает…» в Telegram гаснет через ~5 с, его нужно повторять
+TYPING_INTERVAL: Final[float] = float(os.getenv("TG_TYPING_INTERVAL", "4"))
+
+# Режим получения обновлений: polling (long polling) или webhook
+TG_MODE: Final[str] = os.getenv("TG_MODE", "polling")
+TG_WEBHOOK_URL: Final[str] = os.getenv("TG_WEBHOOK_URL", "")
+TG_WEBHOOK_PATH: Final[str] = os.getenv("TG_WEBHOOK_PATH", "/tg/webhook")
+TG_WEBHOOK_HOST: Final[str] = os.getenv("TG_WEBHOOK_HOST", "0.0.0.0")
+TG_WEBHOOK_PORT: Final[int] = int(os.getenv("TG_WEBHOOK_PORT", "8080"))
+TG_WEBHOOK_SECRET: Final[str | None] = os.getenv("TG_WEBHOOK_SECRET") or None
+# Вложения: Bot API отдаёт боту файлы до 20 МБ; качаем и пересылаем ядру кусками
+TG_MAX_DOWNLOAD_BYTES: Final[int] = 20 * 1024 * 1024
+TG_DOWNLOAD_CHUNK: Final[int] = int(os.getenv("TG_DOWNLOAD_CHUNK", str(256 * 1024)))
+# Сколько обновлений обрабатывается одновременно (остальные ждут своей очереди)
+TG_MAX_CONCURRENT_UPDATES: Final[int] = int(os.getenv("TG_MAX_CONCURRENT_UPDATES", "16"))
+
+# Общий клиент к ядру: соединения переиспользуются между сообщениями
+_core_client: httpx.AsyncClient | None = None
+
+
+def get_core_client() -> httpx.AsyncClient:
+    global _core_client
+    if _core_client is None:
+        _core_client = httpx.AsyncClient(
+            base_url=CORE_BASE_URL.rstrip("/"),
+            timeout=httpx.Timeout(CORE_TIMEOUT, connect=CORE_CONNECT_TIMEOUT),
+            # Соединений не меньше, чем одновременно обрабатываемых обновлений
+            limits=httpx.Limits(
+                max_connections=TG_MAX_CONCURRENT_UPDATES,
+                max_keepalive_connections=TG_MAX_CONCURRENT_UPDATES,
+            ),
+        )
+    return _core_client
+
+
+async def close_core_client() -> None:
+    global _core_client
+    if _core_client is not None:
+        await _core_client.aclose()
+        _core_client = None
+
+
+def busy_text(exc: Exception) -> str | None:
+    """Текст для пользователя, если ядро перегружено (503 от планировщика)."""
+    if isinstance(exc, httpx.HTTPStatusError) and exc.response.status_code == 503:
+        retry_after = exc.response.headers.get("Retry-After", "несколько")
+        return f"Я сейчас занят другими запросами. Попробуй ещё раз через {retry_after} с."
+    return None
+
+
+def error_text(exc: Exception, text: str | None) -> str:
+    """Ответ пользователю, если ядро не смогло ответить."""
+    busy = busy_text(exc)
+    if busy:
+        return busy
+    if isinstance(exc, httpx.TimeoutException) and not isinstance(exc, httpx.ConnectTimeout):
+        # Ядро доступно и работает над ответом — эхо здесь ввело бы в заблуждение
+        return "Ответ готовится слишком долго. Попробуй ещё раз чуть позже."
+    # Фоллбэк: простое эхо, чтобы бот продолжал работать
+    return f"Эхо (ядро недоступно): {text or ''}"
+
+
+def new_trace_id() -> str:
+    """Trace-id сообщения: передаётся ядру в `X-Trace-Id` и попадает в его логи и метрики."""
+    return uuid.uuid4().hex[:16]
+
+
+def core_payload(
+    text: str | None,
+    user_id: int,
+    media_type: str | None = None,
+    media_data: dict[str, Any] | None = None,
+) -> dict[str, Any]:
+    payload: dict[str, Any] = {"user_id": str(user_id), "channel": "telegram", "text": text}
+    if media_type:
+        payload["media_type"] = media_type
+        payload["media_data"] = media_data or {}
+    return payload
+
+
+async def call_core(
+    text: str | None,
+    user_id: int,
+    trace_id: str | None = None,
+    media_type: str | None = None,
+    media_data: dict[str, Any] | None = None,
+) -> str:
+    payload = core_payload(text, user_id, media_type, media_data)
+    trace_id = trace_id or new_trace_id()
+    started = time.perf_counter()
+    try:
+        resp = await get_core_client().post(
+            "/v1/messages", json=payload, headers={"X-Trace-Id": trace_id}
+        )
+        resp.raise_for_status()
+        data = resp.json()
+        logger.info("trace=%s ответ ядра за %.0f мс", trace_id, (time.perf_counter() - started) * 1000)
+        return str(data.get("text") or "")
+    except Exception as exc:  # noqa: BLE001
+        if not busy_text(exc):
+            logger.error("trace=%s ошибка при обращении к ядру: %r", trace_id, exc)
+        return error_text(exc, text)
+
+
+async def stream_core(
+    text: str | None,
+    user_id: int,
+    trace_id: str | None = None,
+    media_type: str | None = None,
+    media_data: dict[str, Any] | None = None,
+) -> AsyncIterator[str]:
+    """Получить ответ ядра по частям (SSE-вариант /v1/messages)."""
+    payload = {**core_payload(text, user_id, media_type, media_data), "stream": True}
+    async with get_core_client().stream(
+        "POST",
+        "/v1/messages",
+        json=payload,
+        headers={"Accept": "text/event-stream", "X-Trace-Id": trace_id or new_trace_id()},
+        # Ограничено ожидание каждого фрагмента, а не всего ответа
+        timeout=httpx.Timeout(CORE_TIMEOUT, connect=CORE_CONNECT_TIMEOUT, read=CORE_STREAM_READ_TIMEOUT),
+    ) as resp:
+        resp.raise_for_status()
+        event = None
+        async for line in resp.aiter_lines():
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                if event == "done":
+                    return
+                if event == "error":
+                    # Полученную часть ответа оставляем, заглушку об ошибке не дописываем
+                    error = json.loads(line[len("data:"):]).get("error")
+                    logger.warning("trace=%s генерация в ядре оборвалась: %s", trace_id, error)
+                    return
+                delta = json.loads(line[len("data:"):]).get("delta")
+                if delta:
+                    yield delta
+            elif not line:
+                event = None
+
+
+def split_for_telegram(text: str) -> list[str]:
+    return [
+        text[i:i + TELEGRAM_MESSAGE_LIMIT]
+        for i in range(0, len(text), TELEGRAM_MESSAGE_LIMIT)
+    ] or [""]
+
+
+async def edit_reply(reply: Message, text: str) -> None:
+    try:
+        await reply.edit_text(text)
+    except TelegramBadRequest as exc:
+        # Текст не изменился или сообщение уже удалено — не повод падать
+        logger.debug("Не удалось обновить сообщение: %s", exc)
+
+
+async def answer_streaming(
+    message: Message,
+    trace_id: str | None = None,
+    media_type: str | None = None,
+    media_data: dict[str, Any] | None = None,
+) -> None:
+    """Ответить, постепенно дописывая сообщение по мере генерации в ядре."""
+    reply = await message.answer("…")
+    loop = asyncio.get_running_loop()
+    text = ""
+    shown = ""
+    last_edit = started = loop.time()
+    first_chunk_at: float | None = None
+    trace_id = trace_id or new_trace_id()
+    request_text = message.text or message.caption
 
-async def call_core(text: str | None, user_id: int) -> str:
-    url = f"{CORE_BASE_URL.rstrip('/')}/v1/messages"
-    payload = {
-        "user_id": str(user_id),
-        "channel": "telegram",
-        "text": text,
-    }
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            resp = await client.post(url, json=payload)
-            resp.raise_for_status()
-            data = resp.json()
-            return str(data.get("text") or "")
+        async for delta in stream_core(request_text, message.from_user.id, trace_id, media_type, media_data):
+            if first_chunk_at is None:
+                first_chunk_at = loop.time()
+            text += delta
+            if loop.time() - last_edit >= EDIT_INTERVAL:
+                preview = text[:TELEGRAM_MESSAGE_LIMIT]
+                if preview != shown:
+                    await edit_reply(reply, preview)
+                    shown = preview
+                last_edit = loop.time()
     except Exception as exc:  # noqa: BLE001
-        logger.error("Ошибка при обращении к ядру: %s", exc)
-        # Фоллбэк: простое эхо, чтобы бот продолжал работать
-        return f"Эхо (ядро недоступно): {text or ''}"
+        if not busy_text(exc):
+            logger.error("trace=%s ошибка при потоковом обращении к ядру: %r", trace_id, exc)
+        # Уже полученную часть ответа не заменяем сообщением об ошибке
+        text = text or error_text(exc, request_text)
+
+    if first_chunk_at is not None:
+        logger.info(
+            "trace=%s первый фрагмент через %.0f мс, ответ целиком за %.0f мс",
+            trace_id, (first_chunk_at - started) * 1000, (loop.time() - started) * 1000,
+        )
+
+    parts = split_for_telegram(text or "Пустой ответ от ядра.")
+    if parts[0] != shown:
+        await edit_reply(reply, parts[0])
+    for part in parts[1:]:
+        await message.answer(part)
 
 
 async def handle_start(message: Message) -> None:
@@ -42,25 +243,204 @@ async def handle_start(message: Message) -> None:
     )
 
 
-async def handle_text(message: Message) -> None:
-    reply = await call_core(message.text, message.from_user.id)
+async def answer(
+    message: Message,
+    trace_id: str | None = None,
+    media_type: str | None = None,
+    media_data: dict[str, Any] | None = None,
+) -> None:
+    """Передать сообщение ядру и отправить ответ (потоком или целиком)."""
+    if CORE_STREAM:
+        await answer_streaming(message, trace_id, media_type, media_data)
+        return
+    reply = await call_core(
+        message.text or message.caption, message.from_user.id, trace_id, media_type, media_data
+    )
     await message.answer(reply or "Пустой ответ от ядра.")
 
 
+async def handle_text(message: Message) -> None:
+    # «Печатает…» повторяется всё время, пока ядро готовит ответ
+    async with ChatActionSender.typing(
+        bot=message.bot, chat_id=message.chat.id, interval=TYPING_INTERVAL
+    ):
+        await answer(message)
+
+
+def extract_media(
+    message: Message,
+) -> tuple[str, PhotoSize | Voice | Video | Document, dict[str, Any]] | None:
+    """Тип вложения в терминах ядра, сам файл Telegram и его метаданные."""
+    if message.photo:
+        # Telegram присылает несколько размеров фото, последний — самый большой
+        photo = message.photo[-1]
+        return "image", photo, {"width": photo.width, "height": photo.height}
+    if message.voice:
+        voice = message.voice
+        return "voice", voice, {"duration": voice.duration, "mime_type": voice.mime_type}
+    if message.video:
+        video = message.video
+        return "video", video, {
+            "duration": video.duration, "width": video.width, "height": video.height,
+            "mime_type": video.mime_type, "file_name": video.file_name,
+        }
+    if message.document:
+        document = message.document
+        return "file", document, {"file_name": document.file_name, "mime_type": document.mime_type}
+    return None
+
+
+async def upload_to_core(bot: Bot, file_id: str, trace_id: str) -> dict[str, Any]:
+    """
+    Переслать файл из Telegram в хранилище ядра, не держа его в памяти целиком.
+
+    Файл скачивается кусками по `TG_DOWNLOAD_CHUNK` байт, и каждый кусок сразу
+    уходит в тело запроса `POST /v1/media` (chunked transfer encoding).
+    В памяти одновременно — лишь несколько кусков.
+    """
+    file = await bot.get_file(file_id)
+    url = bot.session.api.file_url(bot.token, file.file_path)
+    chunks = bot.session.stream_content(url=url, timeout=int(CORE_TIMEOUT), chunk_size=TG_DOWNLOAD_CHUNK)
+    resp = await get_core_client().post(
+        "/v1/media",
+        content=chunks,
+        headers={"Content-Type": "application/octet-stream", "X-Trace-Id": trace_id},
+    )
+    resp.raise_for_status()
+    return resp.json()
+
+
+async def handle_media(message: Message) -> None:
+    media = extract_media(message)
+    if media is None:
+        return
+    media_type, attachment, media_data = media
+    media_data.update(
+        file_id=attachment.file_id,
+        file_unique_id=attachment.file_unique_id,
+        file_size=attachment.file_size,
+    )
+    trace_id = new_trace_id()
+
+    async with ChatActionSender.typing(
+        bot=message.bot, chat_id=message.chat.id, interval=TYPING_INTERVAL
+    ):
+        if attachment.file_size and attachment.file_size > TG_MAX_DOWNLOAD_BYTES:
+            await message.answer("Файл слишком большой: бот может скачать из Telegram не больше 20 МБ.")
+            return
+        try:
+            stored = await upload_to_core(message.bot, attachment.file_id, trace_id)
+            media_data["sha256"] = stored["sha256"]
+        except httpx.HTTPStatusError as exc:
+            if exc.response.status_code == 413:
+                await message.answer("Файл слишком большой для обработки.")
+                return
+            # Без файла ядро всё равно ответит по метаданным
+            logger.error("trace=%s не удалось загрузить файл в ядро: %r", trace_id, exc)
+        except Exception as exc:  # noqa: BLE001
+            logger.error("trace=%s не удалось загрузить файл в ядро: %r", trace_id, exc)
+
+        await answer(message, trace_id, media_type, media_data)
+
+
+class ConcurrencyLimitMiddleware(BaseMiddleware):
+    """
+    Ограничивает число одновременно обрабатываемых обновлений.
+
+    И polling, и webhook запускают обработку каждого обновления отдельной
+    задачей; без ограничения всплеск сообщений превращается в такой же
+    всплеск запросов к ядру и соединений к нему. Лишние обновления ждут
+    на семафоре в порядке поступления.
+    """
+
+    def __init__(self, limit: int) -> None:
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        async with self._semaphore:
+            return await handler(event, data)
+
+
+def build_dispatcher() -> Dispatcher:
+    dp = Dispatcher()
+    dp.update.outer_middleware(ConcurrencyLimitMiddleware(TG_MAX_CONCURRENT_UPDATES))
+
+    dp.message.register(handle_start, CommandStart())
+    dp.message.register(handle_text, lambda m: isinstance(m, types.Message) and m.text)
+    dp.message.register(handle_media, F.photo | F.voice | F.video | F.document)
+
+    dp.shutdown.register(close_core_client)
+    return dp
+
+
+async def run_polling(bot: Bot, dp: Dispatcher) -> None:
+    # Если раньше бот работал через webhook, getUpdates без этого вернёт конфликт
+    await bot.delete_webhook(drop_pending_updates=False)
+    await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher) -> None:
+    """
+    Принимать обновления на локальном aiohttp-сервере.
+
+    Telegram присылает обновления POST-запросами на `TG_WEBHOOK_URL` +
+    `TG_WEBHOOK_PATH` (TLS обычно снимает обратный прокси перед ботом).
+    Обработчик отвечает Telegram сразу, а само обновление обрабатывается в
+    фоне — долгая генерация не приводит к повторной доставке.
+    """
+    if not TG_WEBHOOK_URL:
+        raise RuntimeError("TG_WEBHOOK_URL is not set in environment")
+
+    async def on_startup(bot: Bot) -> None:
+        await bot.set_webhook(
+            TG_WEBHOOK_URL.rstrip("/") + TG_WEBHOOK_PATH,
+            secret_token=TG_WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+            max_connections=TG_MAX_CONCURRENT_UPDATES,
+        )
+
+    async def health(_: web.Request) -> web.Response:
+        return web.json_response({"status": "ok"})
+
+    dp.startup.register(on_startup)
+    app = web.Application()
+    app.router.add_get("/health", health)
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=TG_WEBHOOK_SECRET).register(
+        app, path=TG_WEBHOOK_PATH
+    )
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, TG_WEBHOOK_HOST, TG_WEBHOOK_PORT).start()
+        logger.info("Webhook-сервер слушает %s:%s%s", TG_WEBHOOK_HOST, TG_WEBHOOK_PORT, TG_WEBHOOK_PATH)
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
 async def main() -> None:
     token = os.getenv("TELEGRAM_BOT_TOKEN")
     if not token:
         raise RuntimeError("TELEGRAM_BOT_TOKEN is not set in environment")
 
     bot = Bot(token=token)
-    dp = Dispatcher()
-
-    dp.message.register(handle_start, CommandStart())
-    dp.message.register(handle_text, lambda m: isinstance(m, types.Message) and m.text)
+    dp = build_dispatcher()
 
-    logger.info("Starting Telegram bot...")
+    logger.info("Starting Telegram bot (mode=%s)...", TG_MODE)
     logger.info("CORE_BASE_URL=%s", CORE_BASE_URL)
-    await dp.start_polling(bot)
+    if TG_MODE == "webhook":
+        await run_webhook(bot, dp)
+    elif TG_MODE == "polling":
+        await run_polling(bot, dp)
+    else:
+        raise RuntimeError(f"Unknown TG_MODE: {TG_MODE!r} (expected polling or webhook)")
 
 
 if __name__ == "__main__":